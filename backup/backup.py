@@ -0,0 +1,502 @@
+"""Онлайн-бэкапы SQLite баз бота и бэкенда.
+
+Вместо ``cp`` работающей базы раз в 3 часа:
+
+- полный снимок (base) делается через ``sqlite3.Connection.backup`` небольшими порциями
+  страниц с паузой между шагами — писатели не блокируются на всё время копирования;
+- между снимками каждые ``BACKUP_INCREMENT_SECONDS`` пишется инкремент: снова
+  консистентная копия через backup API, но в архив уходят только изменившиеся страницы
+  (сравнение по хешам страниц). Цепочка base + инкременты даёт восстановление на момент
+  любого инкремента;
+- сжатие (zstd, если установлен ``zstandard``, иначе gzip) идёт в пуле потоков;
+- ретеншн: хранится ``BACKUP_KEEP_CHAINS`` последних цепочек и не старше ``BACKUP_KEEP_DAYS``;
+- раз в ``RETENTION_INTERVAL_SECONDS`` старые строки уносятся в помесячные архивы
+  (см. ``retention.py``);
+- после каждого base снимок восстанавливается во временный файл и проверяется
+  ``PRAGMA integrity_check``; результат и время восстановления пишутся в ``verify.json``.
+
+Раскладка: ``$BACKUP_DIR/<db>/<base_ts>/base.db.<ext>``, ``incr-<ts>.pages.<ext>``, ``manifest.json``.
+
+    python backup.py run                                   # демон (по умолчанию в контейнере)
+    python backup.py snapshot                              # один полный снимок всех баз
+    python backup.py restore --db main --out /tmp/users.db [--at 1735689600]
+    python backup.py verify [--db main]
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # gzip из стандартной библиотеки как запасной вариант
+    zstandard = None
+
+logger = logging.getLogger("backup")
+
+INCREMENT_MAGIC = b"ZZZPAGES1\n"
+_INCREMENT_HEADER = struct.Struct("<IIQ")  # page_size, page_count, ts
+_PAGE_NO = struct.Struct("<I")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _parse_databases(raw: str) -> Dict[str, str]:
+    result: Dict[str, str] = {}
+    for item in raw.split(","):
+        if "=" in item:
+            name, path = item.split("=", 1)
+            result[name.strip()] = path.strip()
+    return result
+
+
+DATABASES = _parse_databases(os.getenv("BACKUP_DATABASES", "bot=/app/bot/users.db,main=/app/main/users.db"))
+BACKUP_DIR = os.getenv("BACKUP_DIR", "/app/backups")
+SNAPSHOT_SECONDS = _env_int("BACKUP_SNAPSHOT_SECONDS", 10800)
+INCREMENT_SECONDS = _env_int("BACKUP_INCREMENT_SECONDS", 60)
+PAGES_PER_STEP = _env_int("BACKUP_PAGES_PER_STEP", 256)
+STEP_SLEEP_MS = _env_int("BACKUP_STEP_SLEEP_MS", 5)
+MAX_RESTARTS = _env_int("BACKUP_MAX_RESTARTS", 3)
+KEEP_CHAINS = _env_int("BACKUP_KEEP_CHAINS", 16)
+KEEP_DAYS = _env_int("BACKUP_KEEP_DAYS", 7)
+COMPRESSION = os.getenv("BACKUP_COMPRESSION", "zstd" if zstandard is not None else "gzip").lower()
+VERIFY = os.getenv("BACKUP_VERIFY", "true").lower() in {"1", "true", "yes"}
+# Архивация старых строк (retention.py); 0 — выключено
+RETENTION_INTERVAL_SECONDS = _env_int("RETENTION_INTERVAL_SECONDS", 86400)
+
+
+# -----------------------------
+# Сжатие
+# -----------------------------
+
+def _extension(codec: str) -> str:
+    return "zst" if codec == "zstd" else "gz"
+
+
+def compress_file(src: str, dst: str, codec: str) -> int:
+    """Сжимает файл и атомарно кладёт результат в ``dst``. Возвращает размер архива."""
+    tmp = dst + ".part"
+    with open(src, "rb") as fin, open(tmp, "wb") as fout:
+        if codec == "zstd":
+            zstandard.ZstdCompressor(level=10, threads=-1).copy_stream(fin, fout)
+        else:
+            with gzip.GzipFile(fileobj=fout, mode="wb", compresslevel=6) as gz:
+                shutil.copyfileobj(fin, gz, 1 << 20)
+    os.replace(tmp, dst)
+    return os.path.getsize(dst)
+
+
+def decompress_file(src: str, dst: str) -> None:
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        if src.endswith(".zst"):
+            if zstandard is None:
+                raise RuntimeError("zstandard не установлен, а архив сжат zstd")
+            zstandard.ZstdDecompressor().copy_stream(fin, fout)
+        else:
+            with gzip.GzipFile(fileobj=fin, mode="rb") as gz:
+                shutil.copyfileobj(gz, fout, 1 << 20)
+
+
+# -----------------------------
+# Снимки и инкременты
+# -----------------------------
+
+class _BackupRestarted(Exception):
+    pass
+
+
+def online_copy(
+    src_path: str,
+    dst_path: str,
+    pages: int = PAGES_PER_STEP,
+    sleep_ms: int = STEP_SLEEP_MS,
+    max_restarts: int = MAX_RESTARTS,
+) -> float:
+    """Консистентная копия работающей базы через backup API порциями по ``pages`` страниц.
+
+    Запись в источник из другого соединения перезапускает backup с начала. В WAL-режиме
+    копия идёт внутри одной читающей транзакции — писатели не мешают и не блокируются.
+    В rollback-журнале после ``max_restarts`` перезапусков копируем одним шагом
+    (короткая блокировка писателей вместо бесконечных рестартов).
+    """
+    started = time.perf_counter()
+    src = sqlite3.connect(f"file:{src_path}?mode=ro", uri=True, timeout=30, isolation_level=None)
+    try:
+        wal = src.execute("PRAGMA journal_mode").fetchone()[0].lower() == "wal"
+        if wal:
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        last_remaining = [None]
+
+        def _progress(status: int, remaining: int, total: int) -> None:
+            if last_remaining[0] is not None and remaining > last_remaining[0]:
+                raise _BackupRestarted()
+            last_remaining[0] = remaining
+            # Между шагами отдаём базу писателям
+            if remaining and sleep_ms > 0:
+                time.sleep(sleep_ms / 1000.0)
+
+        for _attempt in range(max(0, max_restarts) + 1):
+            last_remaining[0] = None
+            dst = sqlite3.connect(dst_path)
+            try:
+                src.backup(dst, pages=max(1, pages), progress=_progress, sleep=0.05)
+                break
+            except _BackupRestarted:
+                continue
+            finally:
+                dst.close()
+        else:
+            dst = sqlite3.connect(dst_path)
+            try:
+                src.backup(dst, pages=-1, sleep=0.05)
+            finally:
+                dst.close()
+            logger.warning("backup of %s restarted %s times, copied in one step", src_path, max_restarts)
+        if wal:
+            src.execute("COMMIT")
+    finally:
+        src.close()
+    return time.perf_counter() - started
+
+
+def page_digests(db_path: str) -> Tuple[int, List[bytes]]:
+    """Хеши всех страниц файла базы. Возвращает (page_size, digests)."""
+    conn = sqlite3.connect(db_path)
+    try:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    finally:
+        conn.close()
+    digests: List[bytes] = []
+    with open(db_path, "rb") as fh:
+        while True:
+            page = fh.read(page_size)
+            if not page:
+                break
+            digests.append(hashlib.blake2b(page, digest_size=16).digest())
+    return page_size, digests
+
+
+def write_increment(db_path: str, out_path: str, page_size: int, digests: List[bytes], previous: List[bytes], ts: int) -> int:
+    """Пишет в ``out_path`` страницы, отличающиеся от ``previous``. Возвращает их число."""
+    changed = 0
+    with open(db_path, "rb") as src, open(out_path, "wb") as out:
+        out.write(INCREMENT_MAGIC)
+        out.write(_INCREMENT_HEADER.pack(page_size, len(digests), ts))
+        for page_no, digest in enumerate(digests):
+            if page_no < len(previous) and previous[page_no] == digest:
+                continue
+            src.seek(page_no * page_size)
+            out.write(_PAGE_NO.pack(page_no))
+            out.write(src.read(page_size))
+            changed += 1
+    return changed
+
+
+def apply_increment(db_path: str, increment_path: str) -> None:
+    with open(increment_path, "rb") as inc, open(db_path, "r+b") as db:
+        if inc.read(len(INCREMENT_MAGIC)) != INCREMENT_MAGIC:
+            raise ValueError(f"{increment_path}: не файл инкремента")
+        page_size, page_count, _ts = _INCREMENT_HEADER.unpack(inc.read(_INCREMENT_HEADER.size))
+        while True:
+            head = inc.read(_PAGE_NO.size)
+            if not head:
+                break
+            (page_no,) = _PAGE_NO.unpack(head)
+            db.seek(page_no * page_size)
+            db.write(inc.read(page_size))
+        db.truncate(page_count * page_size)
+
+
+class DatabaseArchive:
+    """Цепочки base + инкременты одной базы."""
+
+    def __init__(self, name: str, source: str, root: str = BACKUP_DIR, codec: str = COMPRESSION) -> None:
+        self.name = name
+        self.source = source
+        self.root = os.path.join(root, name)
+        self.codec = codec if codec == "gzip" or zstandard is not None else "gzip"
+        self.chain_dir: Optional[str] = None
+        self.page_size = 0
+        self.digests: List[bytes] = []
+        self.last_snapshot_at = 0.0
+        os.makedirs(self.root, exist_ok=True)
+
+    # ---- манифест цепочки ----
+
+    def _manifest_path(self, chain_dir: str) -> str:
+        return os.path.join(chain_dir, "manifest.json")
+
+    def _load_manifest(self, chain_dir: str) -> Dict:
+        try:
+            with open(self._manifest_path(chain_dir), encoding="utf-8") as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self, chain_dir: str, manifest: Dict) -> None:
+        tmp = self._manifest_path(chain_dir) + ".part"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(manifest, fh, ensure_ascii=False, indent=2)
+        os.replace(tmp, self._manifest_path(chain_dir))
+
+    def chains(self) -> List[str]:
+        names = sorted((n for n in os.listdir(self.root) if n.isdigit()), key=int)
+        return [os.path.join(self.root, n) for n in names if os.path.exists(self._manifest_path(os.path.join(self.root, n)))]
+
+    # ---- запись ----
+
+    def snapshot(self, pool: ThreadPoolExecutor) -> Future:
+        """Новая цепочка: полный снимок. Сжатие уходит в пул, Future завершается записью манифеста."""
+        ts = int(time.time())
+        chain_dir = os.path.join(self.root, str(ts))
+        os.makedirs(chain_dir, exist_ok=True)
+        raw = os.path.join(chain_dir, "base.db.raw")
+        copy_seconds = online_copy(self.source, raw)
+        page_size, digests = page_digests(raw)
+        self.chain_dir, self.page_size, self.digests = chain_dir, page_size, digests
+        self.last_snapshot_at = time.time()
+        archive = os.path.join(chain_dir, f"base.db.{_extension(self.codec)}")
+
+        def _finish() -> Dict:
+            size = compress_file(raw, archive, self.codec)
+            os.remove(raw)
+            manifest = {
+                "db": self.name,
+                "source": self.source,
+                "base_ts": ts,
+                "base": os.path.basename(archive),
+                "page_size": page_size,
+                "page_count": len(digests),
+                "raw_bytes": page_size * len(digests),
+                "archive_bytes": size,
+                "copy_seconds": round(copy_seconds, 3),
+                "increments": [],
+            }
+            self._save_manifest(chain_dir, manifest)
+            logger.info("snapshot db=%s pages=%s archive=%sB copy=%.2fs", self.name, len(digests), size, copy_seconds)
+            return manifest
+
+        return pool.submit(_finish)
+
+    def increment(self, pool: ThreadPoolExecutor) -> Optional[Future]:
+        """Архивирует страницы, изменившиеся с прошлого снимка/инкремента. None — изменений нет."""
+        if self.chain_dir is None:
+            return None
+        ts = int(time.time())
+        chain_dir = self.chain_dir
+        fd, raw = tempfile.mkstemp(prefix=f"{self.name}-", suffix=".db", dir=chain_dir)
+        os.close(fd)
+        try:
+            online_copy(self.source, raw)
+            page_size, digests = page_digests(raw)
+            if page_size != self.page_size:
+                # Сменился page_size (VACUUM) — инкремент по страницам невозможен, начнём новую цепочку
+                os.remove(raw)
+                return self.snapshot(pool)
+            if digests == self.digests:
+                os.remove(raw)
+                return None
+            pages_path = os.path.join(chain_dir, f"incr-{ts}.pages")
+            changed = write_increment(raw, pages_path, page_size, digests, self.digests, ts)
+        finally:
+            if os.path.exists(raw):
+                os.remove(raw)
+        self.digests = digests
+        archive = f"{pages_path}.{_extension(self.codec)}"
+
+        def _finish() -> Dict:
+            size = compress_file(pages_path, archive, self.codec)
+            os.remove(pages_path)
+            manifest = self._load_manifest(chain_dir)
+            manifest.setdefault("increments", []).append(
+                {"ts": ts, "file": os.path.basename(archive), "pages": changed, "page_count": len(digests), "archive_bytes": size}
+            )
+            self._save_manifest(chain_dir, manifest)
+            logger.info("increment db=%s changed_pages=%s archive=%sB", self.name, changed, size)
+            return manifest
+
+        return pool.submit(_finish)
+
+    # ---- восстановление ----
+
+    def restore(self, out_path: str, at: Optional[int] = None) -> Dict:
+        """Собирает базу на момент ``at`` (по умолчанию — последний инкремент)."""
+        candidates = [c for c in self.chains() if at is None or self._load_manifest(c).get("base_ts", 0) <= at]
+        if not candidates:
+            raise FileNotFoundError(f"нет снимков {self.name} на момент {at}")
+        chain_dir = candidates[-1]
+        manifest = self._load_manifest(chain_dir)
+        started = time.perf_counter()
+        tmp = out_path + ".part"
+        decompress_file(os.path.join(chain_dir, manifest["base"]), tmp)
+        applied = 0
+        restored_ts = manifest["base_ts"]
+        for item in manifest.get("increments", []):
+            if at is not None and item["ts"] > at:
+                break
+            pages = os.path.join(chain_dir, item["file"] + ".raw")
+            decompress_file(os.path.join(chain_dir, item["file"]), pages)
+            try:
+                apply_increment(tmp, pages)
+            finally:
+                os.remove(pages)
+            applied += 1
+            restored_ts = item["ts"]
+        os.replace(tmp, out_path)
+        return {
+            "db": self.name,
+            "chain": os.path.basename(chain_dir),
+            "restored_ts": restored_ts,
+            "increments_applied": applied,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+
+    def verify(self) -> Dict:
+        """Восстанавливает последнюю точку во временный файл и проверяет целостность."""
+        fd, out = tempfile.mkstemp(prefix=f"verify-{self.name}-", suffix=".db")
+        os.close(fd)
+        try:
+            result = self.restore(out)
+            started = time.perf_counter()
+            conn = sqlite3.connect(out)
+            try:
+                integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+                tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+                rows = {t: conn.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0] for t in tables}
+            finally:
+                conn.close()
+            result.update({
+                "ok": integrity == "ok",
+                "integrity": integrity,
+                "check_seconds": round(time.perf_counter() - started, 3),
+                "rows": rows,
+                "verified_at": int(time.time()),
+            })
+        finally:
+            os.remove(out)
+        chain_dir = os.path.join(self.root, result["chain"])
+        with open(os.path.join(chain_dir, "verify.json"), "w", encoding="utf-8") as fh:
+            json.dump(result, fh, ensure_ascii=False, indent=2)
+        log = logger.info if result["ok"] else logger.error
+        log("verify db=%s ok=%s restore=%.2fs check=%.2fs", self.name, result["ok"], result["seconds"], result["check_seconds"])
+        return result
+
+    # ---- ретеншн ----
+
+    def apply_retention(self, keep_chains: int = KEEP_CHAINS, keep_days: int = KEEP_DAYS) -> List[str]:
+        chains = self.chains()
+        min_ts = int(time.time()) - keep_days * 86400
+        removed = []
+        # Самую свежую цепочку не удаляем никогда
+        for index, chain_dir in enumerate(chains[:-1]):
+            too_many = len(chains) - index > keep_chains
+            too_old = int(os.path.basename(chain_dir)) < min_ts
+            if too_many or too_old:
+                shutil.rmtree(chain_dir, ignore_errors=True)
+                removed.append(os.path.basename(chain_dir))
+        if removed:
+            logger.info("retention db=%s removed=%s", self.name, ",".join(removed))
+        return removed
+
+
+# -----------------------------
+# Демон
+# -----------------------------
+
+def _wait(futures: List[Future]) -> None:
+    for future in futures:
+        try:
+            future.result()
+        except Exception:
+            logger.exception("Backup task failed")
+
+
+def run(archives: List[DatabaseArchive]) -> None:
+    import retention
+
+    last_retention = 0.0
+    with ThreadPoolExecutor(max_workers=max(2, len(archives))) as pool:
+        while True:
+            started = time.time()
+            pending: List[Future] = []
+            snapshotted: List[DatabaseArchive] = []
+            if RETENTION_INTERVAL_SECONDS > 0 and started - last_retention >= RETENTION_INTERVAL_SECONDS:
+                # Перед снимком: уносим старые строки, чтобы снимок был меньше
+                last_retention = started
+                retention.run_all({a.name: a.source for a in archives})
+            for archive in archives:
+                if not os.path.exists(archive.source):
+                    logger.warning("database missing db=%s path=%s", archive.name, archive.source)
+                    continue
+                try:
+                    if archive.chain_dir is None or started - archive.last_snapshot_at >= SNAPSHOT_SECONDS:
+                        pending.append(archive.snapshot(pool))
+                        snapshotted.append(archive)
+                    else:
+                        future = archive.increment(pool)
+                        if future is not None:
+                            pending.append(future)
+                except Exception:
+                    logger.exception("Backup failed db=%s", archive.name)
+            _wait(pending)
+            for archive in snapshotted:
+                try:
+                    archive.apply_retention()
+                    if VERIFY:
+                        archive.verify()
+                except Exception:
+                    logger.exception("Verify/retention failed db=%s", archive.name)
+            time.sleep(max(1.0, INCREMENT_SECONDS - (time.time() - started)))
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    parser = argparse.ArgumentParser(description="Онлайн-бэкапы SQLite")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("run")
+    sub.add_parser("snapshot")
+    restore_p = sub.add_parser("restore")
+    restore_p.add_argument("--db", required=True, choices=sorted(DATABASES))
+    restore_p.add_argument("--out", required=True)
+    restore_p.add_argument("--at", type=int, default=None, help="unix-время точки восстановления")
+    verify_p = sub.add_parser("verify")
+    verify_p.add_argument("--db", default=None, choices=sorted(DATABASES))
+    args = parser.parse_args()
+
+    archives = [DatabaseArchive(name, path) for name, path in DATABASES.items()]
+    command = args.command or "run"
+    if command == "run":
+        run(archives)
+    elif command == "snapshot":
+        with ThreadPoolExecutor(max_workers=max(2, len(archives))) as pool:
+            _wait([a.snapshot(pool) for a in archives if os.path.exists(a.source)])
+    elif command == "restore":
+        archive = next(a for a in archives if a.name == args.db)
+        print(json.dumps(archive.restore(args.out, args.at), ensure_ascii=False))
+    elif command == "verify":
+        results = [a.verify() for a in archives if args.db in (None, a.name)]
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        if not all(r["ok"] for r in results):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
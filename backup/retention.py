@@ -0,0 +1,266 @@
+"""Ретеншн и архивация старых строк в помесячные SQLite-архивы.
+
+Политики задаются на таблицу: какие строки считаются «мёртвыми», по какой колонке времени
+они раскладываются по месяцам и сколько дней храним в горячей базе. Строки переносятся в
+``$BACKUP_DIR/archive/<db>/<YYYY-MM>.db`` через ``ATTACH`` короткими транзакциями
+(``RETENTION_CHUNK_ROWS`` строк) с паузой между ними, чтобы не держать писателей.
+После переноса выполняется ``PRAGMA incremental_vacuum`` и считается освобождённое место.
+
+Базы без ``auto_vacuum = INCREMENTAL`` один раз переводятся в этот режим через ``VACUUM``
+(отключается ``RETENTION_CONVERT_AUTO_VACUUM=false``).
+
+    python retention.py                    # один проход по всем базам, отчёт в stdout
+    python retention.py --db bot --dry-run # только посчитать кандидатов
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Dict, List
+
+logger = logging.getLogger("retention")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR", os.path.join(os.getenv("BACKUP_DIR", "/app/backups"), "archive"))
+CHUNK_ROWS = _env_int("RETENTION_CHUNK_ROWS", 2000)
+CHUNK_PAUSE_MS = _env_int("RETENTION_CHUNK_PAUSE_MS", 20)
+CONVERT_AUTO_VACUUM = os.getenv("RETENTION_CONVERT_AUTO_VACUUM", "true").lower() in {"1", "true", "yes"}
+
+
+@dataclass
+class Policy:
+    table: str
+    # Выражение unix-времени строки: по нему и возраст, и месяц архива
+    ts_expr: str
+    # Какие строки вообще можно уносить (параметр :cutoff — граница возраста)
+    where: str
+    max_age_days: int
+
+
+POLICIES: Dict[str, List[Policy]] = {
+    # Истёкшие конфиги сервис main сам выводит из пула (users -> pruned_configs) и удаляет
+    # их клиентов с панели; сюда попадают только строки, удаление которых панель подтвердила,
+    # иначе клиенты остались бы на панели без строки в базе.
+    "main": [
+        Policy(
+            table="pruned_configs",
+            ts_expr="time_end",
+            where="panel_deleted_at IS NOT NULL AND panel_deleted_at < :cutoff",
+            max_age_days=_env_int("RETENTION_PRUNED_CONFIGS_DAYS", 0),
+        ),
+        Policy(
+            table="idempotency_keys",
+            ts_expr="created_at",
+            where="created_at < :cutoff",
+            max_age_days=_env_int("RETENTION_IDEMPOTENCY_DAYS", 7),
+        ),
+    ],
+    "bot": [
+        # Сообщения рассылки уносятся только целиком по кампании и по времени её завершения:
+        # счётчики кампании пересчитываются по этим строкам (services/broadcast_service.py),
+        # поэтому идущие и отменённые с неотправленными сообщениями кампании не трогаем.
+        Policy(
+            table="broadcast_messages",
+            ts_expr="(SELECT c.completed_at FROM broadcast_campaigns c WHERE c.id = broadcast_messages.campaign_id)",
+            where="""campaign_id IN (
+                SELECT c.id FROM broadcast_campaigns c
+                WHERE c.completed_at IS NOT NULL AND c.completed_at < :cutoff
+                  AND (c.status = 'completed' OR (c.status = 'cancelled' AND NOT EXISTS (
+                      SELECT 1 FROM broadcast_messages p WHERE p.campaign_id = c.id AND p.status = 'pending'
+                  )))
+            )""",
+            max_age_days=_env_int("RETENTION_BROADCAST_DAYS", 30),
+        ),
+        Policy(
+            table="analytics_events",
+            ts_expr="timestamp",
+            where="timestamp < :cutoff",
+            max_age_days=_env_int("RETENTION_ANALYTICS_DAYS", 90),
+        ),
+        Policy(
+            table="smart_notifications",
+            ts_expr="COALESCE(sent_at, scheduled_time)",
+            where="COALESCE(sent_at, scheduled_time) < :cutoff",
+            max_age_days=_env_int("RETENTION_NOTIFICATIONS_DAYS", 30),
+        ),
+    ],
+}
+
+
+def _columns(conn: sqlite3.Connection, schema: str, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f'PRAGMA {schema}.table_info("{table}")')]
+
+
+def _file_size(path: str) -> int:
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+def ensure_incremental_vacuum(conn: sqlite3.Connection) -> bool:
+    """Переводит базу в auto_vacuum=INCREMENTAL (разовый VACUUM). True — если режим включён."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return True
+    if not CONVERT_AUTO_VACUUM:
+        return False
+    started = time.perf_counter()
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    logger.info("auto_vacuum converted to INCREMENTAL in %.2fs", time.perf_counter() - started)
+    return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def archive_policy(conn: sqlite3.Connection, db_name: str, policy: Policy, dry_run: bool = False) -> Dict:
+    """Переносит строки одной политики. Возвращает {месяц: число строк}."""
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (policy.table,)).fetchone()
+    if not exists:
+        return {}
+    cutoff = int(time.time()) - policy.max_age_days * 86400
+    month_expr = f"strftime('%Y-%m', {policy.ts_expr}, 'unixepoch')"
+    candidates = conn.execute(
+        f'SELECT {month_expr} AS month, COUNT(*) FROM main."{policy.table}" WHERE {policy.where} GROUP BY month',
+        {"cutoff": cutoff},
+    ).fetchall()
+    moved: Dict[str, int] = {}
+    if dry_run:
+        return {month: count for month, count in candidates}
+
+    columns = _columns(conn, "main", policy.table)
+    column_list = ", ".join(f'"{c}"' for c in columns)
+    archive_dir = os.path.join(ARCHIVE_DIR, db_name)
+    os.makedirs(archive_dir, exist_ok=True)
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS _chunk (rid INTEGER PRIMARY KEY)")
+
+    for month, _count in candidates:
+        label = month or "undated"
+        conn.execute("ATTACH DATABASE ? AS arch", (os.path.join(archive_dir, f"{label}.db"),))
+        try:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS arch."{policy.table}" AS SELECT * FROM main."{policy.table}" WHERE 0')
+            # Схема горячей таблицы могла вырасти — догоняем архив
+            archived_columns = set(_columns(conn, "arch", policy.table))
+            for column in columns:
+                if column not in archived_columns:
+                    conn.execute(f'ALTER TABLE arch."{policy.table}" ADD COLUMN "{column}"')
+            total = 0
+            while True:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.execute("DELETE FROM temp._chunk")
+                    conn.execute(
+                        f'''
+                        INSERT INTO temp._chunk
+                        SELECT rowid FROM main."{policy.table}"
+                        WHERE {policy.where} AND {month_expr} IS :month
+                        LIMIT :limit
+                        ''',
+                        {"cutoff": cutoff, "month": month, "limit": CHUNK_ROWS},
+                    )
+                    count = conn.execute("SELECT COUNT(*) FROM temp._chunk").fetchone()[0]
+                    if count:
+                        conn.execute(
+                            f'INSERT INTO arch."{policy.table}" ({column_list}) '
+                            f'SELECT {column_list} FROM main."{policy.table}" WHERE rowid IN (SELECT rid FROM temp._chunk)'
+                        )
+                        conn.execute(f'DELETE FROM main."{policy.table}" WHERE rowid IN (SELECT rid FROM temp._chunk)')
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                total += count
+                if count < CHUNK_ROWS:
+                    break
+                # Отдаём базу писателям между порциями
+                time.sleep(CHUNK_PAUSE_MS / 1000.0)
+            if total:
+                moved[label] = total
+        finally:
+            conn.execute("DETACH DATABASE arch")
+    return moved
+
+
+def run_retention(db_name: str, db_path: str, dry_run: bool = False) -> Dict:
+    """Один проход ретеншна по базе. Возвращает отчёт."""
+    started = time.perf_counter()
+    size_before = _file_size(db_path)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    report: Dict = {"db": db_name, "path": db_path, "dry_run": dry_run, "tables": {}}
+    try:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        incremental = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        if not dry_run:
+            incremental = ensure_incremental_vacuum(conn)
+        for policy in POLICIES.get(db_name, []):
+            moved = archive_policy(conn, db_name, policy, dry_run=dry_run)
+            report["tables"][policy.table] = {"rows": sum(moved.values()), "by_month": moved}
+        freelist_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if incremental and not dry_run:
+            # executescript шагает прагму до конца; execute() освобождает лишь одну страницу
+            conn.executescript("PRAGMA incremental_vacuum;")
+        freelist_after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if not dry_run:
+            # Чтобы размер файла отражал усечение и в WAL-режиме
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    finally:
+        conn.close()
+    size_after = _file_size(db_path)
+    report.update({
+        "incremental_vacuum": incremental,
+        "pages_released": max(0, freelist_before - freelist_after),
+        "bytes_released": max(0, freelist_before - freelist_after) * page_size,
+        "free_pages_left": freelist_after,
+        "size_before": size_before,
+        "size_after": size_after,
+        "reclaimed_bytes": max(0, size_before - size_after),
+        "seconds": round(time.perf_counter() - started, 3),
+    })
+    logger.info(
+        "retention db=%s rows=%s reclaimed=%sB size=%s->%s",
+        db_name,
+        sum(t["rows"] for t in report["tables"].values()),
+        report["reclaimed_bytes"],
+        size_before,
+        size_after,
+    )
+    return report
+
+
+def run_all(databases: Dict[str, str], dry_run: bool = False) -> List[Dict]:
+    reports = []
+    for name, path in databases.items():
+        if not os.path.exists(path):
+            continue
+        try:
+            reports.append(run_retention(name, path, dry_run=dry_run))
+        except Exception:
+            logger.exception("Retention failed db=%s", name)
+    if reports and not dry_run:
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        with open(os.path.join(ARCHIVE_DIR, f"retention-{int(time.time())}.json"), "w", encoding="utf-8") as fh:
+            json.dump(reports, fh, ensure_ascii=False, indent=2)
+    return reports
+
+
+def main() -> None:
+    from backup import DATABASES
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    parser = argparse.ArgumentParser(description="Архивация старых строк и компактизация баз")
+    parser.add_argument("--db", default=None, choices=sorted(DATABASES))
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    databases = {n: p for n, p in DATABASES.items() if args.db in (None, n)}
+    print(json.dumps(run_all(databases, dry_run=args.dry_run), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,42 @@
 import logging
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 import asyncio
 import os
 from keyboards import keyboard
 from routes import guide, start, profile, invite, tariff, admin
 from routes.admin import advanced_broadcast, monitoring
-from services.broadcast_service import BroadcastService
 from services.monitoring_service import MonitoringService
+from services.media_registry import media_registry
 from callback import callback
 from database import db
 from middlewares.throttling import ThrottlingMiddleware
+from middlewares.db_session import DbSessionMiddleware, FlushDbBeforeRequest
+from database.pool import pool as db_pool
+from database.fsm_storage import fsm_storage
+from utils import availability_cache
+import webhook
 
 API_TOKEN = str(os.getenv('TELEGRAM_TOKEN'))
+# polling | webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling').strip().lower()
+# Адрес Bot API (например, локальная заглушка для тестов); по умолчанию api.telegram.org
+TELEGRAM_API_BASE = os.getenv('TELEGRAM_API_BASE')
 
 
 logging.basicConfig(level=logging.INFO)
 
-bot = Bot(token=API_TOKEN)
-dp = Dispatcher()
+bot = Bot(
+    token=API_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_BASE)) if TELEGRAM_API_BASE else None,
+)
+# Транзакция апдейта фиксируется до запроса к Bot API, чтобы не держать блокировку записи
+bot.session.middleware(FlushDbBeforeRequest())
+# Состояния FSM переживают перезапуск (таблица fsm_states в users.db)
+dp = Dispatcher(storage=fsm_storage)
+# Одно соединение и одна транзакция users.db на апдейт
+dp.update.middleware(DbSessionMiddleware())
     # Anti-flood / throttling middleware
 dp.message.middleware(ThrottlingMiddleware(default_window=1.5, default_burst=3))
 dp.callback_query.middleware(ThrottlingMiddleware(default_window=1.0, default_burst=4))
@@ -26,10 +45,14 @@ dp.include_routers(guide.router, start.router, tariff.router, profile.router, ca
 
 async def main():
     await db.init_db()
+    # file_id загруженных картинок (start.jpg и др.) — чтобы не загружать их заново
+    await media_registry.init()
     
     # Инициализация сервиса рассылок
-    broadcast_service = BroadcastService(bot)
+    broadcast_service = advanced_broadcast.init_broadcast_service(bot)
     await broadcast_service.init_database()
+    # Кампании, прерванные прошлой остановкой, продолжаются с места остановки
+    await broadcast_service.resume_campaigns()
     
     # Инициализация сервиса мониторинга
     monitoring_service = MonitoringService()
@@ -37,9 +60,20 @@ async def main():
     
     # Передаем сервис мониторинга в модуль
     monitoring.init_monitoring_service(monitoring_service)
+
+    # Фоновое обновление кэша доступности серверов
+    availability_cache.start()
     
-    # Variant B: сбрасываем накопившиеся апдейты при старте
-    await dp.start_polling(bot, skip_updates=True)
+    try:
+        if BOT_MODE == "webhook":
+            # Апдейты, пришедшие за время перезапуска, Telegram доставит повторно
+            await webhook.run_webhook(dp, bot)
+        else:
+            # Variant B: сбрасываем накопившиеся апдейты при старте
+            await dp.start_polling(bot, skip_updates=True)
+    finally:
+        await broadcast_service.close()
+        await db_pool.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
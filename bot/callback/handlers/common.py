@@ -3,6 +3,7 @@
 from __future__ import annotations
 
 import os
+import time
 from aiogram import Bot, F, Router
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
@@ -13,7 +14,7 @@ from keyboards.keyboard import (
     create_payment_method_keyboard,
 )
 from database import db
-from utils import get_session, check_available_configs, check_all_servers_available
+from utils import get_session, check_available_configs, check_all_servers_available, acquire_action_lock
 from utils import pick_first_available_server
 import aiohttp
 
@@ -194,160 +195,170 @@ async def go_back(callback_query: CallbackQuery, bot: Bot, state: FSMContext) ->
 @common_router.callback_query(F.data == "activate_balance")
 async def activate_balance(callback_query: CallbackQuery, bot: Bot, state: FSMContext) -> None:
     tg_id = str(callback_query.from_user.id)
-    try:
-        days = await db.get_balance_days(tg_id)
-    except Exception:
-        days = 0
-    if days <= 0:
-        await callback_query.answer("Баланс пуст", show_alert=True)
-        return
-
-    # Проверяем доступность серверов перед активацией бонусных дней
-    if not await check_all_servers_available():
-        await callback_query.message.edit_text(
-            "❌ К сожалению, сейчас не все серверы доступны для активации бонусных дней.\n"
-            "Для активации дней должны быть доступны все серверы.\n"
-            "Попробуйте позже или обратитесь в поддержку.",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="🔙 Назад", callback_data="back")]
-            ])
-        )
-        await callback_query.answer()
-        return
-    # Проверяем, есть ли у пользователя уже АКТИВНЫЕ конфиги
-    existing_configs = await db.get_active_configs_by_tg_id(tg_id)
-    
-    if existing_configs:
-        # Продлеваем существующие конфиги
-        await extend_existing_configs_balance(tg_id, days, bot)
-    else:
-        # Выдаем конфиги на всех серверах из SERVER_ORDER
-        env_order = os.getenv("SERVER_ORDER", "ge")
-        servers_to_use = [s.strip().lower() for s in env_order.split(',') if s.strip()]
-        # При наличии вариантов (fi2, ge2) выберем по одному варианту на регион
+    # Повторное нажатие ждёт первое и видит уже списанный баланс
+    async with acquire_action_lock(tg_id, "activate_balance"):
         try:
-            from utils import pick_servers_one_per_region
-            selected = await pick_servers_one_per_region(servers_to_use)
+            days = await db.get_balance_days(tg_id)
         except Exception:
-            selected = servers_to_use
-        await give_configs_on_all_servers_balance(tg_id, days, selected, bot)
-    
+            days = 0
+        if days <= 0:
+            await callback_query.answer("Баланс пуст", show_alert=True)
+            return
+
+        # Проверяем доступность серверов перед активацией бонусных дней
+        if not await check_all_servers_available():
+            await callback_query.message.edit_text(
+                "❌ К сожалению, сейчас не все серверы доступны для активации бонусных дней.\n"
+                "Для активации дней должны быть доступны все серверы.\n"
+                "Попробуйте позже или обратитесь в поддержку.",
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                    [InlineKeyboardButton(text="🔙 Назад", callback_data="back")]
+                ])
+            )
+            await callback_query.answer()
+            return
+        # Проверяем, есть ли у пользователя уже АКТИВНЫЕ конфиги
+        existing_configs = await db.get_active_configs_by_tg_id(tg_id)
+
+        # Списываем баланс до выдачи: если списать не удалось (уже активирован), ничего не выдаём
+        if not await db.deduct_balance_days(tg_id, int(days)):
+            await callback_query.answer("Баланс пуст", show_alert=True)
+            return
+        # Ключ операции общий для первого прохода и фоновых повторов; время списания
+        # отличает его от следующей активации баланса того же размера
+        operation_id = f"balance:{tg_id}:{days}:{int(time.time())}"
+
+        if existing_configs:
+            # Продлеваем существующие конфиги
+            await extend_existing_configs_balance(tg_id, days, bot, configs=existing_configs, operation_id=operation_id)
+        else:
+            # Выдаем конфиги на всех серверах из SERVER_ORDER
+            env_order = os.getenv("SERVER_ORDER", "ge")
+            servers_to_use = [s.strip().lower() for s in env_order.split(',') if s.strip()]
+            # При наличии вариантов (fi2, ge2) выберем по одному варианту на регион
+            try:
+                from utils import pick_servers_one_per_region
+                selected = await pick_servers_one_per_region(servers_to_use)
+            except Exception:
+                selected = servers_to_use
+            await give_configs_on_all_servers_balance(tg_id, days, selected, bot, operation_id=operation_id)
+
     try:
         await callback_query.answer()
     except Exception:
         pass
 
 
-async def give_configs_on_all_servers_balance(tg_id: int, days: int, servers: list, bot: Bot) -> None:
-    """Выдает конфиги на всех указанных серверах для нового пользователя (активация баланса)."""
-    from utils import get_session, format_server_list
-    import aiohttp
-    
-    AUTH_CODE = os.getenv("AUTH_CODE")
-    urlupdate = "http://fastapi:8080/giveconfig"
-    session = await get_session()
-    
-    success_count = 0
-    successful_servers: list[str] = []
-    failed_servers = []
-    
-    for server in servers:
-        try:
-            data = {"time": days, "id": str(tg_id), "server": server}
-            async with session.post(urlupdate, json=data, headers={"X-API-Key": AUTH_CODE}) as resp:
-                if resp.status == 200:
-                    success_count += 1
-                    successful_servers.append(server)
-                else:
-                    failed_servers.append(server)
-        except Exception as e:
-            print(f"Failed to create config on server {server}: {e}")
-            failed_servers.append(server)
-    
-    # Списываем баланс только если хотя бы один конфиг создан
-    if success_count > 0:
-        await db.deduct_balance_days(tg_id, int(days))
-        
-        # Уведомляем пользователя о результате
+def _refund_if_failed(bot: Bot, tg_id: int | str, days: int):
+    """Колбэк фоновых повторов: ни один сервер так и не удался — возвращаем дни на баланс."""
+
+    async def _refund(final) -> None:
+        if final.ok:
+            return
+        await db.add_balance_days(str(tg_id), int(days))
+        await bot.send_message(int(tg_id), f"↩️ {days} дн. возвращены на баланс.")
+
+    return _refund
+
+
+async def give_configs_on_all_servers_balance(
+    tg_id: int, days: int, servers: list, bot: Bot, operation_id: str | None = None
+) -> None:
+    """Выдает конфиги на всех указанных серверах для нового пользователя (активация баланса).
+
+    Баланс к этому моменту уже списан; если конфиг не создан ни на одном сервере,
+    дни возвращаются (сразу или по итогам фоновых повторов).
+    """
+    from utils import format_server_list
+    from services.provisioning_service import provisioning_service, retry_note, retry_notifier
+
+    result = await provisioning_service.give_configs(
+        tg_id,
+        days,
+        servers,
+        operation_id=operation_id,
+        on_complete=retry_notifier(bot, extra=_refund_if_failed(bot, tg_id, days)),
+    )
+    note = retry_note(result)
+
+    if result.ok:
+        # Уведомляем пользователя о результате (одним сообщением)
+        servers_text = format_server_list(result.succeeded)
+        text = (
+            "✅ Активированы бонусные дни!\n\n"
+            f"Подписка действует на серверах: {servers_text}.\n"
+            f"Срок: {days} дн."
+        )
         try:
             sub_key = await db.get_or_create_sub_key(str(tg_id))
             base = os.getenv("PUBLIC_BASE_URL", "https://swaga.space").rstrip('/')
-            sub_url = f"{base}/subscription/{sub_key}"
-            servers_text = format_server_list(successful_servers)
-            await bot.send_message(
-                tg_id,
-                "✅ Активированы бонусные дни!\n\n"
-                f"Подписка действует на серверах: {servers_text}.\n"
-                f"Срок: {days} дн.\n\n"
-                f"Ваша ссылка подписки: {sub_url}",
-            )
+            text += f"\n\nВаша ссылка подписки: {base}/subscription/{sub_key}"
         except Exception:
-            servers_text = format_server_list(successful_servers)
-            await bot.send_message(
-                tg_id,
-                "✅ Активированы бонусные дни!\n\n"
-                f"Подписка действует на серверах: {servers_text}.\n"
-                f"Срок: {days} дн.",
-            )
+            pass
+        if note:
+            text += f"\n\n{note}"
+        await bot.send_message(tg_id, text)
         
         # Уведомляем администратора о активации бонусных дней
         try:
             admin_id = 746560409
-            username = "—"  # Можно добавить получение username если нужно
             await bot.send_message(
                 admin_id,
-                f"🎁 Активация бонусных дней: user_id={tg_id}, дней={days}, серверы={format_server_list(successful_servers)}"
+                f"🎁 Активация бонусных дней: user_id={tg_id}, дней={days}, серверы={servers_text}"
             )
         except Exception:
             pass
-    
-    if failed_servers:
-        failed_text = format_server_list(failed_servers)
-        await bot.send_message(tg_id, f"⚠️ Не удалось создать конфиги на серверах: {failed_text}")
-
-
-async def extend_existing_configs_balance(tg_id: int, days: int, bot: Bot) -> None:
-    """Продлевает существующие конфиги пользователя (активация баланса)."""
-    from utils import get_session
-    import aiohttp
-    
-    AUTH_CODE = os.getenv("AUTH_CODE")
-    urlextend = "http://fastapi:8080/extendconfig"
-    session = await get_session()
-    
-    # Получаем все АКТИВНЫЕ конфиги пользователя
-    existing_configs = await db.get_active_configs_by_tg_id(tg_id)
-    success_count = 0
-    failed_configs = []
-    
-    for user_code, time_end, server in existing_configs:
-        try:
-            data = {"time": days, "uid": user_code, "server": server}
-            async with session.post(urlextend, json=data, headers={"X-API-Key": AUTH_CODE}) as resp:
-                if resp.status == 200:
-                    success_count += 1
-                else:
-                    failed_configs.append(user_code)
-        except Exception as e:
-            print(f"Failed to extend config {user_code}: {e}")
-            failed_configs.append(user_code)
-    
-    # Уведомляем пользователя о результате
-    if success_count > 0:
-        # Списываем баланс и уведомляем
-        await db.deduct_balance_days(tg_id, int(days))
-        await bot.send_message(int(tg_id), f"✅ Продлено на {success_count} конфигах! Конфиги доступны в Личном кабинете → Мои конфиги")
+    else:
+        failed_text = format_server_list(result.failed)
+        if not result.retrying:
+            # Повторов не будет — возвращаем дни сразу
+            await db.add_balance_days(str(tg_id), int(days))
+            note = f"↩️ {days} дн. возвращены на баланс."
+        await bot.send_message(
+            tg_id,
+            f"⚠️ Не удалось создать конфиги на серверах: {failed_text}" + (f"\n\n{note}" if note else ""),
+        )
+
+
+async def extend_existing_configs_balance(
+    tg_id: int, days: int, bot: Bot, configs: list | None = None, operation_id: str | None = None
+) -> None:
+    """Продлевает существующие конфиги пользователя (активация баланса).
+
+    Баланс к этому моменту уже списан; если не продлён ни один конфиг, дни возвращаются.
+    """
+    from services.provisioning_service import provisioning_service, retry_note, retry_notifier
+
+    result = await provisioning_service.extend_configs(
+        tg_id,
+        days,
+        configs=configs,
+        operation_id=operation_id,
+        on_complete=retry_notifier(bot, extra=_refund_if_failed(bot, tg_id, days)),
+    )
+    note = retry_note(result)
+
+    if result.ok:
+        await bot.send_message(
+            int(tg_id),
+            f"✅ Продлено на {result.success_count} конфигах! Конфиги доступны в Личном кабинете → Мои конфиги"
+            + (f"\n\n{note}" if note else ""),
+        )
         
         # Уведомляем администратора о активации бонусных дней
         try:
             admin_id = 746560409
             await bot.send_message(
                 admin_id,
-                f"🎁 Продление бонусных дней: user_id={tg_id}, дней={days}, конфигов={success_count}"
+                f"🎁 Продление бонусных дней: user_id={tg_id}, дней={days}, конфигов={result.success_count}"
             )
         except Exception:
             pass
-    
-    if failed_configs:
-        await bot.send_message(int(tg_id), f"⚠️ Не удалось продлить {len(failed_configs)} конфигов")
-
+    else:
+        if not result.retrying:
+            await db.add_balance_days(str(tg_id), int(days))
+            note = f"↩️ {days} дн. возвращены на баланс."
+        await bot.send_message(
+            int(tg_id),
+            f"⚠️ Не удалось продлить {len(result.failed)} конфигов" + (f"\n\n{note}" if note else ""),
+        )
@@ -202,6 +202,8 @@ async def successful_payment_handler(message: Message, bot: Bot, state: FSMConte
     payload = message.successful_payment.invoice_payload
     payload_to_days = {"sub_1m": 31, "sub_3m": 93, "sub_6m": 180, "sub_12m": 365}
     days = payload_to_days.get(payload, 31)
+    # Id платежа Telegram — ключ идемпотентности выдачи/продления
+    charge_id = message.successful_payment.telegram_payment_charge_id
     user_data = await state.get_data()
     
     # Проверяем, есть ли у пользователя уже АКТИВНЫЕ конфиги
@@ -209,7 +211,7 @@ async def successful_payment_handler(message: Message, bot: Bot, state: FSMConte
     
     if existing_configs:
         # Продлеваем существующие конфиги
-        await extend_existing_configs(tg_id, days, bot)
+        await extend_existing_configs(tg_id, days, bot, configs=existing_configs, operation_id=charge_id)
     else:
         # Выдаем конфиги на ранее выбранных серверах (по одному на регион)
         data_state = await state.get_data()
@@ -223,7 +225,7 @@ async def successful_payment_handler(message: Message, bot: Bot, state: FSMConte
                 servers_to_use = await pick_servers_one_per_region(fallback)
             except Exception:
                 servers_to_use = fallback
-        await give_configs_on_all_servers(tg_id, days, servers_to_use, bot)
+        await give_configs_on_all_servers(tg_id, days, servers_to_use, bot, operation_id=charge_id)
     
     # Записываем платеж в статистику
     amount = message.successful_payment.total_amount
@@ -381,78 +383,52 @@ async def cancel_star_invoice(callback_query: CallbackQuery, state: FSMContext,
     await callback_query.answer("Счёт отменён")
 
 
-async def give_configs_on_all_servers(tg_id: int, days: int, servers: list, bot: Bot) -> None:
+async def give_configs_on_all_servers(tg_id: int, days: int, servers: list, bot: Bot, operation_id: str | None = None) -> None:
     """Выдает конфиги на всех указанных серверах для нового пользователя."""
-    from utils import get_session, format_server_list
-    import aiohttp
-    
-    AUTH_CODE = os.getenv("AUTH_CODE")
-    urlupdate = "http://fastapi:8080/giveconfig"
-    session = await get_session()
-    
-    success_count = 0
-    successful_servers: list[str] = []
-    failed_servers = []
-    
-    for server in servers:
-        try:
-            data = {"time": days, "id": str(tg_id), "server": server}
-            async with session.post(urlupdate, json=data, headers={"X-API-Key": AUTH_CODE}) as resp:
-                if resp.status == 200:
-                    success_count += 1
-                    successful_servers.append(server)
-                else:
-                    failed_servers.append(server)
-        except Exception as e:
-            logger.error(f"Failed to create config on server {server}: {e}")
-            failed_servers.append(server)
-    
-    # Уведомляем пользователя о результате
-    if success_count > 0:
-        servers_text = format_server_list(successful_servers)
+    from utils import format_server_list
+    from services.provisioning_service import provisioning_service, retry_note, retry_notifier
+
+    result = await provisioning_service.give_configs(
+        tg_id, days, servers, operation_id=operation_id, on_complete=retry_notifier(bot)
+    )
+
+    # Один итоговый отчёт пользователю
+    note = retry_note(result)
+    if result.ok:
+        servers_text = format_server_list(result.succeeded)
         await bot.send_message(
             tg_id,
             "✅ Оплата прошла успешно!\n\n"
             f"Подписка активирована на серверах: {servers_text}.\n\n"
-            "Получить подписку можно в Личном кабинете → Мои подключения",
+            + (f"{note}\n\n" if note else "")
+            + "Получить подписку можно в Личном кабинете → Мои подключения",
+        )
+    elif result.failed:
+        failed_text = format_server_list(result.failed)
+        await bot.send_message(
+            tg_id,
+            f"⚠️ Не удалось создать конфиги на серверах: {failed_text}" + (f"\n\n{note}" if note else ""),
         )
-    
-    if failed_servers:
-        failed_text = format_server_list(failed_servers)
-        await bot.send_message(tg_id, f"⚠️ Не удалось создать конфиги на серверах: {failed_text}")
 
 
-async def extend_existing_configs(tg_id: int, days: int, bot: Bot) -> None:
+async def extend_existing_configs(tg_id: int, days: int, bot: Bot, operation_id: str | None = None, configs: list | None = None) -> None:
     """Продлевает существующие конфиги пользователя."""
-    from utils import get_session
-    import aiohttp
-    
-    AUTH_CODE = os.getenv("AUTH_CODE")
-    urlextend = "http://fastapi:8080/extendconfig"
-    session = await get_session()
-    
-    # Получаем все АКТИВНЫЕ конфиги пользователя
-    existing_configs = await db.get_active_configs_by_tg_id(tg_id)
-    success_count = 0
-    failed_configs = []
-    
-    for user_code, time_end, server in existing_configs:
-        try:
-            data = {"time": days, "uid": user_code, "server": server}
-            async with session.post(urlextend, json=data, headers={"X-API-Key": AUTH_CODE}) as resp:
-                if resp.status == 200:
-                    success_count += 1
-                else:
-                    failed_configs.append(user_code)
-        except Exception as e:
-            logger.error(f"Failed to extend config {user_code}: {e}")
-            failed_configs.append(user_code)
-    
-    # Уведомляем пользователя о результате
-    if success_count > 0:
-        await bot.send_message(tg_id, f"✅ Оплата прошла успешно! \n\nПолучить подписку можно в Личном кабинете → Мои подключения")
-    
-    if failed_configs:
-        await bot.send_message(tg_id, f"⚠️ Не удалось продлить {len(failed_configs)} конфигов")
+    from services.provisioning_service import provisioning_service, retry_note, retry_notifier
 
+    result = await provisioning_service.extend_configs(
+        tg_id, days, configs=configs, operation_id=operation_id, on_complete=retry_notifier(bot)
+    )
 
+    note = retry_note(result)
+    if result.ok:
+        await bot.send_message(
+            tg_id,
+            "✅ Оплата прошла успешно! \n\n"
+            + (f"{note}\n\n" if note else "")
+            + "Получить подписку можно в Личном кабинете → Мои подключения",
+        )
+    elif result.failed:
+        await bot.send_message(
+            tg_id,
+            f"⚠️ Не удалось продлить {len(result.failed)} конфигов" + (f"\n\n{note}" if note else ""),
+        )
@@ -1,12 +1,15 @@
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
-import aiosqlite
-import random
-import asyncio
+import json
 import os
 import time
 
+from database.pool import connect as _connect, current_uow, pool
+from database.referral_codes import load_key as _load_referral_key, referral_code_for
+from database.user_cache import MISSING, USER_COLUMNS, UserRecord, user_cache
+
 async def init_db():
-    async with aiosqlite.connect("users.db") as conn:
+    # Через пул: первое же соединение переводит файл в WAL
+    async with pool.connection() as conn:
         cursor = await conn.cursor()
         # Если таблица ещё не создана – создаём без поля email
         await cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
@@ -64,89 +67,131 @@ async def init_db():
             await cursor.execute("INSERT INTO payments_agg (id, total_rub, total_stars, count_rub, count_stars) VALUES (1, 0, 0, 0, 0)")
             await conn.commit()
 
-user_locks = {}
+        await _load_referral_key(conn)
+        await _migrate_referral_codes(conn)
+
+
+async def _migrate_referral_codes(conn) -> None:
+    """Индекс по referral_code и детерминированные коды тем, у кого кода ещё нет.
+
+    Уже выданные коды не трогаем — старые ссылки-приглашения продолжают работать.
+    """
+    cursor = await conn.execute("PRAGMA index_list(users)")
+    indexes = await cursor.fetchall()
+    indexed = False
+    for index in indexes:
+        info = await conn.execute(f"PRAGMA index_info({index[1]!r})")
+        columns = [row[2] for row in await info.fetchall()]
+        if columns[:1] == ["referral_code"]:
+            indexed = True
+            break
+    if not indexed:
+        await conn.execute("CREATE INDEX IF NOT EXISTS ix_users_referral_code ON users(referral_code)")
+
+    cursor = await conn.execute("SELECT tg_id FROM users WHERE referral_code IS NULL AND tg_id IS NOT NULL")
+    updates = []
+    for (tg_id,) in await cursor.fetchall():
+        try:
+            updates.append((referral_code_for(tg_id), tg_id))
+        except ValueError:
+            # tg_id не из Telegram (не число) — оставляем без кода
+            continue
+    if updates:
+        await conn.executemany(
+            "UPDATE users SET referral_code = ? WHERE tg_id = ? AND referral_code IS NULL", updates
+        )
+    await conn.commit()
+
 
 DB_PATH = "users.db"
 
+
+# -------------------------------------------------
+# Кэш записей пользователей (см. database.user_cache)
+# -------------------------------------------------
+
+async def get_user_record(tg_id) -> UserRecord | None:
+    """Поля пользователя из кэша или одним SELECT; None — записи нет."""
+    record = user_cache.get(tg_id)
+    if record is not MISSING:
+        return record
+    token = user_cache.load_token()
+    async with _connect() as conn:
+        async with conn.execute(f"SELECT {USER_COLUMNS} FROM users WHERE tg_id = ?", (str(tg_id),)) as cursor:
+            row = await cursor.fetchone()
+    record = UserRecord.from_row(row) if row else None
+    uow = current_uow()
+    # Внутри незафиксированной транзакции апдейт видит свои изменения — другим их рано
+    if uow is None or not uow.dirty:
+        user_cache.put_loaded(tg_id, record, token)
+    return record
+
+
+def _remember(row) -> None:
+    """Write-through строки, возвращённой ``RETURNING {USER_COLUMNS}``."""
+    if not row:
+        return
+    record = UserRecord.from_row(row)
+    uow = current_uow()
+    if uow is None:
+        user_cache.put(record)
+        return
+    # Изменение апдейта ещё не зафиксировано: до commit остальные читают БД,
+    # после commit запись попадает в кэш (при откате — нет)
+    user_cache.invalidate(record.tg_id)
+    uow.after_commit(lambda: user_cache.put(record))
+
+
+def invalidate_user(tg_id) -> None:
+    """Сбрасывает запись из кэша (для кода, который меняет users в обход хелперов)."""
+    user_cache.invalidate(tg_id)
+
+
 async def get_referrer_id(user_tg_id: str):
     """
     Возвращает tg_id пользователя, который пригласил пользователя user_tg_id,
     или None если запись не найдена или referred_by пустой.
     """
-    async with aiosqlite.connect(DB_PATH) as conn:
-        conn.row_factory = aiosqlite.Row
-        async with conn.execute("SELECT referred_by FROM users WHERE tg_id = ?", (user_tg_id,)) as cursor:
-            row = await cursor.fetchone()
-            if not row:
-                return None
-            ref = row["referred_by"]
-            return ref if ref not in (None, "") else None
+    record = await get_user_record(user_tg_id)
+    if record is None:
+        return None
+    ref = record.referred_by
+    return ref if ref not in (None, "") else None
 
 
 async def get_referral_code(tg_id):
-    if tg_id not in user_locks:
-        user_locks[tg_id] = asyncio.Lock()
-
-    async with user_locks[tg_id]:  # Используем блокировку для синхронизации
-        async with aiosqlite.connect("users.db") as conn:
-            async with conn.cursor() as cursor:
-                # Шаг 1: Проверяем, есть ли у пользователя референс-код
-                await cursor.execute("SELECT referral_code FROM users WHERE tg_id = ?", (tg_id,))
-                result = await cursor.fetchone()
-
-                # Если у пользователя уже есть референс-код, возвращаем его
-                if result and result[0]:
-                    return result[0]
-
-                # Шаг 2: Если у пользователя нет референс-кода, проверяем наличие его записи
-                await cursor.execute("SELECT * FROM users WHERE tg_id = ?", (tg_id,))
-                user_exists = await cursor.fetchone()
-
-                # Если пользователя нет в базе данных, добавляем его
-                if not user_exists:
-                    await cursor.execute("INSERT INTO users (tg_id, created_at) VALUES (?, ?)", (tg_id, int(time.time())))
-
-                # Шаг 3: Генерируем новый уникальный референс-код
-                while True:
-                    referral_code = str(random.randint(10_000_000_000, 20_000_000_000))
-                    await cursor.execute("SELECT COUNT(*) FROM users WHERE referral_code = ?", (referral_code,))
-                    count = await cursor.fetchone()
-                    if count[0] == 0:  # Уникальный код
-                        break
-
-                # Шаг 4: Устанавливаем новый референс-код для пользователя
-                await cursor.execute(
-                    "UPDATE users SET referral_code = ? WHERE tg_id = ?",
-                    (referral_code, tg_id)
-                )
-                await conn.commit()
-                return referral_code
+    # Быстрый путь: код уже есть
+    record = await get_user_record(tg_id)
+    if record is not None and record.referral_code:
+        return record.referral_code
+
+    # Код детерминирован (см. database.referral_codes): не нужны ни подбор, ни блокировка.
+    # Уже выданный код (в том числе старый случайный) COALESCE не перезаписывает.
+    async with _connect() as conn:
+        async with conn.execute(
+            f"""
+            INSERT INTO users (tg_id, referral_code, created_at) VALUES (?, ?, ?)
+            ON CONFLICT(tg_id) DO UPDATE SET referral_code = COALESCE(users.referral_code, excluded.referral_code)
+            RETURNING {USER_COLUMNS}
+            """,
+            (str(tg_id), referral_code_for(tg_id), int(time.time())),
+        ) as cursor:
+            row = await cursor.fetchone()
+    _remember(row)
+    return row[1]
 
 async def is_first_time_user(user_id):
-    async with aiosqlite.connect("users.db") as conn:
-        async with conn.cursor() as cursor:
-            # Проверяем, существует ли запись с таким tg_id
-            await cursor.execute("SELECT tg_id FROM users WHERE tg_id = ?", (str(user_id),))
-            exists_result = await cursor.fetchone()
-
-            # Если пользователя нет в базе данных, считаем первым активатором
-            if exists_result is None:
-                return True
-
-            # Если пользователь есть, проверяем, указан ли у него referred_by
-            await cursor.execute("SELECT referred_by FROM users WHERE tg_id = ?", (str(user_id),))
-            referred_by_result = await cursor.fetchone()
-
-            # Возвращаем true, если поля referred_by нет или оно пустое
-            return referred_by_result is None or referred_by_result[0] is None
+    record = await get_user_record(user_id)
+    # Если пользователя нет в базе данных, считаем первым активатором
+    if record is None:
+        return True
+    # Возвращаем true, если поле referred_by не заполнено
+    return record.referred_by is None
 
 async def get_referral_count(tg_id: str) -> int | None:
     """Возвращает количество приглашённых пользователем или None, если записи нет."""
-    async with aiosqlite.connect("users.db") as conn:
-        async with conn.cursor() as cursor:
-            await cursor.execute("SELECT referral_count FROM users WHERE tg_id = ?", (str(tg_id),))
-            row = await cursor.fetchone()
-            return row[0] if row else None
+    record = await get_user_record(tg_id)
+    return record.referral_count if record is not None else None
 
 async def add_referral_by(user_id, referral_code, max_invites: int = 7) -> dict:
     """Добавляет связь реферала и увеличивает счётчик у пригласившего.
@@ -158,40 +203,50 @@ async def add_referral_by(user_id, referral_code, max_invites: int = 7) -> dict:
     Возвращает словарь:
     - award_2d: bool — начислять ли +2 дня за это приглашение
     - new_count: int — новое значение счётчика приглашений
-    """
-    async with aiosqlite.connect("users.db") as conn:
-        async with conn.cursor() as cursor:
-            # 1. Создаём запись пользователя (если её нет) и выставляем referred_by
-            await cursor.execute("SELECT tg_id FROM users WHERE tg_id = ?", (str(user_id),))
-            if await cursor.fetchone() is None:
-                await cursor.execute("INSERT INTO users (tg_id, created_at) VALUES (?, ?)", (str(user_id), int(time.time())))
-
-            await cursor.execute(
-                "UPDATE users SET referred_by = ? WHERE tg_id = ?",
-                (str(referral_code), str(user_id))
-            )
-
-            # 2. Проверяем текущий счётчик у пригласившего
-            await cursor.execute(
-                "SELECT referral_count FROM users WHERE referral_code = ?",
-                (str(referral_code),)
-            )
-            row = await cursor.fetchone()
-            current_count = row[0] if row and row[0] is not None else 0
-
-            # 3. Всегда увеличиваем счётчик (для корректного отображения прогресса > 7)
-            new_count = (current_count or 0) + 1
-            await cursor.execute(
-                "UPDATE users SET referral_count = ? WHERE referral_code = ?",
-                (new_count, str(referral_code))
-            )
-            await conn.commit()
 
-            award_2d = new_count <= max_invites
-            return {"award_2d": award_2d, "new_count": new_count}
+    referred_by выставляется только если он ещё пуст: повторный /start (или два
+    параллельных) не засчитывает приглашение второй раз — тогда award_2d=False.
+    """
+    async with _connect() as conn:
+        # 1. Создаём запись пользователя или выставляем referred_by, если его ещё нет
+        async with conn.execute(
+            f"""
+            INSERT INTO users (tg_id, referred_by, created_at) VALUES (?, ?, ?)
+            ON CONFLICT(tg_id) DO UPDATE SET referred_by = excluded.referred_by
+            WHERE users.referred_by IS NULL
+            RETURNING {USER_COLUMNS}
+            """,
+            (str(user_id), str(referral_code), int(time.time())),
+        ) as cursor:
+            invited = await cursor.fetchone()
+
+        if invited is None:
+            async with conn.execute(
+                "SELECT referral_count FROM users WHERE referral_code = ?", (str(referral_code),)
+            ) as cursor:
+                row = await cursor.fetchone()
+            return {"award_2d": False, "new_count": int(row[0] or 0) if row else 0}
+
+        # 2. Всегда увеличиваем счётчик (для корректного отображения прогресса > 7)
+        async with conn.execute(
+            f"""
+            UPDATE users SET referral_count = COALESCE(referral_count, 0) + 1
+            WHERE referral_code = ?
+            RETURNING {USER_COLUMNS}
+            """,
+            (str(referral_code),),
+        ) as cursor:
+            inviter = await cursor.fetchone()
+    _remember(invited)
+    _remember(inviter)
+    # Кода нет в базе — как и раньше, считаем это первым приглашением
+    new_count = int(inviter[3]) if inviter else 1
+
+    award_2d = new_count <= max_invites
+    return {"award_2d": award_2d, "new_count": new_count}
 
 async def get_tg_id_by_referral_code(referral_code):
-    async with aiosqlite.connect("users.db") as conn:
+    async with _connect() as conn:
         async with conn.execute("SELECT tg_id FROM users WHERE referral_code = ?", (referral_code,)) as cursor:
             row = await cursor.fetchone()
             return row[0] if row else None
@@ -202,68 +257,71 @@ async def get_tg_id_by_referral_code(referral_code):
 # -----------------------------
 
 async def ensure_user_row(tg_id: str) -> None:
-    async with aiosqlite.connect("users.db") as conn:
-        async with conn.cursor() as cursor:
-            await cursor.execute("SELECT tg_id FROM users WHERE tg_id = ?", (str(tg_id),))
-            exists = await cursor.fetchone()
-            if exists is None:
-                await cursor.execute("INSERT INTO users (tg_id, created_at) VALUES (?, ?)", (str(tg_id), int(time.time())))
-                await conn.commit()
+    # Запись уже известна кэшу — в БД идти не нужно
+    if await get_user_record(tg_id) is not None:
+        return
+    async with _connect() as conn:
+        async with conn.execute(
+            f"INSERT INTO users (tg_id, created_at) VALUES (?, ?) ON CONFLICT(tg_id) DO NOTHING RETURNING {USER_COLUMNS}",
+            (str(tg_id), int(time.time())),
+        ) as cursor:
+            row = await cursor.fetchone()
+    _remember(row)
 
 
 async def has_used_trial_3d(tg_id: str) -> bool:
-    async with aiosqlite.connect("users.db") as conn:
-        async with conn.cursor() as cursor:
-            await cursor.execute("SELECT trial_3d_used FROM users WHERE tg_id = ?", (str(tg_id),))
-            row = await cursor.fetchone()
-            return bool(row[0]) if row and row[0] is not None else False
+    record = await get_user_record(tg_id)
+    return bool(record.trial_3d_used) if record is not None and record.trial_3d_used is not None else False
 
 
 async def set_trial_3d_used(tg_id: str) -> None:
-    async with aiosqlite.connect("users.db") as conn:
-        async with conn.cursor() as cursor:
-            await cursor.execute("UPDATE users SET trial_3d_used = 1 WHERE tg_id = ?", (str(tg_id),))
-            if cursor.rowcount == 0:
-                # На случай отсутствия строки создадим её и повторим
-                await cursor.execute("INSERT INTO users (tg_id, trial_3d_used, created_at) VALUES (?, 1, ?)", (str(tg_id), int(time.time())))
-            await conn.commit()
+    async with _connect() as conn:
+        # На случай отсутствия строки она создаётся сразу с отметкой
+        async with conn.execute(
+            f"""
+            INSERT INTO users (tg_id, trial_3d_used, created_at) VALUES (?, 1, ?)
+            ON CONFLICT(tg_id) DO UPDATE SET trial_3d_used = 1
+            RETURNING {USER_COLUMNS}
+            """,
+            (str(tg_id), int(time.time())),
+        ) as cursor:
+            row = await cursor.fetchone()
+    _remember(row)
 
 
 # -------------------------------------------------
 # Оплаты: отметка и проверка
 # -------------------------------------------------
 
-async def mark_payment(tg_id: str, days: int) -> None:
+async def mark_payment(tg_id: str, days: int) -> int:
     """Отмечает успешную оплату пользователем.
 
     - Увеличивает счётчик оплат paid_count
     - Обновляет last_payment_at текущим timestamp
     - По необходимости может пополнять баланс (но баланс уже списывается при выдаче конфига)
+
+    Возвращает новое значение paid_count.
     """
     now_ts = int(time.time())
-    async with aiosqlite.connect("users.db") as conn:
-        async with conn.cursor() as cursor:
-            await cursor.execute("SELECT paid_count FROM users WHERE tg_id = ?", (str(tg_id),))
+    async with _connect() as conn:
+        async with conn.execute(
+            f"""
+            INSERT INTO users (tg_id, paid_count, last_payment_at, created_at) VALUES (?, 1, ?, ?)
+            ON CONFLICT(tg_id) DO UPDATE SET
+                paid_count = COALESCE(users.paid_count, 0) + 1,
+                last_payment_at = excluded.last_payment_at
+            RETURNING {USER_COLUMNS}
+            """,
+            (str(tg_id), now_ts, now_ts),
+        ) as cursor:
             row = await cursor.fetchone()
-            current = int(row[0]) if row and row[0] is not None else 0
-            await cursor.execute(
-                "UPDATE users SET paid_count = ?, last_payment_at = ? WHERE tg_id = ?",
-                (current + 1, now_ts, str(tg_id))
-            )
-            if cursor.rowcount == 0:
-                await cursor.execute(
-                    "INSERT INTO users (tg_id, paid_count, last_payment_at, created_at) VALUES (?, ?, ?, ?)",
-                    (str(tg_id), 1, now_ts, now_ts)
-                )
-            await conn.commit()
+    _remember(row)
+    return int(row[6])
 
 
 async def has_any_payment(tg_id: str) -> bool:
-    async with aiosqlite.connect("users.db") as conn:
-        async with conn.cursor() as cursor:
-            await cursor.execute("SELECT paid_count FROM users WHERE tg_id = ?", (str(tg_id),))
-            row = await cursor.fetchone()
-            return bool(row and row[0] and int(row[0]) > 0)
+    record = await get_user_record(tg_id)
+    return bool(record is not None and record.paid_count and int(record.paid_count) > 0)
 
 
 # -------------------------------------------------
@@ -274,40 +332,36 @@ async def add_rub_payment(amount_rub: int) -> None:
     amount_rub = int(amount_rub)
     if amount_rub <= 0:
         return
-    async with aiosqlite.connect("users.db") as conn:
-        async with conn.cursor() as cursor:
-            await cursor.execute(
-                "UPDATE payments_agg SET total_rub = total_rub + ?, count_rub = count_rub + 1 WHERE id = 1",
-                (amount_rub,)
-            )
-            if cursor.rowcount == 0:
-                await cursor.execute(
-                    "INSERT INTO payments_agg (id, total_rub, count_rub) VALUES (1, ?, 1)",
-                    (amount_rub,)
-                )
-            await conn.commit()
+    async with _connect() as conn:
+        await conn.execute(
+            """
+            INSERT INTO payments_agg (id, total_rub, count_rub) VALUES (1, ?, 1)
+            ON CONFLICT(id) DO UPDATE SET
+                total_rub = COALESCE(total_rub, 0) + excluded.total_rub,
+                count_rub = COALESCE(count_rub, 0) + 1
+            """,
+            (amount_rub,),
+        )
 
 
 async def add_star_payment(amount_stars: int) -> None:
     amount_stars = int(amount_stars)
     if amount_stars <= 0:
         return
-    async with aiosqlite.connect("users.db") as conn:
-        async with conn.cursor() as cursor:
-            await cursor.execute(
-                "UPDATE payments_agg SET total_stars = total_stars + ?, count_stars = count_stars + 1 WHERE id = 1",
-                (amount_stars,)
-            )
-            if cursor.rowcount == 0:
-                await cursor.execute(
-                    "INSERT INTO payments_agg (id, total_stars, count_stars) VALUES (1, ?, 1)",
-                    (amount_stars,)
-                )
-            await conn.commit()
+    async with _connect() as conn:
+        await conn.execute(
+            """
+            INSERT INTO payments_agg (id, total_stars, count_stars) VALUES (1, ?, 1)
+            ON CONFLICT(id) DO UPDATE SET
+                total_stars = COALESCE(total_stars, 0) + excluded.total_stars,
+                count_stars = COALESCE(count_stars, 0) + 1
+            """,
+            (amount_stars,),
+        )
 
 
 async def get_payments_aggregates() -> dict:
-    async with aiosqlite.connect("users.db") as conn:
+    async with _connect() as conn:
         async with conn.cursor() as cursor:
             await cursor.execute("SELECT total_rub, total_stars, count_rub, count_stars FROM payments_agg WHERE id = 1")
             row = await cursor.fetchone()
@@ -325,41 +379,79 @@ async def get_payments_aggregates() -> dict:
 # -------------------------------------------------
 
 async def get_balance_days(tg_id: str) -> int:
-    async with aiosqlite.connect("users.db") as conn:
-        async with conn.cursor() as cursor:
-            await cursor.execute("SELECT balance FROM users WHERE tg_id = ?", (str(tg_id),))
-            row = await cursor.fetchone()
-            return int(row[0]) if row and row[0] is not None else 0
+    record = await get_user_record(tg_id)
+    return int(record.balance) if record is not None and record.balance is not None else 0
 
 
-async def add_balance_days(tg_id: str, days: int) -> None:
+# Начисления и списания — одним оператором (UPSERT / UPDATE ... RETURNING): без
+# чтения-изменения-записи параллельные апдейты не теряют дни друг друга.
+
+_CREDIT_BALANCE_SQL = f"""
+    INSERT INTO users (tg_id, balance, created_at) VALUES (?, ?, ?)
+    ON CONFLICT(tg_id) DO UPDATE SET balance = COALESCE(users.balance, 0) + excluded.balance
+    RETURNING {USER_COLUMNS}
+"""
+
+
+async def add_balance_days(tg_id: str, days: int) -> int | None:
+    """Начисляет дни на баланс (создаёт строку при отсутствии). Возвращает новый баланс."""
     if days <= 0:
-        return
-    async with aiosqlite.connect("users.db") as conn:
-        async with conn.cursor() as cursor:
-            await cursor.execute("SELECT balance FROM users WHERE tg_id = ?", (str(tg_id),))
+        return None
+    async with _connect() as conn:
+        async with conn.execute(_CREDIT_BALANCE_SQL, (str(tg_id), int(days), int(time.time()))) as cursor:
             row = await cursor.fetchone()
-            if row is None:
-                await cursor.execute("INSERT INTO users (tg_id, balance, created_at) VALUES (?, ?, ?)", (str(tg_id), int(days), int(time.time())))
-            else:
-                current_balance = int(row[0]) if row[0] is not None else 0
-                await cursor.execute("UPDATE users SET balance = ? WHERE tg_id = ?", (current_balance + int(days), str(tg_id)))
-            await conn.commit()
+    _remember(row)
+    return int(row[5])
+
+
+async def add_balance_days_bulk(credits) -> dict[str, int]:
+    """Начисляет дни многим пользователям одним оператором (реферальные и промо-выплаты).
+
+    ``credits`` — словарь или пары ``(tg_id, days)``; повторы одного tg_id суммируются,
+    неположительные значения пропускаются. Возвращает ``{tg_id: новый баланс}``.
+    """
+    items = credits.items() if isinstance(credits, dict) else credits
+    totals: dict[str, int] = {}
+    for tg_id, days in items:
+        days = int(days)
+        if days > 0:
+            key = str(tg_id)
+            totals[key] = totals.get(key, 0) + days
+    if not totals:
+        return {}
+    async with _connect() as conn:
+        # WHERE true обязателен: иначе SQLite путает ON CONFLICT с JOIN ... ON
+        async with conn.execute(
+            f"""
+            INSERT INTO users (tg_id, balance, created_at)
+            SELECT key, value, ? FROM json_each(?) WHERE true
+            ON CONFLICT(tg_id) DO UPDATE SET balance = COALESCE(users.balance, 0) + excluded.balance
+            RETURNING {USER_COLUMNS}
+            """,
+            (int(time.time()), json.dumps(totals)),
+        ) as cursor:
+            rows = await cursor.fetchall()
+    for row in rows:
+        _remember(row)
+    return {row[0]: int(row[5]) for row in rows}
 
 
 async def deduct_balance_days(tg_id: str, days: int) -> bool:
+    """Списывает дни, только если их хватает. False — баланса мало или записи нет."""
     if days <= 0:
         return False
-    async with aiosqlite.connect("users.db") as conn:
-        async with conn.cursor() as cursor:
-            await cursor.execute("SELECT balance FROM users WHERE tg_id = ?", (str(tg_id),))
+    async with _connect() as conn:
+        async with conn.execute(
+            f"""
+            UPDATE users SET balance = balance - ?
+            WHERE tg_id = ? AND COALESCE(balance, 0) >= ?
+            RETURNING {USER_COLUMNS}
+            """,
+            (int(days), str(tg_id), int(days)),
+        ) as cursor:
             row = await cursor.fetchone()
-            current_balance = int(row[0]) if row and row[0] is not None else 0
-            if current_balance < days:
-                return False
-            await cursor.execute("UPDATE users SET balance = ? WHERE tg_id = ?", (current_balance - int(days), str(tg_id)))
-            await conn.commit()
-            return True
+    _remember(row)
+    return row is not None
 
 async def build_subscription_kb(user_id: int):
     auth_code = os.getenv("AUTH_CODE", "")
@@ -0,0 +1,337 @@
+"""
+FSM-хранилище aiogram в SQLite.
+
+По умолчанию ``Dispatcher`` держит состояния в памяти (``MemoryStorage``): после
+перезапуска терялись незавершённые оплаты (``invoice_msg_id``, ``yookassa_payment_id``,
+``servers_to_use``), а второй процесс бота не видел состояний первого.
+
+``SqliteStorage`` хранит состояние и данные в таблице ``fsm_states`` того же
+``users.db`` (WAL):
+
+* чтение — из кэша в памяти (LRU); промах читает строку одним SELECT;
+* запись — сразу в кэш и в буфер; буфер сбрасывается одной транзакцией не позже чем
+  через ``flush_interval`` секунд или при ``max_pending`` изменённых ключах, так что
+  апдейт не ждёт диск, а при сбое теряются только изменения последних миллисекунд;
+* пустое состояние без данных удаляет строку — таблица хранит только активные диалоги;
+* ключи, не менявшиеся дольше ``ttl`` секунд, считаются пустыми и периодически удаляются.
+
+Кэш принадлежит процессу. По умолчанию (``cache_ttl = 0``) он считается источником
+истины, и хранилище рассчитано на один процесс бота. Для нескольких процессов (webhook
+раздаёт апдейты одного пользователя любому из них) задайте ``BOT_FSM_CACHE_TTL``:
+запись из кэша старше стольких секунд перечитывается из ``fsm_states``, и берётся
+более свежая по ``updated_at``. Чужие изменения видны не раньше их сброса, поэтому
+апдейты одного пользователя, пришедшие в разные процессы с интервалом меньше
+``cache_ttl + flush_interval``, всё ещё могут прочитать устаревшее состояние.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from copy import copy
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+import aiosqlite
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+# Ключ -> (состояние, данные, время изменения)
+_Record = Tuple[Optional[str], Dict[str, Any], float]
+
+
+class SqliteStorage(BaseStorage):
+    def __init__(
+        self,
+        db_path: str = "users.db",
+        ttl: float = 86400.0,
+        cache_size: int = 10000,
+        flush_interval: float = 0.05,
+        max_pending: int = 500,
+        cleanup_interval: float = 600.0,
+        busy_timeout_ms: int = 5000,
+        cache_ttl: float = 0.0,
+        key_builder: Optional[KeyBuilder] = None,
+    ):
+        self.db_path = db_path
+        self.ttl = max(0.0, float(ttl))
+        self.cache_size = max(1, int(cache_size))
+        self.flush_interval = max(0.0, float(flush_interval))
+        self.max_pending = max(1, int(max_pending))
+        self.cleanup_interval = max(1.0, float(cleanup_interval))
+        self.busy_timeout_ms = max(0, int(busy_timeout_ms))
+        self.cache_ttl = max(0.0, float(cache_ttl))
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache: "OrderedDict[str, _Record]" = OrderedDict()
+        # Ключ -> когда запись кэша прочитана из БД или записана этим процессом
+        self._cached_at: Dict[str, float] = {}
+        # Изменения, ещё не записанные в БД: ключ -> запись
+        self._pending: Dict[str, _Record] = {}
+        # Запись и чтение — разные соединения: в WAL чтение промаха не ждёт сброса буфера
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._reader: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._read_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_now = asyncio.Event()
+        # Ключи, которые ждут чтения из БД
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._loader: Optional[asyncio.Task] = None
+        self._last_cleanup = time.monotonic()
+        # Метрики
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.flushed_keys = 0
+        self.expired = 0
+
+    # --- Соединение ---
+
+    async def _open(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.db_path)
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        return conn
+
+    async def _writer_conn(self) -> aiosqlite.Connection:
+        if self._writer is None:
+            conn = await self._open()
+            await conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS fsm_states (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            await conn.execute("CREATE INDEX IF NOT EXISTS ix_fsm_states_updated_at ON fsm_states(updated_at)")
+            await conn.commit()
+            self._writer = conn
+        return self._writer
+
+    async def _reader_conn(self) -> aiosqlite.Connection:
+        if self._reader is None:
+            # Таблицу создаёт соединение записи
+            async with self._write_lock:
+                await self._writer_conn()
+            self._reader = await self._open()
+        return self._reader
+
+    # --- Кэш ---
+
+    def _is_expired(self, record: _Record) -> bool:
+        return self.ttl > 0 and time.time() - record[2] > self.ttl
+
+    def _remember(self, key: str, record: _Record, fresh: bool = True) -> None:
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        if fresh:
+            self._cached_at[key] = time.monotonic()
+        while len(self._cache) > self.cache_size:
+            evicted, _ = self._cache.popitem(last=False)
+            self._cached_at.pop(evicted, None)
+
+    def _cached(self, built: str) -> Optional[_Record]:
+        # Несброшенное изменение могло уже вытесниться из кэша — в БД его ещё нет
+        pending = self._pending.get(built)
+        if pending is not None:
+            return pending
+        record = self._cache.get(built)
+        if record is not None and self.cache_ttl > 0 and time.monotonic() - self._cached_at.get(built, 0.0) > self.cache_ttl:
+            # Другой процесс мог изменить запись — перечитываем
+            return None
+        return record
+
+    async def _get_record(self, key: StorageKey) -> _Record:
+        built = self.key_builder.build(key)
+        record = self._cached(built)
+        if record is not None:
+            self._remember(built, record, fresh=False)
+            self.hits += 1
+        else:
+            self.misses += 1
+            record = await self._load(built)
+            # Пока читали, запись могла измениться в этом же процессе; из кэша берём
+            # запись, только если она свежее прочитанной
+            pending = self._pending.get(built)
+            cached = self._cache.get(built)
+            if pending is not None:
+                record = pending
+            elif cached is not None and cached[2] > record[2]:
+                record = cached
+            self._remember(built, record)
+        if self._is_expired(record):
+            self.expired += 1
+            return None, {}, record[2]
+        return record
+
+    async def _load(self, built: str) -> _Record:
+        # Промахи одновременных апдейтов читаются одним SELECT ... IN
+        future = self._loading.get(built)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._loading[built] = future
+            if self._loader is None or self._loader.done():
+                self._loader = asyncio.create_task(self._load_batches())
+        return await asyncio.shield(future)
+
+    async def _load_batches(self) -> None:
+        async with self._read_lock:
+            while self._loading:
+                batch, self._loading = self._loading, {}
+                keys = list(batch)
+                try:
+                    conn = await self._reader_conn()
+                    rows = {}
+                    for i in range(0, len(keys), 500):
+                        chunk = keys[i:i + 500]
+                        marks = ",".join("?" * len(chunk))
+                        async with conn.execute(
+                            f"SELECT key, state, data, updated_at FROM fsm_states WHERE key IN ({marks})", chunk
+                        ) as cursor:
+                            for key, state, data, updated_at in await cursor.fetchall():
+                                rows[key] = (state, json.loads(data) if data else {}, float(updated_at))
+                except Exception as exc:
+                    for future in batch.values():
+                        if not future.done():
+                            future.set_exception(exc)
+                    continue
+                now = time.time()
+                for built, future in batch.items():
+                    if not future.done():
+                        future.set_result(rows.get(built) or (None, {}, now))
+
+    async def _put(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]) -> None:
+        built = self.key_builder.build(key)
+        record = (state, data, time.time())
+        self._remember(built, record)
+        self._pending[built] = record
+        if len(self._pending) >= 4 * self.max_pending:
+            # Диск не успевает за апдейтами — притормаживаем их
+            await self.flush()
+            return
+        if len(self._pending) >= self.max_pending:
+            self._flush_now.set()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    # --- BaseStorage ---
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        _, data, _ = await self._get_record(key)
+        await self._put(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get_record(key))[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(
+                f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            )
+        # Несериализуемые данные — ошибка в обработчике, а не при фоновом сбросе
+        json.dumps(data)
+        state, _, _ = await self._get_record(key)
+        await self._put(key, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._get_record(key))[1].copy()
+
+    async def get_value(self, storage_key: StorageKey, dict_key: str, default: Optional[Any] = None) -> Optional[Any]:
+        return copy((await self._get_record(storage_key))[1].get(dict_key, default))
+
+    async def close(self) -> None:
+        # Отложенный сброс ждёт не дольше flush_interval; отменять его посреди записи нельзя
+        if self._flush_task is not None and not self._flush_task.done():
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+        async with self._read_lock:
+            if self._reader is not None:
+                await self._reader.close()
+                self._reader = None
+        async with self._write_lock:
+            if self._writer is not None:
+                await self._writer.close()
+                self._writer = None
+
+    # --- Сброс буфера ---
+
+    async def _flush_later(self) -> None:
+        # Ждём flush_interval или переполнения буфера
+        try:
+            await asyncio.wait_for(self._flush_now.wait(), self.flush_interval)
+        except asyncio.TimeoutError:
+            pass
+        self._flush_now.clear()
+        try:
+            await self.flush()
+        except Exception as exc:
+            logger.warning("FSM flush failed, retrying later: %s", exc)
+            if self._pending:
+                self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def flush(self) -> None:
+        """Записывает накопленные изменения одной транзакцией."""
+        if not self._pending and time.monotonic() - self._last_cleanup < self.cleanup_interval:
+            return
+        pending, self._pending = self._pending, {}
+        upserts = []
+        deletes = []
+        for built, (state, data, updated_at) in pending.items():
+            if state is None and not data:
+                deletes.append((built,))
+            else:
+                upserts.append((built, state, json.dumps(data, ensure_ascii=False), updated_at))
+        try:
+            async with self._write_lock:
+                conn = await self._writer_conn()
+                if upserts:
+                    await conn.executemany(
+                        """
+                        INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                        ON CONFLICT(key) DO UPDATE SET
+                            state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+                        """,
+                        upserts,
+                    )
+                if deletes:
+                    await conn.executemany("DELETE FROM fsm_states WHERE key = ?", deletes)
+                if self.ttl > 0 and time.monotonic() - self._last_cleanup >= self.cleanup_interval:
+                    await conn.execute("DELETE FROM fsm_states WHERE updated_at < ?", (time.time() - self.ttl,))
+                    self._last_cleanup = time.monotonic()
+                await conn.commit()
+        except Exception:
+            # Возвращаем в буфер всё, что не успели перезаписать новыми изменениями
+            for built, record in pending.items():
+                self._pending.setdefault(built, record)
+            raise
+        self.flushes += 1
+        self.flushed_keys += len(pending)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "cached": len(self._cache),
+            "pending": len(self._pending),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "flushes": self.flushes,
+            "flushed_keys": self.flushed_keys,
+            "expired": self.expired,
+        }
+
+
+fsm_storage = SqliteStorage(
+    db_path=os.getenv("BOT_FSM_DB_PATH", "users.db"),
+    ttl=float(os.getenv("BOT_FSM_TTL", "86400")),
+    cache_size=int(os.getenv("BOT_FSM_CACHE_SIZE", "10000")),
+    flush_interval=float(os.getenv("BOT_FSM_FLUSH_INTERVAL", "0.05")),
+    cache_ttl=float(os.getenv("BOT_FSM_CACHE_TTL", "0")),
+)
@@ -0,0 +1,297 @@
+"""
+Общие соединения с ``users.db`` бота и единица работы (unit of work) на апдейт.
+
+Раньше каждый хелпер ``database.db`` открывал своё ``aiosqlite.connect`` (отдельный
+поток и файл) и сам делал ``commit``: обработчик успешной оплаты открывал около шести
+соединений подряд. Теперь соединения живут в пуле фиксированного размера и
+настраиваются один раз: WAL (читатели не ждут писателя), ``synchronous=NORMAL``
+(fsync только на чекпоинте), ``busy_timeout`` вместо мгновенного ``database is locked``.
+
+``DbSessionMiddleware`` открывает на апдейт одну ``UnitOfWork``: хелперы, вызванные
+из этого апдейта, берут одно соединение из пула и пишут в одну транзакцию, которая
+коммитится в конце обработки (или откатывается при исключении).
+
+Чтобы не держать блокировку записи SQLite, пока обработчик ждёт сеть, единица работы
+фиксируется заранее (``flush``) перед каждым запросом к Telegram Bot API и перед
+HTTP-запросами общей aiohttp-сессии ``utils.get_session``. После ``flush`` соединение
+возвращается в пул; следующий хелпер возьмёт его снова, и транзакция откроется только
+если будет что писать. Типичный апдейт (прочитать/записать, затем ответить) — одно
+соединение и один ``commit``. Дочерние задачи (``asyncio.gather``) единицу работы апдейта
+не видят, поэтому перед их запуском обработчик сам вызывает ``flush_current()``.
+
+Код вне апдейтов (фоновые задачи, рассылки) получает соединение из пула на время
+вызова хелпера и коммитит сразу, как раньше.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = "users.db"
+
+POOL_SIZE = max(1, int(os.getenv("BOT_DB_POOL_SIZE", "4")))
+BUSY_TIMEOUT_MS = max(0, int(os.getenv("BOT_DB_BUSY_TIMEOUT_MS", "5000")))
+# Сколько ждать свободного соединения, прежде чем апдейт упадёт с TimeoutError
+ACQUIRE_TIMEOUT = float(os.getenv("BOT_DB_ACQUIRE_TIMEOUT", "10"))
+
+
+class ConnectionPool:
+    """Пул из ``size`` соединений aiosqlite с одинаковыми PRAGMA.
+
+    Соединения открываются лениво. Путь запоминается абсолютным: если рабочий каталог
+    сменился (скрипты, бенчмарки), простаивающие соединения к старому файлу закрываются.
+    Свободного соединения ждём не дольше ``acquire_timeout`` секунд (0 — без ограничения):
+    одно зависшее соединение не должно останавливать все апдейты.
+    """
+
+    def __init__(
+        self,
+        path: str = DB_PATH,
+        size: int = POOL_SIZE,
+        busy_timeout_ms: int = BUSY_TIMEOUT_MS,
+        acquire_timeout: float = ACQUIRE_TIMEOUT,
+    ) -> None:
+        self.path = path
+        self.size = max(1, int(size))
+        self.busy_timeout_ms = int(busy_timeout_ms)
+        self.acquire_timeout = max(0.0, float(acquire_timeout))
+        self._idle: List[aiosqlite.Connection] = []
+        self._paths: Dict[int, str] = {}
+        self._opened = 0
+        self._cond: Optional[asyncio.Condition] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Метрики
+        self.connects = 0
+        self.commits = 0
+        self.rollbacks = 0
+        self.acquire_timeouts = 0
+
+    def _condition(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        if self._cond is None or self._loop is not loop:
+            self._cond = asyncio.Condition()
+            self._loop = loop
+        return self._cond
+
+    async def _open(self, path: str) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(path, timeout=self.busy_timeout_ms / 1000)
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        self._paths[id(conn)] = path
+        self.connects += 1
+        return conn
+
+    async def _discard(self, conn: aiosqlite.Connection) -> None:
+        self._paths.pop(id(conn), None)
+        self._opened -= 1
+        try:
+            await conn.close()
+        except Exception:
+            logger.exception("Failed to close pooled connection")
+
+    async def acquire(self) -> aiosqlite.Connection:
+        path = os.path.abspath(self.path)
+        cond = self._condition()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.acquire_timeout if self.acquire_timeout else None
+        async with cond:
+            while True:
+                while self._idle:
+                    conn = self._idle.pop()
+                    if self._paths.get(id(conn)) == path:
+                        return conn
+                    await self._discard(conn)
+                if self._opened < self.size:
+                    self._opened += 1
+                    break
+                if deadline is None:
+                    await cond.wait()
+                    continue
+                try:
+                    await asyncio.wait_for(cond.wait(), max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    self.acquire_timeouts += 1
+                    raise TimeoutError(
+                        f"No free database connection within {self.acquire_timeout}s (pool size {self.size})"
+                    ) from None
+        try:
+            return await self._open(path)
+        except BaseException:
+            async with cond:
+                self._opened -= 1
+                cond.notify()
+            raise
+
+    async def release(self, conn: aiosqlite.Connection) -> None:
+        """Возвращает соединение; незавершённая транзакция откатывается."""
+        if conn.in_transaction:
+            try:
+                await conn.rollback()
+                self.rollbacks += 1
+            except Exception:
+                logger.exception("Rollback on release failed, dropping connection")
+                cond = self._condition()
+                async with cond:
+                    await self._discard(conn)
+                    cond.notify()
+                return
+        cond = self._condition()
+        async with cond:
+            self._idle.append(conn)
+            cond.notify()
+
+    async def commit(self, conn: aiosqlite.Connection) -> None:
+        if conn.in_transaction:
+            await conn.commit()
+            self.commits += 1
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Соединение на один вызов: ``commit`` при успехе, откат при исключении."""
+        conn = await self.acquire()
+        try:
+            yield conn
+            await self.commit(conn)
+        finally:
+            await self.release(conn)
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await self._discard(conn)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "opened": self._opened,
+            "idle": len(self._idle),
+            "connects": self.connects,
+            "commits": self.commits,
+            "rollbacks": self.rollbacks,
+            "acquire_timeouts": self.acquire_timeouts,
+        }
+
+
+pool = ConnectionPool()
+
+
+class UnitOfWork:
+    """Одно соединение и одна транзакция на апдейт.
+
+    Соединение берётся из пула при первом обращении к БД. ``flush`` фиксирует изменения
+    и отдаёт соединение обратно; ``close`` завершает единицу работы.
+    """
+
+    def __init__(self, pool: ConnectionPool) -> None:
+        self.pool = pool
+        self.task = asyncio.current_task()
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._commit_hooks: List[Callable[[], None]] = []
+        self.closed = False
+
+    async def connection(self) -> aiosqlite.Connection:
+        if self.closed:
+            raise RuntimeError("Unit of work is already closed")
+        if self._conn is None:
+            self._conn = await self.pool.acquire()
+        return self._conn
+
+    @property
+    def dirty(self) -> bool:
+        return self._conn is not None and self._conn.in_transaction
+
+    def after_commit(self, hook: Callable[[], None]) -> None:
+        """Вызывается после фиксации изменений (например, обновить кэш); при откате — нет."""
+        self._commit_hooks.append(hook)
+
+    def _committed(self) -> None:
+        hooks, self._commit_hooks = self._commit_hooks, []
+        for hook in hooks:
+            try:
+                hook()
+            except Exception:
+                logger.exception("After-commit hook failed")
+
+    async def flush(self) -> None:
+        """Коммитит накопленные изменения и возвращает соединение в пул."""
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            await self.pool.commit(conn)
+            self._committed()
+        finally:
+            self._commit_hooks.clear()
+            await self.pool.release(conn)
+
+    async def close(self, commit: bool = True) -> None:
+        self.closed = True
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            if commit:
+                await self.pool.commit(conn)
+                self._committed()
+        finally:
+            # Без commit незавершённая транзакция откатится в release
+            self._commit_hooks.clear()
+            await self.pool.release(conn)
+
+
+_current_uow: contextvars.ContextVar[Optional[UnitOfWork]] = contextvars.ContextVar("bot_db_uow", default=None)
+
+
+def current_uow() -> Optional[UnitOfWork]:
+    """Единица работы текущего апдейта.
+
+    Задачи, запущенные из обработчика (``asyncio.create_task``), наследуют контекст, но
+    соединение апдейта не получают: его транзакция заканчивается вместе с апдейтом.
+    """
+    uow = _current_uow.get()
+    if uow is None or uow.closed or uow.task is not asyncio.current_task():
+        return None
+    return uow
+
+
+@asynccontextmanager
+async def unit_of_work(pool: ConnectionPool = pool) -> AsyncIterator[UnitOfWork]:
+    """Открывает единицу работы: ``commit`` при успехе, откат при исключении."""
+    uow = UnitOfWork(pool)
+    token = _current_uow.set(uow)
+    ok = False
+    try:
+        yield uow
+        ok = True
+    finally:
+        _current_uow.reset(token)
+        await uow.close(commit=ok)
+
+
+@asynccontextmanager
+async def connect() -> AsyncIterator[aiosqlite.Connection]:
+    """Соединение для хелпера: соединение апдейта, если оно есть, иначе своё из пула."""
+    uow = current_uow()
+    if uow is not None:
+        yield await uow.connection()
+        return
+    async with pool.connection() as conn:
+        yield conn
+
+
+async def flush_current() -> None:
+    """Фиксирует изменения текущего апдейта и отдаёт его соединение в пул.
+
+    Вызывается перед сетевыми запросами: пока обработчик ждёт ответа, он не держит
+    ни блокировку записи, ни соединение пула.
+    """
+    uow = current_uow()
+    if uow is not None:
+        await uow.flush()
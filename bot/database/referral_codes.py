@@ -0,0 +1,93 @@
+"""
+Детерминированные реферальные коды.
+
+Раньше код подбирался случайно (``random.randint`` в диапазоне 10^10..2·10^10) и
+проверялся ``SELECT COUNT(*)`` в цикле до первого свободного значения под блокировкой
+пользователя. Теперь код — образ ``tg_id`` при биекции: сеть Фейстеля на 52 битах
+(Telegram гарантирует, что id пользователя в них помещается) с раундовой функцией
+на ключевом BLAKE2b. Разные ``tg_id`` дают разные коды, поэтому проверять
+уникальность и повторять не нужно, а без ключа по коду не восстановить ``tg_id``.
+
+Новые коды — 17-значные числа от 10^16, старые случайные — 11-значные, диапазоны не
+пересекаются: выданные раньше коды остаются в ``users.referral_code`` и продолжают
+работать.
+
+Ключ должен быть постоянным: с другим ключом новый код может совпасть с кодом, уже
+выданным по старому ключу. Поэтому он не выводится из ``TELEGRAM_TOKEN`` (токен
+перевыпускают) и не имеет общей константы по умолчанию. ``BOT_REFERRAL_KEY`` задаёт его
+явно; без него ключ один раз записывается при ``init_db`` в таблицу ``bot_secrets`` той
+же базы, что и коды, и дальше читается только оттуда. Для новой базы он случайный; если
+в базе уже есть 17-значные коды, выданные прежними версиями (ключ от ``TELEGRAM_TOKEN``),
+сохраняется тот же прежний ключ, чтобы новые коды не совпали с уже выданными.
+До ``load_key`` коды не выдаются.
+"""
+import hashlib
+import os
+import secrets
+from typing import Optional
+
+_HALF_BITS = 26
+_HALF_MASK = (1 << _HALF_BITS) - 1
+_DOMAIN = 1 << (2 * _HALF_BITS)
+_ROUNDS = 4
+# Все новые коды 17-значные, старые (10^10..2·10^10) — 11-значные
+CODE_BASE = 10 ** 16
+
+_SECRET_NAME = "referral_key"
+
+_KEY: Optional[bytes] = None
+
+
+def set_key(secret: str) -> None:
+    global _KEY
+    _KEY = hashlib.blake2b(secret.encode(), digest_size=32, person=b"referral-codes").digest()
+
+
+async def load_key(conn) -> None:
+    """Берёт ключ из ``BOT_REFERRAL_KEY`` или из ``bot_secrets`` (создаёт при первом запуске)."""
+    secret = os.getenv("BOT_REFERRAL_KEY")
+    if not secret:
+        await conn.execute(
+            "CREATE TABLE IF NOT EXISTS bot_secrets (name TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        cursor = await conn.execute(
+            "SELECT 1 FROM users WHERE length(referral_code) = 17 LIMIT 1"
+        )
+        if await cursor.fetchone() is None:
+            initial = secrets.token_hex(32)
+        else:
+            # Коды уже выдавались прежним ключом — фиксируем его, а не заводим новый
+            initial = os.getenv("TELEGRAM_TOKEN") or "referral"
+        # INSERT OR IGNORE: при гонке двух процессов выживает одно значение, и оба читают его
+        await conn.execute(
+            "INSERT OR IGNORE INTO bot_secrets (name, value) VALUES (?, ?)", (_SECRET_NAME, initial)
+        )
+        await conn.commit()
+        cursor = await conn.execute("SELECT value FROM bot_secrets WHERE name = ?", (_SECRET_NAME,))
+        (secret,) = await cursor.fetchone()
+    set_key(secret)
+
+
+def _round(value: int, round_no: int) -> int:
+    digest = hashlib.blake2b(
+        value.to_bytes(4, "big") + bytes((round_no,)), digest_size=4, key=_KEY
+    ).digest()
+    return int.from_bytes(digest, "big") & _HALF_MASK
+
+
+def _permute(value: int) -> int:
+    left, right = value >> _HALF_BITS, value & _HALF_MASK
+    for round_no in range(_ROUNDS):
+        left, right = right, left ^ _round(right, round_no)
+    return (left << _HALF_BITS) | right
+
+
+def referral_code_for(tg_id) -> str:
+    """Код пользователя; ValueError, если tg_id не целое из [0, 2^52)."""
+    if _KEY is None:
+        raise RuntimeError("Ключ реферальных кодов не загружен: сначала init_db()")
+    value = int(tg_id)
+    if not 0 <= value < _DOMAIN:
+        raise ValueError(f"tg_id вне диапазона реферальных кодов: {tg_id}")
+    return str(CODE_BASE + _permute(value))
+
@@ -0,0 +1,140 @@
+"""
+Кэш «горячих» записей пользователей бота.
+
+/start, профиль, пробная подписка, активация баланса и оплата почти на каждом шаге
+перечитывают одни и те же поля ``users`` (баланс, ``trial_3d_used``, ``paid_count``,
+реферальный код и пригласившего). Кэш держит эти поля в памяти: LRU на
+``max_size`` записей, каждая живёт не дольше ``ttl`` секунд.
+
+Наполняет его только слой ``database.db``:
+
+* чтение — промах читает строку целиком одним SELECT и кладёт её в кэш (отсутствие
+  строки тоже кэшируется, чтобы новые пользователи не ходили в БД на каждой проверке);
+* запись — изменяющие хелперы возвращают строку через ``RETURNING`` и сразу кладут её
+  в кэш (write-through); при откате единицы работы такие ключи сбрасываются;
+* ``invalidate``/``clear`` — для кода, который меняет ``users`` в обход хелперов.
+
+Загрузка не перезаписывает кэш, если за время чтения в него что-то записали: иначе
+медленный SELECT мог бы вернуть в кэш старое значение поверх свежего write-through.
+"""
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+# Порядок колонок в SELECT/RETURNING, из которых строится запись
+USER_COLUMNS = "tg_id, referral_code, referred_by, referral_count, trial_3d_used, balance, paid_count"
+
+
+@dataclass(frozen=True)
+class UserRecord:
+    """Значения колонок как в БД (без нормализации: хелперы приводят их сами, как раньше)."""
+
+    tg_id: str
+    referral_code: Optional[str]
+    referred_by: Optional[str]
+    referral_count: Optional[int]
+    trial_3d_used: Optional[int]
+    balance: Optional[int]
+    paid_count: Optional[int]
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "UserRecord":
+        return cls(str(row[0]), *row[1:])
+
+
+# Маркер промаха: отличается от None («строки нет в БД»)
+MISSING = object()
+
+
+class UserCache:
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0):
+        self.max_size = max(0, int(max_size))
+        self.ttl = max(0.0, float(ttl))
+        # tg_id -> (запись или None, когда положили)
+        self._entries: "OrderedDict[str, Tuple[Optional[UserRecord], float]]" = OrderedDict()
+        # Растёт при каждой записи/сбросе; по нему загрузка узнаёт, что данные могли устареть
+        self._epoch = 0
+        # Метрики
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_loads = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl > 0
+
+    def get(self, tg_id) -> object:
+        """Запись, ``None`` (строки нет) или ``MISSING`` при промахе."""
+        key = str(tg_id)
+        entry = self._entries.get(key)
+        if entry is not None:
+            record, stored_at = entry
+            if time.monotonic() - stored_at < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return record
+            del self._entries[key]
+        self.misses += 1
+        return MISSING
+
+    def load_token(self) -> int:
+        """Отметка перед чтением из БД; передаётся в ``put_loaded``."""
+        return self._epoch
+
+    def put_loaded(self, tg_id, record: Optional[UserRecord], token: int) -> None:
+        """Кладёт прочитанную из БД запись, если за время чтения ничего не записывали."""
+        if token != self._epoch:
+            self.stale_loads += 1
+            return
+        self._store(str(tg_id), record)
+
+    def put(self, record: UserRecord) -> None:
+        """Write-through после изменения строки."""
+        self._epoch += 1
+        self.writes += 1
+        self._store(record.tg_id, record)
+
+    def _store(self, key: str, record: Optional[UserRecord]) -> None:
+        if not self.enabled:
+            return
+        self._entries[key] = (record, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, tg_id) -> None:
+        self._epoch += 1
+        if self._entries.pop(str(tg_id), None) is not None:
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self._epoch += 1
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "stale_loads": self.stale_loads,
+        }
+
+
+user_cache = UserCache(
+    max_size=int(os.getenv("BOT_USER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("BOT_USER_CACHE_TTL", "300")),
+)
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable, Dict
+
+import aiohttp
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+
+from database.pool import ConnectionPool, flush_current, pool, unit_of_work
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Per-update unit of work for the bot database.
+
+    Opens a ``UnitOfWork`` around every update and exposes it to handlers as
+    ``data["db"]``. Helpers from ``database.db`` called while the update is being
+    handled share its pooled connection and transaction. The transaction is
+    committed when the handler returns and rolled back if it raises.
+
+    Register on ``dp.update`` so every router and observer is covered.
+    """
+
+    def __init__(self, db_pool: ConnectionPool = pool) -> None:
+        super().__init__()
+        self.pool = db_pool
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        async with unit_of_work(self.pool) as uow:
+            data["db"] = uow
+            return await handler(event, data)
+
+
+class FlushDbBeforeRequest(BaseRequestMiddleware):
+    """
+    Bot API request middleware: commits the current update's pending writes
+    before the request goes out, so the SQLite write lock is never held while
+    waiting for Telegram.
+    """
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Any,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        await flush_current()
+        return await make_request(bot, method)
+
+
+async def _flush_on_request_start(session: aiohttp.ClientSession, ctx: Any, params: Any) -> None:
+    await flush_current()
+
+
+def flush_db_trace_config() -> aiohttp.TraceConfig:
+    """aiohttp trace config doing the same for outgoing HTTP requests (backend API)."""
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(_flush_on_request_start)
+    return trace
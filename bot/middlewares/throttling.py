@@ -1,20 +1,22 @@
 from __future__ import annotations
 
-import asyncio
-import time
-from collections import deque
-from typing import Deque, Dict, Hashable, Optional, Tuple
+from typing import Hashable, Optional
 
 from aiogram import BaseMiddleware
-from aiogram.dispatcher.flags import get_flag
+from aiogram.dispatcher.flags import extract_flags
 from aiogram.types import CallbackQuery, Message
 
+from services.rate_limit import GcraLimiter
+
 
 class ThrottlingMiddleware(BaseMiddleware):
     """
-    Simple per-user, per-handler throttling middleware for Aiogram v3.
+    Per-user, per-handler throttling middleware for Aiogram v3.
 
-    Controls frequency of invoking handlers on a sliding time window basis.
+    Each (user, handler) key allows ``burst`` events per ``window`` seconds, enforced
+    with GCRA: the state is a single timestamp per key, checks run without awaiting,
+    so no lock is needed, and keys that went idle are evicted by a time wheel
+    (see ``services.rate_limit``). Memory is proportional to recently active users.
 
     Flags supported on handlers (via @router.message(..., flags={...})):
       - throttle_key: str            # logical key for grouping; defaults to handler function name
@@ -35,10 +37,8 @@ class ThrottlingMiddleware(BaseMiddleware):
         self.default_window = max(0.1, float(default_window))
         self.default_burst = max(1, int(default_burst))
         self.allowlist_user_ids = allowlist_user_ids or set()
-        # key: (user_id, throttle_key) -> deque[timestamps]
-        self._buckets: Dict[Tuple[int, Hashable], Deque[float]] = {}
-        # Protect the buckets mapping in concurrent environment
-        self._lock = asyncio.Lock()
+        # key: (user_id, throttle_key) -> theoretical arrival time
+        self.limiter = GcraLimiter(period=self.default_window, burst=self.default_burst)
 
     async def __call__(self, handler, event, data):  # type: ignore[override]
         user_id = self._extract_user_id(event)
@@ -46,52 +46,33 @@ class ThrottlingMiddleware(BaseMiddleware):
         if user_id is None or user_id in self.allowlist_user_ids:
             return await handler(event, data)
 
-        # Read flags set on the handler
-        if get_flag(data, "throttle_exempt") is True:
+        # Read flags set on the handler (once, not per flag)
+        flags = extract_flags(data)
+        if flags.get("throttle_exempt") is True:
             return await handler(event, data)
 
-        throttle_key = self._resolve_key(handler, data)
-        window = float(get_flag(data, "throttle_window") or self.default_window)
-        burst = int(get_flag(data, "throttle_burst") or self.default_burst)
-
-        now = time.monotonic()
-        key = (user_id, throttle_key)
-
-        async with self._lock:
-            bucket = self._buckets.get(key)
-            if bucket is None:
-                bucket = deque()
-                self._buckets[key] = bucket
-
-            # Drop events outside of window
-            cutoff = now - window
-            while bucket and bucket[0] <= cutoff:
-                bucket.popleft()
-
-            # If we already reached burst within window -> throttle
-            if len(bucket) >= burst:
-                await self._notify_throttled(event, window)
-                return  # swallow the event
+        throttle_key = self._resolve_key(handler, flags)
+        window = float(flags.get("throttle_window") or self.default_window)
+        burst = int(flags.get("throttle_burst") or self.default_burst)
 
-            # Record current event timestamp and proceed
-            bucket.append(now)
+        allowed, retry_after = self.limiter.hit((user_id, throttle_key), period=window, burst=burst)
+        if not allowed:
+            await self._notify_throttled(event, retry_after)
+            return  # swallow the event
 
         return await handler(event, data)
 
     @staticmethod
     def _extract_user_id(event) -> Optional[int]:
-        if isinstance(event, Message) and event.from_user:
-            return event.from_user.id
-        if isinstance(event, CallbackQuery) and event.from_user:
-            return event.from_user.id
-        # Fallbacks (just in case other update types are used later)
+        # Message, CallbackQuery and most other update types carry from_user;
+        # plain attribute access avoids slow isinstance checks on pydantic models
         user = getattr(event, "from_user", None)
         return getattr(user, "id", None)
 
     @staticmethod
-    def _resolve_key(handler, data) -> Hashable:
+    def _resolve_key(handler, flags) -> Hashable:
         # Explicit key via flags has priority
-        explicit = get_flag(data, "throttle_key")
+        explicit = flags.get("throttle_key")
         if explicit is not None:
             return explicit
         # Otherwise, use underlying callback function name (per-handler)
@@ -101,12 +82,13 @@ class ThrottlingMiddleware(BaseMiddleware):
         return "__unknown_handler__"
 
     @staticmethod
-    async def _notify_throttled(event, window: float) -> None:
+    async def _notify_throttled(event, retry_after: float) -> None:
+        retry_after = max(0.1, retry_after)
         try:
             if isinstance(event, CallbackQuery):
-                await event.answer(f"Слишком часто. Подождите {window:.1f} сек.", show_alert=False)
+                await event.answer(f"Слишком часто. Подождите {retry_after:.1f} сек.", show_alert=False)
             elif isinstance(event, Message):
-                await event.answer(f"Слишком часто. Повторите через {window:.1f} сек.")
+                await event.answer(f"Слишком часто. Повторите через {retry_after:.1f} сек.")
         except Exception:
             # Swallow any notification errors silently
             pass
@@ -30,6 +30,32 @@ def init_broadcast_service(bot):
     broadcast_service = BroadcastService(bot)
     return broadcast_service
 
+async def launch_campaign(
+    message: types.Message,
+    name: str,
+    text: str,
+    target_segment: str = "all",
+    recipients=None,
+    disable_web_page_preview: bool = False
+) -> bool:
+    """Запуск рассылки в фоне из обработчика админ-панели
+
+    Ход рассылки — в новом сообщении администратору (с кнопками отмены и продолжения);
+    recipients — готовый список получателей вместо сегмента.
+    """
+    if broadcast_service.running_campaign(name):
+        await message.answer(f"⏳ Рассылка «{name}» уже идёт — прогресс в сообщении о ней.")
+        return False
+    
+    progress_message = await message.answer(f"⏳ Подготовка рассылки «{name}»...")
+    campaign_id = await broadcast_service.create_campaign(
+        name, text, target_segment, disable_web_page_preview=disable_web_page_preview
+    )
+    if not await broadcast_service.start_campaign(campaign_id, recipients=recipients, progress_message=progress_message):
+        await progress_message.edit_text(f"Нет получателей для рассылки «{name}».")
+        return False
+    return True
+
 @router.callback_query(F.data == "admin_advanced_broadcast")
 async def advanced_broadcast_menu(callback: types.CallbackQuery):
     """Меню продвинутой системы рассылок"""
@@ -187,7 +213,7 @@ async def process_parse_mode(callback: types.CallbackQuery, state: FSMContext):
         )
         
         # Получаем количество пользователей в сегменте
-        user_ids = await broadcast_service.get_users_by_segment(user_data["target_segment"])
+        users_count = await broadcast_service.count_users_by_segment(user_data["target_segment"])
         
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="🚀 Запустить кампанию", callback_data=f"start_campaign_{campaign_id}")],
@@ -200,7 +226,7 @@ async def process_parse_mode(callback: types.CallbackQuery, state: FSMContext):
             "✅ <b>Кампания создана!</b>\n\n"
             f"📝 Название: <b>{user_data['campaign_name']}</b>\n"
             f"👥 Сегмент: <b>{user_data['target_segment']}</b>\n"
-            f"📊 Пользователей: <b>{len(user_ids)}</b>\n"
+            f"📊 Пользователей: <b>{users_count}</b>\n"
             f"📝 Формат: <b>{parse_mode or 'Обычный текст'}</b>\n\n"
             "Выберите действие:",
             reply_markup=keyboard,
@@ -225,15 +251,14 @@ async def start_campaign(callback: types.CallbackQuery):
     
     campaign_id = callback.data.replace("start_campaign_", "")
     
+    # Создание сообщений большой кампании занимает время — убираем «часики» сразу
+    await callback.answer()
+    
     try:
-        success = await broadcast_service.start_campaign(campaign_id)
-        if success:
-            await callback.message.edit_text(
-                "🚀 <b>Кампания запущена!</b>\n\n"
-                "Рассылка началась. Вы можете отслеживать прогресс в разделе 'Активные кампании'.",
-                parse_mode="HTML"
-            )
-        else:
+        await callback.message.edit_text("⏳ Подготовка кампании...")
+        # Дальше это сообщение показывает ход рассылки
+        success = await broadcast_service.start_campaign(campaign_id, progress_message=callback.message)
+        if not success:
             await callback.message.edit_text(
                 "❌ <b>Ошибка запуска кампании</b>\n\n"
                 "Не удалось запустить кампанию. Проверьте настройки.",
@@ -244,8 +269,6 @@ async def start_campaign(callback: types.CallbackQuery):
         await callback.message.edit_text(
             f"❌ Ошибка при запуске кампании: {str(e)}"
         )
-    
-    await callback.answer()
 
 @router.callback_query(F.data == "active_campaigns")
 async def show_active_campaigns(callback: types.CallbackQuery):
@@ -329,6 +352,42 @@ async def stop_campaign(callback: types.CallbackQuery):
     
     await callback.answer()
 
+@router.callback_query(F.data.startswith("campaign_cancel_"))
+async def cancel_campaign(callback: types.CallbackQuery):
+    """Отмена рассылки из сообщения о её ходе (сообщение обновит ProgressReporter)"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    
+    campaign_id = callback.data.replace("campaign_cancel_", "")
+    
+    try:
+        if await broadcast_service.stop_campaign(campaign_id):
+            await callback.answer("⏹️ Рассылка отменена")
+        else:
+            await callback.answer("Рассылка уже не идёт", show_alert=True)
+    except Exception as e:
+        logger.error(f"Error cancelling campaign: {e}")
+        await callback.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
+
+@router.callback_query(F.data.startswith("campaign_resume_"))
+async def resume_campaign(callback: types.CallbackQuery):
+    """Продолжение отменённой рассылки: уйдут только неотправленные сообщения"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    
+    campaign_id = callback.data.replace("campaign_resume_", "")
+    
+    try:
+        if await broadcast_service.resume_campaign(campaign_id):
+            await callback.answer("▶️ Рассылка продолжена")
+        else:
+            await callback.answer("Рассылку нельзя продолжить", show_alert=True)
+    except Exception as e:
+        logger.error(f"Error resuming campaign: {e}")
+        await callback.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
+
 @router.callback_query(F.data == "campaign_stats")
 async def show_campaign_stats(callback: types.CallbackQuery):
     """Показ статистики кампаний"""
@@ -416,8 +475,11 @@ async def show_user_segments(callback: types.CallbackQuery):
         text = "🎯 <b>Сегментация пользователей</b>\n\n"
         
         for segment_key, segment_name in segments.items():
-            user_ids = await broadcast_service.get_users_by_segment(segment_key)
-            text += f"👥 <b>{segment_name}</b>: {len(user_ids)} пользователей\n"
+            users_count = await broadcast_service.count_users_by_segment(segment_key)
+            if not broadcast_service.segments.available(segment_key):
+                text += f"👥 <b>{segment_name}</b>: нет данных о подписках\n"
+                continue
+            text += f"👥 <b>{segment_name}</b>: {users_count} пользователей\n"
         
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_advanced_broadcast")]
@@ -440,12 +502,12 @@ async def show_broadcast_settings(callback: types.CallbackQuery):
     
     text = (
         "⚙️ <b>Настройки системы рассылок</b>\n\n"
-        f"📦 Размер батча: {broadcast_service.batch_size} сообщений\n"
-        f"⏱️ Задержка между батчами: {broadcast_service.delay_between_batches} сек\n"
+        f"📦 Темп: {broadcast_service.rate:g} сообщений/сек, одновременно до {broadcast_service.max_in_flight}\n"
         f"🔄 Максимум попыток: {broadcast_service.max_retries}\n"
-        f"⏳ Задержка между попытками: {broadcast_service.retry_delay} сек\n"
+        f"⏳ Задержка между попытками: от {broadcast_service.retry_delay} сек\n"
+        f"🚦 Пауз по RetryAfter: {broadcast_service.sender.flood_waits}\n"
         f"🔄 Статус обработки: {'Активна' if broadcast_service.is_running else 'Остановлена'}\n\n"
-        "Эти настройки можно изменить в коде сервиса рассылок."
+        "Темп задаётся переменными BROADCAST_RATE и BROADCAST_MAX_IN_FLIGHT."
     )
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -2,7 +2,6 @@ from aiogram import Router, F, types
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 import logging
-import aiosqlite
 from keyboards import keyboard
 
 logger = logging.getLogger(__name__)
@@ -15,6 +14,7 @@ class AdminStates(StatesGroup):
 
 # Импортируем is_admin из main модуля
 from .main import is_admin
+from .advanced_broadcast import launch_campaign
 
 @router.callback_query(F.data == "admin_broadcast")
 async def start_broadcast(callback: types.CallbackQuery, state: FSMContext):
@@ -35,7 +35,7 @@ async def start_broadcast(callback: types.CallbackQuery, state: FSMContext):
         await callback.answer("❌ Ошибка при запуске рассылки", show_alert=True)
 
 @router.message(AdminStates.waiting_for_message)
-async def process_broadcast_message(message: types.Message, state: FSMContext, bot):
+async def process_broadcast_message(message: types.Message, state: FSMContext):
     """Обрабатывает сообщение для рассылки и отправляет его всем пользователям."""
     if not is_admin(message.from_user.id):
         await message.answer("У вас нет доступа.", reply_markup=keyboard.create_keyboard())
@@ -47,43 +47,9 @@ async def process_broadcast_message(message: types.Message, state: FSMContext, b
         await message.answer("Сообщение не может быть пустым. Попробуйте снова:", reply_markup=keyboard.create_keyboard())
         return
     
-    # Получаем список всех пользователей из БД
+    # Рассылка идёт в фоне; ход — в отдельном сообщении с кнопками отмены и продолжения
     try:
-        user_ids = await get_all_user_ids()
-        if not user_ids:
-            await message.answer("В базе данных нет пользователей.", reply_markup=keyboard.create_keyboard())
-            await state.clear()
-            return
-        
-        # Отправляем сообщение администратору о начале рассылки
-        progress_msg = await message.answer(f"📤 Начинаю рассылку сообщения {len(user_ids)} пользователям...")
-        
-        # Отправляем сообщение всем пользователям
-        sent_count = 0
-        failed_count = 0
-        
-        for i, user_id in enumerate(user_ids):
-            try:
-                await bot.send_message(user_id, broadcast_text)
-                sent_count += 1
-                
-                # Обновляем прогресс каждые 10 сообщений или в конце
-                if (i + 1) % 10 == 0 or (i + 1) == len(user_ids):
-                    await progress_msg.edit_text(f"📤 Рассылка в процессе... Отправлено: {sent_count}/{len(user_ids)}")
-                    
-            except Exception as e:
-                logger.warning(f"Failed to send message to user {user_id}: {e}")
-                failed_count += 1
-        
-        # Отправляем отчет администратору
-        await message.answer(
-            f"✅ Рассылка завершена!\n\n"
-            f"📊 Статистика:\n"
-            f"• Отправлено: {sent_count}\n"
-            f"• Ошибок: {failed_count}\n"
-            f"• Всего пользователей: {len(user_ids)}"
-        )
-        
+        await launch_campaign(message, f"Всем: {broadcast_text[:30]}", broadcast_text, "all")
     except Exception as e:
         logger.error(f"Error during broadcast: {e}")
         await message.answer(f"❌ Ошибка при рассылке: {str(e)}", reply_markup=keyboard.create_keyboard())
@@ -91,7 +57,7 @@ async def process_broadcast_message(message: types.Message, state: FSMContext, b
     await state.clear()
 
 @router.message(AdminStates.waiting_for_promo_message)
-async def process_promo_message(message: types.Message, state: FSMContext, bot):
+async def process_promo_message(message: types.Message, state: FSMContext):
     """Обрабатывает промо-сообщение и отправляет его всем пользователям."""
     if not is_admin(message.from_user.id):
         await message.answer("У вас нет доступа.", reply_markup=keyboard.create_keyboard())
@@ -104,47 +70,9 @@ async def process_promo_message(message: types.Message, state: FSMContext, bot):
         return
     
     try:
-        user_ids = await get_all_user_ids()
-        if not user_ids:
-            await message.answer("В базе данных нет пользователей.", reply_markup=keyboard.create_keyboard())
-            await state.clear()
-            return
-        
-        await message.answer(f"🔥 Начинаю промо-рассылку {len(user_ids)} пользователям...")
-        
-        sent_count = 0
-        failed_count = 0
-        
-        for user_id in user_ids:
-            try:
-                await bot.send_message(user_id, promo_text)
-                sent_count += 1
-            except Exception as e:
-                logger.warning(f"Failed to send promo message to user {user_id}: {e}")
-                failed_count += 1
-        
-        await message.answer(
-            f"✅ Промо-рассылка завершена!\n\n"
-            f"📊 Статистика:\n"
-            f"• Отправлено: {sent_count}\n"
-            f"• Ошибок: {failed_count}\n"
-            f"• Всего пользователей: {len(user_ids)}"
-        )
-        
+        await launch_campaign(message, f"Промо: {promo_text[:30]}", promo_text, "all")
     except Exception as e:
         logger.error(f"Error during promo broadcast: {e}")
         await message.answer(f"❌ Ошибка при промо-рассылке: {str(e)}", reply_markup=keyboard.create_keyboard())
     
     await state.clear()
-
-async def get_all_user_ids() -> list[str]:
-    """Получает список всех tg_id из bot БД."""
-    try:
-        async with aiosqlite.connect("users.db") as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute("SELECT tg_id FROM users")
-                rows = await cursor.fetchall()
-                return [row[0] for row in rows if row[0]]
-    except Exception as e:
-        logger.error(f"Error getting user IDs: {e}")
-        return []
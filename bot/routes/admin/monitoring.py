@@ -7,6 +7,10 @@ import logging
 import time
 from datetime import datetime, timedelta
 
+from database.pool import pool as db_pool
+from database.user_cache import user_cache
+from database.fsm_storage import fsm_storage
+
 logger = logging.getLogger(__name__)
 router = Router()
 
@@ -151,6 +155,19 @@ async def detailed_metrics(callback: types.CallbackQuery):
             text += f"• Рост дохода: {bot_metrics.get('revenue_growth', 0):.2f} ₽\n"
             text += f"• Очередь рассылок: {bot_metrics['broadcast_queue_size']}\n\n"
         
+        # Кэш записей пользователей и пул соединений users.db
+        cache = user_cache.stats()
+        db_stats = db_pool.stats()
+        text += f"🗄 <b>Кэш пользователей:</b>\n"
+        text += f"• Попаданий: {cache['hit_rate'] * 100:.1f}% ({cache['hits']}/{cache['hits'] + cache['misses']})\n"
+        text += f"• Записей: {cache['size']}/{cache['max_size']}, вытеснено: {cache['evictions']}\n"
+        text += f"• Пул БД: {db_stats['opened']}/{db_stats['size']} соединений, коммитов: {db_stats['commits']}\n\n"
+
+        fsm = fsm_storage.stats()
+        text += f"💾 <b>FSM-хранилище:</b>\n"
+        text += f"• Попаданий: {fsm['hit_rate'] * 100:.1f}%, в кэше: {fsm['cached']}\n"
+        text += f"• Ожидают записи: {fsm['pending']}, сбросов: {fsm['flushes']}\n\n"
+        
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_monitoring")]
         ])
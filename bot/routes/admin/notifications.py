@@ -4,7 +4,6 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 import logging
 import time
 import aiohttp
-import asyncio
 import os
 
 logger = logging.getLogger(__name__)
@@ -17,9 +16,11 @@ AUTH_CODE = os.getenv("AUTH_CODE")
 
 # Импортируем is_admin из main модуля
 from .main import is_admin
+# Рассылки идут в фоне через BroadcastService: темп Telegram, прогресс, отмена и продолжение
+from .advanced_broadcast import launch_campaign
 
 @router.callback_query(F.data == "notif")
-async def send_notif(callback: types.CallbackQuery, bot):
+async def send_notif(callback: types.CallbackQuery):
     if not is_admin(callback.from_user.id):
         await callback.answer("Нет доступа", show_alert=True)
         return
@@ -49,8 +50,7 @@ async def send_notif(callback: types.CallbackQuery, bot):
         await callback.message.answer("Нет пользователей с подпиской, истекающей в ближайшие 8 часов.")
         return
 
-    sent = 0
-    failed = 0
+    recipients = []
     invalid = 0
 
     now = int(time.time())
@@ -80,24 +80,27 @@ async def send_notif(callback: types.CallbackQuery, bot):
                 minutes += 1
             text = f"🔔 Внимание! Подписка на ваш конфиг истекает через {minutes} минут."
 
-        try:
-            await bot.send_message(int(tg), text)
-            sent += 1
-        except Exception as e:
-            logger.warning(f"Failed to send notif to {tg}: {e}")
-            failed += 1
-
-        # небольшая пауза, чтобы не превышать лимиты
-        await asyncio.sleep(0.05)  # 50ms, увеличьте при необходимости
-
-    summary = (
-        f"Уведомления отправлены.\n\n"
-        f"Отправлено: {sent}\n"
-        f"Не доставлено (ошибки): {failed}\n"
-        f"Пропущено (некорректные записи): {invalid}\n"
-        f"Всего проверено записей: {len(data)}"
-    )
-    await callback.message.answer(summary)
+        recipients.append((tg, text))
+
+    if invalid:
+        await callback.message.answer(
+            f"Пропущено некорректных записей: {invalid} из {len(data)}"
+        )
+    if not recipients:
+        return
+
+    # Текст у каждого получателя свой (оставшееся время); текст кампании — запасной
+    try:
+        await launch_campaign(
+            callback.message,
+            "Уведомление об окончании подписки",
+            "🔔 Внимание! Подписка на ваш конфиг скоро истекает.",
+            "expiring",
+            recipients=recipients,
+        )
+    except Exception as e:
+        logger.error(f"Error in send_notif: {e}")
+        await callback.message.answer(f"Ошибка при рассылке: {e}")
 
 @router.callback_query(F.data == "admin_notifications")
 async def notifications_menu(callback: types.CallbackQuery):
@@ -130,7 +133,7 @@ from .statistics import (
 )
 
 @router.callback_query(F.data == "notif_no_sub")
-async def send_no_sub_notification(callback: types.CallbackQuery, bot):
+async def send_no_sub_notification(callback: types.CallbackQuery):
     """Рассылка пользователям без подписки для привлечения."""
     if not is_admin(callback.from_user.id):
         await callback.answer("Нет доступа", show_alert=True)
@@ -158,22 +161,13 @@ async def send_no_sub_notification(callback: types.CallbackQuery, bot):
             "Готовы попробовать? Откройте /start и активируйте пробную подписку. Если остались вопросы — напишите в поддержку, поможем."
         )
 
-        sent = 0
-        failed = 0
-        for uid in user_ids:
-            try:
-                await bot.send_message(uid, message_text, disable_web_page_preview=True)
-                sent += 1
-                await asyncio.sleep(0.1)  # Пауза между отправками
-            except Exception as e:
-                logger.warning(f"Failed to send to {uid}: {e}")
-                failed += 1
-
-        await callback.message.answer(
-            f"✅ Рассылка завершена!\n\n"
-            f"Отправлено: {sent}\n"
-            f"Не доставлено: {failed}\n"
-            f"Всего пользователей: {len(user_ids)}"
+        await launch_campaign(
+            callback.message,
+            "Привлечение: пользователи без подписки",
+            message_text,
+            "no_subscription",
+            recipients=user_ids,
+            disable_web_page_preview=True,
         )
 
     except Exception as e:
@@ -181,7 +175,7 @@ async def send_no_sub_notification(callback: types.CallbackQuery, bot):
         await callback.message.answer(f"Ошибка при рассылке: {e}")
 
 @router.callback_query(F.data == "notif_expired")
-async def send_expired_notification(callback: types.CallbackQuery, bot):
+async def send_expired_notification(callback: types.CallbackQuery):
     """Рассылка пользователям с истекшей подпиской для возврата."""
     if not is_admin(callback.from_user.id):
         await callback.answer("Нет доступа", show_alert=True)
@@ -207,22 +201,13 @@ async def send_expired_notification(callback: types.CallbackQuery, bot):
             "Готовы вернуться? Откройте /start и выберите тариф. Если остались вопросы — напишите в поддержку, поможем."
         )
 
-        sent = 0
-        failed = 0
-        for uid in user_ids:
-            try:
-                await bot.send_message(uid, message_text, disable_web_page_preview=True)
-                sent += 1
-                await asyncio.sleep(0.1)  # Пауза между отправками
-            except Exception as e:
-                logger.warning(f"Failed to send to {uid}: {e}")
-                failed += 1
-
-        await callback.message.answer(
-            f"✅ Рассылка завершена!\n\n"
-            f"Отправлено: {sent}\n"
-            f"Не доставлено: {failed}\n"
-            f"Всего пользователей: {len(user_ids)}"
+        await launch_campaign(
+            callback.message,
+            "Возврат: истекшая подписка",
+            message_text,
+            "expired",
+            recipients=user_ids,
+            disable_web_page_preview=True,
         )
 
     except Exception as e:
@@ -243,7 +228,7 @@ async def send_promo_notification(callback: types.CallbackQuery, state: FSMConte
     )
 
 @router.callback_query(F.data == "notif_trial_only")
-async def send_trial_only_notification(callback: types.CallbackQuery, bot):
+async def send_trial_only_notification(callback: types.CallbackQuery):
     """Рассылка пользователям, кто активировал пробную, но не совершал оплату.
 
     Текст включает: обход отключений интернета на Теле2/МТС/Йота + дополнительные преимущества.
@@ -284,22 +269,13 @@ async def send_trial_only_notification(callback: types.CallbackQuery, bot):
             "Готовы продолжить? Откройте /start и выберите тариф. Если остались вопросы — напишите в поддержку, поможем."
         )
 
-        sent = 0
-        failed = 0
-        for uid in filtered_user_ids:
-            try:
-                await bot.send_message(uid, message_text, disable_web_page_preview=True)
-                sent += 1
-                await asyncio.sleep(0.1)  # Пауза между отправками
-            except Exception as e:
-                logger.warning(f"Failed to send to {uid}: {e}")
-                failed += 1
-
-        await callback.message.answer(
-            f"✅ Рассылка завершена!\n\n"
-            f"Отправлено: {sent}\n"
-            f"Не доставлено: {failed}\n"
-            f"Всего пользователей: {len(filtered_user_ids)}"
+        await launch_campaign(
+            callback.message,
+            "Пробная без покупок",
+            message_text,
+            "trial_only",
+            recipients=filtered_user_ids,
+            disable_web_page_preview=True,
         )
 
     except Exception as e:
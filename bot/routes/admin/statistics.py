@@ -2,12 +2,11 @@ from aiogram import Router, F, types
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 import logging
-import time
-import asyncio
 import aiohttp
-import aiosqlite
 import os
 
+from services.stats_engine import StatsEngine
+
 logger = logging.getLogger(__name__)
 
 router = Router()
@@ -19,71 +18,62 @@ AUTH_CODE = os.getenv("AUTH_CODE")
 # Импортируем is_admin из main модуля
 from .main import is_admin
 
-@router.callback_query(F.data == "admin_stats")
-async def show_admin_stats(callback: types.CallbackQuery):
-    """Показывает детальную статистику пользователей."""
-    if not is_admin(callback.from_user.id):
-        await callback.answer("Нет доступа", show_alert=True)
-        return
-    
-    try:
-        # Получаем все виды статистики параллельно
-        (
-            user_stats,
-            payment_stats,
-            subscription_stats,
-            activity_stats,
-            daily_stats,
-            retention_stats,
-            geographic_stats,
-        ) = await asyncio.gather(
-            get_user_stats(),
-            get_payment_stats(),
-            get_subscription_stats(),
-            get_activity_stats(),
-            get_daily_stats(),
-            get_retention_stats(),
-            get_geographic_stats(),
-        )
-        
-        # Формируем детальную статистику
-        stats_text = (
-            f"📊 **Детальная статистика**\n\n"
-            f"👥 **Пользователи:**\n"
-            f"• Всего: {user_stats['total_users']}\n"
-            f"• С платежами: {user_stats['paid_users']}\n"
-            f"• Только пробная: {user_stats['trial_only_users']}\n"
-            f"• С балансом: {user_stats['with_balance']}\n\n"
-            f"📈 **Активность:**\n"
-            f"• Пробные подписки: {user_stats['new_users_week']}\n"
-            f"• Платежи за 24ч: {activity_stats['active_24h']}\n"
-            f"• Платежи за 7д: {activity_stats['active_7d']}\n"
-            f"• Платежи за 30д: {activity_stats['active_30d']}\n"
-            f"• Конверсия пробная→платная: {activity_stats['conversion_rate']:.1f}%\n\n"
-            f"🔔 **Подписки:**\n"
-            f"• Активные: {subscription_stats['active_subscriptions']}\n"
-            f"• Без подписки: {subscription_stats['no_subscriptions']}\n"
-            f"• Истекшие: {subscription_stats['expired_subscriptions']}\n"
-            f"• Только пробные: {subscription_stats['trial_only_users']}\n\n"
-            f"🤝 **Реферальная программа:**\n"
-            f"• Всего рефералов: {user_stats['total_referrals']}\n"
-            f"• Пользователей с рефералами: {user_stats['users_with_referrals']}\n"
-        )
-        
-        # Добавляем топ реферера, если есть
-        if user_stats['top_referrer']:
-            tg_id, count = user_stats['top_referrer']
-            stats_text += f"• Топ реферер: {tg_id} ({count} приглашений)\n\n"
-        else:
-            stats_text += "\n"
-            
-        # Добавляем статистику платежей
+# Все метрики дашборда считаются одним проходом по users (см. services/stats_engine.py)
+stats_engine = StatsEngine(
+    fetch_active_ids=lambda: _fetch_active_subscription_ids(),
+    ttl=float(os.getenv("STATS_CACHE_TTL_SECONDS", "30")),
+)
+
+
+def _render_stats(metrics: dict, detailed: bool) -> str:
+    """Текст дашборда по посчитанным метрикам; ``detailed`` — расширенная версия."""
+    user_stats = metrics['user_stats']
+    payment_stats = metrics['payment_stats']
+    subscription_stats = metrics['subscription_stats']
+    activity_stats = metrics['activity_stats']
+    daily_stats = metrics['daily_stats']
+    retention_stats = metrics['retention_stats']
+
+    stats_text = (
+        f"📊 **Детальная статистика**\n\n"
+        f"👥 **Пользователи:**\n"
+        f"• Всего: {user_stats['total_users']}\n"
+        f"• С платежами: {user_stats['paid_users']}\n"
+        f"• Только пробная: {user_stats['trial_only_users']}\n"
+        f"• С балансом: {user_stats['with_balance']}\n\n"
+        f"📈 **Активность:**\n"
+        f"• Пробные подписки: {user_stats['new_users_week']}\n"
+        f"• Платежи за 24ч: {activity_stats['active_24h']}\n"
+        f"• Платежи за 7д: {activity_stats['active_7d']}\n"
+        f"• Платежи за 30д: {activity_stats['active_30d']}\n"
+        f"• Конверсия пробная→платная: {activity_stats['conversion_rate']:.1f}%\n\n"
+        f"🔔 **Подписки:**\n"
+        f"• Активные: {subscription_stats['active_subscriptions']}\n"
+        f"• Без подписки: {subscription_stats['no_subscriptions']}\n"
+        f"• Истекшие: {subscription_stats['expired_subscriptions']}\n"
+        f"• Только пробные: {subscription_stats['trial_only_users']}\n\n"
+        f"🤝 **Реферальная программа:**\n"
+        f"• Всего рефералов: {user_stats['total_referrals']}\n"
+        f"• Пользователей с рефералами: {user_stats['users_with_referrals']}\n"
+    )
+
+    # Добавляем топ реферера, если есть
+    if user_stats['top_referrer']:
+        tg_id, count = user_stats['top_referrer']
+        stats_text += f"• Топ реферер: {tg_id} ({count} приглашений)\n\n"
+    else:
+        stats_text += "\n"
+
+    # Добавляем статистику платежей
+    stats_text += (
+        f"💳 **Платежи:**\n"
+        f"• Рубли: {payment_stats['total_rub']:,} ₽ ({payment_stats['count_rub']} транзакций)\n"
+        f"• Звезды: {payment_stats['total_stars']:,} ⭐ ({payment_stats['count_stars']} транзакций)\n"
+        f"• Средний чек (рубли): {payment_stats['avg_rub']:.0f} ₽\n"
+        f"• Средний чек (звезды): {payment_stats['avg_stars']:.0f} ⭐\n\n"
+    )
+    if not detailed:
         stats_text += (
-            f"💳 **Платежи:**\n"
-            f"• Рубли: {payment_stats['total_rub']:,} ₽ ({payment_stats['count_rub']} транзакций)\n"
-            f"• Звезды: {payment_stats['total_stars']:,} ⭐ ({payment_stats['count_stars']} транзакций)\n"
-            f"• Средний чек (рубли): {payment_stats['avg_rub']:.0f} ₽\n"
-            f"• Средний чек (звезды): {payment_stats['avg_stars']:.0f} ⭐\n\n"
             f"🔄 **Удержание:**\n"
             f"• Повторные платежи: {retention_stats['repeat_payers']}\n"
             f"• Лояльные (3+): {retention_stats['loyal_payers']}\n"
@@ -92,7 +82,38 @@ async def show_admin_stats(callback: types.CallbackQuery):
             f"• Самый активный день: {daily_stats['most_active_day']}\n"
             f"• Платежей в этот день: {daily_stats['most_active_count']}"
         )
-        
+        return stats_text
+
+    geographic_stats = metrics['geographic_stats']
+    stats_text += (
+        f"🔄 **Удержание пользователей:**\n"
+        f"• Повторные платежи: {retention_stats['repeat_payers']}\n"
+        f"• Лояльные (3+ платежа): {retention_stats['loyal_payers']}\n"
+        f"• VIP (5+ платежей): {retention_stats['vip_payers']}\n"
+        f"• Среднее платежей на пользователя: {retention_stats['avg_payments_per_user']:.1f}\n\n"
+        f"📅 **Активность по дням:**\n"
+        f"• Самый активный день: {daily_stats['most_active_day']}\n"
+        f"• Платежей в этот день: {daily_stats['most_active_count']}\n\n"
+        f"🌍 **География:**\n"
+        f"• Топ страны: {', '.join(geographic_stats['top_countries'][:3])}"
+    )
+    return stats_text
+
+
+async def _dashboard_metrics() -> dict:
+    snapshot = await stats_engine.get()
+    return {**snapshot.metrics, 'geographic_stats': await get_geographic_stats()}
+
+
+@router.callback_query(F.data == "admin_stats")
+async def show_admin_stats(callback: types.CallbackQuery):
+    """Показывает детальную статистику пользователей."""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    
+    try:
+        stats_text = _render_stats(await _dashboard_metrics(), detailed=False)
         await callback.message.edit_text(stats_text, parse_mode="Markdown")
         
     except Exception as e:
@@ -109,74 +130,7 @@ async def show_detailed_stats(callback: types.CallbackQuery):
         return
     
     try:
-        # Получаем все виды статистики параллельно
-        (
-            user_stats,
-            payment_stats,
-            subscription_stats,
-            activity_stats,
-            daily_stats,
-            retention_stats,
-            geographic_stats,
-        ) = await asyncio.gather(
-            get_user_stats(),
-            get_payment_stats(),
-            get_subscription_stats(),
-            get_activity_stats(),
-            get_daily_stats(),
-            get_retention_stats(),
-            get_geographic_stats(),
-        )
-        
-        # Формируем детальную статистику
-        stats_text = (
-            f"📊 **Детальная статистика**\n\n"
-            f"👥 **Пользователи:**\n"
-            f"• Всего: {user_stats['total_users']}\n"
-            f"• С платежами: {user_stats['paid_users']}\n"
-            f"• Только пробная: {user_stats['trial_only_users']}\n"
-            f"• С балансом: {user_stats['with_balance']}\n\n"
-            f"📈 **Активность:**\n"
-            f"• Пробные подписки: {user_stats['new_users_week']}\n"
-            f"• Платежи за 24ч: {activity_stats['active_24h']}\n"
-            f"• Платежи за 7д: {activity_stats['active_7d']}\n"
-            f"• Платежи за 30д: {activity_stats['active_30d']}\n"
-            f"• Конверсия пробная→платная: {activity_stats['conversion_rate']:.1f}%\n\n"
-            f"🔔 **Подписки:**\n"
-            f"• Активные: {subscription_stats['active_subscriptions']}\n"
-            f"• Без подписки: {subscription_stats['no_subscriptions']}\n"
-            f"• Истекшие: {subscription_stats['expired_subscriptions']}\n"
-            f"• Только пробные: {subscription_stats['trial_only_users']}\n\n"
-            f"🤝 **Реферальная программа:**\n"
-            f"• Всего рефералов: {user_stats['total_referrals']}\n"
-            f"• Пользователей с рефералами: {user_stats['users_with_referrals']}\n"
-        )
-        
-        # Добавляем топ реферера, если есть
-        if user_stats['top_referrer']:
-            tg_id, count = user_stats['top_referrer']
-            stats_text += f"• Топ реферер: {tg_id} ({count} приглашений)\n\n"
-        else:
-            stats_text += "\n"
-            
-        # Добавляем статистику платежей
-        stats_text += (
-            f"💳 **Платежи:**\n"
-            f"• Рубли: {payment_stats['total_rub']:,} ₽ ({payment_stats['count_rub']} транзакций)\n"
-            f"• Звезды: {payment_stats['total_stars']:,} ⭐ ({payment_stats['count_stars']} транзакций)\n"
-            f"• Средний чек (рубли): {payment_stats['avg_rub']:.0f} ₽\n"
-            f"• Средний чек (звезды): {payment_stats['avg_stars']:.0f} ⭐\n\n"
-            f"🔄 **Удержание пользователей:**\n"
-            f"• Повторные платежи: {retention_stats['repeat_payers']}\n"
-            f"• Лояльные (3+ платежа): {retention_stats['loyal_payers']}\n"
-            f"• VIP (5+ платежей): {retention_stats['vip_payers']}\n"
-            f"• Среднее платежей на пользователя: {retention_stats['avg_payments_per_user']:.1f}\n\n"
-            f"📅 **Активность по дням:**\n"
-            f"• Самый активный день: {daily_stats['most_active_day']}\n"
-            f"• Платежей в этот день: {daily_stats['most_active_count']}\n\n"
-            f"🌍 **География:**\n"
-            f"• Топ страны: {', '.join(geographic_stats['top_countries'][:3])}"
-        )
+        stats_text = _render_stats(await _dashboard_metrics(), detailed=True)
         
         # Добавляем кнопку возврата
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -194,46 +148,32 @@ async def show_detailed_stats(callback: types.CallbackQuery):
 async def get_all_user_ids() -> list[str]:
     """Получает список всех tg_id из bot БД."""
     try:
-        async with aiosqlite.connect("users.db") as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute("SELECT tg_id FROM users")
-                rows = await cursor.fetchall()
-                return [row[0] for row in rows if row[0]]
+        return (await stats_engine.get()).ids("all")
     except Exception as e:
         logger.error(f"Error getting user IDs: {e}")
         return []
 
 async def get_users_without_subscription() -> list[str]:
-    """Получает список пользователей без активной подписки."""
+    """Получает список пользователей без активной подписки (без баланса дней)."""
     try:
-        async with aiosqlite.connect("users.db") as conn:
-            async with conn.cursor() as cursor:
-                # Пользователи без баланса (без активной подписки)
-                await cursor.execute("SELECT tg_id FROM users WHERE balance <= 0")
-                rows = await cursor.fetchall()
-                return [row[0] for row in rows if row[0]]
+        return (await stats_engine.get()).ids("no_balance")
     except Exception as e:
         logger.error(f"Error getting users without subscription: {e}")
         return []
 
 async def get_users_with_expired_subscription() -> list[str]:
-    """Получает список пользователей с истекшей подпиской."""
+    """Получает список пользователей с истекшей подпиской.
+
+    Это те, кто когда-то имел подписку (пробную или платную), но сейчас без баланса.
+    """
     try:
-        async with aiosqlite.connect("users.db") as conn:
-            async with conn.cursor() as cursor:
-                # Пользователи, которые когда-то имели подписку, но сейчас без баланса
-                # (использовали пробную подписку или имели платную, но она истекла)
-                await cursor.execute(
-                    "SELECT tg_id FROM users WHERE balance <= 0 AND (trial_3d_used = 1 OR paid_count > 0)"
-                )
-                rows = await cursor.fetchall()
-                return [row[0] for row in rows if row[0]]
+        return (await stats_engine.get()).ids("expired")
     except Exception as e:
         logger.error(f"Error getting users with expired subscription: {e}")
         return []
 
-async def get_users_with_active_subscription() -> list[str]:
-    """Получает список пользователей с активной подпиской через единый API-запрос."""
+async def _fetch_active_subscription_ids() -> list[str] | None:
+    """tg_id с активной подпиской одним API-запросом; None — бэкенд недоступен."""
     try:
         from utils import get_session
         session = await get_session()
@@ -245,28 +185,30 @@ async def get_users_with_active_subscription() -> list[str]:
                     data = await resp.json()
                 except Exception as e:
                     logger.warning(f"JSON parse error for active users: {e}")
-                    return []
+                    return None
                 ids = data.get("ids", [])
                 # Нормализуем к строкам для согласованности с локальной БД
                 return [str(x) for x in ids if x is not None]
             else:
                 logger.warning(f"API error for active-users/ids: {resp.status}")
-                return []
+                return None
     except Exception as e:
         logger.error(f"Error getting users with active subscription (bulk): {e}")
-        return []
+        return None
+
+async def get_users_with_active_subscription() -> list[str]:
+    """Получает список пользователей с активной подпиской через единый API-запрос."""
+    return await _fetch_active_subscription_ids() or []
 
 async def get_users_without_any_subscription() -> list[str]:
     """Получает пользователей без подписки (не в FastAPI БД)."""
     try:
-        # Получаем всех пользователей из bot БД
-        all_bot_users = await get_all_user_ids()
-        
-        # Получаем пользователей с активной подпиской из FastAPI
-        active_sub_users = await get_users_with_active_subscription()
-        
-        # Возвращаем пользователей, которых нет в списке активных подписок
-        return [user_id for user_id in all_bot_users if user_id not in active_sub_users]
+        snapshot = await stats_engine.get()
+        if not snapshot.active_known:
+            # Без списка активных «без подписки» оказались бы все — не рассылаем платящим
+            logger.warning("Active subscriptions unknown, skipping no-subscription segment")
+            return []
+        return snapshot.ids("no_subscription")
     except Exception as e:
         logger.error(f"Error getting users without any subscription: {e}")
         return []
@@ -279,288 +221,89 @@ async def get_users_trial_only_no_payments() -> list[int]:
     Возвращаем список tg_id как int.
     """
     try:
-        # Сначала получаем пользователей с активными подписками
-        active_users = await get_users_with_active_subscription()
-        active_user_ids = set(active_users)
-        
-        async with aiosqlite.connect("users.db") as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute(
-                    "SELECT tg_id FROM users WHERE trial_3d_used = 1 AND (paid_count IS NULL OR paid_count = 0)"
-                )
-                rows = await cursor.fetchall()
-                res: list[int] = []
-                for row in rows:
-                    try:
-                        tg_id = int(row[0])
-                        # Исключаем пользователей с активными подписками
-                        if str(tg_id) not in active_user_ids:
-                            res.append(tg_id)
-                    except Exception:
-                        continue
-                return res
+        snapshot = await stats_engine.get()
+        if not snapshot.active_known:
+            logger.warning("Active subscriptions unknown, skipping trial-only segment")
+            return []
+        res: list[int] = []
+        for tg_id in snapshot.ids("trial_only"):
+            try:
+                res.append(int(tg_id))
+            except ValueError:
+                continue
+        return res
     except Exception as e:
         logger.error(f"Error getting users trial-only: {e}")
         return []
 
-async def get_user_stats() -> dict:
-    """Получает детальную статистику пользователей из bot БД."""
+async def _metrics_section(name: str, default: dict) -> dict:
     try:
-        async with aiosqlite.connect("users.db") as conn:
-            async with conn.cursor() as cursor:
-                # Общее количество пользователей
-                await cursor.execute("SELECT COUNT(*) FROM users")
-                total_users = (await cursor.fetchone())[0]
-                
-                # Пользователи, использовавшие пробную подписку
-                await cursor.execute("SELECT COUNT(*) FROM users WHERE trial_3d_used = 1")
-                trial_used = (await cursor.fetchone())[0]
-                
-                # Пользователи с балансом дней
-                await cursor.execute("SELECT COUNT(*) FROM users WHERE balance > 0")
-                with_balance = (await cursor.fetchone())[0]
-                
-                # Общее количество рефералов
-                await cursor.execute("SELECT SUM(referral_count) FROM users WHERE referral_count IS NOT NULL")
-                total_referrals = (await cursor.fetchone())[0] or 0
-                
-                # Пользователи с платежами
-                await cursor.execute("SELECT COUNT(*) FROM users WHERE paid_count > 0")
-                paid_users = (await cursor.fetchone())[0]
-                
-                # Пользователи только с пробной подпиской (без платежей)
-                await cursor.execute("SELECT COUNT(*) FROM users WHERE trial_3d_used = 1 AND (paid_count IS NULL OR paid_count = 0)")
-                trial_only_users = (await cursor.fetchone())[0]
-                
-                # Пользователи с рефералами
-                await cursor.execute("SELECT COUNT(*) FROM users WHERE referral_count > 0")
-                users_with_referrals = (await cursor.fetchone())[0]
-                
-                # Топ реферер
-                await cursor.execute("SELECT tg_id, referral_count FROM users WHERE referral_count > 0 ORDER BY referral_count DESC LIMIT 1")
-                top_referrer = await cursor.fetchone()
-                
-                # Пробные подписки (приблизительный индикатор новых пользователей)
-                # Поскольку у нас нет поля регистрации, используем trial_3d_used как индикатор
-                await cursor.execute("SELECT COUNT(*) FROM users WHERE trial_3d_used = 1")
-                trial_users_count = (await cursor.fetchone())[0]
-                
-                # Используем одно значение для обеих метрик, так как у нас нет временных данных
-                new_users_week = trial_users_count
-                new_users_month = trial_users_count
-                
-                return {
-                    'total_users': total_users,
-                    'trial_used': trial_used,
-                    'with_balance': with_balance,
-                    'total_referrals': total_referrals,
-                    'paid_users': paid_users,
-                    'trial_only_users': trial_only_users,
-                    'users_with_referrals': users_with_referrals,
-                    'top_referrer': top_referrer,
-                    'new_users_week': new_users_week,
-                    'new_users_month': new_users_month
-                }
+        return (await stats_engine.get()).metrics[name]
     except Exception as e:
-        logger.error(f"Error getting user stats: {e}")
-        return {
-            'total_users': 0,
-            'trial_used': 0,
-            'with_balance': 0,
-            'total_referrals': 0,
-            'paid_users': 0,
-            'trial_only_users': 0,
-            'users_with_referrals': 0,
-            'top_referrer': None,
-            'new_users_week': 0,
-            'new_users_month': 0
-        }
+        logger.error(f"Error getting {name}: {e}")
+        return default
+
+async def get_user_stats() -> dict:
+    """Получает детальную статистику пользователей из bot БД."""
+    return await _metrics_section("user_stats", {
+        'total_users': 0,
+        'trial_used': 0,
+        'with_balance': 0,
+        'total_referrals': 0,
+        'paid_users': 0,
+        'trial_only_users': 0,
+        'users_with_referrals': 0,
+        'top_referrer': None,
+        'new_users_week': 0,
+        'new_users_month': 0
+    })
 
 async def get_payment_stats() -> dict:
     """Получает статистику платежей из bot БД."""
-    try:
-        async with aiosqlite.connect("users.db") as conn:
-            async with conn.cursor() as cursor:
-                # Агрегаты платежей
-                await cursor.execute("SELECT total_rub, total_stars, count_rub, count_stars FROM payments_agg WHERE id = 1")
-                payment_agg = await cursor.fetchone()
-                
-                if payment_agg:
-                    total_rub, total_stars, count_rub, count_stars = payment_agg
-                else:
-                    total_rub = total_stars = count_rub = count_stars = 0
-                
-                # Средний чек в рублях
-                avg_rub = total_rub / count_rub if count_rub > 0 else 0
-                
-                # Средний чек в звездах
-                avg_stars = total_stars / count_stars if count_stars > 0 else 0
-                
-                return {
-                    'total_rub': total_rub,
-                    'total_stars': total_stars,
-                    'count_rub': count_rub,
-                    'count_stars': count_stars,
-                    'avg_rub': avg_rub,
-                    'avg_stars': avg_stars
-                }
-    except Exception as e:
-        logger.error(f"Error getting payment stats: {e}")
-        return {
-            'total_rub': 0,
-            'total_stars': 0,
-            'count_rub': 0,
-            'count_stars': 0,
-            'avg_rub': 0,
-            'avg_stars': 0
-        }
+    return await _metrics_section("payment_stats", {
+        'total_rub': 0,
+        'total_stars': 0,
+        'count_rub': 0,
+        'count_stars': 0,
+        'avg_rub': 0,
+        'avg_stars': 0
+    })
 
 async def get_subscription_stats() -> dict:
-    """Получает статистику подписок через API."""
-    try:
-        # Получаем пользователей с активными подписками
-        active_users = await get_users_with_active_subscription()
-        
-        # Получаем пользователей без подписок
-        no_sub_users = await get_users_without_any_subscription()
-        
-        # Получаем пользователей с истекшими подписками
-        expired_users = await get_users_with_expired_subscription()
-        
-        # Получаем пользователей только с пробной подпиской
-        trial_only_users = await get_users_trial_only_no_payments()
-        
-        return {
-            'active_subscriptions': len(active_users),
-            'no_subscriptions': len(no_sub_users),
-            'expired_subscriptions': len(expired_users),
-            'trial_only_users': len(trial_only_users)
-        }
-    except Exception as e:
-        logger.error(f"Error getting subscription stats: {e}")
-        return {
-            'active_subscriptions': 0,
-            'no_subscriptions': 0,
-            'expired_subscriptions': 0,
-            'trial_only_users': 0
-        }
+    """Получает статистику подписок (активные — по API бэкенда)."""
+    return await _metrics_section("subscription_stats", {
+        'active_subscriptions': 0,
+        'no_subscriptions': 0,
+        'expired_subscriptions': 0,
+        'trial_only_users': 0
+    })
 
 async def get_activity_stats() -> dict:
     """Получает статистику активности пользователей."""
-    try:
-        async with aiosqlite.connect("users.db") as conn:
-            async with conn.cursor() as cursor:
-                # Пользователи с платежами за последние 24 часа
-                day_ago = int(time.time()) - (24 * 60 * 60)
-                await cursor.execute("SELECT COUNT(*) FROM users WHERE last_payment_at > ?", (day_ago,))
-                active_24h = (await cursor.fetchone())[0]
-                
-                # Пользователи с платежами за последние 7 дней
-                week_ago = int(time.time()) - (7 * 24 * 60 * 60)
-                await cursor.execute("SELECT COUNT(*) FROM users WHERE last_payment_at > ?", (week_ago,))
-                active_7d = (await cursor.fetchone())[0]
-                
-                # Пользователи с платежами за последние 30 дней
-                month_ago = int(time.time()) - (30 * 24 * 60 * 60)
-                await cursor.execute("SELECT COUNT(*) FROM users WHERE last_payment_at > ?", (month_ago,))
-                active_30d = (await cursor.fetchone())[0]
-                
-                # Конверсия из пробной в платную
-                await cursor.execute("SELECT COUNT(*) FROM users WHERE trial_3d_used = 1 AND paid_count > 0")
-                converted_users = (await cursor.fetchone())[0]
-                
-                await cursor.execute("SELECT COUNT(*) FROM users WHERE trial_3d_used = 1")
-                total_trial_users = (await cursor.fetchone())[0]
-                
-                conversion_rate = (converted_users / total_trial_users * 100) if total_trial_users > 0 else 0
-                
-                return {
-                    'active_24h': active_24h,
-                    'active_7d': active_7d,
-                    'active_30d': active_30d,
-                    'converted_users': converted_users,
-                    'conversion_rate': conversion_rate
-                }
-    except Exception as e:
-        logger.error(f"Error getting activity stats: {e}")
-        return {
-            'active_24h': 0,
-            'active_7d': 0,
-            'active_30d': 0,
-            'converted_users': 0,
-            'conversion_rate': 0
-        }
+    return await _metrics_section("activity_stats", {
+        'active_24h': 0,
+        'active_7d': 0,
+        'active_30d': 0,
+        'converted_users': 0,
+        'conversion_rate': 0
+    })
 
 async def get_daily_stats() -> dict:
     """Получает статистику по дням недели."""
-    try:
-        async with aiosqlite.connect("users.db") as conn:
-            async with conn.cursor() as cursor:
-                # Статистика по дням недели (0=понедельник, 6=воскресенье)
-                daily_stats = {}
-                for day in range(7):
-                    # Получаем количество платежей по дням недели
-                    await cursor.execute("""
-                        SELECT COUNT(*) FROM users 
-                        WHERE last_payment_at > 0 
-                        AND (last_payment_at / 86400 - 4) % 7 = ?
-                    """, (day,))
-                    count = (await cursor.fetchone())[0]
-                    daily_stats[f'day_{day}'] = count
-                
-                # Находим самый активный день
-                max_day = max(daily_stats.items(), key=lambda x: x[1])
-                day_names = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье']
-                most_active_day = day_names[max_day[0].split('_')[1]]
-                
-                return {
-                    'daily_stats': daily_stats,
-                    'most_active_day': most_active_day,
-                    'most_active_count': max_day[1]
-                }
-    except Exception as e:
-        logger.error(f"Error getting daily stats: {e}")
-        return {
-            'daily_stats': {},
-            'most_active_day': 'Неизвестно',
-            'most_active_count': 0
-        }
+    return await _metrics_section("daily_stats", {
+        'daily_stats': {},
+        'most_active_day': 'Неизвестно',
+        'most_active_count': 0
+    })
 
 async def get_retention_stats() -> dict:
     """Получает статистику удержания пользователей."""
-    try:
-        async with aiosqlite.connect("users.db") as conn:
-            async with conn.cursor() as cursor:
-                # Пользователи с повторными платежами
-                await cursor.execute("SELECT COUNT(*) FROM users WHERE paid_count > 1")
-                repeat_payers = (await cursor.fetchone())[0]
-                
-                # Пользователи с множественными платежами (3+)
-                await cursor.execute("SELECT COUNT(*) FROM users WHERE paid_count >= 3")
-                loyal_payers = (await cursor.fetchone())[0]
-                
-                # Пользователи с 5+ платежами (VIP)
-                await cursor.execute("SELECT COUNT(*) FROM users WHERE paid_count >= 5")
-                vip_payers = (await cursor.fetchone())[0]
-                
-                # Среднее количество платежей на пользователя
-                await cursor.execute("SELECT AVG(paid_count) FROM users WHERE paid_count > 0")
-                avg_payments = (await cursor.fetchone())[0] or 0
-                
-                return {
-                    'repeat_payers': repeat_payers,
-                    'loyal_payers': loyal_payers,
-                    'vip_payers': vip_payers,
-                    'avg_payments_per_user': avg_payments
-                }
-    except Exception as e:
-        logger.error(f"Error getting retention stats: {e}")
-        return {
-            'repeat_payers': 0,
-            'loyal_payers': 0,
-            'vip_payers': 0,
-            'avg_payments_per_user': 0
-        }
+    return await _metrics_section("retention_stats", {
+        'repeat_payers': 0,
+        'loyal_payers': 0,
+        'vip_payers': 0,
+        'avg_payments_per_user': 0
+    })
 
 async def get_geographic_stats() -> dict:
     """Получает географическую статистику (если доступна)."""
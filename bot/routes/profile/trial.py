@@ -9,6 +9,7 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
 from utils import should_throttle, acquire_action_lock, check_all_servers_available, get_session, format_server_list
 from keyboards.ui_labels import BTN_TRIAL
 from database import db
+from services.provisioning_service import provisioning_service, retry_note, retry_notifier
 from keyboards import keyboard
 
 router = Router()
@@ -61,24 +62,29 @@ async def free_trial(message: types.Message):
     except Exception:
         pass
 
-    # Выдаём бесплатные 3 дня на всех серверах
+    # Выдаём бесплатные 3 дня на всех серверах (параллельно, с фоновыми повторами)
     AUTH_CODE = os.getenv("AUTH_CODE")
-    urlupdate = "http://fastapi:8080/giveconfig"
-    success_count = 0
-    successful_servers: list[str] = []
-    failed_servers = []
-    
+
+    async def _mark_trial_if_recovered(final) -> None:
+        # Первый проход ничего не выдал, а фоновые повторы дожали
+        if final.recovered and len(final.recovered) == final.success_count:
+            await db.set_trial_3d_used(str(user_id))
+
     try:
         session = await get_session()
         async with acquire_action_lock(user_id, "free_trial"):
-            for server in servers_to_use:
-                data = {"time": 3, "id": str(user_id), "server": server, "is_trial": True}
-                async with session.post(urlupdate, json=data, headers={"X-API-Key": AUTH_CODE}) as resp:
-                    if resp.status == 200:
-                        success_count += 1
-                        successful_servers.append(server)
-                    else:
-                        failed_servers.append(server)
+            # Ключ идемпотентности постоянный: пробная выдаётся один раз
+            result = await provisioning_service.give_configs(
+                user_id,
+                3,
+                servers_to_use,
+                is_trial=True,
+                operation_id=f"trial:{user_id}",
+                on_complete=retry_notifier(message.bot, extra=_mark_trial_if_recovered),
+            )
+            success_count = result.success_count
+            successful_servers = result.succeeded
+            note = retry_note(result)
             
             if success_count > 0:
                 # Обновляем прогресс
@@ -109,10 +115,11 @@ async def free_trial(message: types.Message):
                 await message.answer(
                     "🎉 Пробная подписка активирована!\n\n"
                     f"Сервера: {servers_text}.\n"
-                    "Срок: 3 дн.",
+                    "Срок: 3 дн.\n\n"
+                    "💡 Подписка может быть не добавлена при нажатии на кнопку на сайте, в этом случае необходимо скопировать ссылку на подписку и вставить в V2rayTun вручную."
+                    + (f"\n\n{note}" if note else ""),
                     reply_markup=kb,
                 )
-                await message.answer("💡 Подписка может быть не добавлена при нажатии на кнопку на сайте, в этом случае необходимо скопировать ссылку на подписку и вставить в V2rayTun вручную.")
 
                 try:
                     admin_id = 746560409
@@ -120,16 +127,14 @@ async def free_trial(message: types.Message):
                     await message.bot.send_message(admin_id, f"Активирована пробная подписка: user_id={user_id}, user={at_username}, серверов={success_count}, срок=3 дн.")
                 except Exception:
                     pass
-            else:
-                await message.answer("❌ Не удалось активировать пробную подписку. Серверы временно недоступны. Попробуйте через 5-10 минут.", reply_markup=keyboard.create_keyboard())
-                
-            if failed_servers:
-                failed_text = format_server_list(failed_servers)
+            elif note:
                 await message.answer(
-                    "⚠️ Частично активировано: не удалось создать конфиги на серверах "
-                    f"{failed_text}. Остальные серверы работают.",
+                    "⏳ Серверы временно недоступны — продолжаем активацию пробной подписки автоматически.\n"
+                    "Пришлём сообщение, когда закончим.",
                     reply_markup=keyboard.create_keyboard(),
                 )
+            else:
+                await message.answer("❌ Не удалось активировать пробную подписку. Серверы временно недоступны. Попробуйте через 5-10 минут.", reply_markup=keyboard.create_keyboard())
                 
     except aiohttp.ClientError:
         await message.answer("🌐 Проблемы с подключением к серверам. Проверьте интернет и попробуйте позже.", reply_markup=keyboard.create_keyboard())
@@ -4,8 +4,8 @@ from keyboards import keyboard
 from keyboards.ui_labels import MSG_START_BRIEF, BTN_TRIAL, BTN_TARIFF, BTN_GUIDE
 from database import db
 import os
-from aiogram.types import FSInputFile
 from routes.admin import is_admin
+from services.media_registry import media_registry
 import logging
 logger = logging.getLogger(__name__)
 
@@ -79,28 +79,19 @@ async def start_command(message: types.Message):
         f"— При необходимости — «{BTN_GUIDE}»"
     )
 
+    # Выбираем клавиатуру в зависимости от роли пользователя
+    user_keyboard = keyboard.create_admin_keyboard() if is_admin(message.from_user.id) else keyboard.create_keyboard()
     try:
-        # Ищем start.jpg локально без переменных окружения
-        routes_dir = os.path.dirname(__file__)
-        bot_root = os.path.abspath(os.path.join(routes_dir, ".."))
-        project_root = os.path.abspath(os.path.join(routes_dir, "..", ".."))
-        candidate_paths = [
-            os.path.join(project_root, "start.jpg"),
-            os.path.join(bot_root, "start.jpg"),
-            os.path.join(os.getcwd(), "start.jpg"),
-        ]
-
-        image_path_found = next((p for p in candidate_paths if os.path.exists(p)), None)
-        # Выбираем клавиатуру в зависимости от роли пользователя
-        user_keyboard = keyboard.create_admin_keyboard() if is_admin(message.from_user.id) else keyboard.create_keyboard()
-        
-        if image_path_found:
-            await message.answer_photo(photo=FSInputFile(image_path_found), caption=start_caption, reply_markup=user_keyboard, parse_mode="HTML")
-        else:
-            await message.answer(start_caption, reply_markup=user_keyboard, parse_mode="HTML")
+        # start.jpg загружается в Telegram один раз, дальше уходит по file_id
+        sent = await media_registry.send_photo(
+            message.bot, message.chat.id, "start.jpg",
+            caption=start_caption, reply_markup=user_keyboard, parse_mode="HTML"
+        )
     except Exception:
-        # Фолбэк на случай ошибки при отправке изображения
-        user_keyboard = keyboard.create_admin_keyboard() if is_admin(message.from_user.id) else keyboard.create_keyboard()
+        logger.exception("Failed to send start image")
+        sent = None
+    if sent is None:
+        # Нет картинки или ошибка при её отправке
         await message.answer(start_caption, reply_markup=user_keyboard, parse_mode="HTML")
 
     # Отправляем уведомление о реферальном бонусе после приветствия
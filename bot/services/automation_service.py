@@ -12,6 +12,8 @@ from datetime import datetime, timedelta
 import aiosqlite
 import random
 
+from services.segments import SegmentEngine
+
 logger = logging.getLogger(__name__)
 
 class TaskStatus(Enum):
@@ -66,8 +68,10 @@ class SmartTargetingRule:
     trigger_count: int = 0
 
 class AutomationService:
-    def __init__(self, db_path: str = "users.db"):
+    def __init__(self, db_path: str = "users.db", segments: Optional[SegmentEngine] = None):
         self.db_path = db_path
+        # Сегменты — те же, что у рассылок (services/segments.py)
+        self.segments = segments or SegmentEngine(db_path=db_path)
         self.scheduled_tasks: Dict[str, ScheduledTask] = {}
         self.drip_campaigns: Dict[str, DripCampaign] = {}
         self.smart_rules: Dict[str, SmartTargetingRule] = {}
@@ -338,22 +342,33 @@ class AutomationService:
         if not campaign.is_active:
             return False
         
-        # Получаем пользователей для сегмента
-        user_ids = await self._get_users_by_segment(campaign.target_segment)
-        campaign.total_users = len(user_ids)
-        
-        # Добавляем пользователей в кампанию
+        # Добавляем пользователей сегмента в кампанию потоком, порциями
+        await self.segments.refresh()
+        now = time.time()
+        total = 0
+        chunk = []
         async with aiosqlite.connect(self.db_path) as conn:
-            for user_id in user_ids:
-                await conn.execute("""
-                    INSERT OR IGNORE INTO drip_campaign_users 
-                    (campaign_id, user_id, next_send_time, created_at)
-                    VALUES (?, ?, ?, ?)
-                """, (campaign_id, user_id, time.time(), time.time()))
+            async for user_id in self.segments.iter_ids(campaign.target_segment):
+                chunk.append((campaign_id, user_id, now, now))
+                if len(chunk) >= self.segments.chunk:
+                    await self._add_drip_users(conn, chunk)
+                    total += len(chunk)
+                    chunk = []
+            if chunk:
+                await self._add_drip_users(conn, chunk)
+                total += len(chunk)
             await conn.commit()
+        campaign.total_users = total
         
         return True
     
+    async def _add_drip_users(self, conn: aiosqlite.Connection, rows: List[tuple]):
+        await conn.executemany("""
+            INSERT OR IGNORE INTO drip_campaign_users 
+            (campaign_id, user_id, next_send_time, created_at)
+            VALUES (?, ?, ?, ?)
+        """, rows)
+    
     async def _process_drip_campaigns(self, current_time: float):
         """Обработка drip кампаний"""
         async with aiosqlite.connect(self.db_path) as conn:
@@ -399,27 +414,6 @@ class AutomationService:
         # Пока просто логируем
         logger.info(f"Sending drip message to user {user_id} in campaign {campaign_id}")
     
-    async def _get_users_by_segment(self, segment: str) -> List[str]:
-        """Получение пользователей по сегменту"""
-        segments = {
-            "all": "SELECT tg_id FROM users",
-            "active": "SELECT tg_id FROM users WHERE balance > 0",
-            "trial_only": "SELECT tg_id FROM users WHERE trial_3d_used = 1 AND (paid_count IS NULL OR paid_count = 0)",
-            "expired": "SELECT tg_id FROM users WHERE balance <= 0 AND (trial_3d_used = 1 OR paid_count > 0)",
-            "no_subscription": "SELECT tg_id FROM users WHERE balance <= 0",
-            "with_referrals": "SELECT tg_id FROM users WHERE referral_count > 0",
-            "vip": "SELECT tg_id FROM users WHERE paid_count >= 5"
-        }
-        
-        if segment not in segments:
-            return []
-        
-        async with aiosqlite.connect(self.db_path) as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute(segments[segment])
-                rows = await cursor.fetchall()
-                return [row[0] for row in rows if row[0]]
-    
     async def create_smart_rule(
         self,
         name: str,
@@ -0,0 +1,185 @@
+"""
+Кэш доступности серверов для сценариев покупки и пробной подписки.
+
+Снимок доступности (ответ POST /placement по всем регионам) обновляется в фоне
+каждые несколько секунд. Обработчики читают его без сетевых запросов
+(stale-while-revalidate): устаревший, но не слишком старый снимок отдаётся сразу,
+а обновление запускается в фоне. Пока снимок никто не читает дольше ``max_stale``
+секунд, фоновые обновления пропускаются. Запрос к бэкенду хеджируется — если ответа нет
+за ``hedge_delay`` секунд, параллельно уходит второй, берём первый ответ.
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Загрузчик снимка: None — ошибка запроса (сеть, не-200); прежний снимок остаётся
+SnapshotFetcher = Callable[[], Awaitable[Optional[Dict[str, Any]]]]
+
+
+class AvailabilityCache:
+    def __init__(
+        self,
+        fetcher: SnapshotFetcher,
+        refresh_interval: float = 5.0,
+        max_stale: float = 60.0,
+        hedge_delay: float = 0.3,
+    ):
+        self._fetcher = fetcher
+        self.refresh_interval = max(0.5, float(refresh_interval))
+        self.max_stale = max(self.refresh_interval, float(max_stale))
+        self.hedge_delay = max(0.0, float(hedge_delay))
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._fetched_at: float = 0.0
+        self._inflight: Optional[asyncio.Task] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        # Когда снимок читали последний раз (без чтений фоновый цикл бэкенд не опрашивает)
+        self._read_at: float = 0.0
+        # Метрики
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.hedged = 0
+
+    # ------------------------------------------------------------------
+    # Фоновое обновление
+    # ------------------------------------------------------------------
+
+    def start(self) -> None:
+        """Запускает фоновое обновление (идемпотентно)."""
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            try:
+                if time.monotonic() - self._read_at <= self.max_stale:
+                    await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Availability refresh failed: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    async def refresh(self) -> Optional[Dict[str, Any]]:
+        """Обновляет снимок; параллельные вызовы ждут один и тот же запрос."""
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self._do_refresh())
+        return await asyncio.shield(self._inflight)
+
+    async def _do_refresh(self) -> Optional[Dict[str, Any]]:
+        self.refreshes += 1
+        result = await self._hedged_fetch()
+        if result is None:
+            self.refresh_errors += 1
+            return self._snapshot
+        self._snapshot = result
+        self._fetched_at = time.monotonic()
+        return result
+
+    async def _hedged_fetch(self) -> Optional[Dict[str, Any]]:
+        first = asyncio.create_task(self._fetcher())
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay or None)
+            if not done:
+                # Первый запрос завис — страхуемся вторым
+                self.hedged += 1
+                tasks.append(asyncio.create_task(self._fetcher()))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result() is not None:
+                        return task.result()
+            return None
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    # ------------------------------------------------------------------
+    # Чтение
+    # ------------------------------------------------------------------
+
+    def age(self) -> float:
+        return time.monotonic() - self._fetched_at if self._snapshot is not None else float("inf")
+
+    def peek(self) -> Optional[Dict[str, Any]]:
+        """Синхронно возвращает снимок (или None, если его нет или он слишком старый).
+
+        Если снимок старше интервала обновления, запускает обновление в фоне.
+        """
+        self._read_at = time.monotonic()
+        age = self.age()
+        if age > self.refresh_interval and (self._inflight is None or self._inflight.done()):
+            try:
+                self._inflight = asyncio.get_running_loop().create_task(self._do_refresh())
+            except RuntimeError:
+                pass
+        if self._snapshot is None or age > self.max_stale:
+            self.misses += 1
+            return None
+        if age > self.refresh_interval:
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        return self._snapshot
+
+    async def get(self) -> Optional[Dict[str, Any]]:
+        """Снимок из кэша; при холодном кэше ждёт один запрос к бэкенду."""
+        snapshot = self.peek()
+        if snapshot is not None:
+            return snapshot
+        return await self.refresh()
+
+    def all_available(self, snapshot: Dict[str, Any]) -> bool:
+        available = snapshot.get("available") or {}
+        return bool(available) and all(available.values()) and bool(snapshot.get("all_available", True))
+
+    def pick_variant(self, snapshot: Dict[str, Any], base: str, variants: List[str]) -> Optional[str]:
+        """Выбирает вариант региона по стоимости из снимка (вес = 1 / стоимость).
+
+        Локально уменьшает оценку свободного пула выбранного варианта, чтобы до следующего
+        обновления пользователи не сваливались на один и тот же почти пустой вариант.
+        """
+        details = snapshot.get("variants") or {}
+        candidates: List[str] = []
+        weights: List[float] = []
+        for code in variants:
+            info = details.get(code)
+            if not info or int(info.get("free", 0)) <= 0:
+                continue
+            candidates.append(code)
+            weights.append(1.0 / max(1.0, float(info.get("cost", 1.0))))
+        if not candidates:
+            return (snapshot.get("servers") or {}).get(base)
+        chosen = random.choices(candidates, weights=weights, k=1)[0]
+        details[chosen]["free"] = int(details[chosen].get("free", 0)) - 1
+        return chosen
+
+    def stats(self) -> Dict[str, Any]:
+        age = self.age()
+        return {
+            "age_seconds": None if age == float("inf") else round(age, 2),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "hedged": self.hedged,
+        }
@@ -0,0 +1,151 @@
+"""
+Прогресс рассылки в одном сообщении администратора.
+
+Раньше обработчик администратора сам отправлял рассылку и редактировал сообщение
+каждые 10 отправок — на больших рассылках это сотни правок и ``RetryAfter`` на весь
+бот. ``ProgressReporter`` следит за кампанией в фоне:
+
+* правит сообщение не чаще раза в ``interval`` секунд и только если текст изменился;
+* сразу — при смене статуса (отмена, продолжение, завершение) через ``poke``;
+* под сообщением — «Отменить» для идущей кампании и «Продолжить» для отменённой;
+* на ``TelegramRetryAfter`` пропускает правки на время паузы, а если сообщение
+  удалено — перестаёт следить (рассылка при этом продолжается).
+"""
+import asyncio
+import html
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+_STATUS_TITLES = {
+    "pending": "⏳ Подготовка",
+    "sending": "📤 Рассылка идёт",
+    "completed": "✅ Рассылка завершена",
+    "failed": "❌ Рассылка прервана",
+    "cancelled": "⏹️ Рассылка отменена",
+}
+
+
+def render_progress(campaign, speed: Optional[float] = None) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Текст и кнопки сообщения о ходе кампании."""
+    status = campaign.status.value
+    processed = campaign.sent_count + campaign.failed_count + campaign.blocked_count
+    total = campaign.total_users
+    percent = processed / total * 100 if total else 0.0
+    lines = [
+        f"{_STATUS_TITLES.get(status, status)}: <b>{html.escape(campaign.name)}</b>",
+        "",
+        f"📊 Обработано: {processed}/{total} ({percent:.1f}%)",
+        f"✅ Отправлено: {campaign.sent_count}",
+        f"❌ Ошибок: {campaign.failed_count}",
+        f"🚫 Заблокировали бота: {campaign.blocked_count}",
+    ]
+    if status == "sending" and speed:
+        remaining = max(0, total - processed)
+        lines.append(f"⚡ {speed:.1f} сообщ./сек, осталось ~{int(remaining / speed // 60) + 1} мин")
+
+    if status == "sending":
+        button = InlineKeyboardButton(text="⏹️ Отменить", callback_data=f"campaign_cancel_{campaign.id}")
+    elif status == "cancelled" and processed < total:
+        button = InlineKeyboardButton(text="▶️ Продолжить", callback_data=f"campaign_resume_{campaign.id}")
+    else:
+        return "\n".join(lines), None
+    return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=[[button]])
+
+
+class ProgressReporter:
+    def __init__(self, bot: Bot, interval: float = 3.0):
+        self.bot = bot
+        self.interval = max(0.5, float(interval))
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._wakeups: Dict[str, asyncio.Event] = {}
+        # Метрики
+        self.edits = 0
+
+    def watch(self, campaign) -> None:
+        """Следит за кампанией, если у неё есть сообщение для прогресса."""
+        if campaign.progress_chat_id is None or campaign.progress_message_id is None:
+            return
+        task = self._tasks.get(campaign.id)
+        if task is not None and not task.done():
+            self.poke(campaign.id)
+            return
+        self._wakeups[campaign.id] = asyncio.Event()
+        self._tasks[campaign.id] = asyncio.create_task(self._run(campaign))
+
+    def poke(self, campaign_id: str) -> None:
+        """Обновить сообщение сейчас, не дожидаясь интервала."""
+        wakeup = self._wakeups.get(campaign_id)
+        if wakeup is not None:
+            wakeup.set()
+
+    async def _run(self, campaign) -> None:
+        wakeup = self._wakeups[campaign.id]
+        last_text = None
+        # Скорость — по обработанным с начала наблюдения (после продолжения — заново)
+        started_at = time.monotonic()
+        started_processed = campaign.sent_count + campaign.failed_count + campaign.blocked_count
+        try:
+            while True:
+                finished = campaign.status.value != "sending"
+                processed = campaign.sent_count + campaign.failed_count + campaign.blocked_count
+                elapsed = time.monotonic() - started_at
+                speed = (processed - started_processed) / elapsed if elapsed > 0 else None
+                text, markup = render_progress(campaign, speed)
+                if text != last_text or finished:
+                    delay = await self._edit(campaign, text, markup)
+                    if delay is None:
+                        return
+                    if delay:
+                        # Пауза Telegram: правим после неё (итоговую правку не теряем)
+                        await asyncio.sleep(delay)
+                        continue
+                    last_text = text
+                if finished:
+                    return
+                wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+        except Exception as e:
+            logger.error(f"Progress reporting for campaign {campaign.id} failed: {e}")
+        finally:
+            if self._tasks.get(campaign.id) is asyncio.current_task():
+                del self._tasks[campaign.id]
+                self._wakeups.pop(campaign.id, None)
+
+    async def _edit(self, campaign, text: str, markup: Optional[InlineKeyboardMarkup]) -> Optional[float]:
+        """Правит сообщение; 0 — готово, > 0 — пауза Telegram, None — сообщения больше нет."""
+        try:
+            await self.bot.edit_message_text(
+                text=text,
+                chat_id=campaign.progress_chat_id,
+                message_id=campaign.progress_message_id,
+                parse_mode="HTML",
+                reply_markup=markup,
+            )
+            self.edits += 1
+        except TelegramRetryAfter as e:
+            return float(e.retry_after)
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return 0
+            logger.warning(f"Stop reporting progress of campaign {campaign.id}: {e}")
+            return None
+        except Exception as e:
+            logger.warning(f"Failed to edit progress of campaign {campaign.id}: {e}")
+            return self.interval
+        return 0
+
+    async def close(self) -> None:
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
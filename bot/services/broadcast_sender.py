@@ -0,0 +1,199 @@
+"""
+Отправка рассылок в темпе, который допускает Telegram.
+
+Telegram разрешает боту около 30 сообщений в секунду суммарно и одно сообщение в
+секунду в один чат; при превышении отвечает ``RetryAfter`` — и тогда ждать нужно
+всему боту, а не одной задаче. ``BroadcastSender``:
+
+* берёт токен общего ``TokenBucket`` (``rate`` сообщений в секунду) перед каждой
+  отправкой и держит не больше ``max_in_flight`` запросов одновременно;
+* проверяет ограничение на чат (``GcraLimiter``, 1 сообщение в секунду): сообщение в
+  чат, которому писать ещё рано, откладывается, а не ждёт в очереди перед остальными;
+* на ``TelegramRetryAfter`` ставит на паузу всё ведро ровно на ``retry_after`` секунд
+  и возвращает сообщение в очередь отложенных к концу паузы;
+* повторяет сетевые ошибки и ошибки сервера с экспоненциальной задержкой через ту же
+  очередь отложенных — min-кучу по времени готовности, без ``sleep`` внутри отправки;
+* блокировку ботом (``TelegramForbiddenError``) и неверный запрос не повторяет;
+* сообщения, для которых ``should_send`` вернул ``False`` (кампания отменена), не
+  отправляет — в том числе уже взятые в очередь и отложенные — и сообщает о них итогом
+  ``SKIPPED``.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, Awaitable, Callable, List, Optional, Tuple
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from services.rate_limit import GcraLimiter, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+SENT = "sent"
+FAILED = "failed"
+BLOCKED = "blocked"
+SKIPPED = "skipped"
+
+
+@dataclass
+class Delivery:
+    """Сообщение в работе у отправителя."""
+
+    item: Any
+    chat_id: Any
+    attempts: int = 0
+    error: Optional[str] = None
+
+
+class BroadcastSender:
+    def __init__(
+        self,
+        send: Callable[[Any], Awaitable[Any]],
+        chat_of: Callable[[Any], Any],
+        on_result: Callable[[Any, str, Optional[str], int], Awaitable[None]],
+        rate: float = 28.0,
+        burst: float = 1.0,
+        per_chat_interval: float = 1.0,
+        max_in_flight: int = 32,
+        max_retries: int = 3,
+        retry_delay: float = 5.0,
+        should_send: Optional[Callable[[Any], bool]] = None,
+    ):
+        self.send = send
+        self.chat_of = chat_of
+        self.on_result = on_result
+        self.bucket = TokenBucket(rate, burst)
+        self.per_chat = GcraLimiter(period=per_chat_interval, burst=1)
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_retries = max(1, int(max_retries))
+        self.retry_delay = max(0.0, float(retry_delay))
+        self.should_send = should_send
+        # Отложенные: (время готовности, порядковый номер, сообщение)
+        self._delayed: List[Tuple[float, int, Delivery]] = []
+        self._seq = itertools.count()
+        self._ready: asyncio.Queue = asyncio.Queue(maxsize=self.max_in_flight * 4)
+        self._wakeup = asyncio.Event()
+        self._in_flight = 0
+        self._tasks: set = set()
+        self._source_done = False
+        # Метрики
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.retried = 0
+        self.flood_waits = 0
+        self.skipped = 0
+
+    def _defer(self, delivery: Delivery, delay: float) -> None:
+        due = asyncio.get_running_loop().time() + max(0.0, delay)
+        heapq.heappush(self._delayed, (due, next(self._seq), delivery))
+        self._wakeup.set()
+
+    async def _feed(self, source: AsyncIterable[Any]) -> None:
+        try:
+            async for item in source:
+                await self._ready.put(Delivery(item, self.chat_of(item)))
+                self._wakeup.set()
+        finally:
+            self._source_done = True
+            self._wakeup.set()
+
+    async def _next(self) -> Optional[Delivery]:
+        """Следующее сообщение: готовое отложенное, затем новое; None — всё отправлено."""
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            if self._delayed and self._delayed[0][0] <= now:
+                return heapq.heappop(self._delayed)[2]
+            if not self._ready.empty():
+                return self._ready.get_nowait()
+            if self._source_done and not self._delayed and not self._in_flight:
+                return None
+            self._wakeup.clear()
+            timeout = self._delayed[0][0] - now if self._delayed else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self, source: AsyncIterable[Any]) -> None:
+        """Отправляет всё из ``source`` (и все повторы) и возвращается."""
+        self._source_done = False
+        feeder = asyncio.create_task(self._feed(source))
+        slots = asyncio.Semaphore(self.max_in_flight)
+        try:
+            while True:
+                delivery = await self._next()
+                if delivery is None:
+                    break
+                if self.should_send is not None and not self.should_send(delivery.item):
+                    self.skipped += 1
+                    await self.on_result(delivery.item, SKIPPED, None, delivery.attempts)
+                    continue
+                allowed, retry_after = self.per_chat.hit(delivery.chat_id)
+                if not allowed:
+                    self._defer(delivery, retry_after)
+                    continue
+                await self.bucket.acquire()
+                await slots.acquire()
+                self._in_flight += 1
+                task = asyncio.create_task(self._deliver(delivery, slots))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            await feeder
+        finally:
+            if not feeder.done():
+                feeder.cancel()
+
+    async def _deliver(self, delivery: Delivery, slots: asyncio.Semaphore) -> None:
+        try:
+            delivery.attempts += 1
+            try:
+                await self.send(delivery.item)
+            except TelegramRetryAfter as exc:
+                # Ограничение на весь бот: останавливаем выдачу токенов, сообщение — после паузы
+                self.flood_waits += 1
+                self.bucket.pause(exc.retry_after)
+                delivery.attempts -= 1
+                self._defer(delivery, exc.retry_after)
+                return
+            except TelegramForbiddenError as exc:
+                self.blocked += 1
+                await self.on_result(delivery.item, BLOCKED, str(exc), delivery.attempts)
+                return
+            except TelegramBadRequest as exc:
+                self.failed += 1
+                await self.on_result(delivery.item, FAILED, str(exc), delivery.attempts)
+                return
+            except Exception as exc:
+                delivery.error = str(exc)
+                if delivery.attempts < self.max_retries:
+                    self.retried += 1
+                    self._defer(delivery, self.retry_delay * 2 ** (delivery.attempts - 1))
+                    return
+                self.failed += 1
+                await self.on_result(delivery.item, FAILED, delivery.error, delivery.attempts)
+                return
+            self.sent += 1
+            await self.on_result(delivery.item, SENT, None, delivery.attempts)
+        except Exception:
+            logger.exception("Broadcast result handling failed")
+        finally:
+            self._in_flight -= 1
+            slots.release()
+            self._wakeup.set()
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "blocked": self.blocked,
+            "retried": self.retried,
+            "flood_waits": self.flood_waits,
+            "skipped": self.skipped,
+            "delayed": len(self._delayed),
+            "in_flight": self._in_flight,
+            **{f"bucket_{k}": v for k, v in self.bucket.stats().items()},
+        }
@@ -1,10 +1,24 @@
 """
 Продвинутая система рассылок с очередями, батчингом и retry логикой
+
+Очередь кампании — сами строки ``broadcast_messages``: отправитель читает
+неотправленные порциями по ``rowid`` (``message_chunk`` строк), а текст берёт из
+кампании, поэтому память не зависит от числа получателей. После перезапуска
+``resume_campaigns`` продолжает кампании в статусе ``sending`` с первого
+неотправленного сообщения; повторно могут уйти только сообщения, итог которых не
+успел записаться (последние ``BROADCAST_FLUSH_INTERVAL`` секунд).
+
+Через этот же сервис идут уведомления из админ-панели: ``start_campaign`` принимает
+готовый список получателей (с отдельным текстом для каждого, если нужно) вместо
+сегмента. Ход кампании показывается в одном сообщении администратора
+(``ProgressReporter``); отменённую кампанию можно продолжить — уйдут только
+неотправленные сообщения.
 """
 import asyncio
 import logging
+import os
 import time
-from typing import List, Dict, Optional, Callable, Any
+from typing import List, Dict, Optional, Callable, Any, AsyncIterable, AsyncIterator, Iterable, Tuple, Union
 from dataclasses import dataclass
 from enum import Enum
 import aiosqlite
@@ -12,6 +26,11 @@ from aiogram import Bot
 from aiogram.types import Message
 import json
 
+from services.broadcast_progress import ProgressReporter
+from services.broadcast_sender import BLOCKED, SENT, SKIPPED, BroadcastSender
+from services.broadcast_status import StatusWriter
+from services.segments import SegmentEngine
+
 logger = logging.getLogger(__name__)
 
 class BroadcastStatus(Enum):
@@ -27,13 +46,13 @@ class MessageStatus(Enum):
     FAILED = "failed"
     BLOCKED = "blocked"
 
-@dataclass
+@dataclass(slots=True)
 class BroadcastMessage:
+    """Получатель кампании в работе; текст и разметка — у кампании"""
     id: str
     user_id: str
-    text: str
-    parse_mode: Optional[str] = None
-    reply_markup: Optional[Dict] = None
+    campaign_id: str
+    text: Optional[str] = None  # Свой текст получателя вместо текста кампании
     status: MessageStatus = MessageStatus.PENDING
     retry_count: int = 0
     error_message: Optional[str] = None
@@ -55,18 +74,50 @@ class BroadcastCampaign:
     blocked_count: int = 0
     parse_mode: Optional[str] = None
     reply_markup: Optional[Dict] = None
+    disable_web_page_preview: bool = False
+    # Сообщение администратора с ходом рассылки
+    progress_chat_id: Optional[int] = None
+    progress_message_id: Optional[int] = None
+
+# Получатель: tg_id или (tg_id, свой текст)
+Recipient = Union[str, int, Tuple[Union[str, int], str]]
 
 class BroadcastService:
-    def __init__(self, bot: Bot, db_path: str = "users.db"):
+    def __init__(self, bot: Bot, db_path: str = "users.db", segments: Optional[SegmentEngine] = None):
         self.bot = bot
         self.db_path = db_path
+        self.segments = segments or SegmentEngine(
+            db_path=db_path,
+            refresh_interval=float(os.getenv("SEGMENTS_REFRESH_SECONDS", "60")),
+        )
         self.active_campaigns: Dict[str, BroadcastCampaign] = {}
-        self.message_queue: asyncio.Queue = asyncio.Queue()
+        # Кампания -> rowid последнего прочитанного сообщения (курсор по broadcast_messages)
+        self._cursors: Dict[str, int] = {}
+        # Сообщения, прочитанные из БД и ещё не получившие итог (защита от повтора при продолжении)
+        self._claimed: set = set()
+        self.message_chunk = int(os.getenv("BROADCAST_MESSAGE_CHUNK", "1000"))
         self.is_running = False
-        self.batch_size = 10  # Размер батча для отправки
-        self.delay_between_batches = 1.0  # Задержка между батчами в секундах
+        self.rate = float(os.getenv("BROADCAST_RATE", "28"))  # Сообщений в секунду на весь бот (лимит Telegram ~30)
+        self.max_in_flight = int(os.getenv("BROADCAST_MAX_IN_FLIGHT", "32"))  # Одновременных запросов
         self.max_retries = 3  # Максимальное количество попыток
-        self.retry_delay = 5.0  # Задержка между попытками в секундах
+        self.retry_delay = 5.0  # Задержка перед первой повторной попыткой в секундах (дальше — вдвое больше)
+        self.sender = BroadcastSender(
+            send=self._send_message,
+            chat_of=lambda message: message.user_id,
+            on_result=self._on_send_result,
+            rate=self.rate,
+            max_in_flight=self.max_in_flight,
+            max_retries=self.max_retries,
+            retry_delay=self.retry_delay,
+            should_send=self._is_live,
+        )
+        # Итоги отправки пишутся в БД пачками, а не транзакцией на сообщение
+        self.status_writer = StatusWriter(
+            db_path,
+            flush_interval=float(os.getenv("BROADCAST_FLUSH_INTERVAL", "0.25")),
+            max_pending=int(os.getenv("BROADCAST_FLUSH_BATCH", "500")),
+        )
+        self.progress = ProgressReporter(bot, interval=float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "3")))
         
     async def init_database(self):
         """Инициализация таблиц для системы рассылок"""
@@ -86,10 +137,23 @@ class BroadcastService:
                     failed_count INTEGER DEFAULT 0,
                     blocked_count INTEGER DEFAULT 0,
                     parse_mode TEXT,
-                    reply_markup TEXT
+                    reply_markup TEXT,
+                    disable_web_page_preview INTEGER DEFAULT 0,
+                    progress_chat_id INTEGER,
+                    progress_message_id INTEGER
                 )
             """)
             
+            # Миграции для уже существующей таблицы
+            async with conn.execute("PRAGMA table_info(broadcast_campaigns)") as cursor:
+                col_names = {row[1] for row in await cursor.fetchall()}
+            if "disable_web_page_preview" not in col_names:
+                await conn.execute("ALTER TABLE broadcast_campaigns ADD COLUMN disable_web_page_preview INTEGER DEFAULT 0")
+            if "progress_chat_id" not in col_names:
+                await conn.execute("ALTER TABLE broadcast_campaigns ADD COLUMN progress_chat_id INTEGER")
+            if "progress_message_id" not in col_names:
+                await conn.execute("ALTER TABLE broadcast_campaigns ADD COLUMN progress_message_id INTEGER")
+            
             await conn.execute("""
                 CREATE TABLE IF NOT EXISTS broadcast_messages (
                     id TEXT PRIMARY KEY,
@@ -104,19 +168,16 @@ class BroadcastService:
                 )
             """)
             
+            # Неотправленные сообщения кампании по порядку rowid — без просмотра всей таблицы
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS user_segments (
-                    user_id TEXT PRIMARY KEY,
-                    segment TEXT NOT NULL,
-                    last_activity REAL,
-                    subscription_status TEXT,
-                    payment_count INTEGER DEFAULT 0,
-                    referral_count INTEGER DEFAULT 0,
-                    created_at REAL
-                )
+                CREATE INDEX IF NOT EXISTS ix_broadcast_messages_campaign_status
+                ON broadcast_messages (campaign_id, status)
             """)
             
             await conn.commit()
+        
+        # Таблица сегментов и триггеры на users (services/segments.py)
+        await self.segments.init()
 
     async def create_campaign(
         self, 
@@ -124,7 +185,8 @@ class BroadcastService:
         text: str, 
         target_segment: str,
         parse_mode: Optional[str] = None,
-        reply_markup: Optional[Dict] = None
+        reply_markup: Optional[Dict] = None,
+        disable_web_page_preview: bool = False
     ) -> str:
         """Создание новой кампании рассылки"""
         campaign_id = f"campaign_{int(time.time())}_{hash(name) % 10000}"
@@ -137,19 +199,21 @@ class BroadcastService:
             status=BroadcastStatus.PENDING,
             created_at=time.time(),
             parse_mode=parse_mode,
-            reply_markup=reply_markup
+            reply_markup=reply_markup,
+            disable_web_page_preview=disable_web_page_preview
         )
         
         # Сохраняем кампанию в БД
         async with aiosqlite.connect(self.db_path) as conn:
             await conn.execute("""
                 INSERT INTO broadcast_campaigns 
-                (id, name, text, target_segment, status, created_at, parse_mode, reply_markup)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                (id, name, text, target_segment, status, created_at, parse_mode, reply_markup, disable_web_page_preview)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (
                 campaign_id, name, text, target_segment, 
                 BroadcastStatus.PENDING.value, time.time(),
-                parse_mode, json.dumps(reply_markup) if reply_markup else None
+                parse_mode, json.dumps(reply_markup) if reply_markup else None,
+                int(disable_web_page_preview)
             ))
             await conn.commit()
         
@@ -157,35 +221,35 @@ class BroadcastService:
         return campaign_id
 
     async def get_users_by_segment(self, segment: str) -> List[str]:
-        """Получение пользователей по сегменту"""
-        segments = {
-            "all": "SELECT tg_id FROM users",
-            "active": "SELECT tg_id FROM users WHERE balance > 0",
-            "trial_only": """
-                SELECT tg_id FROM users 
-                WHERE trial_3d_used = 1 AND (paid_count IS NULL OR paid_count = 0)
-            """,
-            "expired": """
-                SELECT tg_id FROM users 
-                WHERE balance <= 0 AND (trial_3d_used = 1 OR paid_count > 0)
-            """,
-            "no_subscription": "SELECT tg_id FROM users WHERE balance <= 0",
-            "with_referrals": "SELECT tg_id FROM users WHERE referral_count > 0",
-            "vip": "SELECT tg_id FROM users WHERE paid_count >= 5"
-        }
-        
-        if segment not in segments:
-            logger.warning(f"Unknown segment: {segment}")
-            return []
-        
-        async with aiosqlite.connect(self.db_path) as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute(segments[segment])
-                rows = await cursor.fetchall()
-                return [row[0] for row in rows if row[0]]
+        """Получение пользователей по сегменту списком (для больших сегментов — iter_users_by_segment)"""
+        return [user_id async for user_id in self.segments.iter_ids(segment)]
+
+    def iter_users_by_segment(self, segment: str):
+        """tg_id сегмента потоком, порциями из user_segments"""
+        return self.segments.iter_ids(segment)
+
+    async def count_users_by_segment(self, segment: str) -> int:
+        """Размер сегмента без выборки tg_id"""
+        return await self.segments.count(segment)
+
+    def running_campaign(self, name: str) -> Optional[BroadcastCampaign]:
+        """Идущая кампания с таким названием (чтобы не запустить ту же рассылку дважды)"""
+        for campaign in self.active_campaigns.values():
+            if campaign.name == name and campaign.status == BroadcastStatus.SENDING:
+                return campaign
+        return None
 
-    async def start_campaign(self, campaign_id: str) -> bool:
-        """Запуск кампании рассылки"""
+    async def start_campaign(
+        self,
+        campaign_id: str,
+        recipients: Optional[Union[Iterable[Recipient], AsyncIterable[Recipient]]] = None,
+        progress_message: Optional[Message] = None
+    ) -> bool:
+        """Запуск кампании рассылки
+
+        recipients — готовый список получателей вместо сегмента кампании;
+        progress_message — сообщение администратора, в котором показывается ход рассылки.
+        """
         if campaign_id not in self.active_campaigns:
             logger.error(f"Campaign {campaign_id} not found")
             return False
@@ -195,162 +259,290 @@ class BroadcastService:
             logger.error(f"Campaign {campaign_id} is not in pending status")
             return False
         
-        # Получаем пользователей для рассылки
-        user_ids = await self.get_users_by_segment(campaign.target_segment)
-        if not user_ids:
-            logger.warning(f"No users found for segment: {campaign.target_segment}")
-            return False
+        if recipients is None:
+            # Состав сегмента — на момент запуска (активные подписки сверяются с бэкендом)
+            await self.segments.refresh()
+            recipients = self.segments.iter_ids(campaign.target_segment)
         
-        campaign.total_users = len(user_ids)
+        # Повторный запуск той же кампании, пока создаются сообщения, не пройдёт проверку выше
         campaign.status = BroadcastStatus.SENDING
         campaign.started_at = time.time()
+        if progress_message is not None:
+            campaign.progress_chat_id = progress_message.chat.id
+            campaign.progress_message_id = progress_message.message_id
+        try:
+            # Сообщения и статус кампании — одной транзакцией: после сбоя кампания либо
+            # не начата, либо продолжится со всеми получателями
+            async with aiosqlite.connect(self.db_path) as conn:
+                total = await self._create_messages_for_campaign(conn, campaign_id, recipients)
+                if not total:
+                    # Транзакция откатится при закрытии соединения
+                    logger.warning(f"No users found for campaign {campaign_id} ({campaign.target_segment})")
+                    campaign.status = BroadcastStatus.PENDING
+                    campaign.started_at = None
+                    return False
+                await conn.execute("""
+                    UPDATE broadcast_campaigns 
+                    SET status = ?, started_at = ?, total_users = ?, progress_chat_id = ?, progress_message_id = ?
+                    WHERE id = ?
+                """, (
+                    BroadcastStatus.SENDING.value, campaign.started_at, total,
+                    campaign.progress_chat_id, campaign.progress_message_id, campaign_id
+                ))
+                await conn.commit()
+        except Exception:
+            campaign.status = BroadcastStatus.PENDING
+            campaign.started_at = None
+            raise
+        campaign.total_users = total
         
-        # Обновляем статус в БД
-        async with aiosqlite.connect(self.db_path) as conn:
-            await conn.execute("""
-                UPDATE broadcast_campaigns 
-                SET status = ?, started_at = ?, total_users = ?
-                WHERE id = ?
-            """, (BroadcastStatus.SENDING.value, campaign.started_at, campaign.total_users, campaign_id))
-            await conn.commit()
-        
-        # Создаем сообщения для очереди
-        await self._create_messages_for_campaign(campaign_id, user_ids)
-        
-        # Запускаем обработку очереди, если она не запущена
+        self._enqueue(campaign_id)
+        self.progress.watch(campaign)
+        return True
+
+    async def _create_messages_for_campaign(
+        self,
+        conn: aiosqlite.Connection,
+        campaign_id: str,
+        recipients: Union[Iterable[Recipient], AsyncIterable[Recipient]]
+    ) -> int:
+        """Создание сообщений для кампании порциями; возвращает число получателей"""
+        created_at = int(time.time())
+        changes_before = conn.total_changes
+        chunk = []
+        async for recipient in self._iter_recipients(recipients):
+            if isinstance(recipient, tuple):
+                user_id, text = str(recipient[0]), recipient[1]
+            else:
+                # Текст хранится один раз — в broadcast_campaigns
+                user_id, text = str(recipient), ""
+            chunk.append((f"msg_{campaign_id}_{user_id}_{created_at}", campaign_id, user_id, text, MessageStatus.PENDING.value))
+            if len(chunk) >= self.message_chunk:
+                await self._insert_messages(conn, chunk)
+                chunk = []
+        if chunk:
+            await self._insert_messages(conn, chunk)
+        # Повторы tg_id в готовом списке пропускаются (INSERT OR IGNORE)
+        return conn.total_changes - changes_before
+
+    @staticmethod
+    async def _iter_recipients(recipients) -> AsyncIterator[Recipient]:
+        if hasattr(recipients, "__aiter__"):
+            async for recipient in recipients:
+                yield recipient
+        else:
+            for recipient in recipients:
+                yield recipient
+
+    async def _insert_messages(self, conn: aiosqlite.Connection, rows: List[tuple]):
+        await conn.executemany("""
+            INSERT OR IGNORE INTO broadcast_messages 
+            (id, campaign_id, user_id, text, status)
+            VALUES (?, ?, ?, ?, ?)
+        """, rows)
+
+    def _enqueue(self, campaign_id: str, restart: bool = False):
+        """Ставит кампанию в очередь отправки и запускает обработку, если она не запущена
+
+        restart — читать неотправленные сообщения кампании с начала (после отмены).
+        """
+        if restart:
+            self._cursors[campaign_id] = 0
+        else:
+            self._cursors.setdefault(campaign_id, 0)
         if not self.is_running:
+            self.is_running = True
             asyncio.create_task(self._process_queue())
-        
-        return True
 
-    async def _create_messages_for_campaign(self, campaign_id: str, user_ids: List[str]):
-        """Создание сообщений для кампании"""
-        campaign = self.active_campaigns[campaign_id]
-        
+    _CAMPAIGN_COLUMNS = """
+        id, name, text, target_segment, status, created_at, started_at, completed_at, total_users,
+        parse_mode, reply_markup, disable_web_page_preview, progress_chat_id, progress_message_id
+    """
+
+    async def _load_campaign(self, conn: aiosqlite.Connection, row: tuple) -> BroadcastCampaign:
+        """Кампания из строки broadcast_campaigns; счётчики — по строкам сообщений"""
+        (campaign_id, name, text, segment, status, created_at, started_at, completed_at, total,
+         parse_mode, reply_markup, disable_preview, progress_chat_id, progress_message_id) = row
+        campaign = BroadcastCampaign(
+            id=campaign_id,
+            name=name,
+            text=text,
+            target_segment=segment,
+            status=BroadcastStatus(status),
+            created_at=created_at,
+            started_at=started_at,
+            completed_at=completed_at,
+            total_users=total or 0,
+            parse_mode=parse_mode,
+            reply_markup=json.loads(reply_markup) if reply_markup else None,
+            disable_web_page_preview=bool(disable_preview),
+            progress_chat_id=progress_chat_id,
+            progress_message_id=progress_message_id
+        )
+        # Покрывающий индекс (campaign_id, status)
+        async with conn.execute("""
+            SELECT status, COUNT(*) FROM broadcast_messages
+            WHERE campaign_id = ? GROUP BY status
+        """, (campaign_id,)) as cursor:
+            counts = dict(await cursor.fetchall())
+        campaign.sent_count = counts.get(MessageStatus.SENT.value, 0)
+        campaign.failed_count = counts.get(MessageStatus.FAILED.value, 0)
+        campaign.blocked_count = counts.get(MessageStatus.BLOCKED.value, 0)
+        return campaign
+
+    async def resume_campaigns(self) -> int:
+        """Продолжение кампаний, прерванных остановкой бота; возвращает их число"""
         async with aiosqlite.connect(self.db_path) as conn:
-            for user_id in user_ids:
-                message_id = f"msg_{campaign_id}_{user_id}_{int(time.time())}"
-                
-                await conn.execute("""
-                    INSERT INTO broadcast_messages 
-                    (id, campaign_id, user_id, text, status)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (message_id, campaign_id, user_id, campaign.text, MessageStatus.PENDING.value))
-                
-                # Добавляем в очередь
-                message = BroadcastMessage(
-                    id=message_id,
-                    user_id=user_id,
-                    text=campaign.text,
-                    parse_mode=campaign.parse_mode,
-                    reply_markup=campaign.reply_markup
-                )
-                await self.message_queue.put(message)
-            
-            await conn.commit()
+            async with conn.execute(f"""
+                SELECT {self._CAMPAIGN_COLUMNS}
+                FROM broadcast_campaigns WHERE status = ?
+                ORDER BY created_at
+            """, (BroadcastStatus.SENDING.value,)) as cursor:
+                rows = await cursor.fetchall()
+            for row in rows:
+                campaign = await self._load_campaign(conn, row)
+                self.active_campaigns[campaign.id] = campaign
+                processed = campaign.sent_count + campaign.failed_count + campaign.blocked_count
+                logger.info(f"Resuming campaign {campaign.id}: {campaign.total_users - processed} of {campaign.total_users} left")
+                if processed < campaign.total_users:
+                    self._enqueue(campaign.id)
+                else:
+                    # Все итоги записаны, а статус кампании — нет
+                    self._update_campaign_stats(campaign.id, None)
+                self.progress.watch(campaign)
+        return len(rows)
+
+    async def resume_campaign(self, campaign_id: str) -> bool:
+        """Продолжение отменённой кампании: уйдут только неотправленные сообщения"""
+        # Итоги уже отправленных — в БД, чтобы счётчики и выборка неотправленных были точными
+        await self.status_writer.flush()
+        campaign = self.active_campaigns.get(campaign_id)
+        if campaign is None:
+            # Кампания отменена до перезапуска бота
+            async with aiosqlite.connect(self.db_path) as conn:
+                async with conn.execute(f"""
+                    SELECT {self._CAMPAIGN_COLUMNS}
+                    FROM broadcast_campaigns WHERE id = ?
+                """, (campaign_id,)) as cursor:
+                    row = await cursor.fetchone()
+                if row is None:
+                    return False
+                campaign = await self._load_campaign(conn, row)
+            self.active_campaigns[campaign_id] = campaign
+        
+        if campaign.status != BroadcastStatus.CANCELLED:
+            return False
+        
+        campaign.status = BroadcastStatus.SENDING
+        campaign.completed_at = None
+        # Сохраняет статус (после перезапуска кампания продолжится) или сразу завершает её
+        self._update_campaign_stats(campaign_id, None)
+        await self.status_writer.flush()
+        if campaign.status == BroadcastStatus.SENDING:
+            self._enqueue(campaign_id, restart=True)
+        self.progress.watch(campaign)
+        return True
 
     async def _process_queue(self):
         """Обработка очереди сообщений"""
         self.is_running = True
         logger.info("Starting broadcast queue processing")
-        
-        while self.is_running:
+        try:
+            # Темп, лимиты на чат, RetryAfter и повторы — в BroadcastSender.
+            # Новая кампания могла добавить сообщения, пока отправитель дожидался последних ответов
+            while self.is_running:
+                await self.sender.run(self._pending_messages())
+                if not self._cursors:
+                    break
+        except Exception as e:
+            logger.error(f"Error processing broadcast queue: {e}")
+        finally:
+            self.is_running = False
             try:
-                # Получаем батч сообщений
-                batch = []
-                for _ in range(self.batch_size):
-                    try:
-                        message = await asyncio.wait_for(self.message_queue.get(), timeout=1.0)
-                        batch.append(message)
-                    except asyncio.TimeoutError:
-                        break
-                
-                if not batch:
-                    await asyncio.sleep(0.1)
-                    continue
-                
-                # Отправляем батч
-                await self._send_batch(batch)
-                
-                # Задержка между батчами
-                await asyncio.sleep(self.delay_between_batches)
-                
+                await self.status_writer.flush()
             except Exception as e:
-                logger.error(f"Error processing broadcast queue: {e}")
-                await asyncio.sleep(1.0)
-        
+                logger.error(f"Error saving broadcast statuses: {e}")
         logger.info("Broadcast queue processing stopped")
 
-    async def _send_batch(self, batch: List[BroadcastMessage]):
-        """Отправка батча сообщений"""
-        tasks = []
-        for message in batch:
-            task = asyncio.create_task(self._send_single_message(message))
-            tasks.append(task)
-        
-        # Ждем завершения всех задач в батче
-        await asyncio.gather(*tasks, return_exceptions=True)
+    async def _pending_messages(self):
+        """Неотправленные сообщения кампаний из очереди — порциями по rowid, кампания за кампанией"""
+        while self.is_running and self._cursors:
+            campaign_id, after = next(iter(self._cursors.items()))
+            campaign = self.active_campaigns.get(campaign_id)
+            rows = []
+            if campaign is not None and campaign.status == BroadcastStatus.SENDING:
+                async with aiosqlite.connect(self.db_path) as conn:
+                    async with conn.execute("""
+                        SELECT rowid, id, user_id, text FROM broadcast_messages
+                        WHERE campaign_id = ? AND status = ? AND rowid > ?
+                        ORDER BY rowid LIMIT ?
+                    """, (campaign_id, MessageStatus.PENDING.value, after, self.message_chunk)) as cursor:
+                        rows = await cursor.fetchall()
+            if not rows:
+                # Кампания прочитана до конца или отменена
+                del self._cursors[campaign_id]
+                continue
+            self._cursors[campaign_id] = rows[-1][0]
+            for _, message_id, user_id, text in rows:
+                if campaign.status != BroadcastStatus.SENDING:
+                    break
+                # После продолжения кампания читается с начала: пропускаем ещё не записанные итоги
+                if message_id in self._claimed or self.status_writer.has_message(message_id):
+                    continue
+                self._claimed.add(message_id)
+                yield BroadcastMessage(id=message_id, user_id=user_id, campaign_id=campaign_id, text=text or None)
 
-    async def _send_single_message(self, message: BroadcastMessage):
-        """Отправка одного сообщения с retry логикой"""
-        try:
-            # Отправляем сообщение
-            await self.bot.send_message(
-                chat_id=message.user_id,
-                text=message.text,
-                parse_mode=message.parse_mode,
-                reply_markup=message.reply_markup
-            )
-            
-            # Обновляем статус
+    def _is_live(self, message: BroadcastMessage) -> bool:
+        """Сообщения отменённой кампании не отправляются, даже если уже в очереди отправителя"""
+        campaign = self.active_campaigns.get(message.campaign_id)
+        return campaign is not None and campaign.status == BroadcastStatus.SENDING
+
+    async def _send_message(self, message: BroadcastMessage):
+        campaign = self.active_campaigns[message.campaign_id]
+        extra = {"disable_web_page_preview": True} if campaign.disable_web_page_preview else {}
+        await self.bot.send_message(
+            chat_id=message.user_id,
+            text=message.text or campaign.text,
+            parse_mode=campaign.parse_mode,
+            reply_markup=campaign.reply_markup,
+            **extra
+        )
+
+    async def _on_send_result(self, message: BroadcastMessage, status: str, error: Optional[str], attempts: int):
+        """Итог отправки одного сообщения (после всех повторов)"""
+        self._claimed.discard(message.id)
+        if status == SKIPPED:
+            # Кампания отменена: сообщение остаётся неотправленным до продолжения
+            return
+        message.retry_count = attempts - 1
+        message.error_message = error
+        if status == SENT:
             message.status = MessageStatus.SENT
             message.sent_at = time.time()
-            
-            # Обновляем в БД
-            await self._update_message_status(message)
-            
-            # Обновляем статистику кампании
-            await self._update_campaign_stats(message.campaign_id, "sent")
-            
-            logger.info(f"Message sent successfully to user {message.user_id}")
-            
-        except Exception as e:
-            error_msg = str(e)
-            logger.warning(f"Failed to send message to {message.user_id}: {error_msg}")
-            
-            message.retry_count += 1
-            message.error_message = error_msg
-            
-            if message.retry_count < self.max_retries:
-                # Добавляем обратно в очередь для повторной попытки
-                await asyncio.sleep(self.retry_delay)
-                await self.message_queue.put(message)
-            else:
-                # Максимальное количество попыток исчерпано
-                if "blocked" in error_msg.lower() or "forbidden" in error_msg.lower():
-                    message.status = MessageStatus.BLOCKED
-                    await self._update_campaign_stats(message.campaign_id, "blocked")
-                else:
-                    message.status = MessageStatus.FAILED
-                    await self._update_campaign_stats(message.campaign_id, "failed")
-                
-                await self._update_message_status(message)
+            logger.debug(f"Message sent successfully to user {message.user_id}")
+        else:
+            logger.warning(f"Failed to send message to {message.user_id}: {error}")
+            message.status = MessageStatus.BLOCKED if status == BLOCKED else MessageStatus.FAILED
 
-    async def _update_message_status(self, message: BroadcastMessage):
-        """Обновление статуса сообщения в БД"""
-        async with aiosqlite.connect(self.db_path) as conn:
-            await conn.execute("""
-                UPDATE broadcast_messages 
-                SET status = ?, retry_count = ?, error_message = ?, sent_at = ?
-                WHERE id = ?
-            """, (
-                message.status.value, message.retry_count, 
-                message.error_message, message.sent_at, message.id
-            ))
-            await conn.commit()
+        self._update_message_status(message)
+        self._update_campaign_stats(message.campaign_id, message.status.value)
+        await self.status_writer.backpressure()
+
+    def _update_message_status(self, message: BroadcastMessage):
+        """Обновление статуса сообщения (запишется в БД со следующим сбросом)"""
+        self.status_writer.message(
+            message.id, message.status.value, message.retry_count,
+            message.error_message, message.sent_at
+        )
+
+    def _save_campaign(self, campaign: BroadcastCampaign):
+        self.status_writer.campaign(
+            campaign.id, campaign.status.value, campaign.completed_at,
+            campaign.sent_count, campaign.failed_count, campaign.blocked_count
+        )
 
-    async def _update_campaign_stats(self, campaign_id: str, action: str):
-        """Обновление статистики кампании"""
+    def _update_campaign_stats(self, campaign_id: str, action: Optional[str]):
+        """Обновление статистики кампании (в БД — тем же сбросом, что и статусы сообщений)"""
         if campaign_id not in self.active_campaigns:
             return
         
@@ -365,23 +557,13 @@ class BroadcastService:
         
         # Проверяем, завершена ли кампания
         total_processed = campaign.sent_count + campaign.failed_count + campaign.blocked_count
-        if total_processed >= campaign.total_users:
+        if total_processed >= campaign.total_users and campaign.status == BroadcastStatus.SENDING:
             campaign.status = BroadcastStatus.COMPLETED
             campaign.completed_at = time.time()
-            
-            # Обновляем в БД
-            async with aiosqlite.connect(self.db_path) as conn:
-                await conn.execute("""
-                    UPDATE broadcast_campaigns 
-                    SET status = ?, completed_at = ?, sent_count = ?, failed_count = ?, blocked_count = ?
-                    WHERE id = ?
-                """, (
-                    BroadcastStatus.COMPLETED.value, campaign.completed_at,
-                    campaign.sent_count, campaign.failed_count, campaign.blocked_count, campaign_id
-                ))
-                await conn.commit()
-            
             logger.info(f"Campaign {campaign_id} completed: {campaign.sent_count} sent, {campaign.failed_count} failed, {campaign.blocked_count} blocked")
+            self.progress.poke(campaign_id)
+        
+        self._save_campaign(campaign)
 
     async def get_campaign_stats(self, campaign_id: str) -> Optional[Dict]:
         """Получение статистики кампании"""
@@ -412,14 +594,10 @@ class BroadcastService:
         campaign.status = BroadcastStatus.CANCELLED
         campaign.completed_at = time.time()
         
-        # Обновляем в БД
-        async with aiosqlite.connect(self.db_path) as conn:
-            await conn.execute("""
-                UPDATE broadcast_campaigns 
-                SET status = ?, completed_at = ?
-                WHERE id = ?
-            """, (BroadcastStatus.CANCELLED.value, campaign.completed_at, campaign_id))
-            await conn.commit()
+        # Обновляем в БД сразу вместе с накопленными статусами
+        self._save_campaign(campaign)
+        await self.status_writer.flush()
+        self.progress.poke(campaign_id)
         
         return True
 
@@ -430,3 +608,8 @@ class BroadcastService:
         
         self.is_running = False
 
+    async def close(self):
+        """Запись накопленных статусов перед остановкой бота"""
+        await self.progress.close()
+        await self.status_writer.close()
+
@@ -0,0 +1,173 @@
+"""
+Отложенная запись итогов рассылки в SQLite.
+
+Раньше каждое отправленное сообщение стоило отдельного подключения и транзакции
+(``UPDATE broadcast_messages``), а завершение кампании — ещё одной. ``StatusWriter``
+копит изменения в памяти и записывает их одной транзакцией:
+
+* статусы сообщений — ``executemany`` по ``broadcast_messages``; повторное изменение
+  того же сообщения до сброса заменяет предыдущее;
+* счётчики и статус затронутых кампаний — в той же транзакции, значениями на момент
+  сброса, поэтому строки сообщений и счётчики кампании в БД всегда согласованы;
+* сброс — не позже чем через ``flush_interval`` секунд или при ``max_pending``
+  изменениях; при ``4 * max_pending`` (диск не успевает) запись идёт сразу;
+* одно постоянное подключение (WAL) на всё время работы вместо подключения на запись.
+
+При сбое процесса теряются только изменения последних ``flush_interval`` секунд.
+"""
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+# id сообщения -> (status, retry_count, error_message, sent_at)
+_MessageRow = Tuple[str, int, Optional[str], Optional[float]]
+# id кампании -> (status, completed_at, sent_count, failed_count, blocked_count)
+_CampaignRow = Tuple[str, Optional[float], int, int, int]
+
+
+class StatusWriter:
+    def __init__(
+        self,
+        db_path: str = "users.db",
+        flush_interval: float = 0.25,
+        max_pending: int = 500,
+        busy_timeout_ms: int = 5000,
+    ):
+        self.db_path = db_path
+        self.flush_interval = max(0.0, float(flush_interval))
+        self.max_pending = max(1, int(max_pending))
+        self.busy_timeout_ms = busy_timeout_ms
+        self._messages: Dict[str, _MessageRow] = {}
+        self._campaigns: Dict[str, _CampaignRow] = {}
+        # Итоги, которые записываются прямо сейчас
+        self._flushing: Dict[str, _MessageRow] = {}
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_now = asyncio.Event()
+        # Метрики
+        self.flushes = 0
+        self.flushed_messages = 0
+
+    async def _connection(self) -> aiosqlite.Connection:
+        if self._conn is None:
+            conn = await aiosqlite.connect(self.db_path)
+            await conn.execute("PRAGMA journal_mode=WAL")
+            await conn.execute("PRAGMA synchronous=NORMAL")
+            await conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+            self._conn = conn
+        return self._conn
+
+    def message(self, message_id: str, status: str, retry_count: int, error: Optional[str], sent_at: Optional[float]) -> None:
+        """Запоминает итог отправки сообщения."""
+        self._messages[message_id] = (status, retry_count, error, sent_at)
+        self._schedule()
+
+    def has_message(self, message_id: str) -> bool:
+        """Итог сообщения ещё не записан в БД."""
+        return message_id in self._messages or message_id in self._flushing
+
+    def campaign(
+        self,
+        campaign_id: str,
+        status: str,
+        completed_at: Optional[float],
+        sent: int,
+        failed: int,
+        blocked: int,
+    ) -> None:
+        """Запоминает текущие счётчики и статус кампании."""
+        self._campaigns[campaign_id] = (status, completed_at, sent, failed, blocked)
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if len(self._messages) >= self.max_pending:
+            self._flush_now.set()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        # Ждём flush_interval или переполнения буфера
+        try:
+            await asyncio.wait_for(self._flush_now.wait(), self.flush_interval)
+        except asyncio.TimeoutError:
+            pass
+        self._flush_now.clear()
+        try:
+            await self.flush()
+        except Exception as exc:
+            logger.warning("Broadcast status flush failed, retrying later: %s", exc)
+        if self._messages or self._campaigns:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def backpressure(self) -> None:
+        """Ждёт записи, если буфер вырос до ``4 * max_pending`` (диск не успевает)."""
+        if len(self._messages) >= 4 * self.max_pending:
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Записывает накопленные изменения одной транзакцией."""
+        async with self._lock:
+            if not self._messages and not self._campaigns:
+                return
+            messages, self._messages = self._messages, {}
+            campaigns, self._campaigns = self._campaigns, {}
+            self._flushing = messages
+            try:
+                conn = await self._connection()
+                if messages:
+                    await conn.executemany(
+                        """
+                        UPDATE broadcast_messages
+                        SET status = ?, retry_count = ?, error_message = ?, sent_at = ?
+                        WHERE id = ?
+                        """,
+                        [(*row, message_id) for message_id, row in messages.items()],
+                    )
+                if campaigns:
+                    await conn.executemany(
+                        """
+                        UPDATE broadcast_campaigns
+                        SET status = ?, completed_at = ?, sent_count = ?, failed_count = ?, blocked_count = ?
+                        WHERE id = ?
+                        """,
+                        [(*row, campaign_id) for campaign_id, row in campaigns.items()],
+                    )
+                await conn.commit()
+            except BaseException:
+                # Возвращаем в буфер всё, что не успели перезаписать новыми изменениями
+                # (в том числе при отмене фонового сброса в close)
+                for message_id, row in messages.items():
+                    self._messages.setdefault(message_id, row)
+                for campaign_id, row in campaigns.items():
+                    self._campaigns.setdefault(campaign_id, row)
+                raise
+            finally:
+                self._flushing = {}
+            self.flushes += 1
+            self.flushed_messages += len(messages)
+
+    async def close(self) -> None:
+        """Дописывает буфер и закрывает подключение."""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        try:
+            await self.flush()
+        finally:
+            async with self._lock:
+                if self._conn is not None:
+                    await self._conn.close()
+                    self._conn = None
+
+    def stats(self) -> dict:
+        return {
+            "pending_messages": len(self._messages),
+            "pending_campaigns": len(self._campaigns),
+            "flushes": self.flushes,
+            "flushed_messages": self.flushed_messages,
+        }
@@ -0,0 +1,209 @@
+"""
+Реестр медиафайлов бота: файл загружается в Telegram один раз, дальше — по ``file_id``.
+
+Раньше ``/start`` на каждый вызов проверял три пути ``os.path.exists`` и заново загружал
+``start.jpg`` через ``FSInputFile`` — multipart-запрос на ~24 КБ в ответ каждому новому
+пользователю. ``MediaRegistry``:
+
+* ищет файл по имени в ``search_dirs`` один раз и запоминает путь;
+* после первой загрузки хранит ``file_id`` в памяти и в таблице ``media_files``
+  (``users.db``) вместе с SHA-256 содержимого, поэтому после перезапуска бот файл не
+  загружает;
+* проверяет файл не чаще раза в ``check_interval`` секунд и пересчитывает хеш, только
+  если изменились размер или mtime; новый хеш — следующая отправка загрузит файл заново;
+* одновременные первые отправки одного файла ждут одну загрузку;
+* если Telegram не принял ``file_id`` (например, сменился токен бота), загружает заново.
+
+Статичные картинки бота (приветствие, баннеры, картинки гайдов) отправляются через
+``media_registry.send_photo``.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+from database.pool import pool
+
+logger = logging.getLogger(__name__)
+
+_BOT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _default_dirs() -> List[str]:
+    # Как раньше в /start: корень проекта, каталог бота, рабочий каталог
+    return [os.path.dirname(_BOT_ROOT), _BOT_ROOT, os.getcwd()]
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@dataclass
+class _Asset:
+    path: str
+    size: int
+    mtime_ns: int
+    sha256: str
+    checked_at: float
+
+
+class MediaRegistry:
+    def __init__(self, search_dirs: Optional[Sequence[str]] = None, check_interval: float = 30.0):
+        self.search_dirs = list(search_dirs) if search_dirs is not None else _default_dirs()
+        self.check_interval = max(0.0, float(check_interval))
+        self._assets: Dict[str, _Asset] = {}
+        # Имя -> когда файл не нашёлся (повторный поиск — через check_interval)
+        self._missing: Dict[str, float] = {}
+        # Имя -> (sha256, file_id) последней загрузки
+        self._file_ids: Dict[str, Tuple[str, str]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._hashing: Dict[str, asyncio.Future] = {}
+        self._ready = False
+        # Метрики
+        self.reused = 0
+        self.uploads = 0
+        self.hashes = 0
+        self.invalidated = 0
+
+    def _find(self, name: str) -> Optional[str]:
+        for directory in self.search_dirs:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    async def _asset(self, name: str) -> Optional[_Asset]:
+        """Файл и хеш его содержимого; None — файла нет."""
+        now = time.monotonic()
+        asset = self._assets.get(name)
+        if asset is not None and now - asset.checked_at < self.check_interval:
+            return asset
+        if asset is None:
+            missing_at = self._missing.get(name)
+            if missing_at is not None and now - missing_at < self.check_interval:
+                return None
+        path = asset.path if asset is not None else self._find(name)
+        try:
+            if path is None:
+                raise FileNotFoundError(name)
+            stat = os.stat(path)
+        except OSError:
+            # Файл удалён или перенесён — ищем заново
+            self._assets.pop(name, None)
+            path = self._find(name)
+            if path is None:
+                self._missing[name] = now
+                return None
+            stat = os.stat(path)
+            asset = None
+        self._missing.pop(name, None)
+        if asset is not None and asset.size == stat.st_size and asset.mtime_ns == stat.st_mtime_ns:
+            asset.checked_at = now
+            return asset
+        # Одновременные проверки одного файла ждут один подсчёт хеша
+        hashing = self._hashing.get(name)
+        if hashing is None:
+            hashing = self._hashing[name] = asyncio.ensure_future(asyncio.to_thread(_sha256, path))
+            hashing.add_done_callback(lambda _: self._hashing.pop(name, None))
+            self.hashes += 1
+        sha256 = await hashing
+        asset = _Asset(path, stat.st_size, stat.st_mtime_ns, sha256, now)
+        self._assets[name] = asset
+        return asset
+
+    async def init(self) -> None:
+        """Создаёт таблицу media_files и читает сохранённые file_id (строк — по числу файлов)."""
+        # Отдельное соединение из пула: file_id не зависит от исхода апдейта
+        async with pool.connection() as conn:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS media_files (
+                    name TEXT PRIMARY KEY,
+                    sha256 TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    uploaded_at INTEGER NOT NULL
+                )
+            """)
+            async with conn.execute("SELECT name, sha256, file_id FROM media_files") as cursor:
+                rows = await cursor.fetchall()
+        for name, sha256, file_id in rows:
+            self._file_ids.setdefault(name, (sha256, file_id))
+        self._ready = True
+
+    async def _file_id(self, name: str, sha256: str) -> Optional[str]:
+        """file_id загрузки этого содержимого; None — файл ещё не загружался или изменился."""
+        if not self._ready:
+            await self.init()
+        cached = self._file_ids.get(name)
+        if cached is not None and cached[0] == sha256:
+            return cached[1]
+        return None
+
+    async def _remember(self, name: str, sha256: str, file_id: str) -> None:
+        self._file_ids[name] = (sha256, file_id)
+        async with pool.connection() as conn:
+            await conn.execute("""
+                INSERT INTO media_files (name, sha256, file_id, uploaded_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    sha256 = excluded.sha256, file_id = excluded.file_id, uploaded_at = excluded.uploaded_at
+            """, (name, sha256, file_id, int(time.time())))
+
+    async def _upload(self, bot: Bot, chat_id, name: str, asset: _Asset, **kwargs) -> Message:
+        message = await bot.send_photo(chat_id=chat_id, photo=FSInputFile(asset.path), **kwargs)
+        self.uploads += 1
+        # Самый большой размер — он же пригоден для повторной отправки
+        await self._remember(name, asset.sha256, message.photo[-1].file_id)
+        logger.info(f"Uploaded media {name} ({asset.size} bytes, sha256 {asset.sha256[:12]})")
+        return message
+
+    async def send_photo(self, bot: Bot, chat_id, name: str, **kwargs) -> Optional[Message]:
+        """Отправляет картинку по имени файла; None — файла нет (ответьте без картинки).
+
+        kwargs — как у ``Bot.send_photo`` (caption, reply_markup, parse_mode, ...).
+        """
+        asset = await self._asset(name)
+        if asset is None:
+            return None
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        file_id = await self._file_id(name, asset.sha256)
+        if file_id is None:
+            async with lock:
+                # Пока ждали, файл мог загрузить другой запрос
+                file_id = await self._file_id(name, asset.sha256)
+                if file_id is None:
+                    return await self._upload(bot, chat_id, name, asset, **kwargs)
+        try:
+            message = await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+        except TelegramBadRequest as e:
+            # Ошибка не в файле (подпись, разметка) — повторная загрузка не поможет
+            if "file" not in str(e).lower():
+                raise
+            logger.warning(f"Stored file_id for {name} rejected, uploading again: {e}")
+            self.invalidated += 1
+            self._file_ids.pop(name, None)
+            async with lock:
+                return await self._upload(bot, chat_id, name, asset, **kwargs)
+        self.reused += 1
+        return message
+
+    def stats(self) -> dict:
+        return {
+            "assets": len(self._assets),
+            "reused": self.reused,
+            "uploads": self.uploads,
+            "hashes": self.hashes,
+            "invalidated": self.invalidated,
+        }
+
+
+media_registry = MediaRegistry(check_interval=float(os.getenv("MEDIA_CHECK_INTERVAL", "30")))
@@ -0,0 +1,370 @@
+"""
+Выдача и продление конфигов сразу на нескольких серверах.
+
+Единая точка для покупки (Stars, YooKassa), активации баланса и пробной подписки:
+- запросы /giveconfig и /extendconfig уходят параллельно, у каждого свой таймаут,
+  так что время до конфига после оплаты ≈ время одного запроса к бэкенду;
+- результаты сводятся в один ``ProvisionResult`` — пользователь получает одно сообщение;
+- неудачные серверы/конфиги дожимаются в фоне с паузами. Каждая операция несёт
+  ``Idempotency-Key``, а перед повтором проверяется, не применилась ли она уже
+  (ответ мог потеряться по таймауту) — повтор не выдаёт второй конфиг и не продлевает дважды.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from database.pool import flush_current
+from utils import format_server_list, get_session
+
+logger = logging.getLogger(__name__)
+
+API_BASE_URL = "http://fastapi:8080"
+AUTH_CODE = os.getenv("AUTH_CODE")
+
+OP_GIVE = "give"
+OP_EXTEND = "extend"
+
+
+@dataclass
+class ProvisionResult:
+    """Итог операции по всем серверам (для give) или конфигам (для extend)."""
+
+    op: str
+    tg_id: str
+    days: int
+    succeeded: List[str] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+    # Для give — server -> uid выданного конфига; для extend — uid -> server
+    details: Dict[str, str] = field(default_factory=dict)
+    # Ушло на фоновые повторы / дожато повторами
+    retrying: List[str] = field(default_factory=list)
+    recovered: List[str] = field(default_factory=list)
+
+    @property
+    def success_count(self) -> int:
+        return len(self.succeeded)
+
+    @property
+    def ok(self) -> bool:
+        return bool(self.succeeded)
+
+
+# Колбэк по завершении фоновых повторов: получает итоговый результат операции
+CompletionHook = Callable[[ProvisionResult], Awaitable[None]]
+
+
+class ProvisioningService:
+    def __init__(
+        self,
+        base_url: str = API_BASE_URL,
+        call_timeout: float = 12.0,
+        retry_delays: Tuple[float, ...] = (5.0, 20.0, 60.0),
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.call_timeout = max(1.0, float(call_timeout))
+        self.retry_delays = tuple(retry_delays)
+        self._background: set[asyncio.Task] = set()
+
+    # ------------------------------------------------------------------
+    # Публичный API
+    # ------------------------------------------------------------------
+
+    async def give_configs(
+        self,
+        tg_id: int | str,
+        days: int,
+        servers: List[str],
+        is_trial: bool = False,
+        operation_id: Optional[str] = None,
+        on_complete: Optional[CompletionHook] = None,
+    ) -> ProvisionResult:
+        """Выдаёт конфиги на всех ``servers`` параллельно.
+
+        Возвращает результат первого прохода; неудачные серверы дожимаются в фоне,
+        по завершении вызывается ``on_complete`` с итоговым результатом.
+        """
+        tg_id = str(tg_id)
+        op_id = operation_id or uuid.uuid4().hex
+        result = ProvisionResult(op=OP_GIVE, tg_id=tg_id, days=int(days))
+        servers = list(dict.fromkeys(servers))
+
+        # Запросы идут из дочерних задач, где соединение апдейта не сбрасывается само:
+        # фиксируем его до ожидания бэкенда
+        await flush_current()
+        outcomes = await asyncio.gather(
+            *(self._give_one(tg_id, days, server, is_trial, op_id) for server in servers)
+        )
+        for server, (ok, uid) in zip(servers, outcomes):
+            if ok:
+                result.succeeded.append(server)
+                if uid:
+                    result.details[server] = uid
+            else:
+                result.failed.append(server)
+
+        if result.failed and self.retry_delays:
+            result.retrying = list(result.failed)
+            self._spawn(self._retry_give(result, is_trial, op_id, on_complete))
+        logger.info(
+            "provision.give tg_id=%s ok=%s failed=%s",
+            tg_id,
+            result.succeeded,
+            result.failed,
+        )
+        return result
+
+    async def extend_configs(
+        self,
+        tg_id: int | str,
+        days: int,
+        configs: Optional[List[Tuple[str, int, str]]] = None,
+        operation_id: Optional[str] = None,
+        on_complete: Optional[CompletionHook] = None,
+    ) -> ProvisionResult:
+        """Продлевает все активные конфиги пользователя параллельно.
+
+        ``configs`` — список (uid, time_end, server); если не передан, берём активные из бэкенда.
+        """
+        tg_id = str(tg_id)
+        op_id = operation_id or uuid.uuid4().hex
+        result = ProvisionResult(op=OP_EXTEND, tg_id=tg_id, days=int(days))
+        if configs is None:
+            configs = await self._active_configs(tg_id)
+        # Минимальный ожидаемый time_end после продления — для проверки при повторе
+        expected: Dict[str, int] = {}
+        for uid, time_end, server in configs:
+            base = max(int(time_end or 0), int(time.time()))
+            expected[uid] = base + int(days) * 86400 - 3600
+            result.details[uid] = server
+
+        await flush_current()
+        outcomes = await asyncio.gather(
+            *(self._extend_one(uid, days, server, op_id) for uid, _, server in configs)
+        )
+        for (uid, _, _), ok in zip(configs, outcomes):
+            (result.succeeded if ok else result.failed).append(uid)
+
+        if result.failed and self.retry_delays:
+            result.retrying = list(result.failed)
+            self._spawn(self._retry_extend(result, expected, op_id, on_complete))
+        logger.info(
+            "provision.extend tg_id=%s ok=%s failed=%s",
+            tg_id,
+            len(result.succeeded),
+            len(result.failed),
+        )
+        return result
+
+    async def shutdown(self) -> None:
+        for task in list(self._background):
+            task.cancel()
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+
+    # ------------------------------------------------------------------
+    # Один запрос
+    # ------------------------------------------------------------------
+
+    def _headers(self, idempotency_key: str) -> Dict[str, str]:
+        headers = {"Idempotency-Key": idempotency_key}
+        if AUTH_CODE:
+            headers["X-API-Key"] = AUTH_CODE
+        return headers
+
+    async def _post(self, path: str, data: dict, idempotency_key: str) -> Tuple[int, object]:
+        session = await get_session()
+        timeout = aiohttp.ClientTimeout(total=self.call_timeout)
+        async with session.post(
+            f"{self.base_url}{path}",
+            json=data,
+            headers=self._headers(idempotency_key),
+            timeout=timeout,
+        ) as resp:
+            try:
+                body = await resp.json(content_type=None)
+            except Exception:
+                body = None
+            return resp.status, body
+
+    async def _give_one(self, tg_id: str, days: int, server: str, is_trial: bool, op_id: str) -> Tuple[bool, Optional[str]]:
+        data = {"time": int(days), "id": tg_id, "server": server}
+        if is_trial:
+            data["is_trial"] = True
+        try:
+            status, body = await self._post("/giveconfig", data, f"give:{op_id}:{server}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Failed to create config on server {server}: {e!r}")
+            return False, None
+        except Exception as e:
+            logger.error(f"Unexpected error creating config on server {server}: {e}")
+            return False, None
+        if status == 200:
+            return True, body if isinstance(body, str) else None
+        logger.warning(f"/giveconfig server={server} returned {status}")
+        return False, None
+
+    async def _extend_one(self, uid: str, days: int, server: str, op_id: str) -> bool:
+        data = {"time": int(days), "uid": uid, "server": server}
+        try:
+            status, _ = await self._post("/extendconfig", data, f"extend:{op_id}:{uid}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Failed to extend config {uid}: {e!r}")
+            return False
+        except Exception as e:
+            logger.error(f"Unexpected error extending config {uid}: {e}")
+            return False
+        if status == 200:
+            return True
+        logger.warning(f"/extendconfig uid={uid} returned {status}")
+        return False
+
+    async def _user_codes(self, tg_id: str) -> Optional[List[dict]]:
+        """Конфиги пользователя из /usercodes (None — не удалось узнать)."""
+        session = await get_session()
+        headers = {"X-API-Key": AUTH_CODE} if AUTH_CODE else {}
+        try:
+            async with session.get(
+                f"{self.base_url}/usercodes/{tg_id}",
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=self.call_timeout),
+            ) as resp:
+                if resp.status == 404:
+                    return []
+                if resp.status != 200:
+                    return None
+                data = await resp.json()
+                return data if isinstance(data, list) else []
+        except Exception as e:
+            logger.warning(f"Failed to read user codes for {tg_id}: {e}")
+            return None
+
+    async def _active_configs(self, tg_id: str) -> List[Tuple[str, int, str]]:
+        now = int(time.time())
+        rows = await self._user_codes(tg_id) or []
+        return [
+            (row.get("user_code"), int(row.get("time_end") or 0), row.get("server"))
+            for row in rows
+            if int(row.get("time_end") or 0) > now
+        ]
+
+    # ------------------------------------------------------------------
+    # Фоновые повторы
+    # ------------------------------------------------------------------
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _retry_give(self, result: ProvisionResult, is_trial: bool, op_id: str, on_complete: Optional[CompletionHook]) -> None:
+        pending = list(result.failed)
+        for delay in self.retry_delays:
+            if not pending:
+                break
+            await asyncio.sleep(delay)
+            # Ответ мог потеряться по таймауту — если конфиг на сервере уже есть, не выдаём второй
+            now = int(time.time())
+            codes = await self._user_codes(result.tg_id)
+            already = {
+                str(row.get("server")): str(row.get("user_code"))
+                for row in (codes or [])
+                if int(row.get("time_end") or 0) > now
+            }
+            still: List[str] = []
+            for server in pending:
+                if server in already:
+                    ok, uid = True, already[server]
+                else:
+                    ok, uid = await self._give_one(result.tg_id, result.days, server, is_trial, op_id)
+                if ok:
+                    result.failed.remove(server)
+                    result.succeeded.append(server)
+                    result.recovered.append(server)
+                    if uid:
+                        result.details[server] = uid
+                else:
+                    still.append(server)
+            pending = still
+        result.retrying = []
+        logger.info("provision.give.retry tg_id=%s ok=%s failed=%s", result.tg_id, result.succeeded, result.failed)
+        await self._complete(result, on_complete)
+
+    async def _retry_extend(self, result: ProvisionResult, expected: Dict[str, int], op_id: str, on_complete: Optional[CompletionHook]) -> None:
+        pending = list(result.failed)
+        for delay in self.retry_delays:
+            if not pending:
+                break
+            await asyncio.sleep(delay)
+            codes = await self._user_codes(result.tg_id)
+            current = {str(row.get("user_code")): int(row.get("time_end") or 0) for row in (codes or [])}
+            still: List[str] = []
+            for uid in pending:
+                # Продление уже применилось — повторно не продлеваем
+                ok = current.get(uid, 0) >= expected.get(uid, 1 << 62)
+                if not ok:
+                    ok = await self._extend_one(uid, result.days, result.details.get(uid, ""), op_id)
+                if ok:
+                    result.failed.remove(uid)
+                    result.succeeded.append(uid)
+                    result.recovered.append(uid)
+                else:
+                    still.append(uid)
+            pending = still
+        result.retrying = []
+        logger.info("provision.extend.retry tg_id=%s ok=%s failed=%s", result.tg_id, len(result.succeeded), len(result.failed))
+        await self._complete(result, on_complete)
+
+    @staticmethod
+    async def _complete(result: ProvisionResult, on_complete: Optional[CompletionHook]) -> None:
+        if on_complete is None:
+            return
+        try:
+            await on_complete(result)
+        except Exception as e:
+            logger.error(f"Provisioning completion hook failed: {e}")
+
+
+def retry_note(result: ProvisionResult) -> str:
+    """Строка для отчёта о том, что часть операции дожимается в фоне."""
+    if not result.retrying:
+        return ""
+    if result.op == OP_GIVE:
+        return f"⏳ Серверы {format_server_list(result.retrying)} ещё подключаются — пришлём сообщение, когда закончим."
+    return f"⏳ Ещё {len(result.retrying)} конфиг(ов) продлеваются — пришлём сообщение, когда закончим."
+
+
+def retry_notifier(bot, extra: Optional[CompletionHook] = None) -> CompletionHook:
+    """Колбэк по итогам фоновых повторов: одно сообщение пользователю + ``extra``."""
+
+    async def _hook(result: ProvisionResult) -> None:
+        if extra is not None:
+            await extra(result)
+        lines: List[str] = []
+        if result.op == OP_GIVE:
+            if result.recovered:
+                lines.append(f"✅ Подписка активирована на серверах: {format_server_list(result.recovered)}.")
+            if result.failed:
+                lines.append(f"⚠️ Не удалось создать конфиги на серверах: {format_server_list(result.failed)}. Обратитесь в поддержку.")
+        else:
+            if result.recovered:
+                lines.append(f"✅ Продление применено ещё к {len(result.recovered)} конфиг(ам).")
+            if result.failed:
+                lines.append(f"⚠️ Не удалось продлить {len(result.failed)} конфигов. Обратитесь в поддержку.")
+        if lines:
+            try:
+                await bot.send_message(int(result.tg_id), "\n\n".join(lines))
+            except Exception as e:
+                logger.warning(f"Failed to notify {result.tg_id} about provisioning: {e}")
+
+    return _hook
+
+
+provisioning_service = ProvisioningService(
+    call_timeout=float(os.getenv("PROVISION_CALL_TIMEOUT_SECONDS", "12")),
+)
@@ -0,0 +1,203 @@
+"""
+Ограничение частоты и блокировки по ключу без глобальной блокировки и без утечки памяти.
+
+Раньше ``ThrottlingMiddleware`` хранил на каждую пару (пользователь, обработчик) очередь
+отметок времени под одним общим ``asyncio.Lock``, а ``utils`` и ``database.db`` держали
+словари блокировок и времени последнего действия, из которых ничего не удалялось:
+память росла с каждым пользователем, который когда-либо нажал кнопку.
+
+* ``GcraLimiter`` — GCRA (generic cell rate algorithm): на ключ хранится одно число,
+  теоретическое время следующего разрешённого события (TAT). Проверка — пара
+  сравнений; всё выполняется в одном event loop без ``await``, поэтому блокировка не
+  нужна. Ключ, у которого TAT в прошлом, ничем не отличается от отсутствующего, и его
+  удаляет колесо времени: ключ кладётся в слот по своему TAT, а при каждой проверке
+  слоты, чьё время прошло, вычищаются. Память — только активные ключи.
+* ``TokenBucket`` — общий темп для исходящих запросов (рассылки): ``rate`` токенов в
+  секунду, не больше ``capacity`` про запас; ``pause`` останавливает выдачу до
+  заданного момента (ответ Telegram ``retry_after``).
+* ``StripedLocks`` — фиксированный набор ``asyncio.Lock``, ключ выбирает полосу по
+  хэшу. Память не зависит от числа пользователей; разные ключи изредка делят полосу
+  (ждут друг друга), поэтому вложенно брать две блокировки одного набора нельзя.
+"""
+import asyncio
+import time
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+
+class GcraLimiter:
+    """GCRA: не больше ``burst`` событий на ключ за ``period`` секунд.
+
+    ``burst`` событий подряд проходят сразу, дальше — по одному раз в ``period / burst``.
+    При ``burst=1`` это обычный кулдаун: следующее событие не раньше чем через ``period``.
+    Параметры можно передавать в ``hit`` для каждого вызова отдельно.
+    """
+
+    def __init__(self, period: float = 1.0, burst: int = 1, resolution: float = 1.0):
+        self.period = max(1e-3, float(period))
+        self.burst = max(1, int(burst))
+        self.resolution = max(1e-3, float(resolution))
+        self._tat: Dict[Hashable, float] = {}
+        # Колесо времени: номер тика -> ключи, чей TAT попадает в этот тик
+        self._wheel: Dict[int, Set[Hashable]] = {}
+        self._cursor: Optional[int] = None
+        # Метрики
+        self.allowed = 0
+        self.limited = 0
+        self.evicted = 0
+
+    def hit(
+        self,
+        key: Hashable,
+        period: Optional[float] = None,
+        burst: Optional[int] = None,
+        now: Optional[float] = None,
+    ) -> Tuple[bool, float]:
+        """Учитывает событие. Возвращает (разрешено, через сколько секунд повторить)."""
+        now = time.monotonic() if now is None else now
+        self._sweep(now)
+        period = self.period if period is None else max(1e-3, float(period))
+        burst = self.burst if burst is None else max(1, int(burst))
+        interval = period / burst
+        tolerance = period - interval
+
+        tat = self._tat.get(key, now)
+        if tat < now:
+            tat = now
+        if tat - now > tolerance:
+            self.limited += 1
+            return False, tat - now - tolerance
+        tat += interval
+        self._tat[key] = tat
+        tick = int(tat / self.resolution) + 1
+        slot = self._wheel.get(tick)
+        if slot is None:
+            self._wheel[tick] = {key}
+        else:
+            slot.add(key)
+        self.allowed += 1
+        return True, 0.0
+
+    def _sweep(self, now: float) -> None:
+        """Удаляет ключи, чей TAT уже прошёл (их состояние равно начальному)."""
+        now_tick = int(now / self.resolution)
+        cursor = self._cursor
+        if cursor is None:
+            self._cursor = now_tick
+            return
+        if now_tick <= cursor:
+            return
+        wheel = self._wheel
+        if now_tick - cursor <= len(wheel):
+            ticks = [t for t in range(cursor + 1, now_tick + 1) if t in wheel]
+        else:
+            # Долгий простой: дешевле пройти по занятым слотам
+            ticks = [t for t in wheel if t <= now_tick]
+        tats = self._tat
+        for tick in ticks:
+            for key in wheel.pop(tick):
+                tat = tats.get(key)
+                # Ключ мог обновиться и переехать в более поздний слот
+                if tat is not None and tat <= now:
+                    del tats[key]
+                    self.evicted += 1
+        self._cursor = now_tick
+
+    def reset(self, key: Hashable) -> None:
+        self._tat.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self._tat),
+            "wheel_slots": len(self._wheel),
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "evicted": self.evicted,
+        }
+
+
+class TokenBucket:
+    """Ведро токенов для одного потребителя: ``acquire`` ждёт ровно столько, сколько нужно."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = max(1e-3, float(rate))
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        # Метрики
+        self.acquired = 0
+        self.waited = 0.0
+        self.paused = 0.0
+
+    def _refill(self, now: float) -> None:
+        if now > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def delay(self, now: Optional[float] = None) -> float:
+        """Сколько ждать следующего токена (0 — есть сейчас)."""
+        now = time.monotonic() if now is None else now
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._refill(now)
+        return 0.0 if self._tokens >= 1.0 else (1.0 - self._tokens) / self.rate
+
+    async def acquire(self) -> None:
+        """Берёт токен; при нехватке токен резервируется в долг и вызов спит до его срока.
+
+        Опоздание пробуждения не теряется: следующий токен уже «накоплен» за это время,
+        поэтому средний темп держится на ``rate``, а не проседает на задержку таймера.
+        """
+        while True:
+            now = time.monotonic()
+            if now >= self._paused_until:
+                break
+            self.waited += self._paused_until - now
+            await asyncio.sleep(self._paused_until - now)
+        self._refill(now)
+        self._tokens -= 1.0
+        self.acquired += 1
+        if self._tokens < 0:
+            wait = -self._tokens / self.rate
+            self.waited += wait
+            await asyncio.sleep(wait)
+        # Пауза могла начаться, пока мы ждали своей очереди
+        now = time.monotonic()
+        if now < self._paused_until:
+            self.waited += self._paused_until - now
+            await asyncio.sleep(self._paused_until - now)
+
+    def pause(self, seconds: float) -> None:
+        """Не выдавать токены ``seconds`` секунд; после паузы ведро начинает с пустого."""
+        now = time.monotonic()
+        until = now + max(0.0, float(seconds))
+        if until > self._paused_until:
+            self.paused += until - max(now, self._paused_until)
+            self._paused_until = until
+        self._tokens = min(self._tokens, 0.0)
+        self._updated = self._paused_until
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.rate,
+            "capacity": self.capacity,
+            "acquired": self.acquired,
+            "waited_seconds": round(self.waited, 3),
+            "paused_seconds": round(self.paused, 3),
+        }
+
+
+class StripedLocks:
+    """``stripes`` блокировок на все ключи; ключ всегда попадает в одну и ту же полосу."""
+
+    def __init__(self, stripes: int = 1024):
+        self._locks: List[asyncio.Lock] = [asyncio.Lock() for _ in range(max(1, int(stripes)))]
+
+    def get(self, key: Hashable) -> asyncio.Lock:
+        return self._locks[hash(key) % len(self._locks)]
+
+    def __len__(self) -> int:
+        return len(self._locks)
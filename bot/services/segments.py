@@ -0,0 +1,337 @@
+"""
+Сегменты пользователей для рассылок.
+
+Раньше каждый запуск рассылки выполнял SELECT по ``users`` и собирал все ``tg_id``
+сегмента в список, а «активные» определялись по ``balance > 0`` — это не подписка:
+её срок знает только бэкенд.
+
+``SegmentEngine`` держит принадлежность к сегментам в таблице ``user_segments``
+(``segment``, ``tg_id`` — первичный ключ, WITHOUT ROWID):
+
+* выборка — потоком: ``iter_ids`` читает сегмент порциями по ключу, ``count`` —
+  диапазон того же ключа; память не зависит от размера сегмента;
+* активные подписки — множество ``tg_id`` с бэкенда (``/active-users/ids``) хранится
+  в ``segment_active``; запрос идёт с ``If-None-Match``, и пока множество не
+  изменилось, бэкенд отвечает 304 без тела;
+* обновление — инкрементальное: триггеры на ``users`` отмечают изменённых
+  пользователей в ``segment_changes``, разность со старым множеством активных
+  добавляет туда же тех, чья подписка началась или закончилась; пересчитываются
+  только отмеченные — одной транзакцией, соединением ``users`` с ``segment_active``;
+* полный пересчёт — при первом запуске и при изменении определений сегментов.
+
+Пока множество активных ни разу не было получено, сегменты, зависящие от подписки,
+недоступны (пустые) — иначе «без подписки» оказались бы и платящие пользователи.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+API_BASE_URL = "http://fastapi:8080"
+AUTH_CODE = os.getenv("AUTH_CODE")
+
+# Сегмент -> (условие по users ``u`` и segment_active ``a``, зависит ли от подписки)
+SEGMENTS: Dict[str, Tuple[str, bool]] = {
+    "all": ("1", False),
+    "active": ("a.tg_id IS NOT NULL", True),
+    "trial_only": ("u.trial_3d_used = 1 AND COALESCE(u.paid_count, 0) = 0 AND a.tg_id IS NULL", True),
+    "expired": ("a.tg_id IS NULL AND (u.trial_3d_used = 1 OR u.paid_count > 0)", True),
+    "no_subscription": ("a.tg_id IS NULL", True),
+    "with_referrals": ("u.referral_count > 0", False),
+    "vip": ("u.paid_count >= 5", False),
+}
+
+# Меняется вместе с определениями — тогда таблица пересчитывается целиком
+SEGMENTS_VERSION = hashlib.blake2b(repr(sorted(SEGMENTS.items())).encode(), digest_size=8).hexdigest()
+
+# Загрузчик множества активных: (ids, etag); ids=None — не изменилось (304); None — ошибка
+ActiveIdsFetcher = Callable[[Optional[str]], Awaitable[Optional[Tuple[Optional[List[str]], Optional[str]]]]]
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS user_segments (
+        segment TEXT NOT NULL,
+        tg_id TEXT NOT NULL,
+        PRIMARY KEY (segment, tg_id)
+    ) WITHOUT ROWID
+    """,
+    "CREATE TABLE IF NOT EXISTS segment_active (tg_id TEXT PRIMARY KEY) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS segment_changes (tg_id TEXT PRIMARY KEY) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS segment_meta (key TEXT PRIMARY KEY, value TEXT)",
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_users_segments_insert AFTER INSERT ON users
+    WHEN NEW.tg_id IS NOT NULL
+    BEGIN
+        INSERT OR IGNORE INTO segment_changes (tg_id) VALUES (NEW.tg_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_users_segments_update
+    AFTER UPDATE OF tg_id, trial_3d_used, paid_count, referral_count ON users
+    BEGIN
+        INSERT OR IGNORE INTO segment_changes (tg_id) SELECT NEW.tg_id WHERE NEW.tg_id IS NOT NULL;
+        INSERT OR IGNORE INTO segment_changes (tg_id)
+            SELECT OLD.tg_id WHERE OLD.tg_id IS NOT NULL AND OLD.tg_id IS NOT NEW.tg_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_users_segments_delete AFTER DELETE ON users
+    WHEN OLD.tg_id IS NOT NULL
+    BEGIN
+        INSERT OR IGNORE INTO segment_changes (tg_id) VALUES (OLD.tg_id);
+    END
+    """,
+)
+
+
+async def fetch_active_ids(etag: Optional[str]) -> Optional[Tuple[Optional[List[str]], Optional[str]]]:
+    """tg_id с активной подпиской с бэкенда; при совпадении ``etag`` — (None, etag)."""
+    try:
+        from utils import get_session
+        session = await get_session()
+        headers = {"X-API-Key": AUTH_CODE}
+        if etag:
+            headers["If-None-Match"] = etag
+        async with session.get(f"{API_BASE_URL}/active-users/ids", headers=headers, timeout=10) as resp:
+            if resp.status == 304:
+                return None, etag
+            if resp.status != 200:
+                logger.warning(f"API error for active-users/ids: {resp.status}")
+                return None
+            data = await resp.json()
+            return [str(x) for x in data.get("ids", []) if x is not None], resp.headers.get("ETag")
+    except Exception as e:
+        logger.error(f"Error fetching active user ids: {e}")
+        return None
+
+
+class SegmentEngine:
+    def __init__(
+        self,
+        fetch_active_ids: ActiveIdsFetcher = fetch_active_ids,
+        db_path: str = "users.db",
+        refresh_interval: float = 60.0,
+        chunk: int = 1000,
+    ):
+        self._fetch_active_ids = fetch_active_ids
+        self.db_path = db_path
+        self.refresh_interval = max(0.0, float(refresh_interval))
+        self.chunk = max(1, int(chunk))
+        self._initialized = False
+        self._refreshed_at = 0.0
+        self._inflight: Optional[asyncio.Task] = None
+        self.active_known = False
+        # Метрики
+        self.refreshes = 0
+        self.full_rebuilds = 0
+        self.recomputed_users = 0
+        self.active_not_modified = 0
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.db_path)
+        await conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    async def init(self) -> None:
+        """Таблицы и триггеры; ``users`` к этому моменту уже должна существовать."""
+        if self._initialized:
+            return
+        conn = await self._connect()
+        try:
+            # Прежняя user_segments (user_id, segment, ...) создавалась, но никогда не заполнялась
+            async with conn.execute("PRAGMA table_info(user_segments)") as cursor:
+                columns = {row[1] for row in await cursor.fetchall()}
+            if columns and "tg_id" not in columns:
+                await conn.execute("DROP TABLE user_segments")
+            for statement in SCHEMA:
+                await conn.execute(statement)
+            await conn.commit()
+            self.active_known = await self._meta(conn, "active_etag") is not None
+        finally:
+            await conn.close()
+        self._initialized = True
+
+    @staticmethod
+    async def _meta(conn: aiosqlite.Connection, key: str) -> Optional[str]:
+        async with conn.execute("SELECT value FROM segment_meta WHERE key = ?", (key,)) as cursor:
+            row = await cursor.fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    async def _set_meta(conn: aiosqlite.Connection, key: str, value: Optional[str]) -> None:
+        await conn.execute(
+            "INSERT INTO segment_meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+    # --- Обновление ---
+
+    async def ensure_fresh(self) -> None:
+        """Обновляет сегменты, если прошлое обновление старше ``refresh_interval``."""
+        if time.monotonic() - self._refreshed_at >= self.refresh_interval or not self._refreshed_at:
+            await self.refresh()
+
+    async def refresh(self) -> None:
+        """Одно общее обновление на все одновременные вызовы."""
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self._refresh())
+        await asyncio.shield(self._inflight)
+
+    async def _refresh(self) -> None:
+        await self.init()
+        started = time.monotonic()
+        conn = await self._connect()
+        try:
+            etag = await self._meta(conn, "active_etag")
+            fetched = await self._fetch_active_ids(etag)
+
+            # Пишем одной транзакцией: отметки, сделанные триггерами за это время, не теряются
+            await conn.execute("BEGIN IMMEDIATE")
+            try:
+                full = await self._meta(conn, "version") != SEGMENTS_VERSION
+                if fetched is not None:
+                    ids, new_etag = fetched
+                    if ids is None:
+                        self.active_not_modified += 1
+                    else:
+                        await self._apply_active(conn, ids, mark_changes=not full)
+                        await self._set_meta(conn, "active_etag", new_etag or "")
+                        self.active_known = True
+                if full:
+                    recomputed = await self._rebuild(conn)
+                    await self._set_meta(conn, "version", SEGMENTS_VERSION)
+                    self.full_rebuilds += 1
+                else:
+                    recomputed = await self._recompute_changed(conn)
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+        finally:
+            await conn.close()
+        self.refreshes += 1
+        self.recomputed_users += recomputed
+        self._refreshed_at = time.monotonic()
+        if recomputed:
+            logger.info(f"Segments refreshed: {recomputed} users in {(time.monotonic() - started) * 1000:.1f}ms")
+
+    async def _apply_active(self, conn: aiosqlite.Connection, ids: Iterable[str], mark_changes: bool) -> None:
+        """Заменяет множество активных; у кого подписка началась или закончилась — в пересчёт."""
+        new = set(ids)
+        async with conn.execute("SELECT tg_id FROM segment_active") as cursor:
+            old = {row[0] for row in await cursor.fetchall()}
+        added = [(tg_id,) for tg_id in new - old]
+        removed = [(tg_id,) for tg_id in old - new]
+        if removed:
+            await conn.executemany("DELETE FROM segment_active WHERE tg_id = ?", removed)
+        if added:
+            await conn.executemany("INSERT INTO segment_active (tg_id) VALUES (?)", added)
+        if mark_changes:
+            await conn.executemany("INSERT OR IGNORE INTO segment_changes (tg_id) VALUES (?)", added + removed)
+
+    async def _rebuild(self, conn: aiosqlite.Connection) -> int:
+        await conn.execute("DELETE FROM user_segments")
+        await conn.execute("DELETE FROM segment_changes")
+        for segment, (condition, _) in SEGMENTS.items():
+            await conn.execute(
+                f"""
+                INSERT INTO user_segments (segment, tg_id)
+                SELECT ?, u.tg_id FROM users u
+                LEFT JOIN segment_active a ON a.tg_id = u.tg_id
+                WHERE u.tg_id IS NOT NULL AND u.tg_id != '' AND ({condition})
+                """,
+                (segment,),
+            )
+        async with conn.execute("SELECT COUNT(*) FROM users") as cursor:
+            return (await cursor.fetchone())[0]
+
+    async def _recompute_changed(self, conn: aiosqlite.Connection) -> int:
+        await conn.execute("CREATE TEMP TABLE IF NOT EXISTS segment_dirty (tg_id TEXT PRIMARY KEY) WITHOUT ROWID")
+        await conn.execute("DELETE FROM temp.segment_dirty")
+        await conn.execute("INSERT INTO temp.segment_dirty SELECT tg_id FROM segment_changes")
+        await conn.execute("DELETE FROM segment_changes")
+        async with conn.execute("SELECT COUNT(*) FROM temp.segment_dirty") as cursor:
+            changed = (await cursor.fetchone())[0]
+        if not changed:
+            return 0
+        # CROSS JOIN: обходим отмеченных и ищем их в users по индексу, а не наоборот
+        for segment, (condition, _) in SEGMENTS.items():
+            await conn.execute(
+                "DELETE FROM user_segments WHERE segment = ? AND tg_id IN (SELECT tg_id FROM temp.segment_dirty)",
+                (segment,),
+            )
+            await conn.execute(
+                f"""
+                INSERT INTO user_segments (segment, tg_id)
+                SELECT ?, u.tg_id FROM temp.segment_dirty d
+                CROSS JOIN users u ON u.tg_id = d.tg_id
+                LEFT JOIN segment_active a ON a.tg_id = u.tg_id
+                WHERE u.tg_id != '' AND ({condition})
+                """,
+                (segment,),
+            )
+        return changed
+
+    # --- Выборка ---
+
+    def available(self, segment: str) -> bool:
+        """Известен ли состав сегмента (для зависящих от подписки — нужен список активных)."""
+        if segment not in SEGMENTS:
+            return False
+        return self.active_known or not SEGMENTS[segment][1]
+
+    async def _ready(self, segment: str) -> bool:
+        await self.ensure_fresh()
+        if segment not in SEGMENTS:
+            logger.warning(f"Unknown segment: {segment}")
+            return False
+        if not self.available(segment):
+            logger.warning(f"Active subscriptions unknown, segment {segment} is unavailable")
+            return False
+        return True
+
+    async def count(self, segment: str) -> int:
+        if not await self._ready(segment):
+            return 0
+        conn = await self._connect()
+        try:
+            async with conn.execute("SELECT COUNT(*) FROM user_segments WHERE segment = ?", (segment,)) as cursor:
+                return (await cursor.fetchone())[0]
+        finally:
+            await conn.close()
+
+    async def iter_ids(self, segment: str) -> AsyncIterator[str]:
+        """tg_id сегмента по возрастанию, порциями по ``chunk`` строк."""
+        if not await self._ready(segment):
+            return
+        after = ""
+        conn = await self._connect()
+        try:
+            while True:
+                async with conn.execute(
+                    "SELECT tg_id FROM user_segments WHERE segment = ? AND tg_id > ? ORDER BY tg_id LIMIT ?",
+                    (segment, after, self.chunk),
+                ) as cursor:
+                    rows = await cursor.fetchall()
+                if not rows:
+                    return
+                for (tg_id,) in rows:
+                    yield tg_id
+                after = rows[-1][0]
+        finally:
+            await conn.close()
+
+    def stats(self) -> dict:
+        return {
+            "active_known": self.active_known,
+            "refreshes": self.refreshes,
+            "full_rebuilds": self.full_rebuilds,
+            "recomputed_users": self.recomputed_users,
+            "active_not_modified": self.active_not_modified,
+        }
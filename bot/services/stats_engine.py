@@ -0,0 +1,227 @@
+"""
+Статистика админки за один проход.
+
+Раньше каждая метрика дашборда была отдельным ``COUNT(*)`` со своим соединением
+(около 25 запросов на один показ), дни недели считались семью запросами, а
+«без подписки» — через ``not in list`` по всем пользователям.
+
+Теперь таблица ``users`` бота читается одним SELECT в numpy-колонки, список
+активных подписок бэкенда — одним запросом, и все метрики (счётчики, гистограмма
+по дням недели, удержание, конверсия, разность с активными) считаются векторно.
+Результат живёт ``ttl`` секунд; параллельные вызовы ждут одну и ту же загрузку.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import aiosqlite
+import numpy as np
+
+from database.pool import flush_current
+
+logger = logging.getLogger(__name__)
+
+# Загрузчик tg_id с активной подпиской (бэкенд); None — ошибка, список неизвестен
+ActiveIdsFetcher = Callable[[], Awaitable[Optional[List[str]]]]
+
+DAY_NAMES = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье']
+
+
+@dataclass
+class StatsSnapshot:
+    """Колонки пользователей бота, посчитанные метрики и маски сегментов."""
+
+    tg_ids: List[str]
+    metrics: Dict[str, Dict[str, Any]]
+    masks: Dict[str, np.ndarray] = field(default_factory=dict)
+    active_known: bool = True
+    built_at: float = 0.0
+
+    def ids(self, segment: str) -> List[str]:
+        """tg_id пользователей сегмента (порядок как в таблице)."""
+        mask = self.masks[segment]
+        tg_ids = self.tg_ids
+        return [tg_ids[i] for i in np.flatnonzero(mask).tolist()]
+
+
+def _int_column(values: tuple) -> np.ndarray:
+    return np.fromiter((v or 0 for v in values), dtype=np.int64, count=len(values))
+
+
+def _tg_numbers(tg_ids: List[str]) -> np.ndarray:
+    """tg_id как int64; нечисловые получают -1 и ни с кем не совпадают."""
+    out = np.full(len(tg_ids), -1, dtype=np.int64)
+    for i, value in enumerate(tg_ids):
+        try:
+            out[i] = int(value)
+        except (TypeError, ValueError):
+            continue
+    return out
+
+
+def compute_snapshot(
+    rows: List[tuple],
+    payments: Optional[tuple],
+    active_ids: Optional[List[str]],
+    now: int,
+) -> StatsSnapshot:
+    """Считает все метрики дашборда по строкам ``users`` одним векторным проходом.
+
+    ``rows``: (tg_id, trial_3d_used, balance, paid_count, referral_count, last_payment_at).
+    """
+    if rows:
+        tg_col, trial_col, balance_col, paid_col, ref_col, last_col = zip(*rows)
+    else:
+        tg_col = trial_col = balance_col = paid_col = ref_col = last_col = ()
+    tg_ids = ["" if v is None else str(v) for v in tg_col]
+    trial = _int_column(trial_col) == 1
+    balance = _int_column(balance_col)
+    paid_count = _int_column(paid_col)
+    referral_count = _int_column(ref_col)
+    last_payment_at = _int_column(last_col)
+    has_id = np.fromiter((bool(v) for v in tg_ids), dtype=bool, count=len(tg_ids))
+
+    active_list = active_ids or []
+    active_numbers = _tg_numbers(active_list)
+    active = np.isin(_tg_numbers(tg_ids), active_numbers[active_numbers >= 0])
+
+    paid = paid_count > 0
+    trial_only = trial & ~paid
+    with_referrals = referral_count > 0
+    no_balance = balance <= 0
+
+    total_users = len(tg_ids)
+    trial_users = int(trial.sum())
+    converted = int((trial & paid).sum())
+
+    top_referrer = None
+    if with_referrals.any():
+        idx = int(np.argmax(referral_count))
+        top_referrer = (tg_ids[idx], int(referral_count[idx]))
+
+    # Дни недели последней оплаты: 1970-01-01 — четверг, поэтому сдвиг на 4 (0 = понедельник)
+    paid_days = last_payment_at[last_payment_at > 0] // 86400
+    weekdays = np.bincount((paid_days - 4) % 7, minlength=7)
+    best_day = int(np.argmax(weekdays))
+
+    if payments:
+        total_rub, total_stars, count_rub, count_stars = (int(v or 0) for v in payments)
+    else:
+        total_rub = total_stars = count_rub = count_stars = 0
+
+    masks = {
+        "all": has_id,
+        "no_subscription": has_id & ~active,
+        "expired": has_id & no_balance & (trial | paid),
+        "trial_only": has_id & trial_only & ~active,
+        "no_balance": has_id & no_balance,
+    }
+
+    metrics: Dict[str, Dict[str, Any]] = {
+        "user_stats": {
+            "total_users": total_users,
+            "trial_used": trial_users,
+            "with_balance": int((balance > 0).sum()),
+            "total_referrals": int(referral_count.sum()),
+            "paid_users": int(paid.sum()),
+            "trial_only_users": int(trial_only.sum()),
+            "users_with_referrals": int(with_referrals.sum()),
+            "top_referrer": top_referrer,
+            # Даты регистрации в старых строках нет, поэтому «новые» — это активировавшие пробную
+            "new_users_week": trial_users,
+            "new_users_month": trial_users,
+        },
+        "payment_stats": {
+            "total_rub": total_rub,
+            "total_stars": total_stars,
+            "count_rub": count_rub,
+            "count_stars": count_stars,
+            "avg_rub": total_rub / count_rub if count_rub > 0 else 0,
+            "avg_stars": total_stars / count_stars if count_stars > 0 else 0,
+        },
+        "subscription_stats": {
+            "active_subscriptions": len(active_list),
+            "no_subscriptions": int(masks["no_subscription"].sum()),
+            "expired_subscriptions": int(masks["expired"].sum()),
+            "trial_only_users": int(masks["trial_only"].sum()),
+        },
+        "activity_stats": {
+            "active_24h": int((last_payment_at > now - 86400).sum()),
+            "active_7d": int((last_payment_at > now - 7 * 86400).sum()),
+            "active_30d": int((last_payment_at > now - 30 * 86400).sum()),
+            "converted_users": converted,
+            "conversion_rate": (converted / trial_users * 100) if trial_users > 0 else 0,
+        },
+        "daily_stats": {
+            "daily_stats": {f"day_{day}": int(count) for day, count in enumerate(weekdays.tolist())},
+            "most_active_day": DAY_NAMES[best_day] if weekdays[best_day] else "Неизвестно",
+            "most_active_count": int(weekdays[best_day]),
+        },
+        "retention_stats": {
+            "repeat_payers": int((paid_count > 1).sum()),
+            "loyal_payers": int((paid_count >= 3).sum()),
+            "vip_payers": int((paid_count >= 5).sum()),
+            "avg_payments_per_user": float(paid_count[paid].mean()) if paid.any() else 0,
+        },
+    }
+    return StatsSnapshot(
+        tg_ids=tg_ids,
+        metrics=metrics,
+        masks=masks,
+        active_known=active_ids is not None,
+        built_at=time.time(),
+    )
+
+
+class StatsEngine:
+    def __init__(self, fetch_active_ids: ActiveIdsFetcher, db_path: str = "users.db", ttl: float = 30.0):
+        self._fetch_active_ids = fetch_active_ids
+        self.db_path = db_path
+        self.ttl = max(0.0, float(ttl))
+        self._snapshot: Optional[StatsSnapshot] = None
+        self._loaded_at = 0.0
+        self._inflight: Optional[asyncio.Task] = None
+        # Метрики
+        self.loads = 0
+        self.hits = 0
+
+    async def _load_rows(self) -> tuple[List[tuple], Optional[tuple]]:
+        async with aiosqlite.connect(self.db_path) as conn:
+            cursor = await conn.execute(
+                "SELECT tg_id, trial_3d_used, balance, paid_count, referral_count, last_payment_at FROM users"
+            )
+            rows = await cursor.fetchall()
+            cursor = await conn.execute(
+                "SELECT total_rub, total_stars, count_rub, count_stars FROM payments_agg WHERE id = 1"
+            )
+            payments = await cursor.fetchone()
+        return rows, payments
+
+    async def _build(self) -> StatsSnapshot:
+        started = time.monotonic()
+        (rows, payments), active_ids = await asyncio.gather(self._load_rows(), self._fetch_active_ids())
+        snapshot = compute_snapshot(rows, payments, active_ids, int(time.time()))
+        self.loads += 1
+        # Без списка активных подписок снимок не кэшируем: следующий вызов попробует снова
+        if snapshot.active_known:
+            self._snapshot = snapshot
+            self._loaded_at = time.monotonic()
+        logger.info(f"Stats snapshot built: users={len(rows)} in {(time.monotonic() - started) * 1000:.1f}ms")
+        return snapshot
+
+    async def get(self) -> StatsSnapshot:
+        """Актуальный снимок: из кэша, если он моложе ``ttl``, иначе одна общая загрузка."""
+        if self._snapshot is not None and time.monotonic() - self._loaded_at < self.ttl:
+            self.hits += 1
+            return self._snapshot
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self._build())
+        # Загрузка (с запросом к бэкенду) идёт в отдельной задаче — соединение апдейта
+        # на время ожидания возвращаем в пул
+        await flush_current()
+        return await asyncio.shield(self._inflight)
+
+    def invalidate(self) -> None:
+        self._snapshot = None
@@ -0,0 +1,124 @@
+"""
+Очередь обработки апдейтов для режима webhook.
+
+Webhook-обработчик только кладёт апдейт в очередь и сразу отвечает Telegram, а
+обрабатывают апдейты ``workers`` фоновых задач:
+
+* порядок — апдейты одного чата всегда попадают в одну и ту же очередь (по хэшу
+  чата) и обрабатываются строго по очереди, поэтому два нажатия одного пользователя
+  не обгоняют друг друга (состояние FSM, инвойсы); разные чаты идут параллельно;
+* ограниченная память — у каждой очереди предел ``queue_size / workers``; когда она
+  заполнена, ``submit`` ждёт (не дольше ``submit_timeout``) и при неудаче возвращает
+  ``False`` — webhook отвечает 503, и Telegram повторит доставку позже;
+* остановка — ``stop`` перестаёт принимать апдейты и дожидается обработки уже принятых.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+UpdateHandler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+def chat_key(update: Dict[str, Any]) -> int:
+    """Чат (или пользователь), к которому относится сырой апдейт Bot API."""
+    for payload in update.values():
+        if not isinstance(payload, dict):
+            continue
+        chat = payload.get("chat")
+        if chat is None:
+            # callback_query: чат — у сообщения с кнопкой
+            message = payload.get("message")
+            chat = message.get("chat") if isinstance(message, dict) else None
+        if chat is not None:
+            return int(chat.get("id", 0))
+        user = payload.get("from") or payload.get("user")
+        if user is not None:
+            return int(user.get("id", 0))
+    return int(update.get("update_id", 0))
+
+
+class UpdatePipeline:
+    def __init__(
+        self,
+        handler: UpdateHandler,
+        workers: int = 32,
+        queue_size: int = 1024,
+        submit_timeout: float = 5.0,
+    ):
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.queue_size = max(self.workers, int(queue_size))
+        self.submit_timeout = max(0.0, float(submit_timeout))
+        per_queue = self.queue_size // self.workers
+        self._queues: List[asyncio.Queue] = [asyncio.Queue(maxsize=per_queue) for _ in range(self.workers)]
+        self._tasks: List[asyncio.Task] = []
+        self._accepting = False
+        # Метрики
+        self.accepted = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._accepting = True
+        self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+
+    async def submit(self, update: Dict[str, Any]) -> bool:
+        """Ставит апдейт в очередь его чата. ``False`` — очередь переполнена или остановлена."""
+        if not self._accepting:
+            self.rejected += 1
+            return False
+        queue = self._queues[hash(chat_key(update)) % self.workers]
+        try:
+            queue.put_nowait(update)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(queue.put(update), self.submit_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                return False
+        self.accepted += 1
+        return True
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            update = await queue.get()
+            try:
+                await self.handler(update)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                logger.exception("Update %s failed", update.get("update_id"))
+            finally:
+                queue.task_done()
+
+    async def stop(self, timeout: Optional[float] = 30.0) -> None:
+        """Перестаёт принимать апдейты, дожидается обработки принятых и останавливает задачи."""
+        self._accepting = False
+        if self._tasks:
+            try:
+                await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Update pipeline stopped with %s updates queued", self.queued())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def queued(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queued": self.queued(),
+            "queue_size": self.queue_size,
+            "accepted": self.accepted,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
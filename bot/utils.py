@@ -2,10 +2,12 @@ import os
 import aiohttp
 import logging
 import asyncio
-import time
 from contextlib import asynccontextmanager
 from typing import Iterable
 
+from services.availability_cache import AvailabilityCache
+from services.rate_limit import GcraLimiter, StripedLocks
+
 _session: aiohttp.ClientSession | None = None
 
 async def get_session() -> aiohttp.ClientSession:
@@ -13,7 +15,9 @@ async def get_session() -> aiohttp.ClientSession:
     if _session is None or _session.closed:
         timeout = aiohttp.ClientTimeout(total=15)
         connector = aiohttp.TCPConnector(limit=100, ssl=False)
-        _session = aiohttp.ClientSession(timeout=timeout, connector=connector)
+        # Перед каждым запросом фиксируем транзакцию текущего апдейта (см. database.pool)
+        from middlewares.db_session import flush_db_trace_config
+        _session = aiohttp.ClientSession(timeout=timeout, connector=connector, trace_configs=[flush_db_trace_config()])
     return _session
 
 AUTH_CODE = os.getenv("AUTH_CODE")
@@ -141,28 +145,65 @@ def _get_region_variants_map() -> dict[str, list[str]]:
     return region_to_variants
 
 
+async def fetch_placement(order_bases: list[str] | None = None) -> dict | None:
+    """Один запрос к бэкенду за выбором варианта сервера для каждого региона.
+
+    Бэкенд (POST /placement) учитывает задержку и ошибки панелей, свободный пул и число
+    активных клиентов. Возвращает ответ вида ``{"servers": {...}, "available": {...},
+    "all_available": bool}``.
+
+    - «свободных нет» — только ответ 200, в котором это сказано;
+    - не-200, сетевые и прочие ошибки: None — кэш оставляет прежний снимок (холодный кэш
+      не блокирует оплату), окончательная проверка произойдёт в /giveconfig
+    """
+    bases = order_bases or _parse_server_order()
+    region_map = _get_region_variants_map()
+    regions = {base: region_map.get(base, [base]) for base in bases}
+    url = "http://fastapi:8080/placement"
+    headers = {"X-API-Key": AUTH_CODE} if AUTH_CODE else {}
+    try:
+        session = await get_session()
+        async with session.post(url, json={"regions": regions}, headers=headers) as response:
+            if response.status == 200:
+                data = await response.json()
+                if isinstance(data, dict):
+                    return data
+                logger.warning("/placement returned unexpected body: %r", data)
+                return None
+            logger.warning("/placement returned %s", response.status)
+            return None
+    except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+        logger.error("Network error while choosing placement: %s", exc)
+        return None
+    except Exception as exc:
+        logger.error("Unexpected error while choosing placement: %s", exc)
+        return None
+
+
+# Кэш снимка /placement: обработчики не ходят в бэкенд перед каждым счётом
+availability_cache = AvailabilityCache(
+    fetch_placement,
+    refresh_interval=float(os.getenv("AVAILABILITY_REFRESH_SECONDS", "5")),
+    max_stale=float(os.getenv("AVAILABILITY_MAX_STALE_SECONDS", "60")),
+    hedge_delay=float(os.getenv("AVAILABILITY_HEDGE_DELAY_SECONDS", "0.3")),
+)
+
+
 async def pick_servers_one_per_region(order_bases: list[str] | None = None) -> list[str]:
     """Выбирает по одному серверу из каждой региональной группы (ge*).
 
-    Стратегия: для каждой базовой страны берём первый вариант, на котором есть свободные конфиги
-    (по данным /check-available-configs?server=...). Если ни один вариант не доступен,
-    возвращаем первый из списка (best-effort), чтобы не блокировать логику — окончательная
-    проверка произойдёт на /giveconfig.
+    Вариант выбирается по снимку бэкенда (см. ``fetch_placement``) из кэша доступности —
+    медленные и перегруженные панели получают меньше пользователей. Если выбрать не удалось,
+    возвращаем первый вариант из списка (best-effort), чтобы не блокировать логику —
+    окончательная проверка произойдёт на /giveconfig.
     """
     bases = order_bases or _parse_server_order()
     region_map = _get_region_variants_map()
+    snapshot = await availability_cache.get()
     picked: list[str] = []
     for base in bases:
         variants = region_map.get(base, [base])
-        chosen: str | None = None
-        for code in variants:
-            try:
-                if await check_available_configs(code):
-                    chosen = code
-                    break
-            except Exception:
-                # переходим к следующему варианту
-                continue
+        chosen = availability_cache.pick_variant(snapshot, base, variants) if snapshot else None
         picked.append(chosen or variants[0])
     return picked
 
@@ -172,34 +213,23 @@ async def check_all_servers_available() -> bool:
     должен быть доступен хотя бы один вариант (ge/ge2...).
 
     Если у региона нет ни одного доступного варианта — возвращает False.
+    Читает кэш доступности; в бэкенд идёт только при холодном кэше.
     """
-    region_map = _get_region_variants_map()
-    logger.info(f"Checking availability by regions: {region_map}")
-    for base, variants in region_map.items():
-        region_ok = False
-        for code in variants:
-            try:
-                available = await check_available_configs(code)
-                logger.debug(f"Server {code} availability: {available}")
-                if available:
-                    region_ok = True
-                    break
-            except Exception as e:
-                logger.warning(f"Error checking server {code}: {e}", exc_info=True)
-                continue
-        if not region_ok:
-            logger.warning(f"No available servers found for region {base} among {variants}")
+    snapshot = await availability_cache.get()
+    if snapshot is None:
+        # Сеть недоступна — не блокируем оплату
+        return True
+    for base, ok in (snapshot.get("available") or {}).items():
+        if not ok:
+            logger.warning(f"No available servers found for region {base}")
             return False
-    logger.info("All regions have at least one available server")
-    return True
+    return availability_cache.all_available(snapshot)
 
 # --- Simple per-user rate limiting and action locks ---
 
-_last_action_at: dict[tuple[int | str, str], float] = {}
-_action_locks: dict[tuple[int | str, str], asyncio.Lock] = {}
-
-def _now() -> float:
-    return time.monotonic()
+# Cooldowns are GCRA with burst=1; idle keys are evicted, memory stays bounded
+_action_cooldowns = GcraLimiter(period=1.0, burst=1)
+_action_locks = StripedLocks(stripes=4096)
 
 def should_throttle(user_id: int | str, action_key: str, cooldown_seconds: float) -> tuple[bool, float]:
     """Returns (throttled, retry_after_seconds).
@@ -207,23 +237,17 @@ def should_throttle(user_id: int | str, action_key: str, cooldown_seconds: float
     - If called more than once within cooldown_seconds for same (user_id, action_key), it throttles.
     - Records the attempt timestamp when allowed.
     """
-    key = (user_id, action_key)
-    last_at = _last_action_at.get(key, 0.0)
-    now_ts = _now()
-    elapsed = now_ts - last_at
-    if elapsed < cooldown_seconds:
-        return True, cooldown_seconds - elapsed
-    _last_action_at[key] = now_ts
-    return False, 0.0
+    allowed, retry_after = _action_cooldowns.hit((user_id, action_key), period=cooldown_seconds, burst=1)
+    return not allowed, retry_after
 
 @asynccontextmanager
 async def acquire_action_lock(user_id: int | str, action_key: str):
-    """Serialize concurrent executions for the same (user, action)."""
-    key = (user_id, action_key)
-    lock = _action_locks.get(key)
-    if lock is None:
-        lock = asyncio.Lock()
-        _action_locks[key] = lock
+    """Serialize concurrent executions for the same (user, action).
+
+    Locks are striped: unrelated keys may occasionally share a stripe, so never
+    hold one action lock while acquiring another.
+    """
+    lock = _action_locks.get((user_id, action_key))
     await lock.acquire()
     try:
         yield
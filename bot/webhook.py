@@ -0,0 +1,119 @@
+"""
+Режим webhook: Telegram сам присылает апдейты POST-запросами на aiohttp-сервер бота.
+
+Включается ``BOT_MODE=webhook``. Обработчик проверяет секрет, кладёт апдейт в
+``UpdatePipeline`` (порядок внутри чата, ограниченная очередь) и сразу отвечает 200;
+при переполненной очереди — 503, и Telegram повторит доставку. Webhook при остановке
+не удаляется: апдейты, пришедшие во время перезапуска, Telegram доставит после него.
+
+Настройки:
+
+* ``BOT_WEBHOOK_URL`` — публичный адрес (``https://example.com``); если задан, при
+  старте вызывается ``setWebhook``, иначе webhook считается уже настроенным;
+* ``BOT_WEBHOOK_PATH`` (``/telegram/webhook``), ``BOT_WEBHOOK_SECRET``;
+* ``BOT_WEBHOOK_HOST`` / ``BOT_WEBHOOK_PORT`` (``0.0.0.0:8081``);
+* ``BOT_UPDATE_WORKERS`` (32), ``BOT_UPDATE_QUEUE`` (1024), ``BOT_WEBHOOK_MAX_CONNECTIONS`` (40).
+
+Для тестов вместо Telegram подходит любой клиент, отправляющий апдейты POST-запросом,
+а исходящие запросы бота можно направить на заглушку через ``TELEGRAM_API_BASE``.
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+from services.update_pipeline import UpdatePipeline
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def build_app(
+    dp: Dispatcher,
+    bot: Bot,
+    pipeline: UpdatePipeline,
+    path: str = "/telegram/webhook",
+    secret: Optional[str] = None,
+    webhook_url: Optional[str] = None,
+    max_connections: int = 40,
+    **workflow_data: Any,
+) -> web.Application:
+    """aiohttp-приложение: маршрут webhook, запуск и остановка диспетчера и очереди."""
+    app = web.Application()
+    workflow = {"app": app, "dispatcher": dp, "bot": bot, **dp.workflow_data, **workflow_data}
+
+    async def handle(request: web.Request) -> web.Response:
+        if secret and request.headers.get(SECRET_HEADER) != secret:
+            return web.Response(status=401)
+        try:
+            update: Dict[str, Any] = await request.json(loads=json.loads)
+        except ValueError:
+            return web.Response(status=400)
+        if not await pipeline.submit(update):
+            return web.Response(status=503)
+        return web.Response()
+
+    async def on_startup(_: web.Application) -> None:
+        pipeline.start()
+        await dp.emit_startup(**workflow)
+        if webhook_url:
+            await bot.set_webhook(
+                url=webhook_url.rstrip("/") + path,
+                secret_token=secret,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=max_connections,
+            )
+            logger.info("Webhook set to %s%s", webhook_url.rstrip("/"), path)
+
+    async def on_shutdown(_: web.Application) -> None:
+        # Сначала дообрабатываем принятые апдейты, потом закрываем хранилище FSM и сессию
+        await pipeline.stop()
+        await dp.emit_shutdown(**workflow)
+        await bot.session.close()
+
+    app.router.add_post(path, handle)
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    return app
+
+
+def pipeline_for(dp: Dispatcher, bot: Bot, workers: int = 32, queue_size: int = 1024) -> UpdatePipeline:
+    async def feed(update: Dict[str, Any]) -> None:
+        await dp.feed_raw_update(bot, update)
+
+    return UpdatePipeline(feed, workers=workers, queue_size=queue_size)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, **workflow_data: Any) -> None:
+    """Поднимает webhook-сервер по настройкам окружения и работает до отмены."""
+    pipeline = pipeline_for(
+        dp,
+        bot,
+        workers=int(os.getenv("BOT_UPDATE_WORKERS", "32")),
+        queue_size=int(os.getenv("BOT_UPDATE_QUEUE", "1024")),
+    )
+    app = build_app(
+        dp,
+        bot,
+        pipeline,
+        path=os.getenv("BOT_WEBHOOK_PATH", "/telegram/webhook"),
+        secret=os.getenv("BOT_WEBHOOK_SECRET") or None,
+        webhook_url=os.getenv("BOT_WEBHOOK_URL") or None,
+        max_connections=int(os.getenv("BOT_WEBHOOK_MAX_CONNECTIONS", "40")),
+        **workflow_data,
+    )
+    runner = web.AppRunner(app)
+    await runner.setup()
+    host = os.getenv("BOT_WEBHOOK_HOST", "0.0.0.0")
+    port = int(os.getenv("BOT_WEBHOOK_PORT", "8081"))
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Webhook server listening on %s:%s", host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
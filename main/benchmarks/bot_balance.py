@@ -0,0 +1,260 @@
+"""Начисления и списания баланса бота: чтение-изменение-запись против одного оператора.
+
+Сравнивает старую схему (SELECT, затем UPDATE / INSERT, отдельное соединение на вызов) с
+текущими функциями ``bot/database/db.py`` (UPSERT / ``UPDATE ... RETURNING``):
+
+* латентность последовательных вызовов (p50/p95);
+* корректность под конкурентной нагрузкой: ``--workers`` задач одновременно начисляют
+  по дню одним и тем же пользователям, затем столько же задач списывают больше, чем есть
+  на балансе. Старая схема теряет начисления и уходит в минус / списывает дважды;
+* ``add_balance_days_bulk`` против цикла ``add_balance_days`` для выплаты ``--bulk`` пользователям.
+
+Из каталога ``main``::
+
+    python -m benchmarks.bot_balance --size 100k
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+import aiosqlite
+
+from benchmarks.seed import load_bot_db, parse_size, seed_bot_database
+
+
+# Старые реализации — как они были до перехода на один оператор
+async def legacy_add_balance_days(tg_id: str, days: int) -> None:
+    async with aiosqlite.connect("users.db") as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute("SELECT balance FROM users WHERE tg_id = ?", (str(tg_id),))
+            row = await cursor.fetchone()
+            if row is None:
+                await cursor.execute("INSERT INTO users (tg_id, balance, created_at) VALUES (?, ?, ?)", (str(tg_id), int(days), int(time.time())))
+            else:
+                current_balance = int(row[0]) if row[0] is not None else 0
+                await cursor.execute("UPDATE users SET balance = ? WHERE tg_id = ?", (current_balance + int(days), str(tg_id)))
+            await conn.commit()
+
+
+async def legacy_deduct_balance_days(tg_id: str, days: int) -> bool:
+    async with aiosqlite.connect("users.db") as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute("SELECT balance FROM users WHERE tg_id = ?", (str(tg_id),))
+            row = await cursor.fetchone()
+            current_balance = int(row[0]) if row and row[0] is not None else 0
+            if current_balance < days:
+                return False
+            await cursor.execute("UPDATE users SET balance = ? WHERE tg_id = ?", (current_balance - int(days), str(tg_id)))
+            await conn.commit()
+            return True
+
+
+async def legacy_mark_payment(tg_id: str, days: int) -> None:
+    now_ts = int(time.time())
+    async with aiosqlite.connect("users.db") as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute("SELECT paid_count FROM users WHERE tg_id = ?", (str(tg_id),))
+            row = await cursor.fetchone()
+            current = int(row[0]) if row and row[0] is not None else 0
+            await cursor.execute(
+                "UPDATE users SET paid_count = ?, last_payment_at = ? WHERE tg_id = ?",
+                (current + 1, now_ts, str(tg_id))
+            )
+            if cursor.rowcount == 0:
+                await cursor.execute(
+                    "INSERT INTO users (tg_id, paid_count, last_payment_at, created_at) VALUES (?, ?, ?, ?)",
+                    (str(tg_id), 1, now_ts, now_ts)
+                )
+            await conn.commit()
+
+
+def _stats(samples: List[float]) -> Dict[str, float]:
+    samples = sorted(samples)
+    return {
+        "p50_ms": round(samples[len(samples) // 2], 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+    }
+
+
+async def _latency(fn: Callable[[int], Awaitable[Any]], iterations: int) -> Dict[str, float]:
+    samples: List[float] = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        await fn(i)
+        samples.append((time.perf_counter() - started) * 1000)
+    return _stats(samples)
+
+
+def _balances(db_path: str, tg_ids: List[str]) -> Dict[str, int]:
+    conn = sqlite3.connect(db_path)
+    try:
+        marks = ",".join("?" * len(tg_ids))
+        return {
+            tg: int(balance or 0)
+            for tg, balance in conn.execute(f"SELECT tg_id, balance FROM users WHERE tg_id IN ({marks})", tg_ids)
+        }
+    finally:
+        conn.close()
+
+
+def _set_balances(db_path: str, tg_ids: List[str], value: int) -> None:
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executemany("UPDATE users SET balance = ? WHERE tg_id = ?", [(value, tg) for tg in tg_ids])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+async def _race(
+    db_path: str,
+    targets: List[str],
+    workers: int,
+    rounds: int,
+    credit: Callable[[str, int], Awaitable[Any]],
+    deduct: Callable[[str, int], Awaitable[bool]],
+) -> Dict[str, Any]:
+    """Каждый воркер ``rounds`` раз начисляет +1 каждому из ``targets``, затем все списывают."""
+    _set_balances(db_path, targets, 0)
+    errors: List[str] = []
+
+    async def crediting() -> None:
+        for _ in range(rounds):
+            for tg in targets:
+                try:
+                    await credit(tg, 1)
+                except Exception as exc:
+                    errors.append(type(exc).__name__)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(crediting() for _ in range(workers)))
+    credit_seconds = time.perf_counter() - started
+    expected = workers * rounds
+    after_credit = _balances(db_path, targets)
+    lost = sum(expected - value for value in after_credit.values())
+
+    # Все воркеры пытаются списать по 1 дню больше раз, чем дней на балансе
+    successes = 0
+
+    async def deducting() -> None:
+        nonlocal successes
+        for _ in range(rounds + 2):
+            for tg in targets:
+                try:
+                    if await deduct(tg, 1):
+                        successes += 1
+                except Exception as exc:
+                    errors.append(type(exc).__name__)
+
+    await asyncio.gather(*(deducting() for _ in range(workers)))
+    after_deduct = _balances(db_path, targets)
+    return {
+        "credits": expected * len(targets),
+        "lost_credits": lost,
+        "credit_seconds": round(credit_seconds, 3),
+        "deduct_successes": successes,
+        # Списано больше, чем было начислено фактически (двойное списание)
+        "overspent": successes - sum(after_credit.values()) + sum(after_deduct.values()),
+        "final_balance_sum": sum(after_deduct.values()),
+        "negative_balances": sum(1 for value in after_deduct.values() if value < 0),
+        "errors": len(errors),
+    }
+
+
+async def _run(db_path: str, manifest: Dict[str, Any], bot_db, args: argparse.Namespace) -> Dict[str, Any]:
+    tg_ids = manifest["tg_ids"]
+    new_tg = manifest["new_tg_base"]
+
+    def pick(i: int) -> str:
+        return tg_ids[i % len(tg_ids)]
+
+    try:
+        latency = {
+            "add_balance_days": {
+                "legacy": await _latency(lambda i: legacy_add_balance_days(pick(i), 1), args.iterations),
+                "atomic": await _latency(lambda i: bot_db.add_balance_days(pick(i), 1), args.iterations),
+            },
+            "deduct_balance_days": {
+                "legacy": await _latency(lambda i: legacy_deduct_balance_days(pick(i), 1), args.iterations),
+                "atomic": await _latency(lambda i: bot_db.deduct_balance_days(pick(i), 1), args.iterations),
+            },
+            "mark_payment": {
+                "legacy": await _latency(lambda i: legacy_mark_payment(pick(i), 30), args.iterations),
+                "atomic": await _latency(lambda i: bot_db.mark_payment(pick(i), 30), args.iterations),
+            },
+        }
+
+        targets = tg_ids[: args.targets]
+        race = {
+            "legacy": await _race(db_path, targets, args.workers, args.rounds, legacy_add_balance_days, legacy_deduct_balance_days),
+            "atomic": await _race(db_path, targets, args.workers, args.rounds, bot_db.add_balance_days, bot_db.deduct_balance_days),
+        }
+
+        payout = {str(new_tg + i) if i % 2 else pick(i): 2 for i in range(args.bulk)}
+        started = time.perf_counter()
+        for tg, days in payout.items():
+            await bot_db.add_balance_days(tg, days)
+        loop_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        credited = await bot_db.add_balance_days_bulk(payout)
+        bulk_ms = (time.perf_counter() - started) * 1000
+        bulk = {
+            "users": len(payout),
+            "loop_ms": round(loop_ms, 2),
+            "bulk_ms": round(bulk_ms, 2),
+            "credited": len(credited),
+        }
+    finally:
+        await bot_db.pool.close()
+    return {"latency": latency, "race": race, "bulk": bulk}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Баланс бота: read-modify-write против UPSERT/RETURNING")
+    parser.add_argument("--size", default="100k", help="10k | 100k | 1m | число пользователей")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=16, help="конкурентных задач в гонке")
+    parser.add_argument("--rounds", type=int, default=20, help="начислений на пользователя от каждой задачи")
+    parser.add_argument("--targets", type=int, default=5, help="пользователей в гонке")
+    parser.add_argument("--bulk", type=int, default=1000, help="получателей массовой выплаты")
+    parser.add_argument("--workdir", default=None)
+    parser.add_argument("--out", default=None)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="zzz-botbalance-")
+    os.makedirs(workdir, exist_ok=True)
+    db_path = os.path.join(workdir, "users.db")
+    manifest = seed_bot_database(db_path, parse_size(args.size), seed=args.seed)
+    bot_db = load_bot_db()
+
+    prev = os.getcwd()
+    os.chdir(workdir)
+    try:
+        report = asyncio.run(_run(db_path, manifest, bot_db, args))
+    finally:
+        os.chdir(prev)
+    report.update({"timestamp": int(time.time()), "size": manifest["size"], "workers": args.workers, "rounds": args.rounds})
+
+    for name, sides in report["latency"].items():
+        print(f"{name:>20}: legacy p50 {sides['legacy']['p50_ms']}ms → atomic p50 {sides['atomic']['p50_ms']}ms")
+    for side, result in report["race"].items():
+        print(f"{'race ' + side:>20}: {result}")
+    print(f"{'bulk payout':>20}: {report['bulk']}")
+
+    out = args.out or os.path.join(workdir, "bot_balance.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, ensure_ascii=False, indent=2)
+    print(f"results → {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""Апдейты в секунду: long polling против webhook с очередью ``UpdatePipeline``.
+
+Telegram заменяет локальная заглушка на aiohttp в отдельном процессе:
+
+* polling — заглушка отвечает на ``getMe`` / ``getUpdates`` пачками по 100 синтетических
+  апдейтов, бот работает через ``dp.start_polling`` (как в ``bot.py``);
+* webhook — ``--connections`` одновременных соединений (как ``max_connections`` у
+  Telegram) отправляют те же апдейты POST-запросами на ``webhook.build_app``.
+
+Обработчик имитирует работу (``--work-ms``) и записывает номер сообщения по чатам —
+по нему проверяется, что апдейты одного чата обработаны в порядке отправки.
+
+Из каталога ``main``::
+
+    python -m benchmarks.bot_updates --updates 20000 --chats 500
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import time
+from typing import Any, Dict, List
+
+import aiohttp
+from aiogram import Bot, Dispatcher, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message
+from aiohttp import web
+
+from benchmarks.seed import load_bot_module
+
+TOKEN = "42:benchmark"
+BOT_ID = 42
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def synthetic_updates(count: int, chats: int, seed: int = 1) -> List[Dict[str, Any]]:
+    """Сообщения от ``chats`` пользователей вперемешку; текст — номер сообщения в чате."""
+    rnd = random.Random(seed)
+    sent: Dict[int, int] = {}
+    updates = []
+    now = int(time.time())
+    for update_id in range(1, count + 1):
+        chat_id = 1_000_000 + rnd.randrange(chats)
+        seq = sent.get(chat_id, 0)
+        sent[chat_id] = seq + 1
+        user = {"id": chat_id, "is_bot": False, "first_name": "u"}
+        updates.append({
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": now,
+                "chat": {"id": chat_id, "type": "private", "first_name": "u"},
+                "from": user,
+                "text": str(seq),
+            },
+        })
+    return updates
+
+
+class Recorder:
+    """Обработчик-заглушка: ждёт ``work`` секунд и запоминает порядок по чатам."""
+
+    def __init__(self, total: int, work: float) -> None:
+        self.total = total
+        self.work = work
+        self.handled = 0
+        self.out_of_order = 0
+        self._last: Dict[int, int] = {}
+        self.done = asyncio.Event()
+
+    def router(self) -> Router:
+        router = Router()
+
+        @router.message()
+        async def on_message(message: Message) -> None:
+            seq = int(message.text)
+            if self.work:
+                await asyncio.sleep(self.work * random.random() * 2)
+            if seq < self._last.get(message.chat.id, -1):
+                self.out_of_order += 1
+            self._last[message.chat.id] = max(seq, self._last.get(message.chat.id, -1))
+            self.handled += 1
+            if self.handled >= self.total:
+                self.done.set()
+
+        return router
+
+
+def _stand_in(updates: List[Dict[str, Any]]) -> web.Application:
+    """Заглушка Bot API: getMe и getUpdates с offset/limit, остальное — ok."""
+    app = web.Application()
+
+    async def method(request: web.Request) -> web.Response:
+        name = request.match_info["method"]
+        form = await request.post()
+        if name == "getMe":
+            result: Any = {"id": BOT_ID, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif name == "getUpdates":
+            offset = int(form.get("offset") or 0)
+            limit = int(form.get("limit") or 100)
+            start = max(0, offset - 1)
+            result = updates[start:start + limit]
+            if not result:
+                await asyncio.sleep(0.05)
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    app.router.add_post("/bot{token}/{method}", method)
+    return app
+
+
+async def _serve(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def _bot(api_port: int) -> Bot:
+    return Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{api_port}")))
+
+
+async def _send(updates: List[Dict[str, Any]], url: str, connections: int) -> int:
+    """Как Telegram: до ``connections`` одновременных запросов, апдейты одного чата — по
+    очереди (следующий уходит после ответа на предыдущий). Возвращает число ответов 503."""
+    rejected = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(update)
+    chat_busy: Dict[int, asyncio.Lock] = {}
+
+    async def sender(session: aiohttp.ClientSession) -> None:
+        nonlocal rejected
+        while not queue.empty():
+            update = queue.get_nowait()
+            lock = chat_busy.setdefault(update["message"]["chat"]["id"], asyncio.Lock())
+            async with lock:
+                while True:
+                    async with session.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": "s"}) as resp:
+                        if resp.status == 200:
+                            break
+                        rejected += 1
+                    await asyncio.sleep(0.01)
+
+    connector = aiohttp.TCPConnector(limit=connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(sender(session) for _ in range(connections)))
+    return rejected
+
+
+async def _telegram_main(updates, api_port, webhook_url, connections, ready, go, results) -> None:
+    runner = await _serve(_stand_in([] if webhook_url else updates), api_port)
+    ready.set()
+    try:
+        if webhook_url:
+            # Старт отправки — по сигналу, чтобы запуск процесса не попал в замер
+            await asyncio.get_running_loop().run_in_executor(None, go.wait)
+            results.put(await _send(updates, webhook_url, connections))
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def _telegram(updates, api_port, webhook_url, connections, ready, go, results) -> None:
+    """Заглушка Telegram в отдельном процессе — её работа не отнимает цикл у бота."""
+    asyncio.run(_telegram_main(updates, api_port, webhook_url, connections, ready, go, results))
+
+
+def _start_telegram(updates, api_port: int, webhook_url: str | None, connections: int):
+    ctx = multiprocessing.get_context("spawn")
+    ready, go, results = ctx.Event(), ctx.Event(), ctx.Queue()
+    process = ctx.Process(
+        target=_telegram, args=(updates, api_port, webhook_url, connections, ready, go, results), daemon=True
+    )
+    process.start()
+    if not ready.wait(30):
+        raise RuntimeError("Telegram stand-in did not start")
+    return process, go, results
+
+
+async def run_polling(updates: List[Dict[str, Any]], args: argparse.Namespace) -> Dict[str, Any]:
+    api_port = _free_port()
+    process, _, _ = _start_telegram(updates, api_port, None, args.connections)
+    recorder = Recorder(len(updates), args.work_ms / 1000)
+    dp = Dispatcher()
+    dp.include_router(recorder.router())
+    bot = _bot(api_port)
+    started = time.perf_counter()
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=1))
+    try:
+        await asyncio.wait_for(recorder.done.wait(), args.timeout)
+    finally:
+        elapsed = time.perf_counter() - started
+        await dp.stop_polling()
+        await asyncio.gather(polling, return_exceptions=True)
+        process.terminate()
+    return _result(recorder, elapsed)
+
+
+async def run_webhook(updates: List[Dict[str, Any]], args: argparse.Namespace) -> Dict[str, Any]:
+    webhook = load_bot_module(
+        "bot_webhook",
+        "webhook.py",
+        {"services.update_pipeline": os.path.join("services", "update_pipeline.py")},
+    )
+    api_port = _free_port()
+    recorder = Recorder(len(updates), args.work_ms / 1000)
+    dp = Dispatcher()
+    dp.include_router(recorder.router())
+    bot = _bot(api_port)
+    pipeline = webhook.pipeline_for(dp, bot, workers=args.workers, queue_size=args.queue)
+    port = _free_port()
+    runner = await _serve(webhook.build_app(dp, bot, pipeline, path="/hook", secret="s"), port)
+
+    process, go, results = _start_telegram(updates, api_port, f"http://127.0.0.1:{port}/hook", args.connections)
+    started = time.perf_counter()
+    go.set()
+    try:
+        await asyncio.wait_for(recorder.done.wait(), args.timeout)
+        elapsed = time.perf_counter() - started
+        rejected = await asyncio.get_running_loop().run_in_executor(None, results.get, True, 30)
+    finally:
+        await runner.cleanup()
+        process.terminate()
+    result = _result(recorder, elapsed)
+    result.update({"rejected_503": rejected, "pipeline": pipeline.stats()})
+    return result
+
+
+def _result(recorder: Recorder, elapsed: float) -> Dict[str, Any]:
+    return {
+        "handled": recorder.handled,
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(recorder.handled / elapsed),
+        "out_of_order": recorder.out_of_order,
+    }
+
+
+async def _run(args: argparse.Namespace) -> Dict[str, Any]:
+    updates = synthetic_updates(args.updates, args.chats, seed=args.seed)
+    report = {"polling": await run_polling(updates, args), "webhook": await run_webhook(updates, args)}
+    for name, result in report.items():
+        print(f"{name:>8}: {result}")
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бот: long polling против webhook + UpdatePipeline")
+    parser.add_argument("--updates", type=int, default=20_000)
+    parser.add_argument("--chats", type=int, default=500)
+    parser.add_argument("--work-ms", type=float, default=2.0, help="средняя длительность обработчика")
+    parser.add_argument("--connections", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--queue", type=int, default=1024)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    report = asyncio.run(_run(args))
+    report.update({"timestamp": int(time.time()), "updates": args.updates, "chats": args.chats, "work_ms": args.work_ms})
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+        print(f"results → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
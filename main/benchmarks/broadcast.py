@@ -0,0 +1,199 @@
+"""Рассылка на ``--users`` получателей: батчи по 10 с паузой 1 с против ``BroadcastSender``.
+
+Telegram заменяет заглушка ``send_message``: ответ через ``--latency-ms``, лимит
+30 сообщений в секунду на бота (скользящее окно) и 1 в секунду на чат — сверх лимита
+``TelegramRetryAfter``; доля ``--blocked`` получателей заблокировала бота. В середине
+рассылки заглушка один раз отвечает ``RetryAfter`` на ``--flood-seconds``, как при
+реальном flood control.
+
+Время сжато в ``--scale`` раз (лимиты, задержки и паузы умножаются/делятся на него),
+в отчёте — пересчитано обратно в секунды Telegram. Теоретический минимум —
+``users / 30 + flood_seconds``.
+
+Из каталога ``main``::
+
+    python -m benchmarks.broadcast --users 100000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from benchmarks.seed import load_bot_module
+
+TELEGRAM_RATE = 30
+
+
+class FakeTelegram:
+    def __init__(self, args: argparse.Namespace, users: int) -> None:
+        self.scale = args.scale
+        self.latency = args.latency_ms / 1000 / args.scale
+        # Окно в 1 с Telegram; ``retry_after`` заглушка отдаёт уже в сжатом времени
+        self.window = 1.0 / args.scale
+        self.limit = TELEGRAM_RATE
+        self.blocked = set(random.Random(args.seed).sample(range(users), int(users * args.blocked)))
+        self.flood_at = users // 2 if args.flood_seconds else None
+        self.flood_seconds = args.flood_seconds
+        self._recent: Deque[float] = deque()
+        self._last_in_chat: Dict[int, float] = {}
+        self.accepted = 0
+        self.retry_after = 0
+        self.flood_until = 0.0
+
+    async def send_message(self, chat_id: int, text: str, **_: Any) -> None:
+        method = SendMessage(chat_id=chat_id, text=text)
+        now = time.monotonic()
+        await asyncio.sleep(self.latency)
+        if now < self.flood_until:
+            self.retry_after += 1
+            raise TelegramRetryAfter(method, "Too Many Requests", self.flood_until - now)
+        if self.flood_at is not None and self.accepted >= self.flood_at:
+            self.flood_at = None
+            self.flood_until = now + self.flood_seconds / self.scale
+            self.retry_after += 1
+            raise TelegramRetryAfter(method, "Too Many Requests", self.flood_seconds / self.scale)
+        while self._recent and self._recent[0] <= now - self.window:
+            self._recent.popleft()
+        last = self._last_in_chat.get(chat_id)
+        if len(self._recent) >= self.limit or (last is not None and now - last < self.window):
+            self.retry_after += 1
+            raise TelegramRetryAfter(method, "Too Many Requests", self.window)
+        self._recent.append(now)
+        self._last_in_chat[chat_id] = now
+        if chat_id in self.blocked:
+            raise TelegramForbiddenError(method, "Forbidden: bot was blocked by the user")
+        self.accepted += 1
+
+
+class _Message:
+    __slots__ = ("user_id", "text", "retry_count")
+
+    def __init__(self, user_id: int, text: str) -> None:
+        self.user_id = user_id
+        self.text = text
+        self.retry_count = 0
+
+
+async def run_legacy(telegram: FakeTelegram, users: int, args: argparse.Namespace) -> Dict[str, Any]:
+    """Прежний ``_process_queue``: 10 сообщений, затем ``sleep(1)``; ошибка — ``sleep(5)`` и в конец."""
+    queue: asyncio.Queue = asyncio.Queue()
+    for user in range(users):
+        queue.put_nowait(_Message(user, "hi"))
+    done = {"sent": 0, "blocked": 0, "failed": 0}
+
+    async def send_single(message: _Message) -> None:
+        try:
+            await telegram.send_message(chat_id=message.user_id, text=message.text)
+            done["sent"] += 1
+        except Exception as e:
+            message.retry_count += 1
+            if message.retry_count < 3:
+                await asyncio.sleep(5.0 / args.scale)
+                await queue.put(message)
+            elif "blocked" in str(e).lower() or "forbidden" in str(e).lower():
+                done["blocked"] += 1
+            else:
+                done["failed"] += 1
+
+    started = time.perf_counter()
+    while sum(done.values()) < users:
+        batch = []
+        for _ in range(10):
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout=1.0 / args.scale))
+            except asyncio.TimeoutError:
+                break
+        if batch:
+            await asyncio.gather(*(send_single(message) for message in batch))
+            await asyncio.sleep(1.0 / args.scale)
+    return {**done, "seconds": round((time.perf_counter() - started) * args.scale, 1)}
+
+
+async def run_sender(telegram: FakeTelegram, users: int, args: argparse.Namespace) -> Dict[str, Any]:
+    sender_mod = load_bot_module(
+        "bot_services_broadcast_sender",
+        os.path.join("services", "broadcast_sender.py"),
+        {"services.rate_limit": os.path.join("services", "rate_limit.py")},
+    )
+    done = {"sent": 0, "blocked": 0, "failed": 0}
+
+    async def send(message: _Message) -> None:
+        await telegram.send_message(chat_id=message.user_id, text=message.text)
+
+    async def on_result(message: _Message, status: str, error: Optional[str], attempts: int) -> None:
+        done[status] += 1
+
+    async def source():
+        for user in range(users):
+            yield _Message(user, "hi")
+
+    sender = sender_mod.BroadcastSender(
+        send,
+        chat_of=lambda message: message.user_id,
+        on_result=on_result,
+        rate=args.rate * args.scale,
+        per_chat_interval=1.0 / args.scale,
+        max_in_flight=32,
+        retry_delay=5.0 / args.scale,
+    )
+
+    started = time.perf_counter()
+    await sender.run(source())
+    return {**done, "seconds": round((time.perf_counter() - started) * args.scale, 1), "stats": sender.stats()}
+
+
+async def _run(args: argparse.Namespace) -> Dict[str, Any]:
+    theoretical = args.users / TELEGRAM_RATE + args.flood_seconds
+    report: Dict[str, Any] = {"theoretical_seconds": round(theoretical, 1)}
+
+    telegram = FakeTelegram(args, args.users)
+    result = await run_sender(telegram, args.users, args)
+    result.update({"retry_after_responses": telegram.retry_after, "efficiency": round(theoretical / result["seconds"], 3)})
+    report["sender"] = result
+    print(f"  sender: {result}")
+
+    if args.legacy_users:
+        telegram = FakeTelegram(args, args.legacy_users)
+        legacy = await run_legacy(telegram, args.legacy_users, args)
+        legacy["retry_after_responses"] = telegram.retry_after
+        # Прежний цикл линеен по числу получателей
+        legacy["extrapolated_seconds"] = round(legacy["seconds"] * args.users / args.legacy_users, 1)
+        report["legacy"] = legacy
+        print(f"  legacy: {legacy}")
+    print(f"  theoretical minimum: {report['theoretical_seconds']} s")
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Рассылка: батчи по 10/1 с против BroadcastSender")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--legacy-users", type=int, default=10_000, help="0 — не запускать прежний цикл")
+    parser.add_argument("--rate", type=float, default=28.0, help="темп отправителя, сообщений/с")
+    parser.add_argument("--latency-ms", type=float, default=60.0)
+    parser.add_argument("--blocked", type=float, default=0.05, help="доля заблокировавших бота")
+    parser.add_argument("--flood-seconds", type=float, default=10.0)
+    parser.add_argument("--scale", type=float, default=20.0, help="во сколько раз сжать время")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    report = asyncio.run(_run(args))
+    report.update({"timestamp": int(time.time()), "users": args.users, "scale": args.scale})
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+        print(f"results → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Память и перезапуск рассылки: очередь в памяти против курсора по ``broadcast_messages``.
+
+* память — пик ``tracemalloc`` за время кампании на ``--users`` получателей с текстом
+  ``--text-bytes`` байт через ``BroadcastService`` (бот отвечает мгновенно); для
+  сравнения — пик прежней ``asyncio.Queue`` из ``BroadcastMessage`` с копией текста;
+* перезапуск — процесс с кампанией завершается ``os._exit`` после ``--crash-after``
+  отправок, новый процесс вызывает ``resume_campaigns``; считаются получатели без
+  сообщения и получившие его дважды.
+
+Из каталога ``main``::
+
+    python -m benchmarks.broadcast_resume --users 1000000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from benchmarks.broadcast_status import _service_module, _users_db
+
+
+@dataclass
+class _LegacyMessage:
+    """``BroadcastMessage`` до курсора: на получателя — объект с копией текста"""
+    id: str
+    user_id: str
+    text: str
+    parse_mode: Optional[str] = None
+    reply_markup: Optional[Dict] = None
+    status: str = "pending"
+    retry_count: int = 0
+    error_message: Optional[str] = None
+    sent_at: Optional[float] = None
+    campaign_id: Optional[str] = None
+
+
+def legacy_queue_peak(users: int, text: str) -> float:
+    tracemalloc.start()
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(users):
+        # Как раньше: текст кампании копируется в каждое сообщение (строка из БД)
+        queue.put_nowait(_LegacyMessage(f"msg_c_{1_000_000 + i}_0", str(1_000_000 + i), "".join(text)))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1e6
+
+
+class _Bot:
+    def __init__(self, log: Optional[str] = None, crash_after: int = 0) -> None:
+        self.sent = 0
+        self.crash_after = crash_after
+        self.log = open(log, "a") if log else None
+
+    async def send_message(self, chat_id: str, **_: Any) -> None:
+        self.sent += 1
+        if self.log:
+            self.log.write(f"{chat_id}\n")
+            self.log.flush()
+        if self.crash_after and self.sent >= self.crash_after:
+            os._exit(1)
+
+
+async def _campaign(path: str, bot: _Bot, text: str, resume: bool) -> Dict[str, Any]:
+    service = _service_module().BroadcastService(bot, db_path=path)
+    service.sender.bucket.rate = 1e9
+    service.sender.max_in_flight = 256
+    await service.init_database()
+    tracemalloc.start()
+    started = time.perf_counter()
+    if resume:
+        await service.resume_campaigns()
+    else:
+        campaign_id = await service.create_campaign("bench", text, "all")
+        await service.start_campaign(campaign_id)
+    # Запуск (выборка сегмента и создание строк) и отправка — отдельно
+    start_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    while service.is_running:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    send_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    await service.close()
+    return {
+        "seconds": round(elapsed, 2),
+        "start_peak_mb": round(start_peak / 1e6, 1),
+        "send_peak_mb": round(send_peak / 1e6, 1),
+        "sent": bot.sent,
+    }
+
+
+def _crashing(path: str, log: str, text: str, crash_after: int) -> None:
+    asyncio.run(_campaign(path, _Bot(log, crash_after), text, resume=False))
+
+
+async def _run(args: argparse.Namespace) -> Dict[str, Any]:
+    text = "x" * args.text_bytes
+    report: Dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "users.db")
+        _users_db(path, args.users)
+        report["cursor"] = await _campaign(path, _Bot(), text, resume=False)
+        print(f"  cursor: {report['cursor']}")
+        report["legacy_queue_peak_mb"] = round(legacy_queue_peak(args.users, text), 1)
+        print(f"  legacy queue peak: {report['legacy_queue_peak_mb']} MB")
+
+        if args.crash_after:
+            path = os.path.join(tmp, "crash.db")
+            log = os.path.join(tmp, "sent.log")
+            _users_db(path, args.resume_users)
+            process = multiprocessing.get_context("spawn").Process(
+                target=_crashing, args=(path, log, text, args.crash_after)
+            )
+            process.start()
+            process.join()
+            resumed = await _campaign(path, _Bot(log), text, resume=True)
+            with open(log) as fh:
+                deliveries = Counter(fh.read().split())
+            with sqlite3.connect(path) as conn:
+                status = conn.execute("SELECT status, sent_count, total_users FROM broadcast_campaigns").fetchone()
+            report["resume"] = {
+                "users": args.resume_users,
+                "crash_after": args.crash_after,
+                "resumed": resumed,
+                "campaign": list(status),
+                "missed": args.resume_users - len(deliveries),
+                "duplicates": sum(count - 1 for count in deliveries.values()),
+            }
+            print(f"  resume: {report['resume']}")
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Рассылка: память и продолжение после перезапуска")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--text-bytes", type=int, default=500)
+    parser.add_argument("--resume-users", type=int, default=100_000)
+    parser.add_argument("--crash-after", type=int, default=40_000, help="0 — без проверки перезапуска")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    report = asyncio.run(_run(args))
+    report.update({"timestamp": int(time.time()), "users": args.users, "text_bytes": args.text_bytes})
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+        print(f"results → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
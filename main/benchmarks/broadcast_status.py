@@ -0,0 +1,166 @@
+"""Запись итогов рассылки в SQLite: транзакция на сообщение против ``StatusWriter``.
+
+Кампания на ``--users`` получателей проходит через ``BroadcastService`` целиком
+(создание строк ``broadcast_messages``, отправка, запись статусов и счётчиков), но бот
+отвечает мгновенно, а темп не ограничен — остаётся только работа с базой.
+
+* ``batched`` — текущий ``BroadcastService`` (``executemany`` при создании, итоги —
+  через ``StatusWriter``);
+* ``per_message`` — прежняя схема: ``INSERT`` на строку и подключение + ``UPDATE`` +
+  ``COMMIT`` на каждое отправленное сообщение (``--legacy-users`` получателей, в отчёте
+  также пересчёт на ``--users``).
+
+Транзакции считаются по вызовам ``commit``.
+
+Из каталога ``main``::
+
+    python -m benchmarks.broadcast_status --users 100000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from typing import Any, Dict
+
+import aiosqlite
+
+from benchmarks.seed import load_bot_module
+
+_commits = 0
+_commit = aiosqlite.Connection.commit
+
+
+async def _counting_commit(self) -> None:
+    global _commits
+    _commits += 1
+    await _commit(self)
+
+
+aiosqlite.Connection.commit = _counting_commit
+
+
+class _InstantBot:
+    async def send_message(self, **_: Any) -> None:
+        return None
+
+
+def _users_db(path: str, users: int) -> None:
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE users (tg_id TEXT, balance INTEGER, trial_3d_used INTEGER, paid_count INTEGER, referral_count INTEGER)"
+    )
+    conn.executemany("INSERT INTO users VALUES (?, 0, 0, 0, 0)", ((str(1_000_000 + i),) for i in range(users)))
+    conn.commit()
+    conn.close()
+
+
+def _service_module():
+    return load_bot_module(
+        "bot_services_broadcast_service",
+        os.path.join("services", "broadcast_service.py"),
+        {
+            "services.rate_limit": os.path.join("services", "rate_limit.py"),
+            "services.broadcast_sender": os.path.join("services", "broadcast_sender.py"),
+            "services.broadcast_status": os.path.join("services", "broadcast_status.py"),
+            "services.broadcast_progress": os.path.join("services", "broadcast_progress.py"),
+            "services.segments": os.path.join("services", "segments.py"),
+        },
+    )
+
+
+async def run_batched(path: str, users: int) -> Dict[str, Any]:
+    global _commits
+    module = _service_module()
+    service = module.BroadcastService(_InstantBot(), db_path=path)
+    service.sender.bucket.rate = 1e9
+    service.sender.max_in_flight = 256
+    await service.init_database()
+    campaign_id = await service.create_campaign("bench", "hello", "all")
+
+    _commits = 0
+    started = time.perf_counter()
+    await service.start_campaign(campaign_id)
+    while service.is_running:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    commits = _commits
+    await service.close()
+
+    campaign = service.active_campaigns[campaign_id]
+    return {
+        "users": users,
+        "seconds": round(elapsed, 2),
+        "transactions": commits,
+        "status": campaign.status.value,
+        "sent": campaign.sent_count,
+        "writer": service.status_writer.stats(),
+    }
+
+
+async def run_per_message(path: str, users: int) -> Dict[str, Any]:
+    """SQL прежнего ``BroadcastService`` без отправки: INSERT на строку, транзакция на итог."""
+    global _commits
+    async with aiosqlite.connect(path) as conn:
+        async with conn.execute("SELECT tg_id FROM users LIMIT ?", (users,)) as cursor:
+            user_ids = [row[0] for row in await cursor.fetchall()]
+    _commits = 0
+    started = time.perf_counter()
+    async with aiosqlite.connect(path) as conn:
+        for user_id in user_ids:
+            await conn.execute(
+                "INSERT INTO broadcast_messages (id, campaign_id, user_id, text, status) VALUES (?, ?, ?, ?, ?)",
+                (f"legacy_{user_id}", "legacy", user_id, "hello", "pending"),
+            )
+        await conn.commit()
+    for user_id in user_ids:
+        async with aiosqlite.connect(path) as conn:
+            await conn.execute(
+                "UPDATE broadcast_messages SET status = ?, retry_count = ?, error_message = ?, sent_at = ? WHERE id = ?",
+                ("sent", 0, None, time.time(), f"legacy_{user_id}"),
+            )
+            await conn.commit()
+    elapsed = time.perf_counter() - started
+    return {"users": users, "seconds": round(elapsed, 2), "transactions": _commits}
+
+
+async def _run(args: argparse.Namespace) -> Dict[str, Any]:
+    report: Dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "users.db")
+        _users_db(path, args.users)
+        report["batched"] = await run_batched(path, args.users)
+        print(f"      batched: {report['batched']}")
+        if args.legacy_users:
+            legacy = await run_per_message(path, min(args.legacy_users, args.users))
+            scale = args.users / legacy["users"]
+            legacy["extrapolated_seconds"] = round(legacy["seconds"] * scale, 1)
+            legacy["extrapolated_transactions"] = round(legacy["transactions"] * scale)
+            report["per_message"] = legacy
+            print(f"  per_message: {legacy}")
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Итоги рассылки: транзакция на сообщение против StatusWriter")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--legacy-users", type=int, default=10_000, help="0 — не запускать прежнюю схему")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    report = asyncio.run(_run(args))
+    report.update({"timestamp": int(time.time())})
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+        print(f"results → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
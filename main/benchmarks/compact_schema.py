@@ -0,0 +1,200 @@
+"""До/после перехода ``users.db`` на компактную схему.
+
+Наполняет БД в старой схеме (TEXT ``tg_id`` с маркерами резерва, TEXT ``user_code``), меряет
+размер файла, таблиц и индексов (``dbstat``) и латентность горячих запросов, затем мигрирует
+её тем же кодом, что и бэкенд (``migrate_to_compact_schema``), и повторяет замеры.
+
+Запросы выполняются напрямую через sqlite3 — сравнивается только влияние схемы, без aiosqlite.
+Из каталога ``main``::
+
+    python -m benchmarks.compact_schema --size 1m --out bench_results/compact_schema.json
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import aiosqlite
+
+from benchmarks.seed import parse_size, seed_database
+from database.db import code_to_db, migrate_to_compact_schema, tg_to_db
+
+# name -> (SQL старой схемы, SQL компактной схемы). Параметры подставляются в нужном виде.
+QUERIES: Dict[str, tuple[str, str]] = {
+    "codes_by_tg_id": (
+        "SELECT user_code, time_end, server_country FROM users WHERE tg_id = ?",
+        "SELECT user_code, time_end, server_country FROM users WHERE tg_id = ?",
+    ),
+    "time_end_by_code": (
+        "SELECT time_end FROM users WHERE user_code = ?",
+        "SELECT time_end FROM users WHERE user_code = ?",
+    ),
+    "tg_id_by_sub_key": (
+        "SELECT tg_id FROM subscription_keys WHERE sub_key = ?",
+        "SELECT tg_id FROM subscription_keys WHERE sub_key = ?",
+    ),
+    "sub_key_by_tg_id": (
+        "SELECT sub_key FROM subscription_keys WHERE tg_id = ?",
+        "SELECT sub_key FROM subscription_keys WHERE tg_id = ?",
+    ),
+    "free_config": (
+        "SELECT user_code FROM users WHERE server_country = ? AND (time_end = 0 OR time_end < ?) LIMIT 1",
+        "SELECT user_code FROM users WHERE server_country = ? AND (time_end = 0 OR time_end < ?) LIMIT 1",
+    ),
+    "active_reservations": (
+        "SELECT 1 FROM users WHERE tg_id LIKE '__RESERVED__:%' AND time_end > ? LIMIT 1",
+        "SELECT 1 FROM users WHERE reserved_by IS NOT NULL AND time_end > ? LIMIT 1",
+    ),
+    "pool_stats": (
+        "SELECT server_country, SUM(CASE WHEN time_end = 0 OR time_end < ? THEN 1 ELSE 0 END),"
+        " SUM(CASE WHEN tg_id IS NOT NULL AND tg_id != '' AND time_end >= ? THEN 1 ELSE 0 END)"
+        " FROM users GROUP BY server_country",
+        "SELECT server_country, SUM(CASE WHEN time_end = 0 OR time_end < ? THEN 1 ELSE 0 END),"
+        " SUM(CASE WHEN tg_id IS NOT NULL AND time_end >= ? THEN 1 ELSE 0 END)"
+        " FROM users GROUP BY server_country",
+    ),
+}
+HEAVY = {"pool_stats"}
+
+
+def storage(db_path: str) -> Dict[str, Any]:
+    """Размер файла и байты по таблицам/индексам (если sqlite собран с dbstat)."""
+    conn = sqlite3.connect(db_path)
+    try:
+        objects = {
+            name: {"pages": pages, "bytes": size}
+            for name, pages, size in conn.execute(
+                "SELECT name, COUNT(*), SUM(pgsize) FROM dbstat GROUP BY name ORDER BY SUM(pgsize) DESC"
+            )
+        }
+    except sqlite3.OperationalError:
+        objects = {}
+    finally:
+        conn.close()
+    return {"file_bytes": os.path.getsize(db_path), "objects": objects}
+
+
+def _params(name: str, compact: bool, manifest: Dict[str, Any], rnd: random.Random) -> tuple:
+    now = int(time.time())
+    conv_tg = tg_to_db if compact else str
+    conv_code = code_to_db if compact else str
+    if name == "codes_by_tg_id" or name == "sub_key_by_tg_id":
+        return (conv_tg(manifest["tg_base"] + rnd.randrange(manifest["users"])),)
+    if name == "time_end_by_code":
+        return (conv_code(rnd.choice(manifest["active_uids"])[0]),)
+    if name == "tg_id_by_sub_key":
+        return (rnd.choice(manifest["sub_keys"]),)
+    if name == "free_config":
+        return (rnd.choice(manifest["servers"]), now)
+    if name == "active_reservations":
+        return (now,)
+    return (now, now)
+
+
+def measure(db_path: str, compact: bool, manifest: Dict[str, Any], iterations: int, seed: int) -> Dict[str, Any]:
+    conn = sqlite3.connect(db_path)
+    results: Dict[str, Any] = {}
+    try:
+        for name, (legacy_sql, compact_sql) in QUERIES.items():
+            sql = compact_sql if compact else legacy_sql
+            rnd = random.Random(seed)
+            runs = max(5, iterations // 20) if name in HEAVY else iterations
+            samples: List[float] = []
+            for _ in range(runs):
+                params = _params(name, compact, manifest, rnd)
+                started = time.perf_counter()
+                conn.execute(sql, params).fetchall()
+                samples.append(time.perf_counter() - started)
+            samples.sort()
+            plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, _params(name, compact, manifest, rnd))]
+            results[name] = {
+                "runs": runs,
+                "p50_us": round(samples[len(samples) // 2] * 1e6, 1),
+                "p95_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1e6, 1),
+                "plan": plan,
+            }
+    finally:
+        conn.close()
+    return results
+
+
+async def _migrate(db_path: str) -> Dict[str, Any]:
+    async with aiosqlite.connect(db_path) as conn:
+        started = time.perf_counter()
+        stats = await migrate_to_compact_schema(conn)
+        stats["migrate_seconds"] = round(time.perf_counter() - started, 2)
+        started = time.perf_counter()
+        await conn.execute("VACUUM")
+        await conn.execute("ANALYZE")
+        await conn.commit()
+        stats["vacuum_seconds"] = round(time.perf_counter() - started, 2)
+    return stats
+
+
+def _print_side_by_side(before: Dict[str, Any], after: Dict[str, Any]) -> None:
+    fb, fa = before["storage"]["file_bytes"], after["storage"]["file_bytes"]
+    print(f"{'file':>24}: {fb / 1048576:9.1f} MiB → {fa / 1048576:9.1f} MiB  ({fa / fb:.0%})")
+    for name in sorted(set(before["storage"]["objects"]) | set(after["storage"]["objects"])):
+        b = before["storage"]["objects"].get(name, {}).get("bytes", 0)
+        a = after["storage"]["objects"].get(name, {}).get("bytes", 0)
+        print(f"{name:>24}: {b / 1048576:9.2f} MiB → {a / 1048576:9.2f} MiB")
+    for name in QUERIES:
+        b, a = before["queries"][name]["p50_us"], after["queries"][name]["p50_us"]
+        print(f"{name:>24}: p50 {b:9.1f}µs → {a:9.1f}µs")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Размер и латентность users.db до/после компактной схемы")
+    parser.add_argument("--size", default="1m", help="10k | 100k | 1m | число конфигов")
+    parser.add_argument("--servers", default="ge,nl")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--workdir", default=None)
+    parser.add_argument("--out", default=None, help="куда записать JSON с результатами")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="zzz-compact-")
+    os.makedirs(workdir, exist_ok=True)
+    db_path = os.path.join(workdir, "users.db")
+    servers = [s.strip().lower() for s in args.servers.split(",") if s.strip()]
+
+    started = time.perf_counter()
+    manifest = seed_database(db_path, parse_size(args.size), servers, seed=args.seed, legacy=True)
+    conn = sqlite3.connect(db_path)
+    conn.execute("VACUUM")
+    conn.close()
+    print(f"seeded {manifest['size']} legacy configs in {time.perf_counter() - started:.1f}s → {db_path}")
+
+    before = {"storage": storage(db_path), "queries": measure(db_path, False, manifest, args.iterations, args.seed)}
+    shutil.copyfile(db_path, db_path + ".legacy")
+    migration = asyncio.run(_migrate(db_path))
+    after = {"storage": storage(db_path), "queries": measure(db_path, True, manifest, args.iterations, args.seed)}
+    print(f"migration: {migration}")
+    _print_side_by_side(before, after)
+
+    report = {
+        "timestamp": int(time.time()),
+        "size": manifest["size"],
+        "servers": servers,
+        "iterations": args.iterations,
+        "migration": migration,
+        "before": before,
+        "after": after,
+    }
+    out = args.out or os.path.join(workdir, "compact_schema.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, ensure_ascii=False, indent=2)
+    print(f"results → {out}")
+
+
+if __name__ == "__main__":
+    main()
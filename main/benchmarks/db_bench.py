@@ -0,0 +1,317 @@
+"""Микробенчмарки слоя БД и регрессионные проверки планов запросов.
+
+Для каждого размера синтетической БД (см. ``benchmarks.seed``) вызывает настоящие функции
+``main/database/db.py`` и ``bot/database/db.py`` и меряет p50/p95. SQL, который они реально
+выполняют, перехватывается trace-callback'ом sqlite3, и для горячих путей (захват конфига,
+поиск по tg_id, по user_code, по sub_key, по реферальному коду) проверяется
+``EXPLAIN QUERY PLAN``: полный ``SCAN users`` / ``SCAN subscription_keys`` — ошибка.
+
+Бюджеты p50 по функциям лежат в ``benchmarks/db_budgets.json``; превышение бюджета тоже
+ошибка (код выхода 1). Из каталога ``main``::
+
+    python -m benchmarks.db_bench --sizes 10k,100k                # проверка
+    python -m benchmarks.db_bench --sizes 10k,100k --record       # перезаписать бюджеты
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterator, List
+
+from benchmarks.seed import load_bot_db, parse_size, seed_bot_database, seed_database
+
+BUDGETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db_budgets.json")
+TARGETS = ("main", "bot")
+FORBIDDEN_SCANS = {
+    "main": ("SCAN users", "SCAN subscription_keys"),
+    "bot": ("SCAN users",),
+}
+_PLANNED_PREFIXES = ("SELECT", "UPDATE", "DELETE", "INSERT", "WITH", "REPLACE")
+
+
+@dataclass
+class Case:
+    name: str
+    call: Callable[[int], Awaitable[Any]]
+    # Горячий путь: план каждого выполненного запроса проверяется на полный скан
+    hot: bool = False
+    # Тяжёлые выборки (весь пул) гоняем реже
+    heavy: bool = False
+
+
+@contextmanager
+def trace_statements() -> Iterator[List[str]]:
+    """Собирает SQL всех соединений, открытых через sqlite3.connect (aiosqlite в т.ч.)."""
+    statements: List[str] = []
+    original = sqlite3.connect
+
+    def traced_connect(*args: Any, **kwargs: Any) -> sqlite3.Connection:
+        conn = original(*args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    sqlite3.connect = traced_connect
+    try:
+        yield statements
+    finally:
+        sqlite3.connect = original
+
+
+def explain(db_path: str, sql: str) -> List[str]:
+    conn = sqlite3.connect(db_path)
+    try:
+        return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+    finally:
+        conn.close()
+
+
+def plan_violations(db_path: str, statements: List[str], forbidden: tuple[str, ...]) -> List[Dict[str, Any]]:
+    violations = []
+    for sql in statements:
+        text = " ".join(sql.split())
+        if not text.upper().startswith(_PLANNED_PREFIXES):
+            continue
+        plan = explain(db_path, text)
+        bad = [line for line in plan if line.startswith(forbidden)]
+        if bad:
+            violations.append({"sql": text, "plan": plan})
+    return violations
+
+
+def _quantile(sorted_values: List[float], q: float) -> float:
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+async def time_case(case: Case, iterations: int, offset: int) -> Dict[str, float]:
+    samples: List[float] = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        await case.call(offset + i)
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "iterations": iterations,
+        "p50_ms": round(_quantile(samples, 0.50), 3),
+        "p95_ms": round(_quantile(samples, 0.95), 3),
+        "mean_ms": round(sum(samples) / len(samples), 3),
+    }
+
+
+def main_cases(manifest: Dict[str, Any]) -> List[Case]:
+    from database import db
+
+    servers = manifest["servers"]
+    active = manifest["active_uids"]
+    sub_keys = manifest["sub_keys"]
+    owners = [str(manifest["tg_base"] + i) for i in range(min(manifest["users"], len(active)))]
+    new_tg = manifest["new_tg_base"]
+    reserved: List[tuple[str, str]] = []
+    month = 30 * 86400
+
+    async def reserve(i: int) -> None:
+        tg_id = str(new_tg + i)
+        uid = await db.reserve_one_free_config(tg_id, servers[i % len(servers)])
+        if uid:
+            reserved.append((uid, tg_id))
+
+    async def cancel(i: int) -> None:
+        if reserved:
+            uid, tg_id = reserved.pop()
+            await db.cancel_reserved_config(uid, tg_id)
+
+    def pick(seq: List[Any], i: int) -> Any:
+        return seq[i % len(seq)]
+
+    return [
+        Case("reserve_one_free_config", reserve, hot=True),
+        Case("cancel_reserved_config", cancel, hot=True),
+        Case("count_available_configs", lambda i: db.count_available_configs(pick(servers, i)), hot=True),
+        Case("get_codes_by_tg_id", lambda i: db.get_codes_by_tg_id(pick(owners, i)), hot=True),
+        Case("get_user_max_subscription", lambda i: db.get_user_max_subscription(pick(owners, i)), hot=True),
+        Case("get_time_end_by_code", lambda i: db.get_time_end_by_code(pick(active, i)[0]), hot=True),
+        Case("set_time_end", lambda i: db.set_time_end(pick(active, i)[0], int(time.time()) + month), hot=True),
+        Case("get_tg_id_by_key", lambda i: db.get_tg_id_by_key(pick(sub_keys, i)), hot=True),
+        Case("get_sub_key_by_tg_id", lambda i: db.get_sub_key_by_tg_id(pick(owners, i)), hot=True),
+        Case("get_or_create_sub_key", lambda i: db.get_or_create_sub_key(pick(owners, i)), hot=True),
+        Case("has_any_expired_configs", lambda i: db.has_any_expired_configs()),
+        Case("get_idempotent_result", lambda i: db.get_idempotent_result(f"bench:{i}", 86400)),
+        Case("users_with_subscription_expiring_within_5h", lambda i: db.users_with_subscription_expiring_within_5h(), heavy=True),
+        Case("get_server_pool_stats", lambda i: db.get_server_pool_stats(), heavy=True),
+        Case("get_all_active_users", lambda i: db.get_all_active_users(), heavy=True),
+        Case("reset_expired_configs", lambda i: db.reset_expired_configs(), heavy=True),
+    ]
+
+
+def bot_cases(manifest: Dict[str, Any], bot_db) -> List[Case]:
+    tg_ids = manifest["tg_ids"]
+    codes = manifest["referral_codes"]
+    new_tg = manifest["new_tg_base"]
+
+    def pick(seq: List[str], i: int) -> str:
+        return seq[i % len(seq)]
+
+    return [
+        Case("get_referral_code", lambda i: bot_db.get_referral_code(pick(tg_ids, i)), hot=True),
+        # Новый пользователь: код выдаётся одним UPSERT без подбора
+        Case("get_referral_code_new", lambda i: bot_db.get_referral_code(str(new_tg + 1_000_000 + i)), hot=True),
+        Case("get_referrer_id", lambda i: bot_db.get_referrer_id(pick(tg_ids, i)), hot=True),
+        Case("get_tg_id_by_referral_code", lambda i: bot_db.get_tg_id_by_referral_code(pick(codes, i)), hot=True),
+        Case("get_referral_count", lambda i: bot_db.get_referral_count(pick(tg_ids, i)), hot=True),
+        Case("is_first_time_user", lambda i: bot_db.is_first_time_user(pick(tg_ids, i)), hot=True),
+        Case("has_used_trial_3d", lambda i: bot_db.has_used_trial_3d(pick(tg_ids, i)), hot=True),
+        Case("has_any_payment", lambda i: bot_db.has_any_payment(pick(tg_ids, i)), hot=True),
+        Case("get_balance_days", lambda i: bot_db.get_balance_days(pick(tg_ids, i)), hot=True),
+        Case("add_balance_days", lambda i: bot_db.add_balance_days(pick(tg_ids, i), 1), hot=True),
+        Case("deduct_balance_days", lambda i: bot_db.deduct_balance_days(pick(tg_ids, i), 1), hot=True),
+        Case("mark_payment", lambda i: bot_db.mark_payment(pick(tg_ids, i), 30), hot=True),
+        Case("ensure_user_row", lambda i: bot_db.ensure_user_row(str(new_tg + i)), hot=True),
+        Case("add_referral_by", lambda i: bot_db.add_referral_by(str(new_tg + i), pick(codes, i)), hot=True),
+        Case(
+            "add_balance_days_bulk",
+            lambda i: bot_db.add_balance_days_bulk({pick(tg_ids, i * 100 + j): 1 for j in range(100)}),
+            hot=True,
+        ),
+        Case("add_rub_payment", lambda i: bot_db.add_rub_payment(199)),
+        Case("get_payments_aggregates", lambda i: bot_db.get_payments_aggregates()),
+    ]
+
+
+async def _run_cases(
+    cases: List[Case], db_path: str, forbidden: tuple[str, ...], iterations: int, bot_db=None
+) -> Dict[str, Any]:
+    try:
+        return await _measure_cases(cases, db_path, forbidden, iterations)
+    finally:
+        if bot_db is not None:
+            # Пул бота держит соединения открытыми между вызовами
+            await bot_db.pool.close()
+
+
+async def _measure_cases(cases: List[Case], db_path: str, forbidden: tuple[str, ...], iterations: int) -> Dict[str, Any]:
+    functions: Dict[str, Any] = {}
+    violations: Dict[str, Any] = {}
+    for case in cases:
+        # Первый вызов — под трассировкой: заодно прогрев кэша страниц
+        with trace_statements() as statements:
+            await case.call(0)
+        if case.hot:
+            bad = plan_violations(db_path, statements, forbidden)
+            if bad:
+                violations[case.name] = bad
+        n = max(5, iterations // 20) if case.heavy else iterations
+        functions[case.name] = await time_case(case, n, offset=1)
+    return {"functions": functions, "plan_violations": violations}
+
+
+def run_target(target: str, size: int, iterations: int, workdir: str, seed: int) -> Dict[str, Any]:
+    directory = os.path.join(workdir, f"{target}-{size}")
+    os.makedirs(directory, exist_ok=True)
+    db_path = os.path.join(directory, "users.db")
+    bot_db = None
+    if target == "main":
+        manifest = seed_database(db_path, size, ["ge", "nl"], seed=seed)
+        cases = main_cases(manifest)
+    else:
+        manifest = seed_bot_database(db_path, size, seed=seed)
+        bot_db = load_bot_db()
+        cases = bot_cases(manifest, bot_db)
+
+    # Функции БД открывают относительный "users.db"
+    prev = os.getcwd()
+    os.chdir(directory)
+    try:
+        return asyncio.run(_run_cases(cases, db_path, FORBIDDEN_SCANS[target], iterations, bot_db))
+    finally:
+        os.chdir(prev)
+
+
+def compare_budgets(results: Dict[str, Any], budgets: Dict[str, Any]) -> List[str]:
+    regressions = []
+    for target, by_size in results.items():
+        for size_label, result in by_size.items():
+            limits = budgets.get(target, {}).get(size_label, {})
+            for name, stats in result["functions"].items():
+                limit = limits.get(name)
+                if limit is not None and stats["p50_ms"] > limit:
+                    regressions.append(f"{target}/{size_label}/{name}: p50 {stats['p50_ms']}ms > budget {limit}ms")
+    return regressions
+
+
+def record_budgets(results: Dict[str, Any], budgets: Dict[str, Any], headroom: float, floor_ms: float) -> Dict[str, Any]:
+    for target, by_size in results.items():
+        for size_label, result in by_size.items():
+            budgets.setdefault(target, {})[size_label] = {
+                name: round(max(stats["p50_ms"] * headroom, floor_ms), 2)
+                for name, stats in result["functions"].items()
+            }
+    return budgets
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Микробенчмарки БД и проверка планов запросов")
+    parser.add_argument("--sizes", default="10k,100k", help="через запятую: 10k | 100k | 1m | число")
+    parser.add_argument("--targets", default=",".join(TARGETS), help="main,bot")
+    parser.add_argument("--iterations", type=int, default=200, help="вызовов на функцию")
+    parser.add_argument("--budgets", default=BUDGETS_PATH)
+    parser.add_argument("--record", action="store_true", help="перезаписать бюджеты по текущему прогону")
+    parser.add_argument("--headroom", type=float, default=3.0, help="множитель к p50 при --record")
+    parser.add_argument("--floor-ms", type=float, default=2.0, help="минимальный бюджет при --record")
+    parser.add_argument("--workdir", default=None)
+    parser.add_argument("--out", default=None, help="куда записать JSON с результатами")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    targets = [t.strip() for t in args.targets.split(",") if t.strip() in TARGETS]
+    size_labels = [s.strip().lower() for s in args.sizes.split(",") if s.strip()]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="zzz-dbbench-")
+
+    results: Dict[str, Dict[str, Any]] = {}
+    failed = False
+    for target in targets:
+        for label in size_labels:
+            result = run_target(target, parse_size(label), args.iterations, workdir, args.seed)
+            results.setdefault(target, {})[label] = result
+            print(f"== {target} @ {label}")
+            for name, stats in result["functions"].items():
+                print(f"  {name:<44} p50={stats['p50_ms']:>8}ms p95={stats['p95_ms']:>8}ms")
+            for name, bad in result["plan_violations"].items():
+                failed = True
+                for item in bad:
+                    print(f"  PLAN {name}: {item['sql']}\n       -> {' | '.join(item['plan'])}")
+
+    budgets: Dict[str, Any] = {}
+    if os.path.exists(args.budgets):
+        with open(args.budgets, encoding="utf-8") as fh:
+            budgets = json.load(fh)
+    if args.record:
+        record_budgets(results, budgets, args.headroom, args.floor_ms)
+        with open(args.budgets, "w", encoding="utf-8") as fh:
+            json.dump(budgets, fh, ensure_ascii=False, indent=2, sort_keys=True)
+            fh.write("\n")
+        print(f"budgets → {args.budgets}")
+    else:
+        for line in compare_budgets(results, budgets):
+            failed = True
+            print(f"  BUDGET {line}")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump({"timestamp": int(time.time()), "results": results}, fh, ensure_ascii=False, indent=2)
+    if failed:
+        print("FAILED: query plan or budget regressions")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
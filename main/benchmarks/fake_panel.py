@@ -0,0 +1,109 @@
+"""Локальная имитация API панели 3x-ui для нагрузочных тестов.
+
+Эндпоинты повторяют те, что дергает бэкенд:
+
+- ``POST /panel/api/inbounds/addClient``
+- ``POST /panel/api/inbounds/updateClient/{uid}``
+- ``POST /panel/api/inbounds/{inbound_id}/delClient/{uid}``
+
+Клиенты хранятся в памяти (как в inbound settings), задержка и доля ошибок настраиваются.
+Запуск отдельно::
+
+    python -m benchmarks.fake_panel --port 9100 --latency-ms 40 --jitter-ms 20 --error-rate 0.01
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Any, Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def create_app(latency_ms: float = 30.0, jitter_ms: float = 10.0, error_rate: float = 0.0, seed: int | None = None) -> FastAPI:
+    """Собирает приложение фейковой панели."""
+    app = FastAPI()
+    rnd = random.Random(seed)
+    clients: Dict[str, Dict[str, Any]] = {}
+    # Панель перезаписывает конфиг xray под глобальным мьютексом — имитируем это
+    xray_lock = asyncio.Lock()
+    stats = {"add": 0, "update": 0, "delete": 0, "errors": 0, "rewrites": 0, "started_at": time.time()}
+
+    async def _simulate() -> JSONResponse | None:
+        delay = max(0.0, rnd.gauss(latency_ms, jitter_ms)) / 1000.0
+        async with xray_lock:
+            await asyncio.sleep(delay)
+            stats["rewrites"] += 1
+        if error_rate > 0 and rnd.random() < error_rate:
+            stats["errors"] += 1
+            return JSONResponse(status_code=500, content={"success": False, "msg": "simulated failure"})
+        return None
+
+    def _clients_from(body: Dict[str, Any]) -> list[Dict[str, Any]]:
+        raw = body.get("settings") or "{}"
+        try:
+            settings = json.loads(raw) if isinstance(raw, str) else raw
+        except ValueError:
+            return []
+        return list(settings.get("clients") or [])
+
+    @app.post("/panel/api/inbounds/addClient")
+    async def add_client(request: Request):
+        failure = await _simulate()
+        if failure is not None:
+            return failure
+        body = await request.json()
+        for client in _clients_from(body):
+            clients[str(client.get("id"))] = client
+        stats["add"] += 1
+        return {"success": True, "msg": "Client(s) added", "obj": None}
+
+    @app.post("/panel/api/inbounds/updateClient/{uid}")
+    async def update_client(uid: str, request: Request):
+        failure = await _simulate()
+        if failure is not None:
+            return failure
+        body = await request.json()
+        for client in _clients_from(body):
+            clients[str(client.get("id") or uid)] = client
+        stats["update"] += 1
+        return {"success": True, "msg": "Client updated", "obj": None}
+
+    @app.post("/panel/api/inbounds/{inbound_id}/delClient/{uid}")
+    async def del_client(inbound_id: int, uid: str):
+        failure = await _simulate()
+        if failure is not None:
+            return failure
+        clients.pop(uid, None)
+        stats["delete"] += 1
+        return {"success": True, "msg": "Client deleted", "obj": None}
+
+    @app.get("/stats")
+    async def get_stats():
+        return {**stats, "clients": len(clients)}
+
+    return app
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Фейковая панель 3x-ui")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=30.0)
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    app = create_app(args.latency_ms, args.jitter_ms, args.error_rate, args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""FSM-хранилище бота: ``MemoryStorage`` aiogram против ``SqliteStorage`` (``bot/database/fsm_storage.py``).
+
+* накладные расходы на апдейт — типичный обработчик оплаты читает состояние и данные,
+  дописывает пару полей и меняет состояние: p50/p99 первого апдейта пользователя (промах
+  кэша) и следующих, ``--users`` пользователей по ``--updates`` апдейтов;
+* пропускная способность — те же апдейты пачками по ``--concurrency`` одновременных;
+* перезапуск — после ``close()`` новый экземпляр с пустым кэшем видит данные всех
+  пользователей; время чтения с диска.
+
+Из каталога ``main``::
+
+    python -m benchmarks.fsm_storage --users 10000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from benchmarks.seed import load_bot_module
+
+BOT_ID = 42
+
+
+def _key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+
+
+async def _update(storage: BaseStorage, user_id: int, step: int) -> None:
+    """Как ``pay_with_yookassa``: прочитать, дописать данные, сменить состояние."""
+    state = FSMContext(storage, _key(user_id))
+    await state.get_state()
+    data = await state.get_data()
+    await state.update_data(invoice_msg_id=step, servers_to_use=["fi", "nl"], last=data.get("invoice_msg_id"))
+    await state.set_state(f"Form:step{step % 3}")
+
+
+def _stats(samples: List[float]) -> Dict[str, float]:
+    samples = sorted(samples)
+    return {
+        "p50_us": round(samples[len(samples) // 2], 1),
+        "p99_us": round(samples[int(len(samples) * 0.99)], 1),
+    }
+
+
+async def _drive(storage: BaseStorage, args: argparse.Namespace) -> Dict[str, Any]:
+    """Задержка апдейта — по одному (в пачке она включала бы ожидание соседей по циклу)."""
+    cold: List[float] = []
+    warm: List[float] = []
+    for step in range(args.updates):
+        samples = cold if step == 0 else warm
+        for u in range(args.users):
+            started = time.perf_counter()
+            await _update(storage, 1_000_000 + u, step)
+            samples.append((time.perf_counter() - started) * 1e6)
+    return {"updates": args.users * args.updates, "first_update": _stats(cold), "next_updates": _stats(warm)}
+
+
+async def _throughput(storage: BaseStorage, args: argparse.Namespace, base: int) -> int:
+    jobs = [(base + u, step) for step in range(args.updates) for u in range(args.users)]
+    started = time.perf_counter()
+    for i in range(0, len(jobs), args.concurrency):
+        await asyncio.gather(*(_update(storage, u, s) for u, s in jobs[i:i + args.concurrency]))
+    return round(len(jobs) / (time.perf_counter() - started))
+
+
+async def _run(args: argparse.Namespace, db_path: str) -> Dict[str, Any]:
+    fsm = load_bot_module("bot_database_fsm_storage", os.path.join("database", "fsm_storage.py"), {})
+    report: Dict[str, Any] = {}
+    for name, storage in (("memory", MemoryStorage()), ("sqlite", fsm.SqliteStorage(db_path=db_path))):
+        result = await _drive(storage, args)
+        # Пропускная способность — на других пользователях, с нуля
+        result["updates_per_sec"] = await _throughput(storage, args, 5_000_000)
+        if name == "sqlite":
+            result.update({k: v for k, v in storage.stats().items() if k in ("flushes", "flushed_keys")})
+        await storage.close()
+        report[name] = result
+
+    # Перезапуск: новый экземпляр с пустым кэшем
+    restarted = fsm.SqliteStorage(db_path=db_path)
+    samples: List[float] = []
+    restored = 0
+    for u in range(args.users):
+        started = time.perf_counter()
+        data = await restarted.get_data(_key(1_000_000 + u))
+        samples.append((time.perf_counter() - started) * 1e6)
+        if data.get("invoice_msg_id") == args.updates - 1:
+            restored += 1
+    await restarted.close()
+    report["restart"] = {"users": args.users, "restored": restored, "cold_read": _stats(samples)}
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="FSM: MemoryStorage против SqliteStorage")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--updates", type=int, default=5, help="апдейтов на пользователя")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--workdir", default=None)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="zzz-fsm-")
+    os.makedirs(workdir, exist_ok=True)
+    db_path = os.path.join(workdir, "users.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    report = asyncio.run(_run(args, db_path))
+    report.update({"timestamp": int(time.time()), "users": args.users, "updates_per_user": args.updates})
+    for name in ("memory", "sqlite", "restart"):
+        print(f"{name:>8}: {report[name]}")
+
+    out = args.out or os.path.join(workdir, "fsm_storage.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, ensure_ascii=False, indent=2)
+    print(f"results → {out}")
+
+
+if __name__ == "__main__":
+    main()
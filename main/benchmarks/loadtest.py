@@ -0,0 +1,282 @@
+"""Нагрузочный тест бэкенда против локальной фейковой панели 3x-ui.
+
+Что делает:
+
+1. наполняет ``users.db`` синтетикой нужного размера (см. ``benchmarks.seed``);
+2. поднимает фейковую панель (``benchmarks.fake_panel``) с заданной задержкой и долей ошибок;
+3. поднимает бэкенд (uvicorn ``main:app``) с рабочей директорией рядом с БД;
+4. гоняет сценарии ``/giveconfig``, ``/extendconfig``, ``/subscription/{sub_key}`` и
+   ``/check-available-configs`` с заданным параллелизмом;
+5. пишет p50/p95/p99, пропускную способность, коды ответов и ошибки блокировки SQLite в JSON.
+
+Пример (из каталога ``main``)::
+
+    python -m benchmarks.loadtest --size 100k --concurrency 32 --requests 2000 \\
+        --panel-latency-ms 40 --panel-error-rate 0.01 --out bench_results/before.json
+
+Сравнение двух прогонов — просто diff двух JSON (ключи стабильны).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+import httpx
+
+from benchmarks.seed import parse_size, seed_database
+
+MAIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AUTH = "bench"
+SCENARIOS = ("check", "subscription", "extend", "give")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+def summarize(latencies: List[float], statuses: Dict[str, int], wall: float, lock_errors: int) -> Dict[str, Any]:
+    values = sorted(latencies)
+    total = len(values)
+    ok = sum(v for k, v in statuses.items() if k.startswith("2"))
+    return {
+        "requests": total,
+        "ok": ok,
+        "error_rate": round(1 - ok / total, 4) if total else 0.0,
+        "throughput_rps": round(total / wall, 1) if wall > 0 else 0.0,
+        "wall_seconds": round(wall, 3),
+        "latency_ms": {
+            "p50": round(percentile(values, 0.50) * 1000, 2),
+            "p95": round(percentile(values, 0.95) * 1000, 2),
+            "p99": round(percentile(values, 0.99) * 1000, 2),
+            "max": round((values[-1] if values else 0.0) * 1000, 2),
+            "mean": round((sum(values) / total if total else 0.0) * 1000, 2),
+        },
+        "statuses": dict(sorted(statuses.items())),
+        "sqlite_lock_errors": lock_errors,
+    }
+
+
+async def _drive(
+    client: httpx.AsyncClient,
+    make_request: Callable[[int], Awaitable[httpx.Response]],
+    total: int,
+    concurrency: int,
+) -> tuple[List[float], Dict[str, int], float, int]:
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    lock_errors = 0
+    counter = iter(range(total))
+
+    async def worker() -> None:
+        nonlocal lock_errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                resp = await make_request(i)
+                code = str(resp.status_code)
+                if resp.status_code >= 500 and "locked" in resp.text.lower():
+                    lock_errors += 1
+            except httpx.HTTPError as exc:
+                code = type(exc).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[code] = statuses.get(code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return latencies, statuses, time.perf_counter() - started, lock_errors
+
+
+def _count_lock_lines(log_path: str, offset: int) -> tuple[int, int]:
+    """Считает 'database is locked' в логе бэкенда начиная с ``offset``."""
+    with open(log_path, "rb") as fh:
+        fh.seek(offset)
+        chunk = fh.read()
+    return chunk.lower().count(b"database is locked"), offset + len(chunk)
+
+
+async def run_scenarios(base_url: str, manifest: Dict[str, Any], args: argparse.Namespace, log_path: str) -> Dict[str, Any]:
+    rnd = random.Random(args.seed)
+    headers = {"X-API-Key": AUTH}
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency)
+    results: Dict[str, Any] = {}
+    servers = manifest["servers"]
+    active = manifest["active_uids"] or [("missing", servers[0])]
+    sub_keys = manifest["sub_keys"] or ["missing"]
+    next_tg = manifest["new_tg_base"]
+    log_offset = 0
+
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, timeout=60.0, limits=limits) as client:
+
+        async def check(i: int) -> httpx.Response:
+            return await client.get("/check-available-configs", params={"server": servers[i % len(servers)]})
+
+        async def subscription(i: int) -> httpx.Response:
+            # Без браузерных заголовков бэкенд отдаёт text/plain, как клиенту V2rayTun
+            return await client.get(f"/subscription/{rnd.choice(sub_keys)}", headers={"User-Agent": "v2raytun/bench"})
+
+        async def extend(i: int) -> httpx.Response:
+            uid, server = rnd.choice(active)
+            return await client.post("/extendconfig", json={"time": 1, "uid": uid, "server": server})
+
+        async def give(i: int) -> httpx.Response:
+            return await client.post(
+                "/giveconfig",
+                json={"time": 30, "id": str(next_tg + i), "server": servers[i % len(servers)]},
+            )
+
+        drivers = {"check": check, "subscription": subscription, "extend": extend, "give": give}
+        for name in args.scenarios:
+            latencies, statuses, wall, lock_in_body = await _drive(client, drivers[name], args.requests, args.concurrency)
+            lock_in_log, log_offset = _count_lock_lines(log_path, log_offset)
+            results[name] = summarize(latencies, statuses, wall, lock_in_body + lock_in_log)
+            print(
+                f"{name:>12}: {results[name]['throughput_rps']:>8} rps  "
+                f"p50={results[name]['latency_ms']['p50']}ms p95={results[name]['latency_ms']['p95']}ms "
+                f"p99={results[name]['latency_ms']['p99']}ms  errors={results[name]['error_rate']}"
+            )
+    return results
+
+
+def _wait_http(url: str, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up in {timeout}s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бэкенда с фейковой панелью")
+    parser.add_argument("--size", default="10k", help="10k | 100k | 1m | число конфигов")
+    parser.add_argument("--servers", default="ge")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=1000, help="запросов на сценарий")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--panel-latency-ms", type=float, default=30.0)
+    parser.add_argument("--panel-jitter-ms", type=float, default=10.0)
+    parser.add_argument("--panel-error-rate", type=float, default=0.0)
+    parser.add_argument("--workdir", default=None, help="каталог для users.db и логов (по умолчанию временный)")
+    parser.add_argument("--out", default=None, help="куда записать JSON с результатами")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--label", default="", help="метка прогона (например, git sha)")
+    args = parser.parse_args()
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip() in SCENARIOS]
+    servers = [s.strip().lower() for s in args.servers.split(",") if s.strip()]
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="zzz-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    db_path = os.path.join(workdir, "users.db")
+
+    started = time.perf_counter()
+    manifest = seed_database(db_path, parse_size(args.size), servers, seed=args.seed)
+    seed_seconds = time.perf_counter() - started
+    print(f"seeded {manifest['size']} configs in {seed_seconds:.1f}s → {db_path}")
+
+    # Шаблоны бэкенд ищет относительно рабочей директории
+    templates_link = os.path.join(workdir, "templates")
+    if not os.path.exists(templates_link):
+        os.symlink(os.path.join(MAIN_DIR, "templates"), templates_link)
+
+    panel_port = _free_port()
+    api_port = _free_port()
+    panel_url = f"http://127.0.0.1:{panel_port}/panel/api/inbounds"
+    env = dict(os.environ)
+    env.update({"AUTH_CODE": AUTH, "ENABLE_EXPIRE_SWEEP": "false", "PYTHONPATH": MAIN_DIR})
+    for code in servers:
+        env[f"URLCREATE_{code.upper()}"] = f"{panel_url}/addClient"
+        env[f"URLUPDATE_{code.upper()}"] = f"{panel_url}/updateClient/"
+        env[f"URLDELETE_{code.upper()}"] = f"{panel_url}/1/delClient/"
+
+    log_path = os.path.join(workdir, "backend.log")
+    procs: List[subprocess.Popen] = []
+    log_fh = open(log_path, "wb")
+    try:
+        procs.append(subprocess.Popen(
+            [
+                sys.executable, "-m", "benchmarks.fake_panel",
+                "--port", str(panel_port),
+                "--latency-ms", str(args.panel_latency_ms),
+                "--jitter-ms", str(args.panel_jitter_ms),
+                "--error-rate", str(args.panel_error_rate),
+                "--seed", str(args.seed),
+            ],
+            cwd=MAIN_DIR,
+            env=env,
+        ))
+        procs.append(subprocess.Popen(
+            [
+                sys.executable, "-m", "uvicorn", "main:app",
+                "--app-dir", MAIN_DIR,
+                "--host", "127.0.0.1",
+                "--port", str(api_port),
+                "--log-level", "warning",
+                "--no-access-log",
+            ],
+            cwd=workdir,
+            env=env,
+            stdout=log_fh,
+            stderr=subprocess.STDOUT,
+        ))
+        _wait_http(f"http://127.0.0.1:{panel_port}/stats")
+        _wait_http(f"http://127.0.0.1:{api_port}/healthz")
+
+        results = asyncio.run(run_scenarios(f"http://127.0.0.1:{api_port}", manifest, args, log_path))
+        panel_stats = httpx.get(f"http://127.0.0.1:{panel_port}/stats").json()
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        log_fh.close()
+
+    report = {
+        "label": args.label,
+        "timestamp": int(time.time()),
+        "python": sys.version.split()[0],
+        "params": {
+            "size": manifest["size"],
+            "servers": servers,
+            "concurrency": args.concurrency,
+            "requests_per_scenario": args.requests,
+            "panel_latency_ms": args.panel_latency_ms,
+            "panel_jitter_ms": args.panel_jitter_ms,
+            "panel_error_rate": args.panel_error_rate,
+            "seed": args.seed,
+        },
+        "seed_seconds": round(seed_seconds, 2),
+        "scenarios": results,
+        "panel": panel_stats,
+    }
+    out = args.out or os.path.join(workdir, "loadtest.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, ensure_ascii=False, indent=2)
+    print(f"results → {out}")
+
+
+if __name__ == "__main__":
+    main()
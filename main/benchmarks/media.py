@@ -0,0 +1,173 @@
+"""Картинка ``/start``: загрузка ``FSInputFile`` на каждый вызов против ``MediaRegistry``.
+
+``--starts`` вызовов ``/start`` (по ``--concurrency`` одновременно) отправляют
+``start.jpg`` (``--kb`` КБ) через заглушку ``send_photo``: ответ через ``--latency-ms``,
+загрузка файла — ещё ``размер / --upload-kbps``; в отчёте — отправленные байты
+файла, число загрузок и время ответа.
+
+* ``upload`` — прежний ``start_command``: три ``os.path.exists`` и ``FSInputFile``;
+* ``registry`` — ``media_registry.send_photo``: загрузка один раз, дальше ``file_id``;
+  затем перезапуск (новый реестр читает ``file_id`` из ``media_files``) и замена файла.
+
+Из каталога ``main``::
+
+    python -m benchmarks.media --starts 2000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from aiogram.types import FSInputFile
+
+from benchmarks.seed import load_bot_module
+
+
+class _PhotoSize:
+    def __init__(self, file_id: str) -> None:
+        self.file_id = file_id
+
+
+class _Message:
+    def __init__(self, file_id: str) -> None:
+        self.photo = [_PhotoSize(file_id)]
+
+
+class _Bot:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.latency = args.latency_ms / 1000
+        self.upload_kbps = args.upload_kbps
+        self.uploads = 0
+        self.uploaded_bytes = 0
+
+    async def send_photo(self, chat_id: Any, photo: Any, **_: Any) -> _Message:
+        delay = self.latency
+        if isinstance(photo, FSInputFile):
+            # Содержимое файла целиком уходит в multipart-запрос
+            size = len(await asyncio.to_thread(_read, photo.path))
+            self.uploads += 1
+            self.uploaded_bytes += size
+            delay += size / 1024 / self.upload_kbps
+            photo = f"file_{self.uploads}"
+        await asyncio.sleep(delay)
+        return _Message(photo)
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as fh:
+        return fh.read()
+
+
+async def _starts(send, args: argparse.Namespace) -> Dict[str, Any]:
+    latencies: List[float] = []
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def one(chat_id: int) -> None:
+        async with slots:
+            started = time.perf_counter()
+            await send(chat_id)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.starts)))
+    latencies.sort()
+    return {
+        "seconds": round(time.perf_counter() - started, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 1),
+    }
+
+
+async def run_upload(root: str, args: argparse.Namespace) -> Dict[str, Any]:
+    bot = _Bot(args)
+
+    async def send(chat_id: int) -> None:
+        candidate_paths = [os.path.join(root, "start.jpg"), os.path.join(root, "bot", "start.jpg"), os.path.join(os.getcwd(), "start.jpg")]
+        image_path_found = next((p for p in candidate_paths if os.path.exists(p)), None)
+        await bot.send_photo(chat_id, FSInputFile(image_path_found), caption="hi")
+
+    report = await _starts(send, args)
+    report.update({"uploads": bot.uploads, "uploaded_kb": round(bot.uploaded_bytes / 1024)})
+    return report
+
+
+async def run_registry(root: str, args: argparse.Namespace) -> Dict[str, Any]:
+    module = load_bot_module(
+        "bot_services_media_registry",
+        os.path.join("services", "media_registry.py"),
+        {"database.pool": os.path.join("database", "pool.py")},
+    )
+    dirs = [root, os.path.join(root, "bot"), os.getcwd()]
+    bot = _Bot(args)
+    registry = module.MediaRegistry(search_dirs=dirs)
+    await registry.init()
+
+    async def send(chat_id: int) -> None:
+        await registry.send_photo(bot, chat_id, "start.jpg", caption="hi")
+
+    report = await _starts(send, args)
+    report.update({"uploads": bot.uploads, "uploaded_kb": round(bot.uploaded_bytes / 1024), "stats": registry.stats()})
+
+    # Перезапуск: file_id из media_files, без загрузки
+    restarted = module.MediaRegistry(search_dirs=dirs)
+    await restarted.init()
+    uploads = bot.uploads
+    await restarted.send_photo(bot, 0, "start.jpg")
+    report["uploads_after_restart"] = bot.uploads - uploads
+
+    # Замена файла: одна новая загрузка
+    with open(os.path.join(root, "start.jpg"), "ab") as fh:
+        fh.write(b"\0")
+    restarted.check_interval = 0
+    for chat_id in range(10):
+        await restarted.send_photo(bot, chat_id, "start.jpg")
+    report["uploads_after_change"] = bot.uploads - uploads
+    await module.pool.close()
+    return report
+
+
+async def _run(args: argparse.Namespace) -> Dict[str, Any]:
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as root:
+        os.makedirs(os.path.join(root, "bot"))
+        with open(os.path.join(root, "start.jpg"), "wb") as fh:
+            fh.write(os.urandom(args.kb * 1024))
+        # users.db пула бота — во временном каталоге
+        os.chdir(root)
+        try:
+            report = {"upload": await run_upload(root, args)}
+            print(f"    upload: {report['upload']}")
+            report["registry"] = await run_registry(root, args)
+            print(f"  registry: {report['registry']}")
+        finally:
+            os.chdir(cwd)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Картинка /start: FSInputFile на каждый вызов против MediaRegistry")
+    parser.add_argument("--starts", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--kb", type=int, default=24, help="размер start.jpg")
+    parser.add_argument("--latency-ms", type=float, default=60.0)
+    parser.add_argument("--upload-kbps", type=float, default=1024.0, help="скорость загрузки к Bot API, КБ/с")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    report = asyncio.run(_run(args))
+    report.update({"timestamp": int(time.time()), "starts": args.starts, "kb": args.kb})
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+        print(f"results → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
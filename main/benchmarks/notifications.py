@@ -0,0 +1,138 @@
+"""Уведомления из админ-панели: цикл в обработчике против фоновой кампании ``BroadcastService``.
+
+Telegram — заглушка ``FakeTelegram`` из ``benchmarks.broadcast`` (задержка ответа,
+лимиты 30/с на бота и 1/с на чат, заблокировавшие бота, одна пауза ``RetryAfter``),
+время сжато в ``--scale`` раз; в отчёте — секунды Telegram.
+
+* ``handler`` — прежние ``send_no_sub_notification`` и др.: ``send_message`` и
+  ``sleep(0.1)`` по очереди прямо в обработчике (``--legacy-users`` получателей, в
+  отчёте также пересчёт на ``--users``); обработчик занят до конца рассылки;
+* ``campaign`` — ``create_campaign`` + ``start_campaign`` со списком получателей и
+  сообщением для прогресса: время до возврата из обработчика, до конца рассылки и
+  число правок сообщения с прогрессом.
+
+Из каталога ``main``::
+
+    python -m benchmarks.notifications --users 20000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Dict
+
+from benchmarks.broadcast import TELEGRAM_RATE, FakeTelegram
+from benchmarks.broadcast_status import _service_module, _users_db
+
+
+class _Bot:
+    """``send_message`` — через заглушку Telegram, правки прогресса только считаются"""
+
+    def __init__(self, telegram: FakeTelegram) -> None:
+        self.telegram = telegram
+        self.edits = 0
+
+    async def send_message(self, chat_id: Any, text: str, **_: Any) -> None:
+        await self.telegram.send_message(chat_id=int(chat_id), text=text)
+
+    async def edit_message_text(self, **_: Any) -> None:
+        self.edits += 1
+
+
+class _ProgressMessage:
+    message_id = 1
+
+    class chat:
+        id = 1
+
+
+async def run_handler(users: int, args: argparse.Namespace) -> Dict[str, Any]:
+    telegram = FakeTelegram(args, users)
+    sent = failed = 0
+    started = time.perf_counter()
+    for uid in range(users):
+        try:
+            await telegram.send_message(chat_id=uid, text="hi")
+            sent += 1
+            await asyncio.sleep(0.1 / args.scale)  # Пауза между отправками
+        except Exception:
+            failed += 1
+    seconds = (time.perf_counter() - started) * args.scale
+    return {"users": users, "sent": sent, "failed": failed, "handler_seconds": round(seconds, 1)}
+
+
+async def run_campaign(path: str, users: int, args: argparse.Namespace) -> Dict[str, Any]:
+    bot = _Bot(FakeTelegram(args, users))
+    service = _service_module().BroadcastService(bot, db_path=path)
+    service.sender.bucket.rate = service.rate * args.scale
+    service.sender.per_chat.period = 1.0 / args.scale
+    service.sender.retry_delay = service.retry_delay / args.scale
+    service.progress.interval = service.progress.interval / args.scale
+    await service.init_database()
+
+    started = time.perf_counter()
+    campaign_id = await service.create_campaign("bench", "hi", "no_subscription")
+    await service.start_campaign(campaign_id, recipients=range(users), progress_message=_ProgressMessage())
+    handler = time.perf_counter() - started
+    campaign = service.active_campaigns[campaign_id]
+    while campaign.status.value == "sending":
+        await asyncio.sleep(0.01)
+    total = time.perf_counter() - started
+    await service.close()
+    return {
+        "users": users,
+        "sent": campaign.sent_count,
+        "blocked": campaign.blocked_count,
+        "failed": campaign.failed_count,
+        "handler_seconds": round(handler * args.scale, 2),
+        "delivery_seconds": round(total * args.scale, 1),
+        "progress_edits": bot.edits,
+        "flood_waits": service.sender.flood_waits,
+    }
+
+
+async def _run(args: argparse.Namespace) -> Dict[str, Any]:
+    report: Dict[str, Any] = {"theoretical_seconds": round(args.users / TELEGRAM_RATE + args.flood_seconds, 1)}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "users.db")
+        _users_db(path, 0)
+        report["campaign"] = await run_campaign(path, args.users, args)
+        print(f"  campaign: {report['campaign']}")
+    if args.legacy_users:
+        legacy = await run_handler(min(args.legacy_users, args.users), args)
+        legacy["extrapolated_handler_seconds"] = round(legacy["handler_seconds"] * args.users / legacy["users"], 1)
+        report["handler"] = legacy
+        print(f"   handler: {legacy}")
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Уведомления: цикл в обработчике против BroadcastService")
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--legacy-users", type=int, default=2_000, help="0 — не запускать прежний цикл")
+    parser.add_argument("--latency-ms", type=float, default=60.0)
+    parser.add_argument("--blocked", type=float, default=0.05, help="доля заблокировавших бота")
+    parser.add_argument("--flood-seconds", type=float, default=10.0)
+    parser.add_argument("--scale", type=float, default=20.0, help="во сколько раз сжать время")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+    # Без предупреждения на каждого заблокировавшего бота
+    logging.basicConfig(level=logging.ERROR)
+
+    report = asyncio.run(_run(args))
+    report.update({"timestamp": int(time.time()), "users": args.users, "scale": args.scale})
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+        print(f"results → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""Синтетическое наполнение ``users.db`` для бенчмарков.
+
+Схему создаёт сам бэкенд (``database.db.init_db``), затем таблица ``users`` заполняется
+конфигами с реалистичным распределением сроков:
+
+- ~25% свободных (``tg_id`` NULL, ``time_end = 0``);
+- ~55% активных (истекают равномерно в ближайшие 1..95 дней, у части — в ближайшие часы);
+- ~20% истёкших (закончились от часа до 60 дней назад).
+
+У каждого пользователя по конфигу на каждом сервере и постоянный ``sub_key``.
+С ``legacy=True`` данные пишутся в старую схему (TEXT ``tg_id``/``user_code``) — для замеров миграции.
+
+``seed_bot_database`` аналогично наполняет БД бота (``bot/database/db.py``): рефкоды,
+приглашения, баланс дней и оплаты.
+
+    python -m benchmarks.seed --size 100k --out /tmp/bench/users.db
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib.util
+import os
+import random
+import sqlite3
+import sys
+import time
+import uuid
+from typing import Any, Dict, List
+
+BOT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "bot")
+
+SIZES: Dict[str, int] = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+FREE_SHARE = 0.25
+EXPIRED_SHARE = 0.20
+
+# Схема users.db до перехода на компактное хранение (INTEGER tg_id, BLOB user_code)
+LEGACY_SCHEMA = (
+    '''CREATE TABLE users (
+        tg_id TEXT,
+        user_code TEXT,
+        time_end INTEGER,
+        server_country TEXT NOT NULL
+    )''',
+    'CREATE UNIQUE INDEX ux_users_user_code ON users(user_code)',
+    'CREATE INDEX ix_users_tg_id ON users(tg_id)',
+    'CREATE INDEX ix_users_time_end ON users(time_end)',
+    "CREATE INDEX ix_users_free_by_country ON users(server_country, time_end) WHERE tg_id IS NULL OR tg_id = ''",
+    'CREATE INDEX ix_users_country_time_end ON users(server_country, time_end)',
+    '''CREATE TABLE subscription_keys (
+        sub_key TEXT PRIMARY KEY,
+        tg_id TEXT NOT NULL
+    )''',
+    'CREATE INDEX ix_subscription_keys_tg_id ON subscription_keys(tg_id)',
+)
+
+
+def parse_size(raw: str) -> int:
+    key = raw.strip().lower()
+    if key in SIZES:
+        return SIZES[key]
+    return int(key.replace("_", ""))
+
+
+def create_schema(db_path: str) -> None:
+    """Создаёт схему тем же кодом, что и бэкенд при старте."""
+    from database import db as backend_db
+
+    directory = os.path.dirname(os.path.abspath(db_path))
+    prev = os.getcwd()
+    os.makedirs(directory, exist_ok=True)
+    os.chdir(directory)
+    try:
+        asyncio.run(backend_db.init_db())
+    finally:
+        os.chdir(prev)
+    default_path = os.path.join(directory, "users.db")
+    if os.path.abspath(db_path) != default_path:
+        os.replace(default_path, db_path)
+
+
+def seed_database(
+    db_path: str,
+    size: int,
+    servers: List[str] | None = None,
+    seed: int = 1,
+    sample: int = 5000,
+    legacy: bool = False,
+) -> Dict[str, Any]:
+    """Заполняет БД ``size`` конфигами. Возвращает манифест с выборками для нагрузки."""
+    from database.db import code_to_db, tg_to_db
+
+    servers = servers or ["ge"]
+    rnd = random.Random(seed)
+    now = int(time.time())
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    if legacy:
+        to_code, to_tg = str, str
+        conn = sqlite3.connect(db_path)
+        for statement in LEGACY_SCHEMA:
+            conn.execute(statement)
+    else:
+        to_code, to_tg = code_to_db, tg_to_db
+        create_schema(db_path)
+        conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+
+    free_total = int(size * FREE_SHARE)
+    owned_total = size - free_total
+    users_total = max(1, owned_total // len(servers))
+
+    active_uids: List[tuple[str, str]] = []
+    sub_keys: List[str] = []
+    rows: List[tuple] = []
+    key_rows: List[tuple] = []
+    tg_base = 5_000_000_000
+
+    def _flush() -> None:
+        if rows:
+            conn.executemany("INSERT INTO users (tg_id, user_code, time_end, server_country) VALUES (?, ?, ?, ?)", rows)
+            rows.clear()
+        if key_rows:
+            conn.executemany("INSERT OR REPLACE INTO subscription_keys (sub_key, tg_id) VALUES (?, ?)", key_rows)
+            key_rows.clear()
+
+    for i in range(users_total):
+        tg_id = str(tg_base + i)
+        if rnd.random() < EXPIRED_SHARE:
+            time_end = now - rnd.randint(3600, 60 * 86400)
+        elif rnd.random() < 0.05:
+            # Истекают в ближайшие часы — попадают в /expiring-users
+            time_end = now + rnd.randint(600, 8 * 3600)
+        else:
+            time_end = now + rnd.randint(86400, 95 * 86400)
+        sub_key = uuid.UUID(int=rnd.getrandbits(128)).hex
+        key_rows.append((sub_key, to_tg(tg_id)))
+        if time_end > now and len(sub_keys) < sample:
+            sub_keys.append(sub_key)
+        for server in servers:
+            uid = str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+            rows.append((to_tg(tg_id), to_code(uid), time_end, server))
+            if time_end > now and len(active_uids) < sample:
+                active_uids.append((uid, server))
+        if len(rows) >= 50_000:
+            _flush()
+
+    for i in range(free_total):
+        uid = str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+        if legacy and i < 10:
+            # Несколько незавершённых оплат: в старой схеме резерв хранится маркером в tg_id
+            rows.append((f"__RESERVED__:{tg_base + i}", uid, now + 60, servers[i % len(servers)]))
+            continue
+        rows.append((None, to_code(uid), 0, servers[i % len(servers)]))
+        if len(rows) >= 50_000:
+            _flush()
+    _flush()
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.commit()
+    total = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    conn.close()
+
+    return {
+        "db_path": os.path.abspath(db_path),
+        "size": total,
+        "servers": servers,
+        "users": users_total,
+        "tg_base": tg_base,
+        "free": free_total,
+        "active_uids": active_uids,
+        "sub_keys": sub_keys,
+        "new_tg_base": tg_base + users_total + 1,
+    }
+
+
+def _load_module(name: str, path: str):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_bot_module(name: str, relpath: str, deps: Dict[str, str]):
+    """Импортирует модуль бота по пути (у бэкенда свои пакеты ``database`` и ``services``).
+
+    ``deps`` — модули бота, которые он импортирует (``{"database.pool": "database/pool.py"}``):
+    на время загрузки они подставляются под этими именами, потом имена восстанавливаются.
+    """
+    saved = {dotted: sys.modules.get(dotted) for dotted in deps}
+    try:
+        for dotted, dep_path in deps.items():
+            sys.modules[dotted] = _load_module("bot_" + dotted.replace(".", "_"), os.path.join(BOT_DIR, dep_path))
+        return _load_module(name, os.path.join(BOT_DIR, relpath))
+    finally:
+        for dotted, module in saved.items():
+            if module is None:
+                sys.modules.pop(dotted, None)
+            else:
+                sys.modules[dotted] = module
+
+
+def load_bot_db():
+    """Импортирует ``bot/database/db.py`` вместе с модулями бота, от которых он зависит."""
+    return load_bot_module(
+        "bot_database_db",
+        os.path.join("database", "db.py"),
+        {
+            "database.pool": os.path.join("database", "pool.py"),
+            "database.user_cache": os.path.join("database", "user_cache.py"),
+            "database.referral_codes": os.path.join("database", "referral_codes.py"),
+        },
+    )
+
+
+async def _init_bot_db(bot_db) -> None:
+    try:
+        await bot_db.init_db()
+    finally:
+        # Потоки соединений пула не фоновые: без close процесс не завершится
+        await bot_db.pool.close()
+
+
+def create_bot_schema(db_path: str) -> None:
+    bot_db = load_bot_db()
+    directory = os.path.dirname(os.path.abspath(db_path))
+    prev = os.getcwd()
+    os.makedirs(directory, exist_ok=True)
+    os.chdir(directory)
+    try:
+        asyncio.run(_init_bot_db(bot_db))
+    finally:
+        os.chdir(prev)
+    default_path = os.path.join(directory, "users.db")
+    if os.path.abspath(db_path) != default_path:
+        os.replace(default_path, db_path)
+
+
+def seed_bot_database(db_path: str, size: int, seed: int = 1, sample: int = 5000) -> Dict[str, Any]:
+    """Заполняет БД бота ``size`` пользователями. Возвращает манифест с выборками."""
+    rnd = random.Random(seed)
+    now = int(time.time())
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    create_bot_schema(db_path)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+
+    insert_sql = (
+        "INSERT INTO users (tg_id, referral_code, referred_by, referral_count, trial_3d_used,"
+        " balance, paid_count, last_payment_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    )
+    tg_base = 5_000_000_000
+    code_base = 10_000_000_000
+    tg_ids: List[str] = []
+    referral_codes: List[str] = []
+    rows: List[tuple] = []
+    for i in range(size):
+        tg_id = str(tg_base + i)
+        code = str(code_base + i * 7 + 3)
+        # Примерно треть пришла по приглашению от кого-то из уже созданных
+        referred_by = str(code_base + rnd.randrange(i) * 7 + 3) if i and rnd.random() < 0.33 else None
+        paid = rnd.random() < 0.3
+        rows.append((
+            tg_id,
+            code,
+            referred_by,
+            rnd.randint(0, 3) if rnd.random() < 0.2 else 0,
+            1 if rnd.random() < 0.6 else 0,
+            rnd.randint(0, 90) if rnd.random() < 0.1 else 0,
+            rnd.randint(1, 12) if paid else 0,
+            now - rnd.randint(0, 180 * 86400) if paid else 0,
+            now - rnd.randint(0, 365 * 86400),
+        ))
+        if len(tg_ids) < sample:
+            tg_ids.append(tg_id)
+            referral_codes.append(code)
+        if len(rows) >= 50_000:
+            conn.executemany(insert_sql, rows)
+            rows.clear()
+    if rows:
+        conn.executemany(insert_sql, rows)
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.commit()
+    total = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    conn.close()
+
+    return {
+        "db_path": os.path.abspath(db_path),
+        "size": total,
+        "tg_ids": tg_ids,
+        "referral_codes": referral_codes,
+        "new_tg_base": tg_base + size + 1,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Синтетическое наполнение users.db")
+    parser.add_argument("--size", default="10k", help="10k | 100k | 1m | число")
+    parser.add_argument("--servers", default="ge", help="через запятую, например ge,ge2")
+    parser.add_argument("--out", default="users.db")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--bot", action="store_true", help="наполнить БД бота вместо БД бэкенда")
+    parser.add_argument("--legacy", action="store_true", help="старая схема users (до компактной)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.bot:
+        manifest = seed_bot_database(args.out, parse_size(args.size), seed=args.seed)
+        print(f"seeded {manifest['size']} bot users into {manifest['db_path']} in {time.perf_counter() - started:.1f}s")
+        return
+    manifest = seed_database(
+        args.out,
+        parse_size(args.size),
+        [s.strip().lower() for s in args.servers.split(",") if s.strip()],
+        seed=args.seed,
+        legacy=args.legacy,
+    )
+    print(f"seeded {manifest['size']} configs into {manifest['db_path']} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Сегменты рассылок: SELECT в список против ``SegmentEngine`` (``bot/services/segments.py``).
+
+На ``--users`` пользователях бота (``--active`` из них с активной подпиской на бэкенде):
+
+* ``list`` — прежний ``get_users_by_segment``: SELECT по ``users`` и список ``tg_id``;
+  время и пик памяти для каждого сегмента;
+* ``engine`` — полный пересчёт ``user_segments`` (первый запуск), затем
+  инкрементальный после ``--changes`` изменённых пользователей и ухода/прихода
+  ``--churn`` доли активных; обновление без изменений (бэкенд отвечает 304);
+  ``count`` и потоковый обход сегмента — время и пик памяти.
+
+Из каталога ``main``::
+
+    python -m benchmarks.segments --users 1000000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+import aiosqlite
+
+from benchmarks.seed import load_bot_module
+
+LEGACY_SEGMENTS = {
+    "all": "SELECT tg_id FROM users",
+    "active": "SELECT tg_id FROM users WHERE balance > 0",
+    "no_subscription": "SELECT tg_id FROM users WHERE balance <= 0",
+    "vip": "SELECT tg_id FROM users WHERE paid_count >= 5",
+}
+
+
+def _users_db(path: str, users: int, seed: int) -> None:
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        """
+        CREATE TABLE users (
+            tg_id TEXT UNIQUE, referral_code TEXT UNIQUE, referred_by TEXT,
+            referral_count INTEGER DEFAULT 0, trial_3d_used INTEGER DEFAULT 0,
+            balance INTEGER DEFAULT 0, paid_count INTEGER DEFAULT 0,
+            last_payment_at INTEGER DEFAULT 0, created_at INTEGER DEFAULT 0
+        )
+        """
+    )
+    conn.executemany(
+        "INSERT INTO users (tg_id, referral_count, trial_3d_used, balance, paid_count) VALUES (?, ?, ?, ?, ?)",
+        (
+            (str(1_000_000_000 + i), rnd.choice((0, 0, 0, 1, 3)), rnd.randint(0, 1), rnd.choice((0, 0, 5, 30)), rnd.choice((0, 0, 1, 2, 6)))
+            for i in range(users)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+async def _measure(coro) -> tuple[Any, float, float]:
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = await coro
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, round(elapsed * 1000, 1), round(peak / 1e6, 2)
+
+
+async def run_list(path: str) -> Dict[str, Any]:
+    async def select(sql: str) -> List[str]:
+        async with aiosqlite.connect(path) as conn:
+            async with conn.execute(sql) as cursor:
+                return [row[0] for row in await cursor.fetchall() if row[0]]
+
+    report = {}
+    for segment, sql in LEGACY_SEGMENTS.items():
+        ids, ms, peak = await _measure(select(sql))
+        report[segment] = {"users": len(ids), "ms": ms, "peak_mb": peak}
+    return report
+
+
+async def run_engine(path: str, args: argparse.Namespace) -> Dict[str, Any]:
+    segments = load_bot_module("bot_services_segments", os.path.join("services", "segments.py"), {})
+    rnd = random.Random(args.seed)
+    all_ids = [str(1_000_000_000 + i) for i in range(args.users)]
+    active = set(rnd.sample(all_ids, int(args.users * args.active)))
+    state = {"etag": "v1", "fetches": 0}
+
+    async def fetch(etag: Optional[str]):
+        state["fetches"] += 1
+        if etag == state["etag"]:
+            return None, etag
+        return list(active), state["etag"]
+
+    engine = segments.SegmentEngine(fetch, db_path=path, refresh_interval=3600)
+    report: Dict[str, Any] = {}
+    _, report["full_rebuild_ms"], report["full_rebuild_peak_mb"] = await _measure(engine.refresh())
+    _, report["refresh_unchanged_ms"], _ = await _measure(engine.refresh())
+
+    # Изменения в боте (оплаты, рефералы) и на бэкенде (подписки начались/закончились)
+    with sqlite3.connect(path) as conn:
+        conn.executemany(
+            "UPDATE users SET paid_count = paid_count + 1, referral_count = referral_count + 1 WHERE tg_id = ?",
+            ((tg_id,) for tg_id in rnd.sample(all_ids, args.changes)),
+        )
+    churn = int(len(active) * args.churn)
+    for tg_id in rnd.sample(sorted(active), churn):
+        active.discard(tg_id)
+    active.update(rnd.sample(all_ids, churn))
+    state["etag"] = "v2"
+    _, report["incremental_ms"], report["incremental_peak_mb"] = await _measure(engine.refresh())
+    report["incremental_users"] = engine.recomputed_users - args.users
+
+    for segment in LEGACY_SEGMENTS:
+        count, count_ms, _ = await _measure(engine.count(segment))
+
+        async def walk() -> int:
+            return sum([1 async for _ in engine.iter_ids(segment)])
+
+        walked, walk_ms, walk_peak = await _measure(walk())
+        assert walked == count
+        report[segment] = {"users": count, "count_ms": count_ms, "iter_ms": walk_ms, "iter_peak_mb": walk_peak}
+    report["stats"] = engine.stats()
+    return report
+
+
+async def _run(args: argparse.Namespace) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "users.db")
+        _users_db(path, args.users, args.seed)
+        report = {"list": await run_list(path)}
+        print(f"    list: {report['list']}")
+        report["engine"] = await run_engine(path, args)
+        print(f"  engine: {report['engine']}")
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Сегменты: SELECT в список против SegmentEngine")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--active", type=float, default=0.2, help="доля пользователей с активной подпиской")
+    parser.add_argument("--changes", type=int, default=1000, help="изменённых пользователей бота")
+    parser.add_argument("--churn", type=float, default=0.01, help="доля активных, сменившихся на бэкенде")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    report = asyncio.run(_run(args))
+    report.update({"timestamp": int(time.time()), "users": args.users})
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+        print(f"results → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
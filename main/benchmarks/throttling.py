@@ -0,0 +1,195 @@
+"""Троттлинг бота на 100k разных пользователей: очереди под общей блокировкой против GCRA.
+
+Прогоняет через ``ThrottlingMiddleware`` бота (GCRA, ``bot/services/rate_limit.py``) и через
+прежнюю реализацию (deque отметок на ключ под одним ``asyncio.Lock``, без вытеснения):
+
+* ``--users`` разных пользователей по ``--events`` событий, пачками по ``--concurrency``
+  одновременных апдейтов — пропускная способность и p50/p99 на событие;
+* память состояния после прогона (tracemalloc) и число ключей;
+* число ключей после простоя дольше окна — прежняя реализация не освобождает ничего.
+
+Из каталога ``main``::
+
+    python -m benchmarks.throttling --users 100000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import tracemalloc
+from collections import deque
+from typing import Any, Deque, Dict, Hashable, List, Optional, Tuple
+
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message
+
+from benchmarks.seed import load_bot_module
+
+
+class LegacyThrottlingMiddleware:
+    """Прежний ``ThrottlingMiddleware`` (без уведомления о троттлинге)."""
+
+    def __init__(self, default_window: float = 1.5, default_burst: int = 3) -> None:
+        self.default_window = max(0.1, float(default_window))
+        self.default_burst = max(1, int(default_burst))
+        self.allowlist_user_ids: set = set()
+        self._buckets: Dict[Tuple[int, Hashable], Deque[float]] = {}
+        self._lock = asyncio.Lock()
+
+    async def __call__(self, handler, event, data):
+        user_id = self._extract_user_id(event)
+        if user_id is None or user_id in self.allowlist_user_ids:
+            return await handler(event, data)
+        if get_flag(data, "throttle_exempt") is True:
+            return await handler(event, data)
+
+        throttle_key = self._resolve_key(handler, data)
+        window = float(get_flag(data, "throttle_window") or self.default_window)
+        burst = int(get_flag(data, "throttle_burst") or self.default_burst)
+
+        now = time.monotonic()
+        key = (user_id, throttle_key)
+
+        async with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = deque()
+                self._buckets[key] = bucket
+            cutoff = now - window
+            while bucket and bucket[0] <= cutoff:
+                bucket.popleft()
+            if len(bucket) >= burst:
+                return None
+            bucket.append(now)
+
+        return await handler(event, data)
+
+    @staticmethod
+    def _extract_user_id(event) -> Optional[int]:
+        if isinstance(event, Message) and event.from_user:
+            return event.from_user.id
+        if isinstance(event, CallbackQuery) and event.from_user:
+            return event.from_user.id
+        user = getattr(event, "from_user", None)
+        return getattr(user, "id", None)
+
+    @staticmethod
+    def _resolve_key(handler, data) -> Hashable:
+        explicit = get_flag(data, "throttle_key")
+        if explicit is not None:
+            return explicit
+        callback = getattr(handler, "callback", None)
+        if callback is not None:
+            return getattr(callback, "__name__", str(callback))
+        return "__unknown_handler__"
+
+    def keys(self) -> int:
+        return len(self._buckets)
+
+
+class _User:
+    __slots__ = ("id",)
+
+    def __init__(self, user_id: int) -> None:
+        self.id = user_id
+
+
+class _Event:
+    __slots__ = ("from_user",)
+
+    def __init__(self, user_id: int) -> None:
+        self.from_user = _User(user_id)
+
+
+async def _handler(event, data):
+    return True
+
+
+async def _drive(middleware, events: List[_Event], concurrency: int) -> Dict[str, Any]:
+    samples: List[float] = []
+    passed = 0
+
+    async def one(event) -> None:
+        nonlocal passed
+        started = time.perf_counter()
+        if await middleware(_handler, event, {}):
+            passed += 1
+        samples.append((time.perf_counter() - started) * 1e6)
+
+    started = time.perf_counter()
+    for i in range(0, len(events), concurrency):
+        await asyncio.gather(*(one(event) for event in events[i:i + concurrency]))
+    elapsed = time.perf_counter() - started
+    samples.sort()
+    return {
+        "events": len(events),
+        "passed": passed,
+        "events_per_sec": round(len(events) / elapsed),
+        "p50_us": round(samples[len(samples) // 2], 2),
+        "p99_us": round(samples[int(len(samples) * 0.99)], 2),
+    }
+
+
+async def _state_bytes(middleware, events: List[_Event]) -> int:
+    """Сколько памяти middleware удерживает после прогона (отдельно: tracemalloc замедляет)."""
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    for event in events:
+        await middleware(_handler, event, {})
+    # События созданы до замера и живы до конца — в разницу попадает только состояние
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return used
+
+
+async def _run(args: argparse.Namespace) -> Dict[str, Any]:
+    throttling = load_bot_module(
+        "bot_middlewares_throttling",
+        os.path.join("middlewares", "throttling.py"),
+        {"services.rate_limit": os.path.join("services", "rate_limit.py")},
+    )
+    events = [_Event(1_000_000 + u) for u in range(args.users) for _ in range(args.events)]
+    factories = {
+        "legacy": lambda: LegacyThrottlingMiddleware(args.window, args.burst),
+        "gcra": lambda: throttling.ThrottlingMiddleware(default_window=args.window, default_burst=args.burst),
+    }
+    report: Dict[str, Any] = {}
+    for name, factory in factories.items():
+        middleware = factory()
+        result = await _drive(middleware, events, args.concurrency)
+        keys = middleware.keys() if name == "legacy" else len(middleware.limiter)
+        # Простой дольше окна, затем одно событие — GCRA вычищает просроченные ключи
+        await asyncio.sleep(args.window + 1.1)
+        await middleware(_handler, _Event(1), {})
+        keys_after_idle = middleware.keys() if name == "legacy" else len(middleware.limiter)
+        state = await _state_bytes(factory(), events)
+        result.update({"keys": keys, "keys_after_idle": keys_after_idle, "state_mib": round(state / 1048576, 2)})
+        report[name] = result
+        print(f"{name:>8}: {result}")
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ThrottlingMiddleware: deque+lock против GCRA на многих пользователях")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--events", type=int, default=4, help="событий на пользователя (при burst=3 одно отсекается)")
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--window", type=float, default=1.5)
+    parser.add_argument("--burst", type=int, default=3)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    report = asyncio.run(_run(args))
+    report.update({"timestamp": int(time.time()), "users": args.users, "events_per_user": args.events})
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+        print(f"results → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from ast import List
 import aiosqlite
+import logging
 import time
 from typing import Dict, Optional
 import uuid
@@ -9,51 +10,243 @@ country = {
     "ge": "Германия"
 }
 
+logger = logging.getLogger("database")
+
+RESERVED_PREFIX = "__RESERVED__:"
+
+
+# -------------------------------------------------
+# Компактное хранение: tg_id — INTEGER (NULL = свободен), user_code — 16-байтовый UUID.
+# Снаружи (роутеры, API) по-прежнему строки, конвертация только здесь.
+# -------------------------------------------------
+
+def code_to_db(user_code):
+    """Канонический UUID -> 16 байт; всё остальное (старые нестандартные коды) храним как есть."""
+    if isinstance(user_code, str) and len(user_code) == 36:
+        try:
+            parsed = uuid.UUID(user_code)
+        except ValueError:
+            return user_code
+        if str(parsed) == user_code:
+            return parsed.bytes
+    return user_code
+
+
+def code_from_db(value):
+    if isinstance(value, bytes) and len(value) == 16:
+        return str(uuid.UUID(bytes=value))
+    return value
+
+
+def tg_to_db(tg_id):
+    """'123' / 123 -> 123; пусто -> NULL. Нечисловые значения остаются текстом."""
+    if tg_id is None:
+        return None
+    if isinstance(tg_id, int):
+        return tg_id
+    text = str(tg_id).strip()
+    if not text:
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        return text
+
+
+def tg_from_db(value):
+    return None if value is None else str(value)
+
+
+# users остаётся rowid-таблицей: у неё четыре вторичных индекса, и в WITHOUT ROWID каждый из них
+# тащил бы 16-байтовый user_code вместо rowid — замеры (benchmarks/compact_schema.py) дают файл больше.
+USERS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS users (
+        user_code      BLOB NOT NULL UNIQUE,
+        tg_id          INTEGER,
+        time_end       INTEGER NOT NULL DEFAULT 0,
+        server_country TEXT NOT NULL,
+        reserved_by    INTEGER
+    )
+'''
+
+# Узкая таблица без вторичных данных: ключ хранится один раз вместо таблицы + autoindex
+SUBSCRIPTION_KEYS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS subscription_keys (
+        sub_key TEXT PRIMARY KEY NOT NULL,
+        tg_id   INTEGER NOT NULL
+    ) WITHOUT ROWID
+'''
+
+USERS_INDEXES = (
+    # Поиск по пользователю; свободные строки (NULL) в индекс не попадают
+    'CREATE INDEX IF NOT EXISTS ix_users_tg_id ON users(tg_id) WHERE tg_id IS NOT NULL',
+    # Захват свободного/истёкшего конфига на сервере: (time_end = 0 OR time_end < ?) AND server_country = ?
+    # tg_id в хвосте делает индекс покрывающим для get_server_pool_stats
+    'CREATE INDEX IF NOT EXISTS ix_users_country_time_end ON users(server_country, time_end, tg_id)',
+    # Массовые операции по истечению срока
+    'CREATE INDEX IF NOT EXISTS ix_users_time_end ON users(time_end)',
+    # Активные резервации (оплата в процессе) — единицы строк
+    'CREATE INDEX IF NOT EXISTS ix_users_reserved ON users(reserved_by) WHERE reserved_by IS NOT NULL',
+)
+
+# Конфиги, выведенные из пула: строка users переносится сюда до удаления клиента с панели,
+# чтобы её не выдали заново. panel_deleted_at — когда панель подтвердила удаление.
+PRUNED_CONFIGS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS pruned_configs (
+        user_code        BLOB PRIMARY KEY NOT NULL,
+        tg_id            INTEGER,
+        time_end         INTEGER NOT NULL,
+        server_country   TEXT NOT NULL,
+        pruned_at        INTEGER NOT NULL,
+        panel_deleted_at INTEGER
+    )
+'''
+
+# Журнал изменений users для снимка чтения (services/config_snapshot.py). Триггеры ловят
+# любые записи, в том числе из других процессов (retention в контейнере бэкапов).
+CONFIG_CHANGES_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS config_changes (
+        seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_code  BLOB NOT NULL,
+        changed_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS ix_config_changes_changed_at ON config_changes(changed_at)',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_users_changes_insert AFTER INSERT ON users
+    BEGIN
+        INSERT INTO config_changes (user_code) VALUES (NEW.user_code);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_users_changes_update AFTER UPDATE ON users
+    BEGIN
+        INSERT INTO config_changes (user_code) VALUES (NEW.user_code);
+        INSERT INTO config_changes (user_code) SELECT OLD.user_code WHERE OLD.user_code IS NOT NEW.user_code;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_users_changes_delete AFTER DELETE ON users
+    BEGIN
+        INSERT INTO config_changes (user_code) VALUES (OLD.user_code);
+    END
+    ''',
+)
+
+
+async def _is_legacy_schema(conn) -> bool:
+    cursor = await conn.execute("PRAGMA table_info(users)")
+    columns = {row[1] for row in await cursor.fetchall()}
+    await cursor.close()
+    return bool(columns) and "reserved_by" not in columns
+
+
+async def migrate_to_compact_schema(conn) -> dict:
+    """Переносит старую схему (TEXT tg_id с маркерами резерва, TEXT user_code) в компактную.
+
+    Выполняется в одной транзакции; строки без user_code отбрасываются. Возвращает статистику.
+    """
+    await conn.create_function("compact_code", 1, code_to_db, deterministic=True)
+    await conn.create_function("compact_tg", 1, tg_to_db, deterministic=True)
+    prefix_len = len(RESERVED_PREFIX)
+    await conn.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = await conn.execute("SELECT COUNT(*) FROM users")
+        before = (await cursor.fetchone())[0]
+        await conn.execute("DROP TABLE IF EXISTS users_compact")
+        await conn.execute(USERS_SCHEMA.replace("users (", "users_compact (", 1))
+        await conn.execute(
+            f'''
+            INSERT OR IGNORE INTO users_compact (user_code, tg_id, time_end, server_country, reserved_by)
+            SELECT compact_code(user_code),
+                   CASE WHEN tg_id LIKE '{RESERVED_PREFIX}%' THEN NULL ELSE compact_tg(tg_id) END,
+                   COALESCE(time_end, 0),
+                   server_country,
+                   CASE WHEN tg_id LIKE '{RESERVED_PREFIX}%' THEN compact_tg(substr(tg_id, {prefix_len + 1})) END
+            FROM users
+            WHERE user_code IS NOT NULL AND user_code != ''
+            '''
+        )
+        cursor = await conn.execute("SELECT COUNT(*) FROM users_compact")
+        after = (await cursor.fetchone())[0]
+        await conn.execute("DROP TABLE users")
+        await conn.execute("ALTER TABLE users_compact RENAME TO users")
+        for statement in USERS_INDEXES:
+            await conn.execute(statement)
+
+        cursor = await conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'subscription_keys'")
+        if await cursor.fetchone():
+            await conn.execute("DROP TABLE IF EXISTS subscription_keys_compact")
+            await conn.execute(SUBSCRIPTION_KEYS_SCHEMA.replace("subscription_keys (", "subscription_keys_compact (", 1))
+            await conn.execute(
+                '''
+                INSERT OR IGNORE INTO subscription_keys_compact (sub_key, tg_id)
+                SELECT sub_key, compact_tg(tg_id) FROM subscription_keys
+                WHERE sub_key IS NOT NULL AND tg_id IS NOT NULL AND tg_id != ''
+                '''
+            )
+            await conn.execute("DROP TABLE subscription_keys")
+            await conn.execute("ALTER TABLE subscription_keys_compact RENAME TO subscription_keys")
+        await conn.execute('CREATE INDEX IF NOT EXISTS ix_subscription_keys_tg_id ON subscription_keys(tg_id)')
+        await conn.commit()
+    except Exception:
+        await conn.rollback()
+        raise
+    return {"rows_before": before, "rows_after": after, "dropped": before - after}
+
+
 async def init_db():
     async with aiosqlite.connect("users.db") as conn:
+        if await _is_legacy_schema(conn):
+            stats = await migrate_to_compact_schema(conn)
+            # Освобождаем место старых таблиц и индексов
+            await conn.execute("VACUUM")
+            logger.info("users.db migrated to compact schema: %s", stats)
         cursor = await conn.cursor()
+        await cursor.execute(USERS_SCHEMA)
+        for statement in USERS_INDEXES:
+            await cursor.execute(statement)
+        for statement in CONFIG_CHANGES_SCHEMA:
+            await cursor.execute(statement)
+        await conn.commit()
+
+        # Ключи идемпотентности /giveconfig и /extendconfig: повтор запроса получает сохранённый ответ
         await cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                tg_id TEXT,
-                user_code TEXT, 
-                time_end INTEGER,
-                server_country TEXT NOT NULL
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                idem_key    TEXT PRIMARY KEY,
+                endpoint    TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                response    TEXT NOT NULL,
+                created_at  INTEGER NOT NULL
             )
         ''')
-        # Индексы для ускорения частых операций
-        # Уникальность по коду конфига
-        await cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_users_user_code ON users(user_code)')
-        # Поиск по пользователю
-        await cursor.execute('CREATE INDEX IF NOT EXISTS ix_users_tg_id ON users(tg_id)')
-        # Массовые операции по истечению срока
-        await cursor.execute('CREATE INDEX IF NOT EXISTS ix_users_time_end ON users(time_end)')
-        # Быстрый поиск свободных конфигов по стране
-        await cursor.execute(
-            """
-            CREATE INDEX IF NOT EXISTS ix_users_free_by_country
-            ON users(server_country, time_end)
-            WHERE tg_id IS NULL OR tg_id = ''
-            """
-        )
+        await cursor.execute('CREATE INDEX IF NOT EXISTS ix_idempotency_created ON idempotency_keys(created_at)')
+        await conn.commit()
+
+        # Давно истёкшие конфиги, убранные из users: клиент удаляется с панели, после чего
+        # строку уносит в архив ретеншн (backup/retention.py)
+        await cursor.execute(PRUNED_CONFIGS_SCHEMA)
         await conn.commit()
 
         # Таблица ключей подписки: sub_key -> tg_id
-        await cursor.execute('''
-            CREATE TABLE IF NOT EXISTS subscription_keys (
-                sub_key TEXT PRIMARY KEY,
-                tg_id   TEXT NOT NULL
-            )
-        ''')
+        await cursor.execute(SUBSCRIPTION_KEYS_SCHEMA)
+        # Обратный поиск sub_key по пользователю (get_or_create_sub_key на каждый /sub/{tg_id})
+        await cursor.execute('CREATE INDEX IF NOT EXISTS ix_subscription_keys_tg_id ON subscription_keys(tg_id)')
         await conn.commit()
 
+# Окно «скоро истекает» для /expiring-users (историческое имя функции — 5 часов)
+EXPIRING_WINDOW_SECONDS = 8 * 3600
+
+
 async def users_with_subscription_expiring_within_5h(db_path: str = "users.db"):
     now = int(time.time())
-    five_hours = 8 * 3600  # 18000
+    five_hours = EXPIRING_WINDOW_SECONDS
 
     query = """
     SELECT tg_id, MIN(time_end) AS time_end
     FROM users
-    WHERE tg_id IS NOT NULL AND tg_id != ''
+    WHERE tg_id IS NOT NULL
       AND time_end > :now
       AND time_end - :now <= :five_hours
     GROUP BY tg_id
@@ -66,23 +259,23 @@ async def users_with_subscription_expiring_within_5h(db_path: str = "users.db"):
         rows = await cur.fetchall()
         await cur.close()
 
-    return [{"tg_id": r["tg_id"], "time_end": int(r["time_end"])} for r in rows]
+    return [{"tg_id": tg_from_db(r["tg_id"]), "time_end": int(r["time_end"])} for r in rows]
 
 async def insert_into_db(tg_id, user_code, time_end, server_country):
     async with aiosqlite.connect("users.db") as conn:
         cursor = await conn.cursor()
         await cursor.execute('''
             INSERT INTO users (tg_id, user_code, time_end, server_country) VALUES (?, ?, ?, ?)
-        ''', (tg_id, user_code, time_end, server_country))
+        ''', (tg_to_db(tg_id), code_to_db(user_code), int(time_end or 0), server_country))
         await conn.commit()
 
 async def get_codes_by_tg_id(tg_id):
     async with aiosqlite.connect("users.db") as conn:
         async with conn.cursor() as cursor:
-            await cursor.execute('SELECT user_code, time_end, server_country FROM users WHERE tg_id = ?', (tg_id,))
+            await cursor.execute('SELECT user_code, time_end, server_country FROM users WHERE tg_id = ?', (tg_to_db(tg_id),))
             rows = await cursor.fetchall() 
     
-    return rows
+    return [(code_from_db(code), time_end, server) for code, time_end, server in rows]
 
 async def get_all_user_codes() -> list[tuple[str, str]]:
     """Возвращает все (user_code, server_country) из таблицы users."""
@@ -90,7 +283,7 @@ async def get_all_user_codes() -> list[tuple[str, str]]:
         async with conn.cursor() as cursor:
             await cursor.execute('SELECT user_code, server_country FROM users')
             rows = await cursor.fetchall()
-    return rows
+    return [(code_from_db(code), server) for code, server in rows]
 
 async def get_all_rows() -> list[tuple[str | None, str, int, str]]:
     """Возвращает все строки users как (tg_id, user_code, time_end, server_country)."""
@@ -98,7 +291,7 @@ async def get_all_rows() -> list[tuple[str | None, str, int, str]]:
         async with conn.cursor() as cursor:
             await cursor.execute('SELECT tg_id, user_code, time_end, server_country FROM users')
             rows = await cursor.fetchall()
-    return rows
+    return [(tg_from_db(tg_id), code_from_db(code), time_end, server) for tg_id, code, time_end, server in rows]
 
 async def get_one_expired_client(server_country: str | None = None):
     """Возвращает один истекший конфиг (с time_end = 0 или time_end < current_time), независимо от tg_id.
@@ -115,7 +308,7 @@ async def get_one_expired_client(server_country: str | None = None):
             current_time = int(time.time())
             
             await cursor.execute('''
-                SELECT * FROM users
+                SELECT tg_id, user_code, time_end, server_country FROM users
                 WHERE (time_end = 0 OR time_end < ?)
                   AND server_country = ?
                 LIMIT 1
@@ -123,7 +316,10 @@ async def get_one_expired_client(server_country: str | None = None):
             
             expired_client = await cursor.fetchone()
     
-    return expired_client
+    if expired_client is None:
+        return None
+    tg_id, user_code, time_end, server = expired_client
+    return (tg_from_db(tg_id), code_from_db(user_code), time_end, server)
 
 
 async def count_available_configs(server_country: str) -> int:
@@ -158,7 +354,7 @@ async def has_any_expired_configs() -> bool:
 
 async def reset_expired_configs():
     """
-    Сбрасывает tg_id в пустую строку для всех конфигов, у которых истёк срок действия.
+    Отвязывает (tg_id = NULL) все конфиги и резервации, у которых истёк срок действия.
     Возвращает количество обновлённых записей.
     """
     async with aiosqlite.connect("users.db") as conn:
@@ -167,8 +363,9 @@ async def reset_expired_configs():
             
             await cursor.execute('''
                 UPDATE users 
-                SET tg_id = '' 
+                SET tg_id = NULL, reserved_by = NULL
                 WHERE time_end > 0 AND time_end < ?
+                  AND (tg_id IS NOT NULL OR reserved_by IS NOT NULL)
             ''', (current_time,))
             
             await conn.commit()
@@ -179,9 +376,9 @@ async def update_user_code(tg_id: str, user_code: str, time_end: int, server_cou
         async with conn.cursor() as cursor:
             await cursor.execute('''
                 UPDATE users
-                SET tg_id = ?, time_end = ?, server_country = ?
+                SET tg_id = ?, time_end = ?, server_country = ?, reserved_by = NULL
                 WHERE user_code = ?
-            ''', (tg_id, time_end, server_country, user_code))
+            ''', (tg_to_db(tg_id), time_end, server_country, code_to_db(user_code)))
             
             await conn.commit() 
             
@@ -199,7 +396,7 @@ async def update_server_country(user_code: str, new_server: str) -> int:
                 SET server_country = ?
                 WHERE user_code = ?
                 ''',
-                (new_server, user_code),
+                (new_server, code_to_db(user_code)),
             )
             await conn.commit()
             return cursor.rowcount
@@ -210,7 +407,7 @@ async def get_time_end_by_code(user_code: str):
     """
     async with aiosqlite.connect("users.db") as conn:
         async with conn.cursor() as cursor:
-            await cursor.execute('SELECT time_end FROM users WHERE user_code = ?', (user_code,))
+            await cursor.execute('SELECT time_end FROM users WHERE user_code = ?', (code_to_db(user_code),))
             row = await cursor.fetchone()
             return row[0] if row else None
 
@@ -224,7 +421,7 @@ async def set_time_end(user_code: str, new_time_end: int):
                 UPDATE users
                 SET time_end = ?
                 WHERE user_code = ?
-            ''', (new_time_end, user_code))
+            ''', (new_time_end, code_to_db(user_code)))
             await conn.commit()
             return cursor.rowcount
 
@@ -232,7 +429,7 @@ async def delete_user_code(user_code: str):
     """Удаляет запись конфига из БД по его uid."""
     async with aiosqlite.connect("users.db") as conn:
         async with conn.cursor() as cursor:
-            await cursor.execute('DELETE FROM users WHERE user_code = ?', (user_code,))
+            await cursor.execute('DELETE FROM users WHERE user_code = ?', (code_to_db(user_code),))
             await conn.commit()
             return cursor.rowcount
 
@@ -254,14 +451,14 @@ async def get_tg_id_by_key(sub_key: str) -> Optional[str]:
                 (str(sub_key),),
             )
             row = await cursor.fetchone()
-            return str(row[0]) if row else None
+            return tg_from_db(row[0]) if row else None
 
 async def get_sub_key_by_tg_id(tg_id: str) -> Optional[str]:
     async with aiosqlite.connect("users.db") as conn:
         async with conn.cursor() as cursor:
             await cursor.execute(
                 'SELECT sub_key FROM subscription_keys WHERE tg_id = ?',
-                (str(tg_id),),
+                (tg_to_db(tg_id),),
             )
             row = await cursor.fetchone()
             return str(row[0]) if row else None
@@ -275,12 +472,11 @@ async def get_or_create_sub_key(tg_id: str) -> str:
         async with conn.cursor() as cursor:
             await cursor.execute(
                 'INSERT OR REPLACE INTO subscription_keys (sub_key, tg_id) VALUES (?, ?)',
-                (new_key, str(tg_id)),
+                (new_key, tg_to_db(tg_id)),
             )
             await conn.commit()
     return new_key
 
-RESERVED_PREFIX = "__RESERVED__:" 
 
 async def reserve_one_free_config(
     reserver_tg_id: str,
@@ -293,12 +489,12 @@ async def reserve_one_free_config(
 
     Правила:
     - Свободный: (time_end = 0 OR time_end < now) - независимо от tg_id
-    - Резервация: tg_id = "__RESERVED__:{reserver_tg_id}", time_end = now + ttl
+    - Резервация: tg_id = NULL, reserved_by = reserver_tg_id, time_end = now + ttl
     - Перед выбором очищаются просроченные резервации.
     """
     now = int(time.time())
     reservation_expires_at = now + max(5, reservation_ttl_seconds)
-    reserved_marker = f"{RESERVED_PREFIX}{reserver_tg_id}"
+    reserver = tg_to_db(reserver_tg_id)
 
     async with aiosqlite.connect("users.db") as conn:
         # Не допускаем одновременных писателей
@@ -309,22 +505,21 @@ async def reserve_one_free_config(
         await cursor.execute(
             '''
             UPDATE users
-            SET tg_id = '', time_end = 0
-            WHERE tg_id LIKE ? AND time_end > 0 AND time_end < ?
+            SET reserved_by = NULL, time_end = 0
+            WHERE reserved_by IS NOT NULL AND time_end > 0 AND time_end < ?
             ''',
-            (f"{RESERVED_PREFIX}%", now),
+            (now,),
         )
 
         # 1.1) Освободить истёкшие активные конфиги (с реальным tg_id), чтобы они снова стали доступны
         await cursor.execute(
             '''
             UPDATE users
-            SET tg_id = '', time_end = 0
+            SET tg_id = NULL, time_end = 0
             WHERE time_end > 0 AND time_end < ?
-              AND tg_id IS NOT NULL AND tg_id != ''
-              AND tg_id NOT LIKE ?
+              AND tg_id IS NOT NULL
             ''',
-            (now, f"{RESERVED_PREFIX}%"),
+            (now,),
         )
 
         # 2) Найти свободный конфиг (с истекшим временем, независимо от tg_id)
@@ -352,17 +547,17 @@ async def reserve_one_free_config(
             await conn.execute("ROLLBACK")
             return None
 
-        uid: str = row[0]
+        uid_db = row[0]
 
         # 3) Пометить как зарезервированный
         await cursor.execute(
             '''
             UPDATE users
-            SET tg_id = ?, time_end = ?
+            SET tg_id = NULL, reserved_by = ?, time_end = ?
             WHERE user_code = ?
               AND (time_end = 0 OR time_end < ?)
             ''',
-            (reserved_marker, reservation_expires_at, uid, now),
+            (reserver, reservation_expires_at, uid_db, now),
         )
 
         await conn.commit()
@@ -371,7 +566,7 @@ async def reserve_one_free_config(
         if cursor.rowcount == 0:
             return None
 
-        return uid
+        return code_from_db(uid_db)
 
 
 async def finalize_reserved_config(
@@ -384,18 +579,17 @@ async def finalize_reserved_config(
 
     Возвращает количество обновлённых строк (1 при успехе, 0 если резервация не найдена/истекла).
     """
-    reserved_marker = f"{RESERVED_PREFIX}{reserver_tg_id}"
-    now = int(time.time())
+    reserver = tg_to_db(reserver_tg_id)
     async with aiosqlite.connect("users.db") as conn:
         async with conn.cursor() as cursor:
             await cursor.execute(
                 '''
                 UPDATE users
-                SET tg_id = ?, time_end = ?, server_country = ?
+                SET tg_id = ?, reserved_by = NULL, time_end = ?, server_country = ?
                 WHERE user_code = ?
-                  AND tg_id = ?
+                  AND reserved_by = ?
                 ''',
-                (str(reserver_tg_id), final_time_end, server_country, user_code, reserved_marker),
+                (reserver, final_time_end, server_country, code_to_db(user_code), reserver),
             )
             await conn.commit()
             return cursor.rowcount
@@ -406,16 +600,15 @@ async def cancel_reserved_config(user_code: str, reserver_tg_id: str) -> int:
 
     Возвращает количество обновлённых строк.
     """
-    reserved_marker = f"{RESERVED_PREFIX}{reserver_tg_id}"
     async with aiosqlite.connect("users.db") as conn:
         async with conn.cursor() as cursor:
             await cursor.execute(
                 '''
                 UPDATE users
-                SET tg_id = '', time_end = 0
-                WHERE user_code = ? AND tg_id = ?
+                SET tg_id = NULL, reserved_by = NULL, time_end = 0
+                WHERE user_code = ? AND reserved_by = ?
                 ''',
-                (user_code, reserved_marker),
+                (code_to_db(user_code), tg_to_db(reserver_tg_id)),
             )
             await conn.commit()
             return cursor.rowcount
@@ -444,21 +637,20 @@ async def get_all_configs_with_status() -> list[dict]:
     for row in rows:
         user_code, time_end, tg_id, server_country = row
         
-        # Определяем, принадлежит ли конфиг кому-то (активная привязка только при неистёкшем сроке)
+        # Определяем, принадлежит ли конфиг кому-то (активная привязка только при неистёкшем сроке;
+        # у резерваций tg_id = NULL)
         is_owned = bool(
-            tg_id
-            and tg_id.strip()
-            and not tg_id.startswith(RESERVED_PREFIX)
+            tg_id is not None
             and time_end is not None
             and time_end > current_time
         )
         
         configs.append({
-            "uid": user_code,
+            "uid": code_from_db(user_code),
             "time_end": time_end,
             "is_owned": is_owned,
             "server_country": server_country,
-            "tg_id": tg_id if tg_id else None
+            "tg_id": tg_from_db(tg_id)
         })
     
     return configs
@@ -467,8 +659,7 @@ async def get_all_configs_with_status() -> list[dict]:
 async def has_active_reservations(server_country: Optional[str] = None) -> bool:
     """Проверяет есть ли активные резервации (кто-то начал процесс оплаты).
     
-    Возвращает True если есть конфиги с tg_id начинающимся с RESERVED_PREFIX
-    и не истекшим временем резервации.
+    Возвращает True если есть конфиги с reserved_by и не истекшим временем резервации.
     """
     now = int(time.time())
     
@@ -478,17 +669,17 @@ async def has_active_reservations(server_country: Optional[str] = None) -> bool:
                 await cursor.execute(
                     '''
                     SELECT COUNT(*) FROM users
-                    WHERE tg_id LIKE ? AND time_end > ?
+                    WHERE reserved_by IS NOT NULL AND time_end > ?
                     ''',
-                    (f"{RESERVED_PREFIX}%", now),
+                    (now,),
                 )
             else:
                 await cursor.execute(
                     '''
                     SELECT COUNT(*) FROM users
-                    WHERE tg_id LIKE ? AND time_end > ? AND server_country = ?
+                    WHERE reserved_by IS NOT NULL AND time_end > ? AND server_country = ?
                     ''',
-                    (f"{RESERVED_PREFIX}%", now, server_country),
+                    (now, server_country),
                 )
             
             count = await cursor.fetchone()
@@ -498,10 +689,11 @@ async def has_active_reservations(server_country: Optional[str] = None) -> bool:
 async def has_active_reservations_except_user(server_country: Optional[str] = None, exclude_user_id: Optional[str] = None) -> bool:
     """Проверяет есть ли активные резервации (кто-то начал процесс оплаты), исключая указанного пользователя.
     
-    Возвращает True если есть конфиги с tg_id начинающимся с RESERVED_PREFIX
-    и не истекшим временем резервации, но не от exclude_user_id.
+    Возвращает True если есть конфиги с reserved_by и не истекшим временем резервации,
+    но не от exclude_user_id.
     """
     now = int(time.time())
+    excluded = tg_to_db(exclude_user_id)
     
     async with aiosqlite.connect("users.db") as conn:
         async with conn.cursor() as cursor:
@@ -509,17 +701,17 @@ async def has_active_reservations_except_user(server_country: Optional[str] = No
                 await cursor.execute(
                     '''
                     SELECT COUNT(*) FROM users
-                    WHERE tg_id LIKE ? AND time_end > ? AND tg_id != ?
+                    WHERE reserved_by IS NOT NULL AND time_end > ? AND reserved_by IS NOT ?
                     ''',
-                    (f"{RESERVED_PREFIX}%", now, f"{RESERVED_PREFIX}{exclude_user_id}"),
+                    (now, excluded),
                 )
             else:
                 await cursor.execute(
                     '''
                     SELECT COUNT(*) FROM users
-                    WHERE tg_id LIKE ? AND time_end > ? AND server_country = ? AND tg_id != ?
+                    WHERE reserved_by IS NOT NULL AND time_end > ? AND server_country = ? AND reserved_by IS NOT ?
                     ''',
-                    (f"{RESERVED_PREFIX}%", now, server_country, f"{RESERVED_PREFIX}{exclude_user_id}"),
+                    (now, server_country, excluded),
                 )
             
             count = await cursor.fetchone()
@@ -542,13 +734,13 @@ async def get_expired_configs(current_time: int) -> list[tuple[str, str]]:
                 (current_time,)
             )
             rows = await cursor.fetchall()
-    return rows
+    return [(code_from_db(code), server) for code, server in rows]
 
 
 async def get_free_configs() -> list[tuple[str, str]]:
     """Возвращает список свободных (неактивных) конфигов как (user_code, server_country).
     
-    Свободными считаются конфиги с tg_id IS NULL или tg_id = ''.
+    Свободными считаются конфиги без владельца и без резервации.
     """
     async with aiosqlite.connect("users.db") as conn:
         async with conn.cursor() as cursor:
@@ -556,17 +748,17 @@ async def get_free_configs() -> list[tuple[str, str]]:
                 '''
                 SELECT user_code, server_country 
                 FROM users 
-                WHERE tg_id IS NULL OR tg_id = ''
+                WHERE tg_id IS NULL AND reserved_by IS NULL
                 '''
             )
             rows = await cursor.fetchall()
-    return rows
+    return [(code_from_db(code), server) for code, server in rows]
 
 
 async def get_free_configs_by_server(server: str) -> list[tuple[str, str]]:
     """Возвращает список свободных конфигов для конкретного сервера как (user_code, server_country).
     
-    Свободными считаются конфиги с tg_id IS NULL или tg_id = '' и server_country = server.
+    Свободными считаются конфиги без владельца и без резервации на server_country = server.
     """
     async with aiosqlite.connect("users.db") as conn:
         async with conn.cursor() as cursor:
@@ -574,12 +766,12 @@ async def get_free_configs_by_server(server: str) -> list[tuple[str, str]]:
                 '''
                 SELECT user_code, server_country 
                 FROM users 
-                WHERE (tg_id IS NULL OR tg_id = '') AND server_country = ?
+                WHERE tg_id IS NULL AND reserved_by IS NULL AND server_country = ?
                 ''',
                 (server,)
             )
             rows = await cursor.fetchall()
-    return rows
+    return [(code_from_db(code), server) for code, server in rows]
 
 
 async def get_configs_by_server(server: str) -> list[dict]:
@@ -611,18 +803,16 @@ async def get_configs_by_server(server: str) -> list[dict]:
         
         # Определяем, принадлежит ли конфиг кому-то (активная привязка только при неистёкшем сроке)
         is_owned = bool(
-            tg_id
-            and tg_id.strip()
-            and not tg_id.startswith(RESERVED_PREFIX)
+            tg_id is not None
             and time_end is not None
             and time_end > current_time
         )
         
         configs.append({
-            "uid": user_code,
+            "uid": code_from_db(user_code),
             "time_end": time_end,
             "is_owned": is_owned,
-            "tg_id": tg_id if tg_id else None
+            "tg_id": tg_from_db(tg_id)
         })
     
     return configs
@@ -646,8 +836,6 @@ async def get_all_active_users():
             SELECT tg_id, MAX(time_end) as max_time_end
             FROM users 
             WHERE tg_id IS NOT NULL 
-            AND tg_id != '' 
-            AND time_end IS NOT NULL 
             AND time_end > ?
             GROUP BY tg_id
             ORDER BY max_time_end DESC
@@ -659,7 +847,7 @@ async def get_all_active_users():
         for tg_id, time_end in rows:
             days_left = max(0, (time_end - current_time) // 86400)  # Конвертируем секунды в дни
             active_users.append({
-                "tg_id": tg_id,
+                "tg_id": tg_from_db(tg_id),
                 "time_end": time_end,
                 "days_left": days_left
             })
@@ -688,9 +876,8 @@ async def get_user_max_subscription(tg_id: int):
             SELECT MAX(time_end) as max_time_end
             FROM users 
             WHERE tg_id = ? 
-            AND time_end IS NOT NULL 
             AND time_end > ?
-        """, (tg_id, current_time))
+        """, (tg_to_db(tg_id), current_time))
         
         result = await cursor.fetchone()
         
@@ -725,5 +912,192 @@ async def get_all_rows_by_server(server_country: str):
         """, (server_country,))
         
         rows = await cursor.fetchall()
-        return rows
+        return [(tg_from_db(tg_id), code_from_db(code), time_end, server) for tg_id, code, time_end, server in rows]
+
+
+
+async def get_server_pool_stats() -> Dict[str, Dict[str, int]]:
+    """Глубина свободного пула и число активных клиентов по каждому серверу одним запросом.
+
+    Returns:
+        Dict[str, Dict[str, int]]: server_country -> {"free": N, "active": M}
+    """
+    now = int(time.time())
+    async with aiosqlite.connect("users.db") as conn:
+        cursor = await conn.cursor()
+        await cursor.execute("""
+            SELECT server_country,
+                   SUM(CASE WHEN time_end = 0 OR time_end < ? THEN 1 ELSE 0 END) AS free,
+                   SUM(CASE WHEN tg_id IS NOT NULL AND time_end >= ? THEN 1 ELSE 0 END) AS active
+            FROM users
+            GROUP BY server_country
+        """, (now, now))
+        rows = await cursor.fetchall()
+    return {
+        str(server): {"free": int(free or 0), "active": int(active or 0)}
+        for server, free, active in rows
+    }
+
+
+async def get_idempotent_result(idem_key: str, ttl_seconds: int) -> Optional[tuple[str, str, str]]:
+    """Возвращает (endpoint, fingerprint, response) для ключа, если он моложе ``ttl_seconds``."""
+    min_created = int(time.time()) - int(ttl_seconds)
+    async with aiosqlite.connect("users.db") as conn:
+        cursor = await conn.execute(
+            """
+            SELECT endpoint, fingerprint, response FROM idempotency_keys
+            WHERE idem_key = ? AND created_at >= ?
+            """,
+            (idem_key, min_created),
+        )
+        row = await cursor.fetchone()
+        await cursor.close()
+    return (row[0], row[1], row[2]) if row else None
+
 
+async def save_idempotent_result(idem_key: str, endpoint: str, fingerprint: str, response: str) -> None:
+    """Сохраняет успешный ответ под ключом идемпотентности (перезаписывает просроченный)."""
+    async with aiosqlite.connect("users.db") as conn:
+        await conn.execute(
+            """
+            INSERT OR REPLACE INTO idempotency_keys (idem_key, endpoint, fingerprint, response, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (idem_key, endpoint, fingerprint, response, int(time.time())),
+        )
+        await conn.commit()
+
+
+async def purge_idempotency_keys(ttl_seconds: int) -> int:
+    """Удаляет ключи идемпотентности старше ``ttl_seconds``. Возвращает число удалённых."""
+    min_created = int(time.time()) - int(ttl_seconds)
+    async with aiosqlite.connect("users.db") as conn:
+        cursor = await conn.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (min_created,))
+        await conn.commit()
+        return cursor.rowcount
+
+
+
+async def prune_expired_configs(max_age_seconds: int, keep_per_server: int, limit: int) -> int:
+    """Переносит давно истёкшие конфиги из users в pruned_configs. Возвращает число строк.
+
+    Уносятся конфиги, истёкшие раньше ``max_age_seconds`` назад, кроме ``keep_per_server``
+    самых свежих на каждом сервере (пул для переиспользования) и резерваций.
+    """
+    now = int(time.time())
+    async with aiosqlite.connect("users.db") as conn:
+        await conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = await conn.execute(
+                """
+                SELECT user_code, tg_id, time_end, server_country FROM (
+                    SELECT user_code, tg_id, time_end, server_country,
+                           ROW_NUMBER() OVER (PARTITION BY server_country ORDER BY time_end DESC) AS rn
+                    FROM users
+                    WHERE time_end > 0 AND time_end < ? AND reserved_by IS NULL
+                )
+                WHERE rn > ?
+                LIMIT ?
+                """,
+                (now - int(max_age_seconds), int(keep_per_server), int(limit)),
+            )
+            rows = await cursor.fetchall()
+            if rows:
+                await conn.executemany(
+                    """
+                    INSERT OR REPLACE INTO pruned_configs (user_code, tg_id, time_end, server_country, pruned_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    [(*row, now) for row in rows],
+                )
+                await conn.executemany("DELETE FROM users WHERE user_code = ?", [(row[0],) for row in rows])
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+    return len(rows)
+
+
+async def get_pruned_configs_on_panel(limit: int) -> list[tuple[str, str]]:
+    """Выведенные из пула конфиги, чей клиент ещё не удалён с панели, как (user_code, server_country)."""
+    async with aiosqlite.connect("users.db") as conn:
+        cursor = await conn.execute(
+            """
+            SELECT user_code, server_country FROM pruned_configs
+            WHERE panel_deleted_at IS NULL
+            ORDER BY pruned_at
+            LIMIT ?
+            """,
+            (int(limit),),
+        )
+        rows = await cursor.fetchall()
+    return [(code_from_db(code), server) for code, server in rows]
+
+
+async def mark_pruned_config_deleted(user_code: str) -> None:
+    """Отмечает, что клиент выведенного конфига удалён с панели (строку можно архивировать)."""
+    async with aiosqlite.connect("users.db") as conn:
+        await conn.execute(
+            "UPDATE pruned_configs SET panel_deleted_at = ? WHERE user_code = ?",
+            (int(time.time()), code_to_db(user_code)),
+        )
+        await conn.commit()
+
+# -------------------------------------------------
+# Снимок чтения: полная загрузка и журнал изменений (значения как в БД, без конвертации)
+# -------------------------------------------------
+
+async def load_config_snapshot_rows() -> tuple[int, list[tuple]]:
+    """Все строки users и номер последнего изменения журнала, прочитанные одной транзакцией.
+
+    Returns:
+        (last_seq, [(user_code, tg_id, time_end, server_country, reserved_by), ...])
+    """
+    async with aiosqlite.connect("users.db") as conn:
+        await conn.execute("BEGIN")
+        cursor = await conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'config_changes'")
+        row = await cursor.fetchone()
+        cursor = await conn.execute("SELECT user_code, tg_id, time_end, server_country, reserved_by FROM users")
+        rows = await cursor.fetchall()
+        await conn.execute("COMMIT")
+    return (int(row[0]) if row else 0), rows
+
+
+async def get_config_changes(after_seq: int, limit: int) -> tuple[int, int, list[tuple]]:
+    """Изменения журнала после ``after_seq`` вместе с текущими значениями строк.
+
+    Returns:
+        (head_seq, min_seq, [(seq, user_code, tg_id, time_end, server_country, reserved_by), ...]).
+        Для удалённой строки все поля кроме seq/user_code — NULL (server_country тоже).
+        ``min_seq`` — самый старый номер в журнале (0, если журнал пуст): по нему видно,
+        не вычищены ли нужные записи.
+    """
+    async with aiosqlite.connect("users.db") as conn:
+        await conn.execute("BEGIN")
+        cursor = await conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'config_changes'")
+        head = await cursor.fetchone()
+        cursor = await conn.execute("SELECT MIN(seq) FROM config_changes")
+        oldest = await cursor.fetchone()
+        cursor = await conn.execute(
+            '''
+            SELECT c.seq, c.user_code, u.tg_id, u.time_end, u.server_country, u.reserved_by
+            FROM config_changes c
+            LEFT JOIN users u ON u.user_code = c.user_code
+            WHERE c.seq > ?
+            ORDER BY c.seq
+            LIMIT ?
+            ''',
+            (int(after_seq), int(limit)),
+        )
+        rows = await cursor.fetchall()
+        await conn.execute("COMMIT")
+    return (int(head[0]) if head else 0), int(oldest[0] or 0), rows
+
+
+async def purge_config_changes(max_age_seconds: int) -> int:
+    """Удаляет записи журнала изменений старше ``max_age_seconds``. Возвращает число удалённых."""
+    min_changed = int(time.time()) - int(max_age_seconds)
+    async with aiosqlite.connect("users.db") as conn:
+        cursor = await conn.execute("DELETE FROM config_changes WHERE changed_at < ?", (min_changed,))
+        await conn.commit()
+        return cursor.rowcount
@@ -0,0 +1,69 @@
+"""Перевод ``users.db`` бэкенда на компактную схему вручную.
+
+Бэкенд мигрирует БД сам при старте (``init_db``), но на больших базах удобнее сделать это
+заранее, остановив сервис, и посмотреть результат:
+
+    python -m database.migrate --db /app/data/users.db
+    python -m database.migrate --db users.db --dry-run   # только проверить, нужна ли миграция
+
+Перед миграцией рядом кладётся копия ``<db>.pre-compact`` (отключается ``--no-backup``).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import time
+
+import aiosqlite
+
+from database.db import _is_legacy_schema, migrate_to_compact_schema
+
+
+def _copy(src: str, dst: str) -> None:
+    with sqlite3.connect(src) as source, sqlite3.connect(dst) as target:
+        source.backup(target)
+
+
+async def migrate(db_path: str, dry_run: bool = False, backup: bool = True) -> int:
+    if not os.path.exists(db_path):
+        print(f"{db_path}: not found", file=sys.stderr)
+        return 2
+    size_before = os.path.getsize(db_path)
+    async with aiosqlite.connect(db_path) as conn:
+        if not await _is_legacy_schema(conn):
+            print(f"{db_path}: already compact, nothing to do")
+            return 0
+        if dry_run:
+            print(f"{db_path}: legacy schema, migration required")
+            return 1
+        if backup:
+            backup_path = db_path + ".pre-compact"
+            _copy(db_path, backup_path)
+            print(f"backup → {backup_path}")
+        started = time.perf_counter()
+        stats = await migrate_to_compact_schema(conn)
+        await conn.execute("VACUUM")
+        await conn.execute("ANALYZE")
+        await conn.commit()
+    size_after = os.path.getsize(db_path)
+    print(
+        f"{db_path}: {stats['rows_before']} → {stats['rows_after']} rows (dropped {stats['dropped']}), "
+        f"{size_before / 1048576:.1f} → {size_after / 1048576:.1f} MiB in {time.perf_counter() - started:.1f}s"
+    )
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Миграция users.db на компактную схему")
+    parser.add_argument("--db", default="users.db")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--no-backup", action="store_true")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(migrate(args.db, dry_run=args.dry_run, backup=not args.no_backup)))
+
+
+if __name__ == "__main__":
+    main()
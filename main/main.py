@@ -52,10 +52,16 @@ async def startup_event() -> None:
     enable_sweep = os.getenv("ENABLE_EXPIRE_SWEEP", "true").lower() in {"1", "true", "yes"}
     sweep_interval = int(os.getenv("EXPIRE_SWEEP_SECONDS", "300"))
 
+    # Журнал изменений для снимка чтения: хранится с запасом относительно интервала обновления
+    changes_ttl = int(os.getenv("CONFIG_CHANGES_TTL_SECONDS", "3600"))
+
     async def _expire_sweeper() -> None:
         while True:
             try:
                 await db.reset_expired_configs()
+                await db.purge_idempotency_keys(routers.IDEMPOTENCY_TTL_SECONDS)
+                await db.purge_config_changes(changes_ttl)
+                await routers.prune_expired_configs(app.state.http_client)
             except Exception:
                 # Не падаем из-за фоновой задачи
                 logger.exception("Background sweeper task failed")
@@ -65,6 +71,14 @@ async def startup_event() -> None:
     if enable_sweep:
         app.state.expire_task = asyncio.create_task(_expire_sweeper())
 
+    # Снимок users в памяти для админских списков; строим до первого запроса
+    app.state.snapshot_task = None
+    if routers.READ_SNAPSHOT_ENABLED:
+        await routers.config_snapshot.rebuild()
+        app.state.snapshot_task = asyncio.create_task(
+            routers.config_snapshot.run(routers.READ_SNAPSHOT_REFRESH_SECONDS)
+        )
+
     # Монтируем статику (CSS/JS/изображения)
     static_dir = os.path.join(os.path.dirname(__file__), "static")
     app.mount("/static", StaticFiles(directory=static_dir), name="static")
@@ -79,12 +93,17 @@ async def healthz() -> dict[str, str]:
 
 @app.on_event("shutdown")
 async def shutdown_event() -> None:
+    # Досылаем накопленные записи в панель, пока HTTP-клиент ещё жив
+    coalescer = getattr(app.state, "panel_coalescer", None)
+    if coalescer is not None:
+        await coalescer.aclose()
     client = getattr(app.state, "http_client", None)
     if client is not None:
         await client.aclose()
-    task = getattr(app.state, "expire_task", None)
-    if task is not None:
-        task.cancel()
+    for name in ("expire_task", "snapshot_task"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8080, reload=True)
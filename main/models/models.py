@@ -1,3 +1,5 @@
+from typing import Dict, List
+
 from pydantic import BaseModel
 
 
@@ -52,4 +54,9 @@ class AddServerToUser(BaseModel):
 
     server: str  # код страны сервера (например, "ge" для Германии)
     tg_id: int  # Telegram ID пользователя
-    message: str = ""  # опциональное сообщение для пользователя
\ No newline at end of file
+    message: str = ""  # опциональное сообщение для пользователя
+
+class PlacementRequest(BaseModel):
+    """Запрос выбора варианта сервера для каждого региона."""
+
+    regions: Dict[str, List[str]]  # базовый код региона -> варианты, например {"ge": ["ge", "ge2"]}
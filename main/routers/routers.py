@@ -7,8 +7,9 @@ import logging
 import os
 import random
 import time
+import hashlib
 import uuid
-from typing import Any, Dict, List
+from typing import Any, Awaitable, Callable, Dict, List
 import re
 
 import httpx
@@ -27,6 +28,9 @@ from fastapi.templating import Jinja2Templates
 from database import db
 from fastapi import FastAPI
 from models import models
+from services.config_snapshot import ConfigSnapshot
+from services.panel_coalescer import PanelWriteCoalescer
+from services.placement import PlacementEngine
 
 logger = logging.getLogger(__name__)
 
@@ -81,6 +85,7 @@ def load_country_settings() -> dict[str, dict[str, str]]:
             "pbk": _env_any("PBK_GE", "pbk_ge", default=""),
             "sni": _env_any("SNI_GE", "sni_ge", default="eh.vk.com"),
             "sid": _env_any("SID_GE", "sid_ge", default=""),
+            "urlbulkupdate": _env_any("URLBULKUPDATE_GE", "urlbulkupdate_ge", default=""),
         },
     }
 
@@ -111,6 +116,8 @@ def load_country_settings() -> dict[str, dict[str, str]]:
             "pbk": _env_any(f"PBK_{lc.upper()}", f"pbk_{lc.lower()}", default=base_defaults.get("pbk", "")),
             "sni": _env_any(f"SNI_{lc.upper()}", f"sni_{lc.lower()}", default=base_defaults.get("sni", "")),
             "sid": _env_any(f"SID_{lc.upper()}", f"sid_{lc.lower()}", default=base_defaults.get("sid", "")),
+            # Bulk-обновление не наследуем от базы: эндпоинт есть не на каждой панели
+            "urlbulkupdate": _env_any(f"URLBULKUPDATE_{lc.upper()}", f"urlbulkupdate_{lc.lower()}", default=""),
         }
 
     return settings
@@ -220,13 +227,36 @@ def build_payload(
     }
 
 
-async def panel_request(request: Request, url: str, server_code: str, payload: Dict[str, Any] | None = None) -> httpx.Response:
-    """Помощник для запросов к панели."""
+# Оценки панелей для выбора варианта сервера в регионе (ge/ge2/...)
+placement_engine = PlacementEngine(
+    alpha=float(_env_any("PLACEMENT_EWMA_ALPHA", "placement_ewma_alpha", default="0.2")),
+    default_latency_ms=float(_env_any("PLACEMENT_DEFAULT_LATENCY_MS", "placement_default_latency_ms", default="300")),
+    error_penalty=float(_env_any("PLACEMENT_ERROR_PENALTY", "placement_error_penalty", default="10")),
+    load_penalty=float(_env_any("PLACEMENT_LOAD_PENALTY", "placement_load_penalty", default="1")),
+)
+
+
+# Снимок users в памяти для админских списков (READ_SNAPSHOT_ENABLED=false — читать из БД)
+READ_SNAPSHOT_ENABLED: bool = _env_any("READ_SNAPSHOT_ENABLED", "read_snapshot_enabled", default="true").lower() in {"1", "true", "yes"}
+READ_SNAPSHOT_REFRESH_SECONDS: float = float(_env_any("READ_SNAPSHOT_REFRESH_SECONDS", "read_snapshot_refresh_seconds", default="1"))
+config_snapshot = ConfigSnapshot()
+
+
+def _snapshot_ready() -> bool:
+    return READ_SNAPSHOT_ENABLED and config_snapshot.ready
+
+
+async def _panel_post(
+    http_client: httpx.AsyncClient | None,
+    url: str,
+    server_code: str,
+    payload: Dict[str, Any] | None = None,
+) -> httpx.Response:
+    """POST в панель с ретраями на сетевые ошибки."""
     headers = {
         "Content-Type": "application/json",
         "Cookie": _get_cookie(server_code),
     }
-    # Берём общий клиент из app.state
     async def _do_request(client: httpx.AsyncClient) -> httpx.Response:
         if payload is None:
             return await client.post(url, headers=headers)
@@ -234,22 +264,195 @@ async def panel_request(request: Request, url: str, server_code: str, payload: D
 
     # Ретраи на сетевые ошибки
     last_exc: Exception | None = None
+    started = time.monotonic()
     for attempt in range(3):
         try:
-            # Получаем клиента из request.app.state
-            http_client = getattr(request.app.state, "http_client", None)
             if http_client is not None:
-                return await _do_request(http_client)
-            # Fallback: локальный клиент (не должно часто срабатывать)
-            async with httpx.AsyncClient(timeout=15, follow_redirects=True) as tmp_client:
-                return await _do_request(tmp_client)
+                response = await _do_request(http_client)
+            else:
+                # Fallback: локальный клиент (не должно часто срабатывать)
+                async with httpx.AsyncClient(timeout=15, follow_redirects=True) as tmp_client:
+                    response = await _do_request(tmp_client)
+            placement_engine.observe(server_code, time.monotonic() - started, response.status_code == 200)
+            return response
         except httpx.RequestError as exc:
             last_exc = exc
             await asyncio.sleep(0.3 * (attempt + 1))
+    placement_engine.observe(server_code, time.monotonic() - started, False)
     logger.error("HTTP request to %s failed after retries: %s", url, last_exc)
     raise HTTPException(status_code=502, detail="Ошибка обращения к панели")
 
 
+async def panel_request(request: Request, url: str, server_code: str, payload: Dict[str, Any] | None = None) -> httpx.Response:
+    """Помощник для запросов к панели."""
+    # Берём общий клиент из app.state
+    http_client = getattr(request.app.state, "http_client", None)
+    return await _panel_post(http_client, url, server_code, payload)
+
+
+# Окно и размер пачки коалесинга записей в панель (PANEL_COALESCE_WINDOW_MS=0 — выключено)
+PANEL_COALESCE_WINDOW_MS: int = int(_env_any("PANEL_COALESCE_WINDOW_MS", "panel_coalesce_window_ms", default="50"))
+PANEL_COALESCE_MAX_BATCH: int = int(_env_any("PANEL_COALESCE_MAX_BATCH", "panel_coalesce_max_batch", default="50"))
+
+
+def get_panel_coalescer(request: Request) -> PanelWriteCoalescer:
+    """Возвращает общий для приложения коалесер записей в панель (создаётся лениво)."""
+    coalescer = getattr(request.app.state, "panel_coalescer", None)
+    if coalescer is None:
+        app = request.app
+
+        async def _send(url: str, server_code: str, payload: Dict[str, Any]) -> httpx.Response:
+            return await _panel_post(getattr(app.state, "http_client", None), url, server_code, payload)
+
+        coalescer = PanelWriteCoalescer(
+            _send,
+            window_seconds=PANEL_COALESCE_WINDOW_MS / 1000.0,
+            max_batch=PANEL_COALESCE_MAX_BATCH,
+            bulk_update_urls={code: cfg.get("urlbulkupdate", "") for code, cfg in COUNTRY_SETTINGS.items()},
+        )
+        app.state.panel_coalescer = coalescer
+    return coalescer
+
+
+async def panel_update_client(request: Request, server_code: str, uid: str, payload: Dict[str, Any]) -> httpx.Response:
+    """``updateClient``: сразу в панель; пачкой — только если у сервера задан ``URLBULKUPDATE_<CODE>``."""
+    url = COUNTRY_SETTINGS[server_code]["urlupdate"] + uid
+    logger.info("panel.update URL=%s", url)
+    return await get_panel_coalescer(request).submit_update(server_code, uid, url, payload)
+
+
+async def panel_create_client(request: Request, server_code: str, payload: Dict[str, Any]) -> httpx.Response:
+    """``addClient`` через коалесер: клиенты одной пачки уходят одним запросом."""
+    url = COUNTRY_SETTINGS[server_code]["urlcreate"]
+    logger.info("panel.create URL=%s", url)
+    return await get_panel_coalescer(request).submit_create(server_code, url, payload)
+
+
+# Вывод давно истёкших конфигов из пула: клиент удаляется с панели 3x-ui (delClient),
+# строка уходит в архив. Выключено по умолчанию (0): включается явно, например
+# RETENTION_CONFIGS_DAYS=90 — тогда конфиги, истёкшие больше 90 дней назад, удаляются с панелей.
+CONFIG_PRUNE_DAYS: int = int(_env_any("RETENTION_CONFIGS_DAYS", "retention_configs_days", default="0"))
+CONFIG_PRUNE_KEEP_PER_SERVER: int = int(_env_any("RETENTION_KEEP_FREE_PER_SERVER", "retention_keep_free_per_server", default="500"))
+CONFIG_PRUNE_BATCH: int = int(_env_any("CONFIG_PRUNE_BATCH", "config_prune_batch", default="200"))
+
+
+async def prune_expired_configs(http_client: httpx.AsyncClient | None) -> Dict[str, int]:
+    """Убирает из пула давно истёкшие конфиги и удаляет их клиентов с панели.
+
+    Строки сначала переносятся из users в pruned_configs (одной транзакцией — выдать их
+    уже нельзя), затем по каждой вызывается ``delClient``. Удалённые с панели строки
+    архивирует ретеншн в контейнере бэкапов; не удалённые (панель недоступна) повторяются
+    при следующем запуске. За запуск — не больше ``CONFIG_PRUNE_BATCH`` удалений.
+    Пока ``RETENTION_CONFIGS_DAYS`` не задан (0), ничего не делает.
+    """
+    if CONFIG_PRUNE_DAYS <= 0:
+        return {"pruned": 0, "deleted": 0, "failed": 0}
+    pruned = await db.prune_expired_configs(CONFIG_PRUNE_DAYS * 86400, CONFIG_PRUNE_KEEP_PER_SERVER, CONFIG_PRUNE_BATCH)
+    deleted, failed = 0, 0
+    for uid, server in await db.get_pruned_configs_on_panel(CONFIG_PRUNE_BATCH):
+        url = COUNTRY_SETTINGS.get(server, {}).get("urldelete")
+        if not url:
+            logger.error("No delete URL for server %s, pruned config %s stays on panel", server, uid)
+            failed += 1
+            continue
+        try:
+            response = await _panel_post(http_client, f"{url}{uid}", server)
+        except HTTPException:
+            failed += 1
+            continue
+        if response.status_code != 200:
+            logger.warning("Panel delete of pruned config %s on %s failed: %s", uid, server, response.status_code)
+            failed += 1
+            continue
+        await db.mark_pruned_config_deleted(uid)
+        deleted += 1
+    if pruned or deleted or failed:
+        logger.info("Config prune: pruned=%s, panel_deleted=%s, failed=%s", pruned, deleted, failed)
+    return {"pruned": pruned, "deleted": deleted, "failed": failed}
+
+
+# Ключи идемпотентности: сохранённый ответ живёт IDEMPOTENCY_TTL_SECONDS
+IDEMPOTENCY_TTL_SECONDS: int = int(_env_any("IDEMPOTENCY_TTL_SECONDS", "idempotency_ttl_seconds", default="86400"))
+# Параллельные запросы с одним ключом выполняются по очереди: второй получит ответ первого.
+# Ключ -> [замок, число запросов, которые держат или ждут его]; запись удаляет последний.
+idempotency_locks: Dict[str, list] = {}
+# Сохранение ответа под ключом: попыток и пауза перед повтором
+IDEMPOTENCY_SAVE_ATTEMPTS = 3
+IDEMPOTENCY_SAVE_RETRY_DELAY = 0.2
+
+
+def _request_fingerprint(endpoint: str, body: Dict[str, Any]) -> str:
+    raw = json.dumps({"endpoint": endpoint, "body": body}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def run_idempotent(
+    endpoint: str,
+    idempotency_key: str | None,
+    body: Dict[str, Any],
+    handler: Callable[[], Awaitable[Any]],
+) -> Any:
+    """Выполняет ``handler`` не более одного раза на ключ идемпотентности.
+
+    - без ключа — обычный вызов;
+    - повтор с тем же ключом и телом — сохранённый ответ без обращения к панели;
+    - тот же ключ с другим телом — 422;
+    - сохраняются только успешные ответы: ошибку клиент может повторить с тем же ключом.
+    """
+    if not idempotency_key:
+        return await handler()
+    key = idempotency_key.strip()[:200]
+    fingerprint = _request_fingerprint(endpoint, body)
+
+    entry = idempotency_locks.get(key)
+    if entry is None:
+        entry = idempotency_locks[key] = [asyncio.Lock(), 0]
+    # Счётчик растёт до ожидания: пока кто-то ждёт замок, запись не удаляется
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            stored = await db.get_idempotent_result(key, IDEMPOTENCY_TTL_SECONDS)
+            if stored is not None:
+                stored_endpoint, stored_fingerprint, response = stored
+                if stored_endpoint != endpoint or stored_fingerprint != fingerprint:
+                    raise HTTPException(
+                        status_code=422,
+                        detail="Ключ идемпотентности уже использован с другим запросом",
+                    )
+                logger.info("idempotent replay endpoint=%s key=%s", endpoint, key)
+                return json.loads(response)
+
+            result = await handler()
+            await _save_idempotent_result(key, endpoint, fingerprint, result)
+            return result
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0 and idempotency_locks.get(key) is entry:
+            del idempotency_locks[key]
+
+
+async def _save_idempotent_result(key: str, endpoint: str, fingerprint: str, result: Any) -> None:
+    """Сохраняет ответ под ключом с повторами.
+
+    Конфиг к этому моменту уже выдан: без сохранённого ключа повтор запроса выдал бы
+    второй, поэтому запись повторяется, а если так и не удалась — запрос падает с 503
+    и в лог пишется ключ с ответом для ручного разбора.
+    """
+    response = json.dumps(result, ensure_ascii=False)
+    for attempt in range(1, IDEMPOTENCY_SAVE_ATTEMPTS + 1):
+        try:
+            await db.save_idempotent_result(key, endpoint, fingerprint, response)
+            return
+        except Exception:
+            if attempt == IDEMPOTENCY_SAVE_ATTEMPTS:
+                logger.exception(
+                    "Failed to store idempotency key %s endpoint=%s response=%s", key, endpoint, response
+                )
+                raise HTTPException(status_code=503, detail="Не удалось сохранить ключ идемпотентности")
+            logger.warning("Failed to store idempotency key %s (attempt %s), retrying", key, attempt)
+            await asyncio.sleep(IDEMPOTENCY_SAVE_RETRY_DELAY * attempt)
+
+
 # ---------------------------------------------------------------------------
 # Эндпоинты
 # ---------------------------------------------------------------------------
@@ -267,14 +470,16 @@ async def create_config(
 
     created_ids: list[str] = []
 
-    for _ in range(client_data.count):
-        uid = str(uuid.uuid4())
-        payload = build_payload(uid, enable=False, is_trial=False)
-
-        url = COUNTRY_SETTINGS[client_data.server]["urlcreate"]
-        logger.info("panel.create URL=%s", url)
-        response = await panel_request(request, url, client_data.server, payload)
+    # Отправляем все создания разом — коалесер склеит их в один addClient
+    uids = [str(uuid.uuid4()) for _ in range(client_data.count)]
+    responses = await asyncio.gather(
+        *(
+            panel_create_client(request, client_data.server, build_payload(uid, enable=False, is_trial=False))
+            for uid in uids
+        )
+    )
 
+    for uid, response in zip(uids, responses):
         if response.status_code == 200:
             await db.insert_into_db(
                 tg_id=None,
@@ -305,9 +510,22 @@ async def create_config(
 async def give_config(
     client_data: models.ClientData,
     request: Request,
+    idempotency_key: str | None = Header(default=None, alias="Idempotency-Key"),
     _: None = Depends(verify_api_key),
 ) -> str:
-    """Активирует свободную конфигурацию для пользователя с атомарной бронью."""
+    """Активирует свободную конфигурацию для пользователя с атомарной бронью.
+
+    С заголовком ``Idempotency-Key`` повтор запроса вернёт тот же uid, а не выдаст второй конфиг.
+    """
+    return await run_idempotent(
+        "/giveconfig",
+        idempotency_key,
+        client_data.model_dump(),
+        lambda: _give_config(client_data, request),
+    )
+
+
+async def _give_config(client_data: models.ClientData, request: Request) -> str:
 
     # 1) Пытаемся зарезервировать свободный конфиг атомарно
     reserved_uid = await db.reserve_one_free_config(
@@ -344,9 +562,7 @@ async def give_config(
                         # Создаем новый конфиг напрямую
                         uid = str(uuid.uuid4())
                         payload = build_payload(uid, enable=False, is_trial=client_data.is_trial)
-                        url = COUNTRY_SETTINGS[client_data.server]["urlcreate"]
-                        logger.info("panel.create URL=%s", url)
-                        response = await panel_request(request, url, client_data.server, payload)
+                        response = await panel_create_client(request, client_data.server, payload)
 
                         if response.status_code == 200:
                             # Сохраняем в БД
@@ -411,11 +627,8 @@ async def give_config(
         is_trial=client_data.is_trial,
         traffic_bytes=traffic_bytes,
     )
-    url = COUNTRY_SETTINGS[client_data.server]["urlupdate"] + reserved_uid
-    logger.info("panel.update URL=%s", url)
-
-    # 2) Обновляем конфиг на панели
-    response = await panel_request(request, url, client_data.server, payload)
+    # 2) Обновляем конфиг на панели (через коалесер записей)
+    response = await panel_update_client(request, client_data.server, reserved_uid, payload)
 
     if response.status_code != 200:
         # Откатываем бронь, чтобы конфиг снова стал доступен
@@ -472,9 +685,22 @@ async def give_config(
 async def extend_config(
     update_data: models.ExtendConfig,
     request: Request,
+    idempotency_key: str | None = Header(default=None, alias="Idempotency-Key"),
     _: None = Depends(verify_api_key),
 ) -> str:
-    """Продлевает срок действия конфига на `update_data.time` суток."""
+    """Продлевает срок действия конфига на `update_data.time` суток.
+
+    С заголовком ``Idempotency-Key`` повтор запроса не продлевает конфиг второй раз.
+    """
+    return await run_idempotent(
+        "/extendconfig",
+        idempotency_key,
+        update_data.model_dump(),
+        lambda: _extend_config(update_data, request),
+    )
+
+
+async def _extend_config(update_data: models.ExtendConfig, request: Request) -> str:
 
     uid = update_data.uid
     added_seconds = update_data.time * 60 * 60 * 24
@@ -489,9 +715,7 @@ async def extend_config(
     # При продлении не переопределяем лимит трафика (totalGB), только срок
     payload = build_payload(uid, enable=True, expiry_time=new_time_end, is_trial=False, traffic_bytes=None)
 
-    url = f"{COUNTRY_SETTINGS[update_data.server]['urlupdate']}{uid}"
-    logger.info("panel.extend URL=%s", url)
-    response = await panel_request(request, url, update_data.server, payload)
+    response = await panel_update_client(request, update_data.server, uid, payload)
 
     if response.status_code == 200:
         await db.set_time_end(uid, new_time_end)
@@ -983,12 +1207,7 @@ async def check_available_configs(
 ):
     """Проверяет наличие свободных конфигов."""
 
-    # Сначала сбрасываем истёкшие конфиги, чтобы отразить актуальную доступность
-    try:
-        await db.reset_expired_configs()
-    except Exception:
-        pass
-    
+    # Только чтение: истёкшие конфиги считаются свободными и без отвязки (её делает sweeper)
     if server is None:
         # Проверяем общую доступность конфигов
         has_any = await db.has_any_expired_configs()
@@ -1017,6 +1236,57 @@ async def check_available_configs(
             }
         )
 
+
+@router.post(
+    "/placement",
+    response_model=dict,
+)
+async def choose_placement(
+    data: models.PlacementRequest,
+    _: None = Depends(verify_api_key),
+) -> dict:
+    """Выбирает по одному варианту сервера на регион для новой активации.
+
+    Заменяет серию запросов ``/check-available-configs`` по каждому варианту:
+    учитывает задержку и ошибки панелей, глубину свободного пула и число активных клиентов.
+    Только чтение: истёкшие конфиги уже считаются свободными, отвязку делает фоновый sweeper.
+    """
+    pool = await db.get_server_pool_stats()
+    regions = {base.lower(): [v.lower() for v in variants] or [base.lower()] for base, variants in data.regions.items()}
+    result = placement_engine.choose(regions, pool)
+    logger.info("placement servers=%s", result["servers"])
+    return result
+
+
+@router.get(
+    "/placement/stats",
+    response_model=dict,
+)
+async def placement_stats(_: None = Depends(verify_api_key)) -> dict:
+    """Текущие оценки панелей (задержка, доля ошибок) и состояние пулов."""
+    return {"panels": placement_engine.snapshot(), "pool": await db.get_server_pool_stats()}
+
+
+@router.get(
+    "/panel-coalescer/metrics",
+    response_model=dict,
+)
+async def panel_coalescer_metrics(
+    request: Request,
+    _: None = Depends(verify_api_key),
+) -> dict:
+    """Метрики коалесинга записей в панель: размеры пачек и сэкономленные запросы."""
+    return get_panel_coalescer(request).metrics()
+
+
+@router.get(
+    "/read-snapshot/stats",
+    response_model=dict,
+)
+async def read_snapshot_stats(_: None = Depends(verify_api_key)) -> dict:
+    """Состояние снимка users в памяти: размер, номер журнала, отставание."""
+    return {"enabled": READ_SNAPSHOT_ENABLED, **config_snapshot.stats()}
+
 @router.get(
     "/usercodes/{tg_id}",
 )
@@ -1217,7 +1487,10 @@ async def get_all_configs(_: None = Depends(verify_api_key)):
     - total_count: общее количество конфигов
     """
     try:
-        configs = await db.get_all_configs_with_status()
+        if _snapshot_ready():
+            configs = config_snapshot.configs(int(time.time()))
+        else:
+            configs = await db.get_all_configs_with_status()
         return JSONResponse({
             "configs": configs,
             "total_count": len(configs)
@@ -1229,6 +1502,8 @@ async def get_all_configs(_: None = Depends(verify_api_key)):
 @router.get("/getids")
 async def get_all_id(_: None = Depends(verify_api_key)):
     """Возвращает все конфиги с их статусом и информацией."""
+    if _snapshot_ready():
+        return {"configs": config_snapshot.configs(int(time.time()))}
     configs = await db.get_all_configs_with_status()
     return {"configs": configs}
 
@@ -1236,15 +1511,27 @@ async def get_all_id(_: None = Depends(verify_api_key)):
 @router.get("/expiring-users")
 async def get_expiring_users(_: None = Depends(verify_api_key)):
     """Возвращает пользователей с истекающими подписками (в течение 5 часов)."""
+    if _snapshot_ready():
+        return config_snapshot.expiring_users(int(time.time()), db.EXPIRING_WINDOW_SECONDS)
     return await db.users_with_subscription_expiring_within_5h("users.db")
 
 
 @router.get("/active-users/ids")
-async def get_active_user_ids(_: None = Depends(verify_api_key)):
-    """Возвращает список tg_id пользователей с активными подписками."""
-    users = await db.get_all_active_users()
+async def get_active_user_ids(request: Request, _: None = Depends(verify_api_key)):
+    """Возвращает список tg_id пользователей с активными подписками.
+
+    ``ETag`` — хэш множества id: клиент с ``If-None-Match`` получает 304 без тела, пока
+    множество не изменилось (бот обновляет по нему сегменты рассылок).
+    """
+    if _snapshot_ready():
+        users = config_snapshot.active_users(int(time.time()))
+    else:
+        users = await db.get_all_active_users()
     ids = [u["tg_id"] for u in users]
-    return {"count": len(ids), "ids": ids}
+    etag = '"' + hashlib.blake2b(",".join(sorted(map(str, ids))).encode(), digest_size=16).hexdigest() + '"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse({"count": len(ids), "ids": ids}, headers={"ETag": etag})
 
 
 @router.post(
@@ -1267,7 +1554,10 @@ async def get_server_configs(
         raise HTTPException(status_code=400, detail="Поле 'server' обязательно")
     
     try:
-        configs = await db.get_configs_by_server(server)
+        if _snapshot_ready():
+            configs = config_snapshot.configs(int(time.time()), server=server, with_server=False)
+        else:
+            configs = await db.get_configs_by_server(server)
         return {
             "configs": configs,
             "total_count": len(configs),
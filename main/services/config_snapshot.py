@@ -0,0 +1,298 @@
+"""
+Снимок таблицы ``users`` в памяти для админских и списочных эндпоинтов.
+
+``/all-configs``, ``/getids``, ``/get-server-configs``, ``/active-users/ids`` и
+``/expiring-users`` раньше каждый раз сканировали всю таблицу. Теперь они читают
+колонки снимка (numpy-массивы ``tg_id``, ``time_end``, индекс сервера, состояние)
+и фильтруют их векторно — файл SQLite при этом не трогается.
+
+Снимок строится один раз целиком, а дальше догоняется по журналу
+``config_changes``, который ведут триггеры на ``users``. Фоновая задача раз в
+``refresh_seconds`` читает новые записи журнала вместе с текущими значениями строк
+и точечно обновляет колонки. Если журнал вычищен дальше, чем снимок успел
+применить, или БД подменили (восстановление из бэкапа), снимок строится заново.
+
+Данные отстают от БД не больше чем на ``refresh_seconds``.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+STATE_FREE = 0
+STATE_OWNED = 1
+STATE_RESERVED = 2
+STATE_DELETED = 3
+
+# tg_id = 0 в колонке — «никому не принадлежит» (NULL в БД)
+NO_TG = 0
+
+
+class ConfigSnapshot:
+    """Колоночный снимок ``users``; обновляется по журналу изменений."""
+
+    def __init__(self, batch_limit: int = 20000, initial_capacity: int = 1024) -> None:
+        self.batch_limit = max(100, int(batch_limit))
+        self._initial_capacity = max(16, int(initial_capacity))
+        self.ready = False
+        self.last_seq = 0
+        self.built_at = 0.0
+        self.refreshed_at = 0.0
+        self.rebuilds = 0
+        self.applied_changes = 0
+        self._lock = asyncio.Lock()
+        self._reset(self._initial_capacity)
+
+    # ------------------------------------------------------------------
+    # Хранение
+    # ------------------------------------------------------------------
+
+    def _reset(self, capacity: int) -> None:
+        self._size = 0
+        self._dead = 0
+        self._codes: List[Optional[str]] = []
+        self._pos: Dict[str, int] = {}
+        self._tg = np.zeros(capacity, dtype=np.int64)
+        self._time_end = np.zeros(capacity, dtype=np.int64)
+        self._server = np.zeros(capacity, dtype=np.int16)
+        self._state = np.full(capacity, STATE_DELETED, dtype=np.int8)
+        self._servers: List[str] = []
+        self._server_pos: Dict[str, int] = {}
+        # Нечисловые tg_id (старые данные) получают отрицательные суррогатные ключи
+        self._tg_text: Dict[int, str] = {}
+        self._tg_text_ids: Dict[str, int] = {}
+
+    def _grow(self, needed: int) -> None:
+        capacity = len(self._tg)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        extra = capacity - len(self._tg)
+        self._tg = np.concatenate([self._tg, np.zeros(extra, dtype=np.int64)])
+        self._time_end = np.concatenate([self._time_end, np.zeros(extra, dtype=np.int64)])
+        self._server = np.concatenate([self._server, np.zeros(extra, dtype=np.int16)])
+        self._state = np.concatenate([self._state, np.full(extra, STATE_DELETED, dtype=np.int8)])
+
+    def _tg_key(self, raw: Any) -> int:
+        if raw is None:
+            return NO_TG
+        if isinstance(raw, int):
+            return raw
+        text = str(raw).strip()
+        if not text:
+            return NO_TG
+        try:
+            return int(text)
+        except ValueError:
+            pass
+        key = self._tg_text_ids.get(text)
+        if key is None:
+            key = -(len(self._tg_text) + 1)
+            self._tg_text[key] = text
+            self._tg_text_ids[text] = key
+        return key
+
+    def _tg_out(self, key: int) -> Optional[str]:
+        if key == NO_TG:
+            return None
+        if key < 0:
+            return self._tg_text.get(key)
+        return str(key)
+
+    def _server_key(self, server: str) -> int:
+        idx = self._server_pos.get(server)
+        if idx is None:
+            idx = len(self._servers)
+            self._servers.append(server)
+            self._server_pos[server] = idx
+        return idx
+
+    def _put(self, code: str, tg_id: Any, time_end: Any, server: Any, reserved_by: Any) -> None:
+        pos = self._pos.get(code)
+        if server is None:
+            # Строки больше нет в БД
+            if pos is not None and self._state[pos] != STATE_DELETED:
+                self._state[pos] = STATE_DELETED
+                self._codes[pos] = None
+                del self._pos[code]
+                self._dead += 1
+            return
+        if pos is None:
+            pos = self._size
+            self._grow(pos + 1)
+            self._codes.append(code)
+            self._pos[code] = pos
+            self._size += 1
+        tg_key = self._tg_key(tg_id)
+        self._tg[pos] = tg_key
+        self._time_end[pos] = int(time_end or 0)
+        self._server[pos] = self._server_key(str(server))
+        if reserved_by is not None:
+            self._state[pos] = STATE_RESERVED
+        elif tg_key != NO_TG:
+            self._state[pos] = STATE_OWNED
+        else:
+            self._state[pos] = STATE_FREE
+
+    def _compact(self) -> None:
+        """Выкидывает удалённые строки, когда их накопилось много (без обращения к БД)."""
+        n = self._size
+        keep = np.flatnonzero(self._state[:n] != STATE_DELETED)
+        codes = [self._codes[i] for i in keep.tolist()]
+        self._tg = self._tg[keep].copy()
+        self._time_end = self._time_end[keep].copy()
+        self._server = self._server[keep].copy()
+        self._state = self._state[keep].copy()
+        self._codes = codes
+        self._pos = {code: i for i, code in enumerate(codes)}
+        self._size = len(codes)
+        self._dead = 0
+        self._grow(max(self._initial_capacity, self._size + 1))
+
+    # ------------------------------------------------------------------
+    # Загрузка и обновление
+    # ------------------------------------------------------------------
+
+    async def rebuild(self) -> None:
+        """Строит снимок целиком одной выборкой."""
+        async with self._lock:
+            await self._rebuild_locked()
+
+    async def _rebuild_locked(self) -> None:
+        started = time.monotonic()
+        last_seq, rows = await db.load_config_snapshot_rows()
+        self._reset(max(self._initial_capacity, len(rows) + 1))
+        for code, tg_id, time_end, server, reserved_by in rows:
+            self._put(db.code_from_db(code), tg_id, time_end, server, reserved_by)
+        self.last_seq = last_seq
+        self.ready = True
+        self.built_at = self.refreshed_at = time.time()
+        self.rebuilds += 1
+        logger.info(
+            "config snapshot built: rows=%s seq=%s in %.1fms",
+            self._size, last_seq, (time.monotonic() - started) * 1000,
+        )
+
+    async def refresh(self) -> int:
+        """Применяет новые записи журнала. Возвращает число применённых изменений."""
+        async with self._lock:
+            if not self.ready:
+                await self._rebuild_locked()
+                return 0
+            applied = 0
+            while True:
+                head, oldest, rows = await db.get_config_changes(self.last_seq, self.batch_limit)
+                missed = head > self.last_seq and (oldest == 0 or oldest > self.last_seq + 1)
+                if head < self.last_seq or missed:
+                    # БД подменили или нужные записи журнала уже вычищены — догнать нельзя
+                    logger.warning("config snapshot lost track (seq=%s head=%s oldest=%s), rebuilding", self.last_seq, head, oldest)
+                    await self._rebuild_locked()
+                    return applied
+                for seq, code, tg_id, time_end, server, reserved_by in rows:
+                    self._put(db.code_from_db(code), tg_id, time_end, server, reserved_by)
+                    self.last_seq = seq
+                applied += len(rows)
+                if len(rows) < self.batch_limit:
+                    break
+            if self._dead > max(1024, self._size // 4):
+                self._compact()
+            self.applied_changes += applied
+            self.refreshed_at = time.time()
+            return applied
+
+    async def run(self, refresh_seconds: float) -> None:
+        """Фоновая задача: строит снимок и догоняет журнал каждые ``refresh_seconds``."""
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                # Снимок просто отстанет до следующей попытки
+                logger.exception("Config snapshot refresh failed")
+            await asyncio.sleep(refresh_seconds)
+
+    # ------------------------------------------------------------------
+    # Чтение
+    # ------------------------------------------------------------------
+
+    def _live(self) -> np.ndarray:
+        return self._state[: self._size] != STATE_DELETED
+
+    def configs(self, now: int, server: Optional[str] = None, with_server: bool = True) -> List[Dict[str, Any]]:
+        """Конфиги (все или одного сервера) по возрастанию ``time_end``.
+
+        Поля совпадают с ``db.get_all_configs_with_status`` / ``db.get_configs_by_server``.
+        """
+        mask = self._live()
+        if server is not None:
+            idx = self._server_pos.get(server)
+            if idx is None:
+                return []
+            mask &= self._server[: self._size] == idx
+        pos = np.flatnonzero(mask)
+        pos = pos[np.argsort(self._time_end[pos], kind="stable")]
+        time_end = self._time_end[pos]
+        tg = self._tg[pos]
+        owned = (tg != NO_TG) & (time_end > now)
+        codes, servers, tg_out = self._codes, self._servers, self._tg_out
+        if with_server:
+            return [
+                {"uid": codes[p], "time_end": t, "is_owned": o, "server_country": servers[s], "tg_id": tg_out(g)}
+                for p, t, o, s, g in zip(pos.tolist(), time_end.tolist(), owned.tolist(), self._server[pos].tolist(), tg.tolist())
+            ]
+        return [
+            {"uid": codes[p], "time_end": t, "is_owned": o, "tg_id": tg_out(g)}
+            for p, t, o, g in zip(pos.tolist(), time_end.tolist(), owned.tolist(), tg.tolist())
+        ]
+
+    def _per_user(self, mask: np.ndarray, take_max: bool) -> tuple[np.ndarray, np.ndarray]:
+        """(tg, time_end) по одному на пользователя: max или min ``time_end`` среди ``mask``."""
+        tg = self._tg[: self._size][mask]
+        time_end = self._time_end[: self._size][mask]
+        if not len(tg):
+            return tg, time_end
+        order = np.lexsort((time_end, tg))
+        tg, time_end = tg[order], time_end[order]
+        if take_max:
+            edge = np.r_[tg[1:] != tg[:-1], True]
+        else:
+            edge = np.r_[True, tg[1:] != tg[:-1]]
+        return tg[edge], time_end[edge]
+
+    def active_users(self, now: int) -> List[Dict[str, Any]]:
+        """Как ``db.get_all_active_users``: максимальный срок на пользователя, по убыванию."""
+        mask = self._live() & (self._tg[: self._size] != NO_TG) & (self._time_end[: self._size] > now)
+        tg, time_end = self._per_user(mask, take_max=True)
+        order = np.argsort(-time_end, kind="stable")
+        tg, time_end = tg[order], time_end[order]
+        days_left = np.maximum(0, (time_end - now) // 86400)
+        return [
+            {"tg_id": self._tg_out(g), "time_end": t, "days_left": d}
+            for g, t, d in zip(tg.tolist(), time_end.tolist(), days_left.tolist())
+        ]
+
+    def expiring_users(self, now: int, window_seconds: int) -> List[Dict[str, Any]]:
+        """Как ``db.users_with_subscription_expiring_within_5h``: ближайший срок в окне."""
+        time_end = self._time_end[: self._size]
+        mask = self._live() & (self._tg[: self._size] != NO_TG) & (time_end > now) & (time_end - now <= window_seconds)
+        tg, time_end = self._per_user(mask, take_max=False)
+        return [{"tg_id": self._tg_out(g), "time_end": t} for g, t in zip(tg.tolist(), time_end.tolist())]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "rows": self._size - self._dead,
+            "dead_slots": self._dead,
+            "last_seq": self.last_seq,
+            "age_seconds": round(time.time() - self.refreshed_at, 3) if self.ready else None,
+            "rebuilds": self.rebuilds,
+            "applied_changes": self.applied_changes,
+        }
@@ -0,0 +1,302 @@
+"""
+Коалесинг записей в панель 3x-ui.
+
+Каждый ``updateClient``/``addClient`` заставляет панель перезаписать конфиг xray.
+Во время волн продлений (например, после промо-рассылки) это сотни отдельных
+перезаписей подряд. Коалесер копит записи по каждому серверу в течение короткого
+окна и отправляет их пачкой:
+
+- ``addClient`` принимает несколько клиентов в ``settings.clients`` — такие
+  записи склеиваются в один запрос;
+- ``updateClient/{uid}`` в 3x-ui обновляет ровно одного клиента и склеить такие
+  записи нечем, поэтому обновления уходят в панель сразу, без окна и очереди;
+- если для сервера задан bulk-эндпоинт обновления (``URLBULKUPDATE_<CODE>``),
+  обновления копятся в окне, как и создания, и уходят одним запросом на inbound;
+  одинаковые обновления одного uid отправляются один раз, разные — по очереди.
+
+Результат запроса раздаётся всем ожидающим вызывающим.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Отправитель: (url, server_code, payload) -> ответ панели
+PanelSender = Callable[[str, str, Dict[str, Any]], Awaitable[httpx.Response]]
+
+KIND_CREATE = "create"
+KIND_UPDATE = "update"
+
+
+@dataclass
+class _PendingWrite:
+    kind: str
+    url: str
+    uid: str
+    payload: Dict[str, Any]
+    future: asyncio.Future
+
+
+@dataclass
+class _ServerMetrics:
+    """Счётчики по одному серверу."""
+
+    submitted: int = 0
+    batches: int = 0
+    panel_requests: int = 0
+    merged_writes: int = 0
+    deduplicated: int = 0
+    failed_batches: int = 0
+    max_batch: int = 0
+    batch_sizes: Dict[int, int] = field(default_factory=dict)
+
+    def as_dict(self) -> Dict[str, Any]:
+        avg = (self.submitted / self.batches) if self.batches else 0.0
+        return {
+            "submitted": self.submitted,
+            "batches": self.batches,
+            "panel_requests": self.panel_requests,
+            "merged_writes": self.merged_writes,
+            "deduplicated": self.deduplicated,
+            "failed_batches": self.failed_batches,
+            "max_batch": self.max_batch,
+            "avg_batch": round(avg, 2),
+            "batch_sizes": {str(k): v for k, v in sorted(self.batch_sizes.items())},
+        }
+
+
+def _split_clients(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Достаёт список клиентов из payload вида ``{"id": .., "settings": "<json>"}``."""
+    raw = payload.get("settings") or "{}"
+    try:
+        settings = json.loads(raw) if isinstance(raw, str) else dict(raw)
+    except (TypeError, ValueError):
+        return []
+    clients = settings.get("clients") or []
+    return list(clients) if isinstance(clients, list) else []
+
+
+def _merge_payloads(inbound_id: Any, payloads: List[Dict[str, Any]]) -> Dict[str, Any]:
+    clients: List[Dict[str, Any]] = []
+    for payload in payloads:
+        clients.extend(_split_clients(payload))
+    return {"id": inbound_id, "settings": json.dumps({"clients": clients})}
+
+
+class PanelWriteCoalescer:
+    """Буферизует записи в панель по серверам и отправляет их пачками."""
+
+    def __init__(
+        self,
+        sender: PanelSender,
+        window_seconds: float = 0.05,
+        max_batch: int = 50,
+        bulk_update_urls: Dict[str, str] | None = None,
+    ) -> None:
+        self._sender = sender
+        self.window_seconds = max(0.0, float(window_seconds))
+        self.max_batch = max(1, int(max_batch))
+        self._bulk_update_urls = {k.lower(): v for k, v in (bulk_update_urls or {}).items() if v}
+        self._pending: Dict[str, List[_PendingWrite]] = {}
+        self._timers: Dict[str, asyncio.Task] = {}
+        self._dispatches: set[asyncio.Task] = set()
+        # Одна пачка на сервер за раз — панель не получает параллельных перезаписей
+        self._server_locks: Dict[str, asyncio.Lock] = {}
+        self._metrics: Dict[str, _ServerMetrics] = {}
+        self._started_at = time.time()
+
+    # ------------------------------------------------------------------
+    # Публичный API
+    # ------------------------------------------------------------------
+
+    async def submit_update(self, server_code: str, uid: str, url: str, payload: Dict[str, Any]) -> httpx.Response:
+        """``updateClient``: сразу в панель; с bulk-эндпоинтом сервера — через окно пачкой."""
+        if server_code.lower() not in self._bulk_update_urls:
+            m = self._metrics_for(server_code)
+            m.submitted += 1
+            m.panel_requests += 1
+            return await self._sender(url, server_code, payload)
+        return await self._submit(server_code, _PendingWrite(KIND_UPDATE, url, uid, payload, self._new_future()))
+
+    async def submit_create(self, server_code: str, url: str, payload: Dict[str, Any]) -> httpx.Response:
+        """Ставит ``addClient`` в очередь сервера; клиенты одной пачки уходят одним запросом."""
+        clients = _split_clients(payload)
+        uid = str(clients[0].get("id", "")) if clients else ""
+        return await self._submit(server_code, _PendingWrite(KIND_CREATE, url, uid, payload, self._new_future()))
+
+    def metrics(self) -> Dict[str, Any]:
+        """Снимок метрик по размерам достигнутых пачек."""
+        servers = {code: m.as_dict() for code, m in sorted(self._metrics.items())}
+        total_submitted = sum(m.submitted for m in self._metrics.values())
+        total_requests = sum(m.panel_requests for m in self._metrics.values())
+        return {
+            "window_ms": int(self.window_seconds * 1000),
+            "max_batch": self.max_batch,
+            "uptime_seconds": int(time.time() - self._started_at),
+            "submitted": total_submitted,
+            "panel_requests": total_requests,
+            "saved_requests": max(0, total_submitted - total_requests),
+            "pending": sum(len(v) for v in self._pending.values()),
+            "servers": servers,
+        }
+
+    async def aclose(self) -> None:
+        """Сбрасывает всё накопленное и дожидается отправки (вызывается на shutdown)."""
+        for server_code in list(self._pending.keys()):
+            self._flush(server_code)
+        if self._dispatches:
+            await asyncio.gather(*list(self._dispatches), return_exceptions=True)
+
+    # ------------------------------------------------------------------
+    # Внутреннее
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _new_future() -> asyncio.Future:
+        return asyncio.get_running_loop().create_future()
+
+    def _metrics_for(self, server_code: str) -> _ServerMetrics:
+        m = self._metrics.get(server_code)
+        if m is None:
+            m = _ServerMetrics()
+            self._metrics[server_code] = m
+        return m
+
+    async def _submit(self, server_code: str, item: _PendingWrite) -> httpx.Response:
+        self._metrics_for(server_code).submitted += 1
+
+        # Окно 0 — коалесинг выключен, пачка из одной записи уходит сразу
+        queue = self._pending.setdefault(server_code, [])
+        queue.append(item)
+        if self.window_seconds <= 0 or len(queue) >= self.max_batch:
+            self._flush(server_code)
+        elif server_code not in self._timers:
+            self._timers[server_code] = asyncio.create_task(self._flush_later(server_code))
+
+        # shield: отмена одного вызывающего не должна ронять запись остальным
+        return await asyncio.shield(item.future)
+
+    async def _flush_later(self, server_code: str) -> None:
+        try:
+            await asyncio.sleep(self.window_seconds)
+        except asyncio.CancelledError:
+            return
+        self._timers.pop(server_code, None)
+        self._flush(server_code)
+
+    def _flush(self, server_code: str) -> None:
+        timer = self._timers.pop(server_code, None)
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+        items = self._pending.pop(server_code, [])
+        if not items:
+            return
+        task = asyncio.create_task(self._dispatch(server_code, items))
+        self._dispatches.add(task)
+        task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, server_code: str, items: List[_PendingWrite]) -> None:
+        lock = self._server_locks.get(server_code)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._server_locks[server_code] = lock
+
+        m = self._metrics_for(server_code)
+        size = len(items)
+        m.batches += 1
+        m.max_batch = max(m.max_batch, size)
+        m.batch_sizes[size] = m.batch_sizes.get(size, 0) + 1
+
+        creates = [it for it in items if it.kind == KIND_CREATE]
+        updates = [it for it in items if it.kind == KIND_UPDATE]
+
+        async with lock:
+            try:
+                await self._send_creates(server_code, creates, m)
+                await self._send_updates(server_code, updates, m)
+            except Exception as exc:  # страховка: никто не должен зависнуть навсегда
+                m.failed_batches += 1
+                logger.exception("panel.coalesce dispatch failed server=%s size=%s", server_code, size)
+                for it in items:
+                    if not it.future.done():
+                        it.future.set_exception(exc)
+
+        if size > 1:
+            logger.info(
+                "panel.coalesce server=%s batch=%s creates=%s updates=%s",
+                server_code,
+                size,
+                len(creates),
+                len(updates),
+            )
+
+    async def _send_group(self, server_code: str, url: str, payload: Dict[str, Any], group: List[_PendingWrite], m: _ServerMetrics) -> None:
+        m.panel_requests += 1
+        try:
+            response = await self._sender(url, server_code, payload)
+        except Exception as exc:
+            m.failed_batches += 1
+            for it in group:
+                if not it.future.done():
+                    it.future.set_exception(exc)
+            return
+        for it in group:
+            if not it.future.done():
+                it.future.set_result(response)
+
+    async def _send_creates(self, server_code: str, creates: List[_PendingWrite], m: _ServerMetrics) -> None:
+        # addClient умеет несколько клиентов, но только в пределах одного inbound
+        groups: Dict[Tuple[str, Any], List[_PendingWrite]] = {}
+        for it in creates:
+            groups.setdefault((it.url, it.payload.get("id")), []).append(it)
+        for (url, inbound_id), group in groups.items():
+            if len(group) == 1:
+                payload = group[0].payload
+            else:
+                payload = _merge_payloads(inbound_id, [it.payload for it in group])
+                m.merged_writes += len(group) - 1
+            await self._send_group(server_code, url, payload, group, m)
+
+    async def _send_updates(self, server_code: str, updates: List[_PendingWrite], m: _ServerMetrics) -> None:
+        if not updates:
+            return
+        # Сюда попадают только серверы с bulk-эндпоинтом (см. submit_update).
+        # Одинаковые обновления одного uid — одна запись; ответ раздаётся всем их вызывающим.
+        by_write: Dict[Tuple[str, str], List[_PendingWrite]] = {}
+        for it in updates:
+            key = (it.uid, json.dumps(it.payload, sort_keys=True, default=str))
+            by_write.setdefault(key, []).append(it)
+        m.deduplicated += len(updates) - len(by_write)
+
+        # uid с разными обновлениями в одной пачке: порядок важен, шлём их по одному
+        uid_writes: Dict[str, int] = {}
+        for uid, _ in by_write:
+            uid_writes[uid] = uid_writes.get(uid, 0) + 1
+        single: List[List[_PendingWrite]] = []
+        sequential: List[List[_PendingWrite]] = []
+        for (uid, _), group in by_write.items():
+            (single if uid_writes[uid] == 1 else sequential).append(group)
+
+        # Bulk-запрос — в пределах одного inbound, как и addClient
+        bulk_url = self._bulk_update_urls[server_code.lower()]
+        by_inbound: Dict[Any, List[List[_PendingWrite]]] = {}
+        for group in single:
+            by_inbound.setdefault(group[0].payload.get("id"), []).append(group)
+        for inbound_id, groups in by_inbound.items():
+            if len(groups) == 1:
+                sequential.insert(0, groups[0])
+                continue
+            payload = _merge_payloads(inbound_id, [g[0].payload for g in groups])
+            m.merged_writes += len(groups) - 1
+            await self._send_group(server_code, bulk_url, payload, [it for g in groups for it in g], m)
+
+        for group in sequential:
+            await self._send_group(server_code, group[0].url, group[0].payload, group, m)
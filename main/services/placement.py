@@ -0,0 +1,165 @@
+"""
+Выбор варианта сервера внутри региона (ge, ge2, ...) для новой активации.
+
+По каждому варианту копятся скользящие (EWMA) оценки задержки и доли ошибок
+запросов к панели; глубину свободного пула и число активных клиентов даёт БД.
+Из этого считается стоимость варианта, и вариант выбирается взвешенно-случайно
+(вес = 1 / стоимость), чтобы нагрузка распределялась, а медленные и
+перегруженные панели получали меньше новых пользователей.
+"""
+from __future__ import annotations
+
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _PanelStats:
+    """Скользящие оценки по одной панели."""
+
+    latency_ms: float | None = None
+    error_rate: float = 0.0
+    requests: int = 0
+    errors: int = 0
+    last_seen: float = 0.0
+
+
+class PlacementEngine:
+    """Считает стоимость вариантов и выбирает вариант для каждого региона."""
+
+    def __init__(
+        self,
+        alpha: float = 0.2,
+        default_latency_ms: float = 300.0,
+        error_penalty: float = 10.0,
+        load_penalty: float = 1.0,
+        min_free: int = 1,
+    ) -> None:
+        # alpha — вес нового наблюдения в EWMA
+        self.alpha = min(1.0, max(0.01, float(alpha)))
+        self.default_latency_ms = max(1.0, float(default_latency_ms))
+        self.error_penalty = max(0.0, float(error_penalty))
+        self.load_penalty = max(0.0, float(load_penalty))
+        self.min_free = max(1, int(min_free))
+        self._stats: Dict[str, _PanelStats] = {}
+
+    # ------------------------------------------------------------------
+    # Наблюдения
+    # ------------------------------------------------------------------
+
+    def observe(self, server_code: str, latency_seconds: float, ok: bool) -> None:
+        """Учитывает один запрос к панели сервера ``server_code``."""
+        code = server_code.lower()
+        st = self._stats.get(code)
+        if st is None:
+            st = _PanelStats()
+            self._stats[code] = st
+        latency_ms = max(0.0, latency_seconds * 1000.0)
+        if st.latency_ms is None:
+            st.latency_ms = latency_ms
+        else:
+            st.latency_ms += self.alpha * (latency_ms - st.latency_ms)
+        st.error_rate += self.alpha * ((0.0 if ok else 1.0) - st.error_rate)
+        st.requests += 1
+        if not ok:
+            st.errors += 1
+        st.last_seen = time.time()
+
+    # ------------------------------------------------------------------
+    # Выбор
+    # ------------------------------------------------------------------
+
+    def _latency_for(self, code: str) -> float:
+        st = self._stats.get(code)
+        if st is not None and st.latency_ms is not None:
+            return st.latency_ms
+        # Нет наблюдений — берём медиану известных панелей, чтобы новый вариант не был ни фаворитом, ни изгоем
+        known = sorted(s.latency_ms for s in self._stats.values() if s.latency_ms is not None)
+        if known:
+            return known[len(known) // 2]
+        return self.default_latency_ms
+
+    def cost(self, code: str, free: int, active: int) -> float:
+        """Стоимость варианта: задержка × штраф за ошибки × штраф за загрузку."""
+        st = self._stats.get(code)
+        error_rate = st.error_rate if st is not None else 0.0
+        latency = max(1.0, self._latency_for(code))
+        # Загрузка: активные клиенты относительно оставшегося пула
+        load = active / float(free + active) if (free + active) > 0 else 0.0
+        return latency * (1.0 + self.error_penalty * error_rate) * (1.0 + self.load_penalty * load)
+
+    def choose(
+        self,
+        regions: Dict[str, List[str]],
+        pool: Dict[str, Dict[str, int]],
+        rng: random.Random | None = None,
+    ) -> Dict[str, Any]:
+        """Выбирает по варианту на регион.
+
+        Args:
+            regions: базовый код региона -> список вариантов (в порядке приоритета)
+            pool: server_country -> {"free": N, "active": M} (см. ``db.get_server_pool_stats``)
+
+        Returns:
+            Dict: ``servers`` (регион -> вариант или None), ``available`` (регион -> bool),
+            ``all_available`` и ``variants`` с подробностями оценки.
+        """
+        rnd = rng or random
+        servers: Dict[str, str | None] = {}
+        available: Dict[str, bool] = {}
+        details: Dict[str, Dict[str, Any]] = {}
+
+        for base, variants in regions.items():
+            candidates: List[tuple[str, float]] = []
+            for code in variants:
+                code = code.lower()
+                counts = pool.get(code, {})
+                free = int(counts.get("free", 0))
+                active = int(counts.get("active", 0))
+                cost = self.cost(code, free, active)
+                st = self._stats.get(code)
+                details[code] = {
+                    "region": base,
+                    "free": free,
+                    "active": active,
+                    "latency_ms": round(self._latency_for(code), 1),
+                    "error_rate": round(st.error_rate, 3) if st is not None else 0.0,
+                    "cost": round(cost, 1),
+                }
+                if free >= self.min_free:
+                    candidates.append((code, cost))
+
+            if not candidates:
+                servers[base] = None
+                available[base] = False
+                continue
+
+            weights = [1.0 / c for _, c in candidates]
+            chosen = rnd.choices([code for code, _ in candidates], weights=weights, k=1)[0]
+            servers[base] = chosen
+            available[base] = True
+
+        return {
+            "servers": servers,
+            "available": available,
+            "all_available": bool(available) and all(available.values()),
+            "variants": details,
+        }
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Текущие оценки по панелям (для отладки/мониторинга)."""
+        return {
+            code: {
+                "latency_ms": round(st.latency_ms, 1) if st.latency_ms is not None else None,
+                "error_rate": round(st.error_rate, 3),
+                "requests": st.requests,
+                "errors": st.errors,
+                "last_seen": int(st.last_seen),
+            }
+            for code, st in sorted(self._stats.items())
+        }